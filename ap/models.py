@@ -638,6 +638,22 @@ class APInvoice(models.Model):
         help_text="Invoice total (subtotal + tax)"
     )
     
+    # Stored payment state, maintained by finance.payment_state_services
+    amount_paid = models.DecimalField(
+        max_digits=14,
+        decimal_places=2,
+        null=True,
+        blank=True,
+        help_text="Allocated payments in invoice currency (NULL until first computed)"
+    )
+    amount_outstanding = models.DecimalField(
+        max_digits=14,
+        decimal_places=2,
+        null=True,
+        blank=True,
+        help_text="Invoice total less amount_paid"
+    )
+    
     class Meta:
         db_table = 'ap_apinvoice'  # NEW table name
     
@@ -668,7 +684,11 @@ class APInvoice(models.Model):
         self.subtotal = subtotal_amt
         self.tax_amount = tax_amt
         self.total = subtotal_amt + tax_amt
-        self.save(update_fields=['subtotal', 'tax_amount', 'total'])
+        update_fields = ['subtotal', 'tax_amount', 'total']
+        if self.amount_paid is not None:
+            self.amount_outstanding = self.total - self.amount_paid
+            update_fields.append('amount_outstanding')
+        self.save(update_fields=update_fields)
         
         return {
             'subtotal': self.subtotal,
@@ -999,7 +1019,7 @@ class APPayment(models.Model):
         """
         from decimal import Decimal
         
-        allocations = self.allocations.all()
+        allocations = self.allocations.select_related("invoice__currency")
         if not allocations.exists():
             return
         
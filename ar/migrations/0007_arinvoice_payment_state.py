@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-16 06:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('ar', '0006_alter_invoiceglline_invoice'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='arinvoice',
+            name='amount_outstanding',
+            field=models.DecimalField(blank=True, decimal_places=2, help_text='Invoice total less amount_paid', max_digits=14, null=True),
+        ),
+        migrations.AddField(
+            model_name='arinvoice',
+            name='amount_paid',
+            field=models.DecimalField(blank=True, decimal_places=2, help_text='Allocated payments in invoice currency (NULL until first computed)', max_digits=14, null=True),
+        ),
+    ]
@@ -128,6 +128,22 @@ class ARInvoice(models.Model):
         help_text="Invoice total (subtotal + tax)"
     )
     
+    # Stored payment state, maintained by finance.payment_state_services
+    amount_paid = models.DecimalField(
+        max_digits=14,
+        decimal_places=2,
+        null=True,
+        blank=True,
+        help_text="Allocated payments in invoice currency (NULL until first computed)"
+    )
+    amount_outstanding = models.DecimalField(
+        max_digits=14,
+        decimal_places=2,
+        null=True,
+        blank=True,
+        help_text="Invoice total less amount_paid"
+    )
+    
     class Meta:
         db_table = 'ar_arinvoice'  # NEW table name
     
@@ -158,7 +174,11 @@ class ARInvoice(models.Model):
         self.subtotal = subtotal_amt
         self.tax_amount = tax_amt
         self.total = subtotal_amt + tax_amt
-        self.save(update_fields=['subtotal', 'tax_amount', 'total'])
+        update_fields = ['subtotal', 'tax_amount', 'total']
+        if self.amount_paid is not None:
+            self.amount_outstanding = self.total - self.amount_paid
+            update_fields.append('amount_outstanding')
+        self.save(update_fields=update_fields)
         
         return {
             'subtotal': self.subtotal,
@@ -338,7 +358,7 @@ class ARPayment(models.Model):
         """
         from decimal import Decimal
         
-        allocations = self.allocations.all()
+        allocations = self.allocations.select_related("invoice__currency")
         if not allocations.exists():
             return
         
@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Currency, TaxRate, ExchangeRate, FXGainLossAccount
+from .models import Currency, TaxRate, ExchangeRate, FXGainLossAccount, DocumentSequence
 
 @admin.register(Currency)
 class CurrencyAdmin(admin.ModelAdmin):
@@ -67,3 +67,10 @@ class FXGainLossAccountAdmin(admin.ModelAdmin):
         }),
     )
 
+
+
+@admin.register(DocumentSequence)
+class DocumentSequenceAdmin(admin.ModelAdmin):
+    list_display = ("key", "last_value")
+    search_fields = ("key",)
+    ordering = ("key",)
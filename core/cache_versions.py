@@ -0,0 +1,100 @@
+"""
+Cross-process invalidation of in-process caches.
+
+Several services keep read-mostly tables in process memory (exchange rates,
+the segment registry, compiled segment assignment rules, catalog price
+tiers). Each such cache owns a CacheVersion row. A change to the cached
+tables bumps the row in the writer's transaction, so other processes see the
+new version exactly when they can see the change. Before serving from memory
+a process compares the row with the version its copy was loaded under.
+
+The row is read at most once per request for each cache (request_started
+begins a new check) and, outside requests (commands, workers), at most every
+settings.CACHE_VERSION_CHECK_SECONDS. A change committed by one process is
+therefore seen by the next request any process serves. A version bumped by a
+transaction that then rolls back simply moves back, and the next check
+reloads again.
+"""
+import threading
+import time
+
+from django.conf import settings
+from django.core.signals import request_started
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.dispatch import receiver
+from django.utils import timezone
+
+from .models import CacheVersion
+
+CHECK_SECONDS = 5.0
+
+_request = {"serial": 0}
+
+
+@receiver(request_started)
+def _start_request(**kwargs):
+    _request["serial"] += 1
+
+
+def current_version(key: str) -> int:
+    return CacheVersion.objects.filter(key=key).values_list("version", flat=True).first() or 0
+
+
+def bump_version(key: str):
+    """Move the cache's version on, inside the current transaction"""
+    if CacheVersion.objects.filter(key=key).update(version=F("version") + 1, updated_at=timezone.now()):
+        return
+    try:
+        with transaction.atomic():
+            CacheVersion.objects.create(key=key, version=1)
+    except IntegrityError:
+        # Another process created the row first
+        CacheVersion.objects.filter(key=key).update(version=F("version") + 1, updated_at=timezone.now())
+
+
+class VersionGuard:
+    """
+    Tracks the CacheVersion a process-local cache was loaded under.
+
+    Callers hold their own lock around is_current() and the reload it
+    asks for:
+
+        if not guard.is_current() or not loaded:
+            reload()
+    """
+
+    def __init__(self, key: str):
+        self.key = key
+        self._lock = threading.Lock()
+        self._version = None
+        self._checked_request = None
+        self._checked_at = None
+
+    def _check_due(self):
+        if self._version is None or self._checked_request != _request["serial"]:
+            return True
+        interval = getattr(settings, "CACHE_VERSION_CHECK_SECONDS", CHECK_SECONDS)
+        return time.monotonic() - self._checked_at >= interval
+
+    def is_current(self) -> bool:
+        """False when the cache must be reloaded (first use, or the version moved)"""
+        with self._lock:
+            if not self._check_due():
+                return True
+            version = current_version(self.key)
+            self._checked_request, self._checked_at = _request["serial"], time.monotonic()
+            if version == self._version:
+                return True
+            self._version = version
+            return False
+
+    def reset(self):
+        """Reload on the next check in this process"""
+        with self._lock:
+            self._version = None
+
+    def bump(self):
+        """Invalidate the cache in every process (this one at once, others after commit)"""
+        bump_version(self.key)
+        self.reset()
@@ -0,0 +1,24 @@
+# Generated by Django 5.2.7 on 2026-10-16 09:12
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='DocumentSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=100, unique=True)),
+                ('last_value', models.PositiveBigIntegerField(default=0, help_text='Highest number reserved so far')),
+            ],
+            options={
+                'db_table': 'core_document_sequence',
+            },
+        ),
+    ]
@@ -0,0 +1,58 @@
+"""
+Viewset mixins shared across apps.
+"""
+from django.db.models import Prefetch
+
+FIELDS_QUERY_PARAM = 'fields'
+
+
+def _lookup_root(lookup):
+    path = lookup.prefetch_through if isinstance(lookup, Prefetch) else lookup
+    return path.split('__')[0]
+
+
+def _source_root(field):
+    return None if field.source == '*' else field.source.split('.')[0]
+
+
+class FieldProjectionMixin:
+    """
+    ?fields=id,number,total limits the serialized fields of read requests.
+
+    Nested fields that are not asked for are neither serialized nor
+    prefetched: prefetch lookups rooted at a dropped field's source are
+    removed from the queryset unless a kept field reads the same relation.
+    Unknown names are ignored. Writes always use the full serializer.
+    """
+
+    def get_projected_fields(self):
+        request = getattr(self, 'request', None)
+        if request is None or request.method != 'GET':
+            return None
+        raw = request.query_params.get(FIELDS_QUERY_PARAM)
+        if not raw:
+            return None
+        return {name.strip() for name in raw.split(',') if name.strip()}
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        projected = self.get_projected_fields()
+        lookups = getattr(queryset, '_prefetch_related_lookups', ())
+        if projected and lookups:
+            fields = self.get_serializer_class()(context=self.get_serializer_context()).fields
+            kept = {_source_root(f) for name, f in fields.items() if name in projected}
+            dropped = {_source_root(f) for name, f in fields.items() if name not in projected} - kept - {None}
+            remaining = [lookup for lookup in lookups if _lookup_root(lookup) not in dropped]
+            if len(remaining) != len(lookups):
+                queryset = queryset.prefetch_related(None).prefetch_related(*remaining)
+        return queryset
+
+    def get_serializer(self, *args, **kwargs):
+        serializer = super().get_serializer(*args, **kwargs)
+        projected = self.get_projected_fields()
+        if projected:
+            target = getattr(serializer, 'child', serializer)
+            for name in list(target.fields):
+                if name not in projected:
+                    target.fields.pop(name)
+        return serializer
@@ -112,3 +112,34 @@ class FXGainLossAccount(models.Model):
     def __str__(self):
         return f"{self.gain_loss_type}: {self.account.code} - {self.account.name}"
 
+
+
+class DocumentSequence(models.Model):
+    """
+    Counter behind a document number series (see core.sequences).
+    One row per model field and period prefix, e.g. "purchase_orders.poheader.po_number:PO-202610".
+    """
+    key = models.CharField(max_length=100, unique=True)
+    last_value = models.PositiveBigIntegerField(default=0, help_text="Highest number reserved so far")
+
+    class Meta:
+        db_table = "core_document_sequence"
+
+    def __str__(self):
+        return f"{self.key} = {self.last_value}"
+
+
+class CacheVersion(models.Model):
+    """
+    Change counter of an in-process cache (see core.cache_versions).
+    Bumped with every change to the cached tables so all processes reload.
+    """
+    key = models.CharField(max_length=100, unique=True)
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = "core_cache_version"
+
+    def __str__(self):
+        return f"{self.key} v{self.version}"
@@ -0,0 +1,170 @@
+"""
+Pagination for the high-volume list endpoints (journals, invoices, payments,
+stock movements, procurement documents); viewsets opt in with
+`pagination_class = KeysetCursorPagination`. Lookup tables stay unpaginated.
+
+KeysetCursorPagination pages by position in the result ordering instead of
+by offset, so fetching page N costs the same as fetching page 1 and rows
+inserted meanwhile do not shift later pages. The ordering is taken from
+?ordering= or the view's `ordering` (through the OrderingFilter backend),
+then the queryset's own ordering, then the model's Meta.ordering, and
+finally -pk. DRF positions the cursor on the first ordering term:
+- a local, non-null column carries the cursor itself; foreign keys are
+  ordered by their id column;
+- a related (customer__name) or nullable first term is annotated as
+  POSITION and the cursor runs on that. NULLs are replaced by the lowest
+  value of the field's type, so they sort first ascending and last
+  descending, on every database;
+- a first term neither can express (a reverse or many-to-many relation, a
+  transform, a nullable field of a type with no lowest value) is rejected
+  with a 400 error when the client asked for it, and falls back to -pk
+  (with a warning) when it is the view's own default;
+- pk is appended as a tie-breaker, so rows sharing a value page stably.
+
+Clients pick the page size with ?page_size= (up to MAX_PAGE_SIZE) and follow
+the `next`/`previous` links in the response.
+"""
+from datetime import date, datetime, timezone as dt_timezone
+from decimal import Decimal
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.db import models
+from django.db.models import F, Value
+from django.db.models.functions import Coalesce
+from rest_framework.exceptions import ValidationError
+from rest_framework.pagination import CursorPagination
+import logging
+
+logger = logging.getLogger(__name__)
+
+PAGE_SIZE = 100
+MAX_PAGE_SIZE = 1000
+POSITION = 'keyset_position'
+
+
+class UnsupportedOrdering(ValueError):
+    """An ordering whose first term cannot carry a cursor"""
+
+
+def _lowest_value(field):
+    """The lowest value of the field's type, standing in for NULL; None if there is none"""
+    if isinstance(field, (models.CharField, models.TextField)):
+        return ''
+    if isinstance(field, models.BooleanField):
+        return False
+    if isinstance(field, models.DateTimeField):
+        return datetime.min.replace(tzinfo=dt_timezone.utc) if settings.USE_TZ else datetime.min
+    if isinstance(field, models.DateField):
+        return date.min
+    if isinstance(field, models.DecimalField):
+        whole_digits = field.max_digits - field.decimal_places
+        return -(Decimal(10) ** whole_digits) + Decimal(1).scaleb(-field.decimal_places)
+    if isinstance(field, (models.IntegerField, models.FloatField)):
+        return -(2 ** 63)
+    return None
+
+
+def _position(model, name):
+    """Expression ordering like the field path `name`, NULLs lowest; or None"""
+    parts = name.split('__')
+    nullable = False
+    for n, part in enumerate(parts):
+        try:
+            field = model._meta.get_field(part)
+        except FieldDoesNotExist:
+            return None
+        if not field.concrete or field.many_to_many:
+            return None
+        nullable = nullable or field.null
+        if n < len(parts) - 1:
+            if not field.is_relation:
+                return None
+            model = field.related_model
+    if field.is_relation:
+        field = field.target_field
+    if not nullable:
+        return F(name)
+    lowest = _lowest_value(field)
+    if lowest is None:
+        return None
+    return Coalesce(F(name), Value(lowest, output_field=field), output_field=field)
+
+
+def _cursor_term(model, term):
+    """
+    (term, position) for the first ordering term: the local column and None,
+    or POSITION and the expression it stands for.
+    """
+    desc = term.startswith('-')
+    name = term.lstrip('-')
+    if name == 'pk':
+        return term, None
+    if '__' not in name:
+        try:
+            field = model._meta.get_field(name)
+        except FieldDoesNotExist:
+            field = None
+        if field is not None and field.concrete and not field.many_to_many and not field.null:
+            column = field.attname if field.is_relation else field.name
+            return (f"-{column}" if desc else column), None
+    position = _position(model, name)
+    if position is None:
+        raise UnsupportedOrdering(f"Cannot page results ordered by '{name}'")
+    return (f"-{POSITION}" if desc else POSITION), position
+
+
+def keyset_ordering(model, ordering):
+    """
+    Normalize `ordering` into one a cursor can page over, ending with pk.
+    Returns (terms, position): position is the expression to annotate as
+    POSITION when the first term needs one, else None. Raises
+    UnsupportedOrdering when the first term can carry no cursor.
+    """
+    if isinstance(ordering, str):
+        ordering = (ordering,)
+    ordering = [term for term in ordering or () if isinstance(term, str)]
+    terms, position = [], None
+    if ordering:
+        first, position = _cursor_term(model, ordering[0])
+        terms = [first, *ordering[1:]]
+    pk_names = {'pk', model._meta.pk.name, model._meta.pk.attname}
+    if not any(t.lstrip('-') in pk_names for t in terms):
+        terms.append('-pk' if not terms or terms[0].startswith('-') else 'pk')
+    return tuple(terms), position
+
+
+class KeysetCursorPagination(CursorPagination):
+    page_size = PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = MAX_PAGE_SIZE
+    ordering = '-pk'
+
+    def _keyset(self, request, queryset, view):
+        ordering, param = None, None
+        for backend in getattr(view, 'filter_backends', ()):
+            if hasattr(backend, 'get_ordering'):
+                backend = backend()
+                ordering = backend.get_ordering(request, queryset, view)
+                param = getattr(backend, 'ordering_param', None)
+                break
+        if not ordering:
+            ordering = queryset.query.order_by or queryset.model._meta.ordering or type(self).ordering
+        try:
+            return keyset_ordering(queryset.model, ordering)
+        except UnsupportedOrdering as exc:
+            if param and request.query_params.get(param):
+                raise ValidationError({param: [str(exc)]})
+            logger.warning("%s; %s pages by %s instead", exc, type(view).__name__, type(self).ordering)
+            return keyset_ordering(queryset.model, type(self).ordering)
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = self._keyset(request, queryset, view)
+        position = self.keyset[1]
+        if position is not None:
+            queryset = queryset.annotate(**{POSITION: position})
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_ordering(self, request, queryset, view):
+        keyset = getattr(self, 'keyset', None) or self._keyset(request, queryset, view)
+        return keyset[0]
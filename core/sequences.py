@@ -0,0 +1,132 @@
+"""
+Document number allocation.
+
+Document numbers look like PREFIX-NNNN, with the prefix carrying the period
+(PR-202610-0001). Numbers come from a DocumentSequence counter row per model
+field and prefix rather than a MAX() scan of the document table. Allocation
+is therefore one single-row UPDATE whatever the table size, and the row lock
+on that UPDATE stops two processes from ever seeing the same "last" number.
+
+Each process reserves settings.DOCUMENT_SEQUENCE_BLOCK_SIZE numbers per trip
+to the counter and hands the rest of the block out from memory. A block only
+joins the in-memory pool once the transaction that reserved it commits. If
+that transaction rolls back, the counter rolls back with it and the block is
+never used. Numbers are unique but not gap-free: numbers left in a block when
+the process exits, or used by a document whose transaction rolled back, are
+skipped.
+
+A counter created for a prefix that already has documents starts after the
+highest existing number, so deployments switch over without collisions.
+"""
+import os
+import re
+import threading
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import F, Max
+
+from .models import DocumentSequence
+
+_lock = threading.Lock()
+_pool = {}  # sequence key -> list of [next, last] ranges reserved by this process
+
+
+def _clear_pool():
+    _pool.clear()
+
+
+# A forked worker (gunicorn --preload) must not reuse blocks reserved by its parent
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_clear_pool)
+
+
+def clear_reserved_blocks():
+    """Forget the blocks this process holds (tests that roll back the counter table)"""
+    with _lock:
+        _clear_pool()
+
+
+def _block_size():
+    return max(1, int(getattr(settings, "DOCUMENT_SEQUENCE_BLOCK_SIZE", 1)))
+
+
+def _existing_max(model, field, prefix):
+    """Highest number already issued under prefix; only read when a counter row is first created"""
+    last = model.objects.filter(**{f"{field}__startswith": f"{prefix}-"}).aggregate(last=Max(field))["last"]
+    match = re.search(r"-(\d+)$", last or "")
+    return int(match.group(1)) if match else 0
+
+
+def reserve_block(key, count, start_after=lambda: 0):
+    """
+    Reserve `count` consecutive numbers on counter `key` and return (first, last).
+
+    `start_after` is called only when the counter row does not exist yet and
+    returns the number the new counter continues from. Inside an outer
+    transaction the counter row stays locked until that transaction ends.
+    """
+    with transaction.atomic():
+        updated = DocumentSequence.objects.filter(key=key).update(last_value=F("last_value") + count)
+        if not updated:
+            try:
+                with transaction.atomic():
+                    DocumentSequence.objects.create(key=key, last_value=start_after() + count)
+            except IntegrityError:
+                # Another process created the counter first
+                DocumentSequence.objects.filter(key=key).update(last_value=F("last_value") + count)
+        last = DocumentSequence.objects.filter(key=key).values_list("last_value", flat=True).get()
+    return last - count + 1, last
+
+
+def _take_pooled(key):
+    with _lock:
+        ranges = _pool.get(key)
+        while ranges:
+            block = ranges[0]
+            if block[0] <= block[1]:
+                number = block[0]
+                block[0] += 1
+                return number
+            ranges.pop(0)
+    return None
+
+
+def _add_to_pool(key, first, last):
+    with _lock:
+        _pool.setdefault(key, []).append([first, last])
+
+
+def next_number(key, start_after=lambda: 0):
+    """Next number on counter `key`, from this process's reserved block when one is available"""
+    number = _take_pooled(key)
+    if number is not None:
+        return number
+
+    first, last = reserve_block(key, _block_size(), start_after)
+    if last > first:
+        transaction.on_commit(lambda: _add_to_pool(key, first + 1, last))
+    return first
+
+
+def next_document_number(model, field, prefix, width=4):
+    """
+    Allocate the next "<prefix>-<NNNN>" value for `model.field`.
+
+        self.po_number = next_document_number(POHeader, 'po_number', 'PO-202610')
+    """
+    key = f"{model._meta.label_lower}.{field}:{prefix}"
+    number = next_number(key, start_after=lambda: _existing_max(model, field, prefix))
+    return f"{prefix}-{number:0{width}d}"
+
+
+def next_document_numbers(model, field, prefix, count, width=4):
+    """
+    Allocate `count` consecutive "<prefix>-<NNNN>" values in one counter update,
+    for rows written with bulk_create.
+    """
+    if count <= 0:
+        return []
+    key = f"{model._meta.label_lower}.{field}:{prefix}"
+    first, last = reserve_block(key, count, start_after=lambda: _existing_max(model, field, prefix))
+    return [f"{prefix}-{number:0{width}d}" for number in range(first, last + 1)]
@@ -0,0 +1,188 @@
+import os
+import sqlite3
+import tempfile
+from datetime import date
+
+from django.db import connection, transaction
+from django.test import SimpleTestCase, TestCase, override_settings
+
+from .management.commands.benchmark_document_sequences import run_allocators
+from .models import DocumentSequence, TaxRate
+from .sequences import clear_reserved_blocks, next_document_number, next_document_numbers, next_number
+
+
+@override_settings(DOCUMENT_SEQUENCE_BLOCK_SIZE=10)
+class DocumentSequenceTestCase(TestCase):
+
+    def tearDown(self):
+        clear_reserved_blocks()
+
+    def test_new_counter_continues_after_existing_documents(self):
+        TaxRate.objects.create(name="Old", rate=5, code="VAT-0041", effective_from=date(2024, 1, 1))
+        TaxRate.objects.create(name="Other", rate=5, code="GST-0099", effective_from=date(2024, 1, 1))
+
+        self.assertEqual(next_document_number(TaxRate, "code", "VAT"), "VAT-0042")
+        self.assertEqual(next_document_number(TaxRate, "code", "GST", width=5), "GST-00100")
+        self.assertEqual(next_document_number(TaxRate, "code", "TAX"), "TAX-0001")
+
+    def test_bulk_allocation_shares_the_counter(self):
+        TaxRate.objects.create(name="Old", rate=5, code="VAT-0041", effective_from=date(2024, 1, 1))
+        numbers = next_document_numbers(TaxRate, "code", "VAT", 3)
+        self.assertEqual(numbers, ["VAT-0042", "VAT-0043", "VAT-0044"])
+        self.assertEqual(DocumentSequence.objects.get(key="core.taxrate.code:VAT").last_value, 44)
+        self.assertEqual(next_document_number(TaxRate, "code", "VAT"), "VAT-0045")
+        self.assertEqual(next_document_numbers(TaxRate, "code", "VAT", 0), [])
+
+    def test_block_is_served_from_memory_after_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(next_number("test:block"), 1)
+        self.assertEqual(DocumentSequence.objects.get(key="test:block").last_value, 10)
+
+        with self.assertNumQueries(0):
+            numbers = [next_number("test:block") for _ in range(9)]
+        self.assertEqual(numbers, list(range(2, 11)))
+        # Block exhausted: one reservation for the next ten
+        self.assertEqual(next_number("test:block"), 11)
+        self.assertEqual(DocumentSequence.objects.get(key="test:block").last_value, 20)
+
+    def test_rolled_back_reservation_is_not_reused(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            try:
+                with transaction.atomic():
+                    self.assertEqual(next_number("test:rollback"), 1)
+                    raise RuntimeError
+            except RuntimeError:
+                pass
+        self.assertFalse(DocumentSequence.objects.filter(key="test:rollback").exists())
+        self.assertEqual(next_number("test:rollback"), 1)
+
+
+class DocumentSequenceConcurrencyTestCase(SimpleTestCase):
+    """
+    Spawned processes sharing one counter never hand out the same number.
+
+    The workers need a database they can all open, so the test builds a
+    throwaway SQLite file holding just the counter table.
+    """
+
+    databases = {"default"}  # only to render the counter table DDL
+    PROCESSES = 6
+    PER_PROCESS = 150
+
+    def run_workers(self, block_size):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "sequences.sqlite3")
+            with connection.schema_editor(collect_sql=True) as editor:
+                editor.create_model(DocumentSequence)
+            db = sqlite3.connect(path)
+            db.executescript(";".join(editor.collected_sql))
+            db.close()
+
+            numbers = run_allocators("test:concurrent", self.PROCESSES, self.PER_PROCESS, block_size, db_path=path)
+            db = sqlite3.connect(path)
+            (reserved,) = db.execute("SELECT last_value FROM core_document_sequence").fetchone()
+            db.close()
+        return numbers, reserved
+
+    def test_no_duplicates_across_processes(self):
+        numbers, reserved = self.run_workers(block_size=25)
+        self.assertEqual(len(numbers), self.PROCESSES * self.PER_PROCESS)
+        self.assertEqual(len(set(numbers)), len(numbers))
+        # At most one partly used block left per process
+        self.assertLess(reserved - len(numbers), 25 * self.PROCESSES)
+
+    def test_gap_free_without_blocks(self):
+        numbers, reserved = self.run_workers(block_size=1)
+        self.assertEqual(sorted(numbers), list(range(1, self.PROCESSES * self.PER_PROCESS + 1)))
+        self.assertEqual(reserved, len(numbers))
+
+
+
+class KeysetOrderingTestCase(SimpleTestCase):
+
+    def test_cursor_ordering(self):
+        from django.db.models.functions import Coalesce
+        from procurement.receiving.models import GoodsReceipt
+        from procurement.rfx.models import RFxItem, SupplierQuote, SupplierQuoteLine
+        from .pagination import POSITION, UnsupportedOrdering, keyset_ordering
+
+        self.assertEqual(keyset_ordering(GoodsReceipt, GoodsReceipt._meta.ordering),
+                         (("-receipt_date", "-grn_number", "-pk"), None))
+        # Foreign keys page on their id column
+        self.assertEqual(keyset_ordering(RFxItem, ["rfx_event", "line_number"]),
+                         (("rfx_event_id", "line_number", "pk"), None))
+        # Related and nullable leading fields page on an annotated position
+        terms, position = keyset_ordering(SupplierQuoteLine, ["rfx_item__line_number"])
+        self.assertEqual((terms, position.name), ((POSITION, "pk"), "rfx_item__line_number"))
+        terms, position = keyset_ordering(SupplierQuote, "-submitted_date")
+        self.assertEqual(terms, (f"-{POSITION}", "-pk"))
+        self.assertIsInstance(position, Coalesce)
+        self.assertEqual(keyset_ordering(GoodsReceipt, ["id"]), (("id",), None))
+        with self.assertRaises(UnsupportedOrdering):
+            keyset_ordering(RFxItem, ["quote_lines"])
+
+
+class KeysetPaginationTestCase(TestCase):
+    """Pages follow the requested order, related and nullable terms included"""
+
+    def setUp(self):
+        from ap.models import Supplier
+        from procurement.catalog.models import CatalogCategory, CatalogItem, UnitOfMeasure
+        from .models import Currency
+
+        currency = Currency.objects.create(code="AED", name="Dirham", is_base=True)
+        uom = UnitOfMeasure.objects.create(code="EA", name="Each")
+        category = CatalogCategory.objects.create(code="GEN", name="General")
+        suppliers = [Supplier.objects.create(code=f"S{n}", name=name) for n, name in enumerate("DBCA")]
+        # Two items per supplier, two with no supplier at all
+        for n, supplier in enumerate(suppliers * 2 + [None, None]):
+            CatalogItem.objects.create(sku=f"ITM-{n}", item_code=f"ITM-{n}", name=f"Item {n}", category=category,
+                                       unit_of_measure=uom, list_price=1, currency=currency, preferred_supplier=supplier)
+
+    def view(self):
+        from rest_framework import filters, generics, serializers
+        from procurement.catalog.models import CatalogItem
+        from .pagination import KeysetCursorPagination
+
+        class ItemSerializer(serializers.ModelSerializer):
+            supplier = serializers.CharField(source="preferred_supplier.name", default=None)
+
+            class Meta:
+                model = CatalogItem
+                fields = ["id", "supplier"]
+
+        class ItemList(generics.ListAPIView):
+            queryset = CatalogItem.objects.select_related("preferred_supplier")
+            serializer_class = ItemSerializer
+            pagination_class = KeysetCursorPagination
+            filter_backends = [filters.OrderingFilter]
+            ordering_fields = ["preferred_supplier__name", "supplier_price_tiers__unit_price", "sku"]
+            ordering = ["sku"]
+
+        return ItemList.as_view()
+
+    def pages(self, query):
+        from rest_framework.test import APIRequestFactory
+
+        view, factory, rows, url = self.view(), APIRequestFactory(), [], f"/items/?page_size=3&{query}"
+        while url:
+            data = view(factory.get(url)).data
+            rows += [(row["supplier"], row["id"]) for row in data["results"]]
+            url = data["next"]
+        return rows
+
+    def test_related_nullable_ordering_is_kept(self):
+        rows = self.pages("ordering=preferred_supplier__name")
+        # No supplier first, then by supplier name, ties by pk
+        self.assertEqual(rows, sorted(rows, key=lambda row: (row[0] or "", row[1])))
+        self.assertEqual(len(rows), 10)
+        rows = self.pages("ordering=-preferred_supplier__name")
+        self.assertEqual(rows, sorted(rows, key=lambda row: (row[0] or "", row[1]), reverse=True))
+        self.assertEqual(len(set(rows)), 10)
+
+    def test_unsupported_requested_ordering_is_rejected(self):
+        from rest_framework.test import APIRequestFactory
+
+        resp = self.view()(APIRequestFactory().get("/items/?ordering=supplier_price_tiers__unit_price"))
+        self.assertEqual(resp.status_code, 400)
+        self.assertIn("ordering", resp.data)
@@ -153,6 +153,13 @@ CORS_ALLOW_HEADERS = [
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Finished report job artifacts (served only through /api/reports/jobs/<id>/download/)
+REPORT_ARTIFACT_ROOT = os.path.join(BASE_DIR, 'report_artifacts')
+
+# Document numbers each process reserves per trip to core_document_sequence
+# (1 gives gap-free numbering at the cost of a counter row lock per document)
+DOCUMENT_SEQUENCE_BLOCK_SIZE = 20
+
 # Maximum file upload size (10MB)
 DATA_UPLOAD_MAX_MEMORY_SIZE = 10485760  # 10MB in bytes
 FILE_UPLOAD_MAX_MEMORY_SIZE = 10485760  # 10MB in bytes
@@ -7,10 +7,11 @@ from finance.api import (CorporateTaxReverse, JournalEntryViewSet, JournalLineVi
 from finance.api import BankAccountViewSet
 from segment.api import AccountViewSet
 from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView
-from finance.api import TrialBalanceReport, ARAgingReport, APAgingReport
+from finance.api import TrialBalanceReport, ARAgingReport, APAgingReport, SegmentRollupReport
 from rest_framework.urlpatterns import format_suffix_patterns
 from finance.api import SeedVATPresets, ListTaxRates, TaxRateDetail, CorporateTaxAccrual,CorporateTaxFile,CorporateTaxBreakdown,CorporateTaxFilingDetail
 from finance.api import ExchangeRateViewSet, CurrencyConvertView, CreateExchangeRateView, FXGainLossAccountViewSet, BaseCurrencyView
+from finance.api import ReportJobViewSet
 from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView, SpectacularRedocView
 from crm.api import CustomerViewSet
 # Note: SupplierViewSet is available at /api/ap/vendors/ with full vendor management features
@@ -40,11 +41,13 @@ router.register(r"customers", CustomerViewSet)
 router.register(r"fx/rates", ExchangeRateViewSet, basename="exchangerate")
 router.register(r"fx/accounts", FXGainLossAccountViewSet, basename="fxgainlossaccount")
 router.register(r"invoice-approvals", InvoiceApprovalViewSet, basename="invoice-approvals")
+router.register(r"reports/jobs", ReportJobViewSet, basename="report-jobs")
 
 # Import inventory API viewsets
 from inventory.api import (
     InventoryBalanceViewSet, StockMovementViewSet,
-    StockAdjustmentViewSet, StockTransferViewSet
+    StockAdjustmentViewSet, StockTransferViewSet,
+    InventoryValuationReport,
 )
 
 # Register inventory endpoints
@@ -74,6 +77,8 @@ urlpatterns = [
     path("api/reports/trial-balance/", TrialBalanceReport.as_view()),
     path("api/reports/ar-aging/", ARAgingReport.as_view()),
     path("api/reports/ap-aging/", APAgingReport.as_view()),
+    path("api/reports/segment-rollup/", SegmentRollupReport.as_view()),
+    path("api/reports/inventory-valuation/", InventoryValuationReport.as_view()),
     path("api/tax/seed-presets/", SeedVATPresets.as_view()),
     path("api/tax/rates/", ListTaxRates.as_view()),
     path("api/tax/rates/<int:pk>/", TaxRateDetail.as_view()),
@@ -1,19 +1,21 @@
 
-from rest_framework import viewsets, status
+from rest_framework import viewsets, status, mixins
 from rest_framework.permissions import IsAdminUser
 from rest_framework.decorators import api_view, permission_classes,action
 from rest_framework.response import Response
 from rest_framework.views import APIView
+import os
 from datetime import datetime, date
 from django.utils import timezone
+from django.db import transaction
 from django.middleware.csrf import get_token
 from django.views.decorators.csrf import ensure_csrf_cookie
 from django.utils.decorators import method_decorator
 from core.models import TaxRate, Currency
-from django.http import HttpResponse
-import csv
+from core.mixins import FieldProjectionMixin
+from core.pagination import KeysetCursorPagination
+from django.http import FileResponse, HttpResponse
 from django.db.models import Sum, F, Q
-from io import BytesIO
 from decimal import Decimal
 from .models import JournalEntry, JournalLine, BankAccount, InvoiceApproval
 from segment.models import XX_Segment
@@ -26,22 +28,24 @@ from .services import (
     gl_post_from_ar_balanced, gl_post_from_ap_balanced,
     post_ar_payment, post_ap_payment,
     reverse_journal, seed_vat_presets, accrue_corporate_tax,
-    q2, _with_org_filter, ar_totals, ap_totals
+    q2, _with_org_filter, ar_totals, ap_totals,
+    annotate_open_balances, apply_unrated_fx_adjustments,
 )
 from .models import CorporateTaxFiling
+from .balance_services import apply_entry_to_balances
+from .bulk_posting_services import BULK_POST_CHUNK_SIZE, bulk_post_invoices
 from .services import (
     resolve_tax_rate_for_date,
     accrue_corporate_tax_with_filing, reverse_corporate_tax_filing, file_corporate_tax,
     # reuse accrue_corporate_tax if you need raw calc without filing
 )
-try:
-    from openpyxl import Workbook
-    OPENPYXL_OK = True
-except ImportError:
-    OPENPYXL_OK = False
+from .exports import OPENPYXL_OK, EXPORT_CHUNK_SIZE, csv_response, xlsx_response
+from .models import ReportJob
+from .report_job_services import FILE_FORMATS, artifact_file, download_name, report_types, submit_report_job
+from .serializers import ReportJobSerializer, ReportJobRequestSerializer
 
 
-from .services import build_trial_balance, build_ar_aging, build_ap_aging
+from .services import build_trial_balance, build_ar_aging, build_ap_aging, build_segment_rollup
 
 
 from drf_spectacular.utils import extend_schema, extend_schema_view, OpenApiExample, inline_serializer
@@ -49,60 +53,42 @@ from rest_framework import serializers as drf_serializers
 
 @extend_schema(
     parameters=[],
-    description="Trial Balance report. Supports ?date_from=YYYY-MM-DD&date_to=YYYY-MM-DD and format choices.",
+    description="Trial Balance report. Supports ?date_from=YYYY-MM-DD&date_to=YYYY-MM-DD, "
+                "optional ?segment_type=<name|id> to split rows by a segment dimension, and format choices.",
     responses={200: None}
 )
 class TrialBalanceReport(APIView):
     def get(self, request):
         df = request.GET.get("date_from")
         dt = request.GET.get("date_to")
+        segment_type = request.GET.get("segment_type") or None
         fmt = (request.GET.get("format") or "json").lower()
         file_type = request.GET.get("file_type", "").lower()
 
-        # Force list to avoid generator exhaustion
-        rows = list(build_trial_balance(df, dt))
+        try:
+            # Force list to avoid generator exhaustion
+            rows = list(build_trial_balance(df, dt, segment_type=segment_type))
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
 
-        if fmt == "csv" or file_type == "csv":
-            # CSV uses built-in csv module, no external library needed
-            resp = HttpResponse(content_type="text/csv; charset=utf-8")
-            resp["Content-Disposition"] = 'attachment; filename="trial_balance.csv"'
-            resp.write('\ufeff')  # Excel-friendly BOM
-            w = csv.writer(resp)
-            w.writerow(["Account Code", "Account Name", "Debit", "Credit"])
+        header = ["Account Code", "Account Name", "Debit", "Credit"]
+        if segment_type:
+            header.insert(2, "Segment")
+
+        def export_rows(amount):
             for r in rows:
-                w.writerow([
-                    r.get("code", ""),
-                    r.get("name", ""),
-                    f'{r.get("debit", 0):.2f}',
-                    f'{r.get("credit", 0):.2f}'
-                ])
-            return resp
+                line = [r.get("code", ""), r.get("name", ""), amount(r.get("debit", 0)), amount(r.get("credit", 0))]
+                if segment_type:
+                    line.insert(2, r.get("segment") or "")
+                yield line
+
+        if fmt == "csv" or file_type == "csv":
+            return csv_response(export_rows(lambda v: f"{v:.2f}"), header, "trial_balance.csv")
 
         if fmt in ("xlsx", "excel", "xlsm") or file_type == "xlsx":
             if not OPENPYXL_OK:
                return HttpResponse("openpyxl not installed", status=400)
-            wb = Workbook()
-            ws = wb.active
-            ws.title = "Trial Balance"
-            ws.append(["Account Code", "Account Name", "Debit", "Credit"])
-            for r in rows:
-                ws.append([
-                    r.get("code", ""),
-                    r.get("name", ""),
-                    float(r.get("debit", 0)),
-                    float(r.get("credit", 0))
-                ])
-
-            bio = BytesIO()
-            wb.save(bio)
-            bio.seek(0)
-
-            resp = HttpResponse(
-                bio.getvalue(),
-                content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
-            )
-            resp["Content-Disposition"] = 'attachment; filename="trial_balance.xlsx"'
-            return resp
+            return xlsx_response(export_rows(float), header, "trial_balance.xlsx", "Trial Balance")
 
         # Default JSON response with download links
         base_url = request.build_absolute_uri(request.path)
@@ -111,6 +97,8 @@ class TrialBalanceReport(APIView):
             query_params.append(f"date_from={df}")
         if dt:
             query_params.append(f"date_to={dt}")
+        if segment_type:
+            query_params.append(f"segment_type={segment_type}")
         
         query_string = "&".join(query_params)
         
@@ -127,7 +115,38 @@ class TrialBalanceReport(APIView):
 
 @extend_schema(
     parameters=[],
-    description="AR Aging report. Supports ?as_of=YYYY-MM-DD, and bucket sizes b1,b2,b3.",
+    description="Segment roll-up report: posted debit/credit of every segment of ?segment_type=<name|id>, "
+                "each including its whole subtree. Optional ?root=<segment id> limits rows to one subtree; "
+                "supports ?date_from=YYYY-MM-DD&date_to=YYYY-MM-DD and ?file_type=csv.",
+    responses={200: None}
+)
+class SegmentRollupReport(APIView):
+    def get(self, request):
+        segment_type = request.GET.get("segment_type")
+        root = request.GET.get("root")
+        if not segment_type:
+            return Response({"detail": "segment_type is required"}, status=status.HTTP_400_BAD_REQUEST)
+        if root and not root.isdigit():
+            return Response({"detail": "root must be a segment id"}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            rows = build_segment_rollup(segment_type, root=int(root) if root else None,
+                                        date_from=request.GET.get("date_from"), date_to=request.GET.get("date_to"))
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+
+        if (request.GET.get("format") or request.GET.get("file_type") or "").lower() == "csv":
+            header = ["Code", "Name", "Parent Code", "Debit", "Credit", "Balance"]
+            return csv_response(
+                ([r["code"], r["name"], r["parent_code"] or "", f"{r['debit']:.2f}", f"{r['credit']:.2f}",
+                  f"{r['balance']:.2f}"] for r in rows),
+                header, "segment_rollup.csv",
+            )
+        return Response({"data": rows})
+
+
+@extend_schema(
+    parameters=[],
+    description="AR Aging report. Supports ?as_of=YYYY-MM-DD, bucket sizes b1,b2,b3 and ?open_only=1 to skip cancelled/paid invoices.",
     responses={200: None}
 )
 class ARAgingReport(APIView):
@@ -147,40 +166,28 @@ class ARAgingReport(APIView):
         fmt = (request.GET.get("format") or "json").lower()
         file_type = request.GET.get("file_type", "").lower()
 
-        data = build_ar_aging(as_of, b1, b2, b3)
+        open_only = request.GET.get("open_only", "").lower() in ("1", "true", "yes")
+
+        data = build_ar_aging(as_of, b1, b2, b3, open_only=open_only)
         
-        if fmt == "csv" or file_type == "csv":
-            resp = HttpResponse(content_type="text/csv; charset=utf-8")
-            resp["Content-Disposition"] = 'attachment; filename="ar_aging.csv"'
-            resp.write('\ufeff')  # Excel-friendly BOM
-            w = csv.writer(resp)
-            w.writerow(["Invoice ID","Number","Customer","Date","Due Date","Days Overdue","Bucket","Balance"])
+        header = ["Invoice ID","Number","Customer","Date","Due Date","Days Overdue","Bucket","Balance"]
+
+        def export_rows(amount):
             for r in data["invoices"]:
-                w.writerow([r["invoice_id"], r["number"], r["customer"], r["date"], r["due_date"], r["days_overdue"], r["bucket"], f'{r["balance"]:.2f}'])
-            # add summary rows
-            w.writerow([]); w.writerow(["Summary"])
-            for k in data["buckets"] + [">=TOTAL_MARKER"]:
-                if k == ">=TOTAL_MARKER":
-                    w.writerow(["TOTAL", "", "", "", "", "", "", f'{data["summary"]["TOTAL"]:.2f}'])
-                else:
-                    w.writerow([k, "", "", "", "", "", "", f'{data["summary"][k]:.2f}'])
-            return resp
+                yield [r["invoice_id"], r["number"], r["customer"], r["date"], r["due_date"], r["days_overdue"], r["bucket"], amount(r["balance"])]
+            yield []
+            yield ["Summary"]
+            for k in data["buckets"]:
+                yield [k, "", "", "", "", "", "", amount(data["summary"][k])]
+            yield ["TOTAL", "", "", "", "", "", "", amount(data["summary"]["TOTAL"])]
+
+        if fmt == "csv" or file_type == "csv":
+            return csv_response(export_rows(lambda v: f"{v:.2f}"), header, "ar_aging.csv")
 
         if fmt in ("xlsx", "excel") or file_type == "xlsx":
             if not OPENPYXL_OK:
                return HttpResponse("openpyxl not installed", status=400)
-            wb = Workbook(); ws = wb.active; ws.title = "AR Aging"
-            ws.append(["Invoice ID","Number","Customer","Date","Due Date","Days Overdue","Bucket","Balance"])
-            for r in data["invoices"]:
-                ws.append([r["invoice_id"], r["number"], r["customer"], r["date"], r["due_date"], r["days_overdue"], r["bucket"], r["balance"]])
-            ws.append([]); ws.append(["Summary"])
-            for k in data["buckets"]:
-                ws.append([k, "", "", "", "", "", "", data["summary"][k]])
-            ws.append(["TOTAL","","","","","","", data["summary"]["TOTAL"]])
-            bio = BytesIO(); wb.save(bio); bio.seek(0)
-            resp = HttpResponse(bio.read(), content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
-            resp["Content-Disposition"] = 'attachment; filename="ar_aging.xlsx"'
-            return resp
+            return xlsx_response(export_rows(lambda v: v), header, "ar_aging.xlsx", "AR Aging")
 
         # Default JSON response with download links
         base_url = request.build_absolute_uri(request.path)
@@ -193,6 +200,8 @@ class ARAgingReport(APIView):
             query_params.append(f"b2={b2}")
         if request.GET.get("b3"):
             query_params.append(f"b3={b3}")
+        if open_only:
+            query_params.append("open_only=1")
         
         query_string = "&".join(query_params)
         
@@ -208,7 +217,7 @@ class ARAgingReport(APIView):
 
 @extend_schema(
     parameters=[],
-    description="AP Aging report. Supports ?as_of=YYYY-MM-DD, and bucket sizes b1,b2,b3.",
+    description="AP Aging report. Supports ?as_of=YYYY-MM-DD, bucket sizes b1,b2,b3 and ?open_only=1 to skip cancelled/paid invoices.",
     responses={200: None}
 )
 class APAgingReport(APIView):
@@ -229,40 +238,28 @@ class APAgingReport(APIView):
         fmt = (request.GET.get("format") or "json").lower()
         file_type = request.GET.get("file_type", "").lower()
 
-        data = build_ap_aging(as_of, b1, b2, b3)
+        open_only = request.GET.get("open_only", "").lower() in ("1", "true", "yes")
 
-        if fmt == "csv" or file_type == "csv":
-            resp = HttpResponse(content_type="text/csv; charset=utf-8")
-            resp["Content-Disposition"] = 'attachment; filename="ap_aging.csv"'
-            resp.write('\ufeff')  # Excel-friendly BOM
-            w = csv.writer(resp)
-            w.writerow(["Invoice ID","Number","Supplier","Date","Due Date","Days Overdue","Bucket","Balance"])
+        data = build_ap_aging(as_of, b1, b2, b3, open_only=open_only)
+
+        header = ["Invoice ID","Number","Supplier","Date","Due Date","Days Overdue","Bucket","Balance"]
+
+        def export_rows(amount):
             for r in data["invoices"]:
-                w.writerow([r["id"], r["number"], r["supplier"], r["date"], r["due_date"], r["days_overdue"], r["bucket"], r["balance"]])
-            # add summary rows
-            w.writerow([]); w.writerow(["Summary"])
-            for k in data["buckets"] + [">=TOTAL_MARKER"]:
-                if k == ">=TOTAL_MARKER":
-                    w.writerow(["TOTAL", "", "", "", "", "", "", f'{data["summary"]["TOTAL"]:.2f}'])
-                else:
-                    w.writerow([k, "", "", "", "", "", "", f'{data["summary"][k]:.2f}'])
-            return resp
+                yield [r["invoice_id"], r["number"], r["supplier"], r["date"], r["due_date"], r["days_overdue"], r["bucket"], amount(r["balance"])]
+            yield []
+            yield ["Summary"]
+            for k in data["buckets"]:
+                yield [k, "", "", "", "", "", "", amount(data["summary"][k])]
+            yield ["TOTAL", "", "", "", "", "", "", amount(data["summary"]["TOTAL"])]
+
+        if fmt == "csv" or file_type == "csv":
+            return csv_response(export_rows(lambda v: f"{v:.2f}"), header, "ap_aging.csv")
 
         if fmt in ("xlsx", "excel") or file_type == "xlsx":
             if not OPENPYXL_OK:
                return HttpResponse("openpyxl not installed", status=400)
-            wb = Workbook(); ws = wb.active; ws.title = "AP Aging"
-            ws.append(["Invoice ID","Number","Supplier","Date","Due Date","Days Overdue","Bucket","Balance"])
-            for r in data["invoices"]:
-                ws.append([r["invoice_id"], r["number"], r["supplier"], r["date"], r["due_date"], r["days_overdue"], r["bucket"], r["balance"]])
-            ws.append([]); ws.append(["Summary"])
-            for k in data["buckets"]:
-                ws.append([k, "", "", "", "", "", "", data["summary"][k]])
-            ws.append(["TOTAL","","","","","","", data["summary"]["TOTAL"]])
-            bio = BytesIO(); wb.save(bio); bio.seek(0)
-            resp = HttpResponse(bio.read(), content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
-            resp["Content-Disposition"] = 'attachment; filename="ap_aging.xlsx"'
-            return resp
+            return xlsx_response(export_rows(lambda v: v), header, "ap_aging.xlsx", "AP Aging")
 
         # Default JSON response with download links
         base_url = request.build_absolute_uri(request.path)
@@ -275,6 +272,8 @@ class APAgingReport(APIView):
             query_params.append(f"b2={b2}")
         if request.GET.get("b3"):
             query_params.append(f"b3={b3}")
+        if open_only:
+            query_params.append("open_only=1")
         
         query_string = "&".join(query_params)
         
@@ -315,7 +314,8 @@ class CurrencyViewSet(viewsets.ModelViewSet):
 # AccountViewSet moved to segment/api.py
 
 
-class JournalEntryViewSet(viewsets.ModelViewSet):
+class JournalEntryViewSet(FieldProjectionMixin, viewsets.ModelViewSet):
+    pagination_class = KeysetCursorPagination
     serializer_class = JournalEntrySerializer; queryset = JournalEntry.objects.all()
     
     @action(detail=True, methods=["post"], url_path="post")
@@ -353,8 +353,10 @@ class JournalEntryViewSet(viewsets.ModelViewSet):
                 }, status=status.HTTP_400_BAD_REQUEST)
         
         # Mark as posted
-        journal.posted = True
-        journal.save()
+        with transaction.atomic():
+            journal.posted = True
+            journal.save()
+            apply_entry_to_balances(journal)
         
         return Response({
             'message': 'Journal entry posted successfully',
@@ -398,65 +400,34 @@ class JournalEntryViewSet(viewsets.ModelViewSet):
         if posted_only:
             queryset = queryset.filter(posted=True)
         
-        queryset = queryset.order_by('date', 'id').prefetch_related('lines__account')
+        header = ["Journal ID", "Date", "Currency", "Memo", "Posted", "Account Code", "Account Name", "Debit", "Credit"]
+        lines = (
+            JournalLine.objects.filter(entry__in=queryset)
+            .order_by('entry__date', 'entry_id', 'id')
+            .values_list('entry_id', 'entry__date', 'entry__currency__code', 'entry__memo', 'entry__posted',
+                         'account__code', 'account__alias', 'debit', 'credit')
+        )
+
+        def export_rows(amount):
+            for entry_id, entry_date, currency, memo, posted, code, alias, debit, credit in \
+                    lines.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+                yield [entry_id, entry_date, currency or "", memo, "Yes" if posted else "No",
+                       code, alias or code, amount(debit), amount(credit)]
 
         if file_type == "csv":
-            resp = HttpResponse(content_type="text/csv; charset=utf-8")
-            resp["Content-Disposition"] = 'attachment; filename="journals.csv"'
-            resp.write('\ufeff')  # BOM for Excel
-            w = csv.writer(resp)
-            w.writerow(["Journal ID", "Date", "Currency", "Memo", "Posted", "Account Code", "Account Name", "Debit", "Credit"])
-            
-            for entry in queryset:
-                for line in entry.lines.all():
-                    w.writerow([
-                        entry.id,
-                        entry.date,
-                        entry.currency.code if entry.currency else "",
-                        entry.memo,
-                        "Yes" if entry.posted else "No",
-                        line.account.code,
-                        line.account.name,
-                        f"{line.debit:.2f}",
-                        f"{line.credit:.2f}"
-                    ])
-            return resp
+            return csv_response(export_rows(lambda v: f"{v:.2f}"), header, "journals.csv")
 
         elif file_type == "xlsx":
             if not OPENPYXL_OK:
                 return HttpResponse("openpyxl not installed", status=400)
-            
-            wb = Workbook()
-            ws = wb.active
-            ws.title = "Journal Entries"
-            ws.append(["Journal ID", "Date", "Currency", "Memo", "Posted", "Account Code", "Account Name", "Debit", "Credit"])
-            
-            for entry in queryset:
-                for line in entry.lines.all():
-                    ws.append([
-                        entry.id,
-                        entry.date,
-                        entry.currency.code if entry.currency else "",
-                        entry.memo,
-                        "Yes" if entry.posted else "No",
-                        line.account.code,
-                        line.account.name,
-                        float(line.debit),
-                        float(line.credit)
-                    ])
-            
-            bio = BytesIO()
-            wb.save(bio)
-            bio.seek(0)
-            resp = HttpResponse(bio.read(), content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
-            resp["Content-Disposition"] = 'attachment; filename="journals.xlsx"'
-            return resp
+            return xlsx_response(export_rows(float), header, "journals.xlsx", "Journal Entries")
         
         else:
             return Response({"error": "Invalid file_type. Use 'csv' or 'xlsx'."}, status=400)
 
-class JournalLineViewSet(viewsets.ReadOnlyModelViewSet):
+class JournalLineViewSet(FieldProjectionMixin, viewsets.ReadOnlyModelViewSet):
     """Read-only viewset for journal lines with filtering capabilities"""
+    pagination_class = KeysetCursorPagination
     serializer_class = JournalLineDetailSerializer
     queryset = JournalLine.objects.select_related('entry', 'account', 'entry__currency').all()
     filterset_fields = ['account', 'entry']
@@ -495,9 +466,57 @@ class JournalLineViewSet(viewsets.ReadOnlyModelViewSet):
         
         return queryset.order_by('-entry__date', '-entry__id', 'id')
 
-class ARInvoiceViewSet(viewsets.ModelViewSet):
+BulkPostGLRequest = inline_serializer(
+    name="BulkPostGLRequest",
+    fields={
+        "invoice_ids": drf_serializers.ListField(child=drf_serializers.IntegerField()),
+        "chunk_size": drf_serializers.IntegerField(required=False, min_value=1, max_value=5000),
+    },
+)
+
+
+def _bulk_post_gl(request, kind):
+    """Shared body of the AR/AP bulk-post-gl actions"""
+    invoice_ids = request.data.get("invoice_ids")
+    if not isinstance(invoice_ids, list) or not invoice_ids:
+        return Response({"detail": "invoice_ids must be a non-empty list"}, status=status.HTTP_400_BAD_REQUEST)
+    try:
+        chunk_size = int(request.data.get("chunk_size") or BULK_POST_CHUNK_SIZE)
+        result = bulk_post_invoices(kind, invoice_ids, chunk_size=max(1, min(chunk_size, 5000)))
+    except (TypeError, ValueError) as e:
+        return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(result, status=status.HTTP_200_OK)
+
+
+class InvoiceListTotalsMixin:
+    """
+    List views of AR/AP invoices annotate paid amounts and balances in the
+    queryset and prefetch the nested rows, so a page of invoices costs a fixed
+    number of queries. Detail views keep computing totals per invoice.
+    """
+    list_select_related = ()
+    list_prefetch_related = ()
+
+    def get_queryset(self):
+        qs = super().get_queryset()
+        if self.action == "list":
+            qs = annotate_open_balances(
+                qs.select_related(*self.list_select_related).prefetch_related(*self.list_prefetch_related)
+            )
+        return qs
+
+    def get_serializer(self, *args, **kwargs):
+        if self.action == "list" and kwargs.get("many") and args:
+            invoices = apply_unrated_fx_adjustments(list(args[0]))
+            args = (invoices,) + args[1:]
+        return super().get_serializer(*args, **kwargs)
+
+
+class ARInvoiceViewSet(FieldProjectionMixin, InvoiceListTotalsMixin, viewsets.ModelViewSet):
+    pagination_class = KeysetCursorPagination
     serializer_class = ARInvoiceSerializer
     queryset = ARInvoice.objects.select_related('customer', 'currency').prefetch_related('items', 'items__tax_rate')
+    list_prefetch_related = ('gl_lines',)
     
     def update(self, request, *args, **kwargs):
         """Override update to prevent modification after submission for approval or posting"""
@@ -641,6 +660,15 @@ class ARInvoiceViewSet(viewsets.ModelViewSet):
         payload = {"already_posted": not created, "journal": JournalEntryReadSerializer(je).data}
         return Response(payload, status=200 if created or not created else 201)
 
+    @extend_schema(
+        request=BulkPostGLRequest,
+        description="Post many APPROVED AR invoices to the GL in chunked transactions. "
+                    "Returns a per-invoice status (POSTED, ALREADY_POSTED or FAILED) and throughput.",
+    )
+    @action(detail=False, methods=["post"], url_path="bulk-post-gl")
+    def bulk_post_gl(self, request):
+        return _bulk_post_gl(request, "AR")
+
     @action(detail=True, methods=["post"], url_path="submit-for-approval")
     def submit_for_approval(self, request, pk=None):
         """Submit AR invoice for approval"""
@@ -701,9 +729,12 @@ class ARInvoiceViewSet(viewsets.ModelViewSet):
 
 
 
-class APInvoiceViewSet(viewsets.ModelViewSet):
+class APInvoiceViewSet(FieldProjectionMixin, InvoiceListTotalsMixin, viewsets.ModelViewSet):
+    pagination_class = KeysetCursorPagination
     serializer_class = APInvoiceSerializer
     queryset = APInvoice.objects.select_related('supplier', 'currency').prefetch_related('items', 'items__tax_rate')
+    list_select_related = ('goods_receipt', 'po_header')
+    list_prefetch_related = ('distributions__segments__segment_type', 'distributions__segments__segment')
     
     def update(self, request, *args, **kwargs):
         """Override update to prevent modification after submission for approval or posting"""
@@ -847,6 +878,15 @@ class APInvoiceViewSet(viewsets.ModelViewSet):
         payload = {"already_posted": not created, "journal": JournalEntryReadSerializer(je).data}
         return Response(payload, status=200 if created or not created else 201)
 
+    @extend_schema(
+        request=BulkPostGLRequest,
+        description="Post many APPROVED AP invoices to the GL in chunked transactions. "
+                    "Returns a per-invoice status (POSTED, ALREADY_POSTED or FAILED) and throughput.",
+    )
+    @action(detail=False, methods=["post"], url_path="bulk-post-gl")
+    def bulk_post_gl(self, request):
+        return _bulk_post_gl(request, "AP")
+
     @action(detail=True, methods=["post"], url_path="submit-for-approval")
     def submit_for_approval(self, request, pk=None):
         """Submit AP invoice for approval"""
@@ -988,6 +1028,7 @@ class APInvoiceViewSet(viewsets.ModelViewSet):
 
 
 class ARPaymentViewSet(viewsets.ModelViewSet):
+    pagination_class = KeysetCursorPagination
     serializer_class = ARPaymentSerializer
     queryset = ARPayment.objects.all()
 
@@ -1097,6 +1138,7 @@ class ARPaymentViewSet(viewsets.ModelViewSet):
     )
 )
 class APPaymentViewSet(viewsets.ModelViewSet):
+    pagination_class = KeysetCursorPagination
     serializer_class = APPaymentSerializer
     queryset = APPayment.objects.all()
 
@@ -1469,71 +1511,74 @@ class CorporateTaxBreakdown(APIView):
        df_d = datetime.fromisoformat(df).date() if df else None
        dt_d = datetime.fromisoformat(dt).date() if dt else None
        # collect rows
-       qs = JournalLine.objects.select_related("entry","account") \
-            .filter(entry__posted=True)
+       qs = JournalLine.objects.filter(entry__posted=True)
        if df_d: qs = qs.filter(entry__date__gte=df_d)
        if dt_d: qs = qs.filter(entry__date__lte=dt_d)
        qs = _with_org_filter(qs, org_id)
-       rows = []
-       income = Decimal("0"); expense = Decimal("0")
-       for ln in qs:
-           kind = "OTHER"
-           delta = Decimal("0")
-           # Handle both short codes (IN, EX) and full names (INCOME, EXPENSE)
-           acc_type = ln.account.type.upper()
-           if acc_type in ("INCOME", "IN"):
-               kind = "INCOME"
-               delta = (Decimal(ln.credit) - Decimal(ln.debit))
-               income += delta
-           elif acc_type in ("EXPENSE", "EX"):
-               kind = "EXPENSE"
-               delta = (Decimal(ln.debit) - Decimal(ln.credit))
-               expense += delta
-           rows.append({
-               "date": ln.entry.date.isoformat() if ln.entry.date else None,
-               "journal_id": ln.entry.id,
-               "account_code": ln.account.code,
-               "account_name": ln.account.name,
-               "type": kind,
-               "delta": float(q2(delta)),
-               "debit": float(q2(ln.debit)),
-               "credit": float(q2(ln.credit)),
-           })
-       profit = q2(income - expense)
-       meta = {
-           "country": country,
-           "date_from": df, "date_to": dt, "org_id": org_id,
-           "income": float(q2(income)), "expense": float(q2(expense)),
-           "profit": float(profit)
-       }
+       qs = qs.order_by("entry__date", "entry_id", "id").values_list(
+           "entry__date", "entry_id", "account__code", "account__alias",
+           "account__segment_type__segment_type", "debit", "credit",
+       )
+       totals = {"INCOME": Decimal("0"), "EXPENSE": Decimal("0")}
+
+       def breakdown_rows():
+           """Yield row dicts from a chunked iterator, accumulating income/expense"""
+           for entry_date, journal_id, code, alias, acc_type, debit, credit in qs.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+               kind = "OTHER"
+               delta = Decimal("0")
+               # Handle both short codes (IN, EX) and full names (INCOME, EXPENSE)
+               acc_type = (acc_type or "").upper()
+               if acc_type in ("INCOME", "IN"):
+                   kind = "INCOME"
+                   delta = (Decimal(credit) - Decimal(debit))
+               elif acc_type in ("EXPENSE", "EX"):
+                   kind = "EXPENSE"
+                   delta = (Decimal(debit) - Decimal(credit))
+               if kind != "OTHER":
+                   totals[kind] += delta
+               yield {
+                   "date": entry_date.isoformat() if entry_date else None,
+                   "journal_id": journal_id,
+                   "account_code": code,
+                   "account_name": alias or code,
+                   "type": kind,
+                   "delta": float(q2(delta)),
+                   "debit": float(q2(debit)),
+                   "credit": float(q2(credit)),
+               }
+
+       def build_meta():
+           income = q2(totals["INCOME"]); expense = q2(totals["EXPENSE"])
+           return {
+               "country": country,
+               "date_from": df, "date_to": dt, "org_id": org_id,
+               "income": float(income), "expense": float(expense),
+               "profit": float(q2(income - expense))
+           }
+
+       header = ["Date","Journal","Account Code","Account Name","Type","Delta","Debit","Credit"]
+
+       def export_rows(amount):
+           for r in breakdown_rows():
+               yield [r["date"], r["journal_id"], r["account_code"], r["account_name"], r["type"], amount(r["delta"]), amount(r["debit"]), amount(r["credit"])]
+           # footer (totals are complete once every row has been streamed)
+           meta = build_meta()
+           yield []
+           yield ["Income", amount(meta["income"])]
+           yield ["Expense", amount(meta["expense"])]
+           yield ["Profit", amount(meta["profit"])]
+
        # CSV Export
        if fmt == "csv" or file_type == "csv":
-           from django.http import HttpResponse; import csv
-           resp = HttpResponse(content_type="text/csv; charset=utf-8")
-           resp["Content-Disposition"] = 'attachment; filename="corp_tax_breakdown.csv"'
-           resp.write('\ufeff')  # Excel-friendly BOM
-           w = csv.writer(resp)
-           w.writerow(["Date","Journal","Account Code","Account Name","Type","Delta","Debit","Credit"])
-           for r in rows: w.writerow([r["date"], r["journal_id"], r["account_code"], r["account_name"], r["type"], f'{r["delta"]:.2f}', f'{r["debit"]:.2f}', f'{r["credit"]:.2f}'])
-           # footer
-           w.writerow([]); w.writerow(["Income", f'{meta["income"]:.2f}'])
-           w.writerow(["Expense", f'{meta["expense"]:.2f}'])
-           w.writerow(["Profit", f'{meta["profit"]:.2f}'])
-           return resp
+           return csv_response(export_rows(lambda v: f"{v:.2f}"), header, "corp_tax_breakdown.csv")
        # XLSX Export
        if fmt in ("xlsx","excel") or file_type == "xlsx":
            if not OPENPYXL_OK:
                return HttpResponse("openpyxl not installed", status=400)
-           from io import BytesIO
-           wb = Workbook(); ws = wb.active; ws.title="CorpTax Breakdown"
-           ws.append(["Date","Journal","Account Code","Account Name","Type","Delta","Debit","Credit"])
-           for r in rows: ws.append([r["date"], r["journal_id"], r["account_code"], r["account_name"], r["type"], r["delta"], r["debit"], r["credit"]])
-           ws.append([]); ws.append(["Income", meta["income"]]); ws.append(["Expense", meta["expense"]]); ws.append(["Profit", meta["profit"]])
-           bio = BytesIO(); wb.save(bio); bio.seek(0)
-           from django.http import HttpResponse
-           resp = HttpResponse(bio.getvalue(), content_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet")
-           resp["Content-Disposition"] = 'attachment; filename="corp_tax_breakdown.xlsx"'
-           return resp
+           return xlsx_response(export_rows(lambda v: v), header, "corp_tax_breakdown.xlsx", "CorpTax Breakdown")
+
+       rows = list(breakdown_rows())
+       meta = build_meta()
        
        # Default JSON response with download links (like Trail Balance)
        base_url = request.build_absolute_uri(request.path)
@@ -1575,7 +1620,7 @@ from .serializers import (
 )
 from .fx_services import (
     get_exchange_rate, convert_amount, get_base_currency,
-    create_exchange_rate
+    create_exchange_rate, rate_cache
 )
 
 
@@ -1620,6 +1665,61 @@ class ExchangeRateViewSet(viewsets.ModelViewSet):
             queryset = queryset.filter(rate_date__lte=date_to)
         
         return queryset
+    
+    @action(detail=False, methods=["get"], url_path="cache-stats")
+    def cache_stats(self, request):
+        """Hit/miss counters of the in-process exchange rate cache"""
+        return Response(rate_cache.stats())
+
+
+class ReportJobViewSet(mixins.ListModelMixin, mixins.RetrieveModelMixin, viewsets.GenericViewSet):
+    """
+    Asynchronous reports: submit a job, poll its status, download the artifact.
+    Jobs are built by `manage.py run_report_worker`.
+    """
+    queryset = ReportJob.objects.all()
+    serializer_class = ReportJobSerializer
+    filterset_fields = ["status", "report_type", "file_format"]
+
+    @extend_schema(
+        request=ReportJobRequestSerializer,
+        responses={202: ReportJobSerializer, 200: ReportJobSerializer},
+        description="Queue a report (see /types/ for report_type values and their params). "
+                    "Returns 200 with the existing job when an identical report built from the "
+                    "current data is already queued, running or finished."
+    )
+    def create(self, request):
+        ser = ReportJobRequestSerializer(data=request.data)
+        ser.is_valid(raise_exception=True)
+        user = request.user.get_username() if request.user.is_authenticated else ""
+        try:
+            job, created = submit_report_job(
+                ser.validated_data["report_type"], ser.validated_data["file_format"],
+                ser.validated_data["params"], requested_by=user,
+            )
+        except ValueError as e:
+            return Response({"detail": str(e)}, status=status.HTTP_400_BAD_REQUEST)
+        data = dict(ReportJobSerializer(job, context={"request": request}).data, deduplicated=not created)
+        return Response(data, status=status.HTTP_202_ACCEPTED if created else status.HTTP_200_OK)
+
+    @action(detail=False, methods=["get"])
+    def types(self, request):
+        """Available report types"""
+        return Response(report_types())
+
+    @action(detail=True, methods=["get"])
+    def download(self, request, pk=None):
+        """Stream the finished artifact from disk"""
+        job = self.get_object()
+        if job.status != ReportJob.SUCCEEDED:
+            return Response({"detail": f"Report job is {job.status}", "status": job.status},
+                            status=status.HTTP_409_CONFLICT)
+        path = artifact_file(job)
+        if not path or not os.path.exists(path):
+            return Response({"detail": "Report artifact no longer exists; submit the report again"},
+                            status=status.HTTP_410_GONE)
+        return FileResponse(open(path, "rb"), as_attachment=True, filename=download_name(job),
+                            content_type=FILE_FORMATS[job.file_format])
 
 
 class CurrencyConvertView(APIView):
@@ -10,15 +10,51 @@ from django.utils import timezone
 from django.shortcuts import get_object_or_404
 from decimal import Decimal
 
+from core.mixins import FieldProjectionMixin
+from core.pagination import KeysetCursorPagination
 from ar.models import ARPayment, ARPaymentAllocation, ARInvoice, Customer
 from ap.models import APPayment, APPaymentAllocation, APInvoice, Supplier
 from finance.models import InvoiceApproval
+from finance.bulk_allocation_services import BulkAllocationError, bulk_allocate_payment
 from finance.serializers_extended import (
     ARPaymentSerializer, ARPaymentAllocationSerializer,
     APPaymentSerializer, APPaymentAllocationSerializer,
     InvoiceApprovalSerializer
 )
-from drf_spectacular.utils import extend_schema, extend_schema_view
+from drf_spectacular.utils import extend_schema, extend_schema_view, inline_serializer
+from rest_framework import serializers as drf_serializers
+
+
+BulkAllocateRequest = inline_serializer(
+    name="BulkAllocateRequest",
+    fields={
+        "allocations": drf_serializers.ListField(child=inline_serializer(
+            name="BulkAllocateRow",
+            fields={
+                "invoice": drf_serializers.IntegerField(),
+                "amount": drf_serializers.DecimalField(max_digits=14, decimal_places=2),
+            },
+        )),
+        "memo": drf_serializers.CharField(required=False),
+        "post": drf_serializers.BooleanField(required=False),
+    },
+)
+
+
+def _bulk_allocate(viewset, request, kind):
+    """Shared body of the AR/AP bulk-allocate actions"""
+    payment = viewset.get_object()
+    allocations = request.data.get('allocations')
+    if not isinstance(allocations, list) or not allocations:
+        return Response({'detail': 'allocations must be a non-empty list'}, status=status.HTTP_400_BAD_REQUEST)
+    post = str(request.data.get('post', '')).lower() in ('1', 'true')
+    try:
+        result = bulk_allocate_payment(kind, payment.pk, allocations, memo=request.data.get('memo') or '', post=post)
+    except BulkAllocationError as e:
+        return Response({'detail': str(e), 'errors': e.errors}, status=status.HTTP_400_BAD_REQUEST)
+    except ValueError as e:
+        return Response({'detail': str(e)}, status=status.HTTP_400_BAD_REQUEST)
+    return Response(result, status=status.HTTP_200_OK)
 
 
 # ============================================================================
@@ -32,8 +68,9 @@ from drf_spectacular.utils import extend_schema, extend_schema_view
     update=extend_schema(description="Update AR payment and allocations"),
     partial_update=extend_schema(description="Partially update AR payment"),
 )
-class ARPaymentViewSet(viewsets.ModelViewSet):
+class ARPaymentViewSet(FieldProjectionMixin, viewsets.ModelViewSet):
     """AR Payment ViewSet with allocation support"""
+    pagination_class = KeysetCursorPagination
     queryset = ARPayment.objects.all().prefetch_related('allocations', 'allocations__invoice')
     serializer_class = ARPaymentSerializer
     
@@ -84,6 +121,16 @@ class ARPaymentViewSet(viewsets.ModelViewSet):
         
         return Response(self.get_serializer(payment).data)
     
+    @extend_schema(
+        request=BulkAllocateRequest,
+        description="Allocate this AR payment to many invoices in one request, validated against their "
+                    "open balances. All rows are written or none; with post=true the payment is then "
+                    "posted to the GL as one journal entry.",
+    )
+    @action(detail=True, methods=['post'], url_path='bulk-allocate')
+    def bulk_allocate(self, request, pk=None):
+        return _bulk_allocate(self, request, 'AR')
+    
     @action(detail=False, methods=['get'])
     def outstanding(self, request):
         """Get AR payments with unallocated amounts"""
@@ -112,8 +159,9 @@ class ARPaymentViewSet(viewsets.ModelViewSet):
     update=extend_schema(description="Update AP payment and allocations"),
     partial_update=extend_schema(description="Partially update AP payment"),
 )
-class APPaymentViewSet(viewsets.ModelViewSet):
+class APPaymentViewSet(FieldProjectionMixin, viewsets.ModelViewSet):
     """AP Payment ViewSet with allocation support"""
+    pagination_class = KeysetCursorPagination
     queryset = APPayment.objects.all().prefetch_related('allocations', 'allocations__invoice')
     serializer_class = APPaymentSerializer
     
@@ -164,6 +212,16 @@ class APPaymentViewSet(viewsets.ModelViewSet):
         
         return Response(self.get_serializer(payment).data)
     
+    @extend_schema(
+        request=BulkAllocateRequest,
+        description="Allocate this AP payment to many invoices in one request, validated against their "
+                    "open balances. All rows are written or none; with post=true the payment is then "
+                    "posted to the GL as one journal entry.",
+    )
+    @action(detail=True, methods=['post'], url_path='bulk-allocate')
+    def bulk_allocate(self, request, pk=None):
+        return _bulk_allocate(self, request, 'AP')
+    
     @action(detail=False, methods=['get'])
     def outstanding(self, request):
         """Get AP payments with unallocated amounts"""
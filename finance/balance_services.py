@@ -0,0 +1,239 @@
+"""
+Account-period balance store.
+
+AccountPeriodBalance holds posted debit/credit totals per account, monthly
+fiscal period, currency and segment combination. Posting services update it
+in the same transaction as the journal; closing a period rebuilds that
+period from raw lines. Reports read the store for closed periods and only
+scan raw JournalLine rows for the remaining (open or uncovered) dates.
+
+Not every posting path maintains the store, so a closed period must not
+change: posting, editing or deleting posted entries, lines or line
+segments dated in a CLOSED monthly period raises PeriodClosed (see the
+finance.signals guards). Reopen the period to post into it; closing it
+again rebuilds its balances.
+"""
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import IntegrityError, transaction
+from django.db.models import F, Q, Sum
+from django.utils import timezone
+
+from periods.models import FiscalPeriod
+from .models import AccountBalanceRebuild, AccountPeriodBalance, JournalEntry, JournalLine, JournalLineSegment
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Balances are bucketed by the monthly period containing JournalEntry.date
+BALANCE_PERIOD_TYPE = "MONTHLY"
+REBUILD_CHUNK_SIZE = 5000
+
+
+class PeriodClosed(ValueError):
+    """A posting would change a closed period"""
+
+
+def ensure_period_open(d):
+    """Raise PeriodClosed if date d lies in a CLOSED monthly fiscal period"""
+    closed = FiscalPeriod.objects.filter(
+        period_type=BALANCE_PERIOD_TYPE, status="CLOSED", start_date__lte=d, end_date__gte=d
+    ).values_list("period_code", flat=True).first()
+    if closed is not None:
+        raise PeriodClosed(f"Fiscal period {closed} is closed; reopen it to post on {d}")
+
+
+def period_for_date(d):
+    """Monthly fiscal period containing date d, or None"""
+    return FiscalPeriod.objects.filter(
+        period_type=BALANCE_PERIOD_TYPE, start_date__lte=d, end_date__gte=d
+    ).order_by("start_date").first()
+
+
+def segment_key(pairs):
+    """Canonical segment key ('type:segment,...') for (segment_type_id, segment_id) pairs"""
+    return ",".join(f"{t}:{s}" for t, s in sorted(pairs))
+
+
+def _segment_keys(line_ids):
+    """Map journal line id -> canonical segment key"""
+    pairs = defaultdict(list)
+    rows = JournalLineSegment.objects.filter(journal_line_id__in=line_ids) \
+        .values_list("journal_line_id", "segment_type_id", "segment_id")
+    for line_id, type_id, segment_id in rows:
+        pairs[line_id].append((type_id, segment_id))
+    return {line_id: segment_key(p) for line_id, p in pairs.items()}
+
+
+def _accumulate(lines, totals):
+    """Add (id, account_id, currency_id, debit, credit) rows into totals keyed by (account, currency, segment_key)"""
+    lines = list(lines)
+    keys = _segment_keys([l[0] for l in lines])
+    for line_id, account_id, currency_id, debit, credit in lines:
+        t = totals[(account_id, currency_id, keys.get(line_id, ""))]
+        t[0] += debit or Decimal("0")
+        t[1] += credit or Decimal("0")
+
+
+def _add_to_balance(account_id, period_id, currency_id, segment_key, debit, credit):
+    key = dict(account_id=account_id, period_id=period_id, currency_id=currency_id, segment_key=segment_key)
+    delta = dict(debit=F("debit") + debit, credit=F("credit") + credit)
+    if AccountPeriodBalance.objects.filter(**key).update(**delta):
+        return
+    try:
+        with transaction.atomic():
+            AccountPeriodBalance.objects.create(debit=debit, credit=credit, **key)
+    except IntegrityError:
+        # Another transaction created the row first
+        AccountPeriodBalance.objects.filter(**key).update(**delta)
+
+
+@transaction.atomic
+def apply_entry_to_balances(entry: JournalEntry, sign: int = 1):
+    """
+    Add a posted journal entry's lines to the balance store (sign=-1 removes them).
+    No-op for unposted entries or dates outside any monthly fiscal period.
+    """
+    if not entry.posted:
+        return
+    period = period_for_date(entry.date)
+    if period is None:
+        return
+
+    totals = defaultdict(lambda: [Decimal("0"), Decimal("0")])
+    _accumulate(
+        entry.lines.values_list("id", "account_id", "entry__currency_id", "debit", "credit"),
+        totals,
+    )
+    for (account_id, currency_id, segment_key), (debit, credit) in totals.items():
+        _add_to_balance(account_id, period.id, currency_id, segment_key, sign * debit, sign * credit)
+
+
+@transaction.atomic
+def apply_lines_to_balances(lines):
+    """
+    Add already-posted lines to the store in one pass, for bulk posting.
+    lines: iterable of (entry_date, account_id, currency_id, segment_key, debit, credit).
+    """
+    periods = {}
+    totals = defaultdict(lambda: [Decimal("0"), Decimal("0")])
+    for entry_date, account_id, currency_id, key, debit, credit in lines:
+        if entry_date not in periods:
+            periods[entry_date] = period_for_date(entry_date)
+        period = periods[entry_date]
+        if period is None:
+            continue
+        t = totals[(account_id, period.id, currency_id, key)]
+        t[0] += debit or Decimal("0")
+        t[1] += credit or Decimal("0")
+    for (account_id, period_id, currency_id, key), (debit, credit) in totals.items():
+        _add_to_balance(account_id, period_id, currency_id, key, debit, credit)
+
+
+def compute_period_balances(period: FiscalPeriod) -> dict:
+    """Recompute balances of one period from raw posted lines: {(account, currency, segment_key): [debit, credit]}"""
+    totals = defaultdict(lambda: [Decimal("0"), Decimal("0")])
+    lines = JournalLine.objects.filter(
+        entry__posted=True,
+        entry__date__gte=period.start_date,
+        entry__date__lte=period.end_date,
+    ).order_by("id").values_list("id", "account_id", "entry__currency_id", "debit", "credit")
+
+    chunk = []
+    for row in lines.iterator(chunk_size=REBUILD_CHUNK_SIZE):
+        chunk.append(row)
+        if len(chunk) >= REBUILD_CHUNK_SIZE:
+            _accumulate(chunk, totals)
+            chunk = []
+    if chunk:
+        _accumulate(chunk, totals)
+    return totals
+
+
+def stored_period_balances(period: FiscalPeriod) -> dict:
+    return {
+        (b.account_id, b.currency_id, b.segment_key): [b.debit, b.credit]
+        for b in AccountPeriodBalance.objects.filter(period=period)
+    }
+
+
+def diff_period_balances(period: FiscalPeriod) -> list:
+    """Return [(key, stored, expected)] for every key where the store drifted from raw lines"""
+    expected = compute_period_balances(period)
+    stored = stored_period_balances(period)
+    zero = [Decimal("0"), Decimal("0")]
+    drift = []
+    for key in set(expected) | set(stored):
+        s = stored.get(key, zero)
+        e = expected.get(key, zero)
+        if s[0] != e[0] or s[1] != e[1]:
+            drift.append((key, s, e))
+    return drift
+
+
+@transaction.atomic
+def rebuild_period_balances(period: FiscalPeriod) -> int:
+    """Replace a period's stored balances with totals recomputed from raw lines. Returns row count."""
+    totals = compute_period_balances(period)
+    AccountPeriodBalance.objects.filter(period=period).delete()
+    AccountPeriodBalance.objects.bulk_create([
+        AccountPeriodBalance(
+            account_id=account_id, period=period, currency_id=currency_id,
+            segment_key=segment_key, debit=debit, credit=credit,
+        )
+        for (account_id, currency_id, segment_key), (debit, credit) in totals.items()
+    ], batch_size=1000)
+    AccountBalanceRebuild.objects.update_or_create(
+        period=period, defaults={"rebuilt_at": timezone.now(), "row_count": len(totals)}
+    )
+    logger.info(f"Rebuilt {len(totals)} balance rows for period {period.period_code}")
+    return len(totals)
+
+
+def stored_periods_in_range(date_from=None, date_to=None):
+    """
+    Closed, rebuilt monthly periods lying fully inside [date_from, date_to].
+    Only these are read from the store: closed periods refuse postings,
+    while open ones may receive them from paths that do not maintain
+    balances.
+    """
+    qs = FiscalPeriod.objects.filter(
+        period_type=BALANCE_PERIOD_TYPE, status="CLOSED", balance_rebuild__isnull=False
+    )
+    if date_from:
+        qs = qs.filter(start_date__gte=date_from)
+    if date_to:
+        qs = qs.filter(end_date__lte=date_to)
+    return list(qs.only("id", "start_date", "end_date"))
+
+
+def grouped_totals(group_by, date_from=None, date_to=None, use_store=True) -> dict:
+    """
+    Posted debit/credit sums in [date_from, date_to] grouped by `group_by`
+    lookups, which must start with "account__" (valid on both JournalLine and
+    AccountPeriodBalance). Returns {group_values_tuple: [debit, credit]}.
+    """
+    lines = JournalLine.objects.filter(entry__posted=True)
+    if date_from:
+        lines = lines.filter(entry__date__gte=date_from)
+    if date_to:
+        lines = lines.filter(entry__date__lte=date_to)
+
+    periods = stored_periods_in_range(date_from, date_to) if use_store else []
+    sources = []
+    if periods:
+        covered = Q()
+        for p in periods:
+            covered |= Q(entry__date__gte=p.start_date, entry__date__lte=p.end_date)
+        lines = lines.exclude(covered)
+        sources.append(AccountPeriodBalance.objects.filter(period__in=periods))
+    sources.append(lines)
+
+    totals = defaultdict(lambda: [Decimal("0"), Decimal("0")])
+    for qs in sources:
+        for g in qs.values(*group_by).annotate(dr=Sum("debit"), cr=Sum("credit")).order_by():
+            t = totals[tuple(g[f] for f in group_by)]
+            t[0] += g["dr"] or Decimal("0")
+            t[1] += g["cr"] or Decimal("0")
+    return totals
@@ -0,0 +1,185 @@
+"""
+Bulk allocation of one AR/AP payment across many invoices.
+
+Allocating a wire that settles hundreds of invoices one allocation at a time
+runs the allocation model's save() and signals per row. bulk_allocate_payment
+instead:
+- checks every requested (invoice, amount) against the invoices' open
+  balances, read in one annotated query;
+- fills the allocation currency fields that save() would, looking up one
+  exchange rate per invoice currency, and writes all rows with bulk_create;
+- queues the new allocations for the invoices' stored payment state, which
+  is applied in one pass when the transaction commits;
+- optionally posts the payment as a single journal entry.
+
+The request is all or nothing: if any row is rejected, nothing is written
+and BulkAllocationError lists every rejected row.
+"""
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+
+from ar.models import ARPayment, ARPaymentAllocation
+from ap.models import APPayment, APPaymentAllocation
+from .fx_services import get_exchange_rate
+from .payment_state_services import AllocationState, record_allocation_change
+from .report_job_services import LEDGER, mark_data_changed
+from .services import annotate_open_balances, apply_unrated_fx_adjustments, post_ap_payment, post_ar_payment, q2
+import logging
+
+logger = logging.getLogger(__name__)
+
+# current_exchange_rate is stored with 6 decimal places
+RATE_QUANTUM = Decimal("0.000001")
+
+_KINDS = {
+    "AR": (ARPayment, ARPaymentAllocation, "customer_id", post_ar_payment),
+    "AP": (APPayment, APPaymentAllocation, "supplier_id", post_ap_payment),
+}
+
+
+class BulkAllocationError(ValueError):
+    """Raised with the rejected rows ({"index", "invoice", "error"}) of a bulk allocation"""
+
+    def __init__(self, errors):
+        self.errors = errors
+        super().__init__(f"{len(errors)} allocation(s) rejected")
+
+
+def _parse_rows(allocations):
+    """[(index, invoice_id, amount)] and errors for malformed rows"""
+    rows, errors = [], []
+    for index, row in enumerate(allocations):
+        invoice_id = row.get("invoice") if isinstance(row, dict) else None
+        try:
+            invoice_id = int(invoice_id)
+            amount = Decimal(str(row.get("amount")))
+        except (TypeError, ValueError, InvalidOperation):
+            errors.append({"index": index, "invoice": invoice_id, "error": "invoice and amount are required"})
+            continue
+        if not amount.is_finite() or amount <= 0:
+            errors.append({"index": index, "invoice": invoice_id, "error": "Amount must be greater than zero"})
+            continue
+        rows.append((index, invoice_id, q2(amount)))
+    return rows, errors
+
+
+@transaction.atomic
+def bulk_allocate_payment(kind: str, payment_id, allocations, memo: str = "", post: bool = False):
+    """
+    Allocate an AR or AP payment to many invoices at once.
+
+    allocations: [{"invoice": id, "amount": amount in payment currency}].
+    An amount may not exceed the invoice's open balance once converted to
+    the invoice currency, and together they may not exceed the payment's
+    unallocated amount. With post=True the payment is posted to the GL
+    afterwards. Returns {"payment", "allocations", "allocated_total",
+    "journal_entry", "invoices_closed"}.
+    """
+    kind = kind.upper()
+    if kind not in _KINDS:
+        raise ValueError(f"Unknown payment kind '{kind}' (expected AR or AP)")
+    payment_model, allocation_model, party_field, post_payment = _KINDS[kind]
+    invoice_model = allocation_model.invoice.field.related_model
+
+    try:
+        payment = payment_model.objects.select_for_update().select_related("currency").get(pk=payment_id)
+    except payment_model.DoesNotExist:
+        raise ValueError(f"{kind} payment {payment_id} not found")
+    if payment.posted_at or payment.gl_journal_id:
+        raise ValueError(f"{kind} payment {payment.reference or payment.pk} is already posted")
+    if not allocations:
+        raise ValueError("allocations must be a non-empty list")
+
+    rows, errors = _parse_rows(allocations)
+    ids = [invoice_id for _, invoice_id, _ in rows]
+    invoices = {
+        invoice.pk: invoice
+        for invoice in apply_unrated_fx_adjustments(list(
+            annotate_open_balances(invoice_model.objects.filter(pk__in=ids).select_related("currency"))
+        ))
+    }
+    already_allocated = set(
+        allocation_model.objects.filter(payment=payment, invoice_id__in=ids).values_list("invoice_id", flat=True)
+    )
+
+    # Rate from each invoice currency to the payment currency, as allocation save() sets it
+    rates = {}
+
+    def rate_for(currency):
+        if currency.id not in rates:
+            if payment.currency is None:
+                rates[currency.id] = None
+            elif currency.id == payment.currency_id:
+                rates[currency.id] = Decimal("1.000000")
+            else:
+                try:
+                    rates[currency.id] = Decimal(get_exchange_rate(
+                        from_currency=currency, to_currency=payment.currency,
+                        rate_date=payment.date, rate_type="SPOT",
+                    )).quantize(RATE_QUANTUM)
+                except Exception as e:
+                    logger.warning(f"No {currency.code}->{payment.currency.code} rate for {kind} payment {payment.pk}: {e}")
+                    rates[currency.id] = None
+        return rates[currency.id]
+
+    seen = set()
+    new_allocations = []
+    for index, invoice_id, amount in rows:
+        invoice = invoices.get(invoice_id)
+        error = None
+        if invoice is None:
+            error = "Invoice not found"
+        elif invoice_id in seen:
+            error = "Invoice appears more than once"
+        elif invoice_id in already_allocated:
+            error = "Invoice is already allocated to this payment"
+        elif getattr(payment, party_field) and getattr(invoice, party_field) != getattr(payment, party_field):
+            error = "Invoice belongs to a different customer" if kind == "AR" else "Invoice belongs to a different supplier"
+        elif invoice.is_cancelled:
+            error = "Invoice is cancelled"
+        else:
+            rate = rate_for(invoice.currency)
+            if payment.currency_id and invoice.currency_id != payment.currency_id and not rate:
+                error = f"No exchange rate from {invoice.currency.code} to {payment.currency.code}"
+            else:
+                in_invoice_currency = q2(amount / rate) if rate else amount
+                open_balance = q2(invoice.open_total) - q2(invoice.paid_total)
+                if in_invoice_currency > open_balance:
+                    error = f"Amount {in_invoice_currency} exceeds open balance {open_balance}"
+        seen.add(invoice_id)
+        if error:
+            errors.append({"index": index, "invoice": invoice_id, "error": error})
+            continue
+        new_allocations.append(allocation_model(
+            payment=payment, invoice=invoice, amount=amount, memo=memo,
+            invoice_currency=invoice.currency, current_exchange_rate=rate_for(invoice.currency),
+        ))
+
+    allocated_total = sum((a.amount for a in new_allocations), Decimal("0"))
+    if not errors and payment.total_amount is not None and allocated_total > payment.unallocated_amount():
+        errors.append({
+            "index": None, "invoice": None,
+            "error": f"Total allocated amount ({allocated_total}) exceeds unallocated amount "
+                     f"({payment.unallocated_amount()})",
+        })
+    if errors:
+        raise BulkAllocationError(sorted(errors, key=lambda e: (e["index"] is None, e["index"] or 0)))
+
+    created = allocation_model.objects.bulk_create(new_allocations)
+    # bulk_create sends no signals: queue the payment state and report refresh they would have
+    for allocation in created:
+        after = AllocationState(allocation.invoice_id, payment.pk, allocation.amount, allocation.current_exchange_rate)
+        record_allocation_change(allocation_model, allocation.pk, None, after)
+    mark_data_changed(LEDGER)
+
+    entry, closed = None, []
+    if post:
+        entry, _, closed = post_payment(payment)
+    return {
+        "payment": payment.pk,
+        "allocations": len(created),
+        "allocated_total": str(allocated_total),
+        "journal_entry": entry.pk if entry else None,
+        "invoices_closed": closed,
+    }
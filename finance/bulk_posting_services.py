@@ -0,0 +1,261 @@
+"""
+Batch GL posting of AR/AP invoices.
+
+Produces the same journals as gl_post_from_ar_balanced / gl_post_from_ap_balanced
+(same totals, FX conversion and auto-generated distributions) but builds them
+in memory and writes entries, lines and segments with bulk_create, one
+transaction per chunk of invoices. Already-posted invoices are skipped, so a
+batch can be re-submitted safely.
+"""
+import time
+from decimal import Decimal
+
+from django.db import transaction
+from django.utils import timezone
+from simple_history.utils import bulk_create_with_history
+
+from ar.models import ARInvoice
+from ap.models import APInvoice
+from segment.models import XX_Segment, XX_SegmentType
+from .balance_services import apply_lines_to_balances, segment_key
+from .distribution_services import (
+    auto_generate_ar_invoice_distributions,
+    auto_generate_ap_invoice_distributions,
+    get_default_segments_for_account,
+    validate_distributions_balance,
+)
+from .fx_services import get_base_currency, get_exchange_rate, convert_amount
+from .models import JournalEntry, JournalLine, JournalLineSegment
+from .report_job_services import LEDGER, mark_data_changed
+from .services import amount_with_tax, line_rate, q2
+import logging
+
+logger = logging.getLogger(__name__)
+
+BULK_POST_CHUNK_SIZE = 500
+
+POSTED = "POSTED"
+ALREADY_POSTED = "ALREADY_POSTED"
+FAILED = "FAILED"
+
+_KINDS = {
+    "AR": (ARInvoice, "customer", auto_generate_ar_invoice_distributions),
+    "AP": (APInvoice, "supplier", auto_generate_ap_invoice_distributions),
+}
+
+_INVOICE_FIELDS = ["gl_journal", "posted_at", "is_posted", "exchange_rate", "base_currency_total",
+                   "subtotal", "tax_amount", "total"]
+
+
+class _PostingContext:
+    """Lookups shared by every invoice of a batch"""
+
+    def __init__(self, kind):
+        self.kind = kind
+        self.base_currency = get_base_currency()
+        self.account_type_ids = set(
+            XX_SegmentType.objects.filter(segment_name__iexact="account").values_list("segment_id", flat=True)
+        )
+        self._segments = {}
+
+    def segment_lookup(self, account_code, customer=None, supplier=None):
+        """Memoized get_default_segments_for_account (rules do not change mid-batch)"""
+        key = (account_code, getattr(customer, "pk", None), getattr(supplier, "pk", None))
+        if key not in self._segments:
+            self._segments[key] = get_default_segments_for_account(account_code, customer=customer, supplier=supplier)
+        return [dict(s) for s in self._segments[key]]
+
+
+def _stored_totals(inv):
+    """Same formula as calculate_and_save_totals, without the per-invoice save"""
+    subtotal = Decimal("0.00")
+    tax = Decimal("0.00")
+    for item in inv.items.all():
+        line_subtotal = item.quantity * item.unit_price
+        subtotal += line_subtotal
+        if item.tax_rate:
+            tax += line_subtotal * (item.tax_rate.rate / 100)
+    return subtotal, tax, subtotal + tax
+
+
+def _prepare(inv, ctx):
+    """
+    Validate one locked invoice and build its journal in memory.
+    Returns (entry, [(line, [(segment_type_id, segment_id)])]); raises ValueError on failure.
+    """
+    _, _, generate = _KINDS[ctx.kind]
+    items = list(inv.items.all())
+    if not items:
+        raise ValueError(f"Cannot post invoice {inv.number} to GL: Invoice has no line items")
+
+    inv.subtotal, inv.tax_amount, inv.total = _stored_totals(inv)
+
+    subtotal = Decimal("0"); tax = Decimal("0")
+    for item in items:
+        s, t, _ = amount_with_tax(item.quantity, item.unit_price, line_rate(item, inv.date))
+        subtotal += s; tax += t
+    invoice_total = q2(q2(subtotal) + q2(tax))
+    if invoice_total == Decimal("0.00"):
+        raise ValueError(f"Cannot post invoice {inv.number} to GL: Total amount is zero")
+
+    base = ctx.base_currency
+    needs_conversion = inv.currency_id != base.id
+    if needs_conversion:
+        inv.exchange_rate = get_exchange_rate(inv.currency, base, inv.date, "SPOT")
+        inv.base_currency_total = convert_amount(invoice_total, inv.currency, base, inv.date)
+        memo = f"{ctx.kind} Post {inv.number} ({inv.currency.code}→{base.code} @ {inv.exchange_rate})"
+    else:
+        inv.exchange_rate = Decimal("1.000000")
+        inv.base_currency_total = invoice_total
+        memo = f"{ctx.kind} Post {inv.number}"
+
+    distributions = generate(inv, segment_lookup=ctx.segment_lookup)
+    if needs_conversion:
+        for dist in distributions:
+            dist["amount"] = str(convert_amount(Decimal(str(dist["amount"])), inv.currency, base, inv.date))
+    validate_distributions_balance(distributions)
+
+    entry = JournalEntry(date=inv.date, currency=base, memo=memo, posted=True, period=getattr(inv, "period", None))
+    lines = []
+    for dist in distributions:
+        amount = Decimal(str(dist["amount"]))
+        line_type = dist.get("line_type", "").upper()
+        pairs = [(s["segment_type"], s["segment"]) for s in dist.get("segments", [])]
+        if not pairs:
+            raise ValueError("Distribution must have at least one segment (account)")
+        account_id = next((seg for seg_type, seg in pairs if seg_type in ctx.account_type_ids), None)
+        if not account_id:
+            raise ValueError("Distribution must include an account segment")
+        line = JournalLine(
+            account_id=account_id,
+            debit=amount if line_type == "DEBIT" else Decimal("0"),
+            credit=amount if line_type == "CREDIT" else Decimal("0"),
+        )
+        lines.append((line, pairs))
+    return entry, lines
+
+
+def _check_segments(prepared):
+    """Apply JournalLineSegment.clean rules to every prepared line with one query"""
+    ids = {seg for _, (_, lines) in prepared for _, pairs in lines for _, seg in pairs}
+    segments = XX_Segment.objects.in_bulk(ids)
+    errors = {}
+    for inv, (_, lines) in prepared:
+        for _, pairs in lines:
+            for seg_type, seg_id in pairs:
+                seg = segments.get(seg_id)
+                if seg is None:
+                    errors[inv.pk] = f"Segment {seg_id} does not exist"
+                elif seg.node_type != "child":
+                    errors[inv.pk] = (f"Only child segments can be assigned to journal lines. "
+                                      f"Segment '{seg.code}' is a '{seg.node_type}' type.")
+                elif seg.segment_type_id != seg_type:
+                    errors[inv.pk] = f"Segment '{seg.code}' does not belong to segment type {seg_type}"
+    return errors
+
+
+def _result(inv_id, number, status, entry_id=None, error=None):
+    return {"invoice_id": inv_id, "number": number, "status": status, "journal_entry_id": entry_id, "error": error}
+
+
+def _post_chunk(ctx, ids, require_approval):
+    model, party, _ = _KINDS[ctx.kind]
+    results = {}
+    with transaction.atomic():
+        invoices = (
+            model.objects.select_for_update()
+            .filter(pk__in=ids)
+            .select_related("currency", party, "period")
+            .prefetch_related("items__tax_rate")
+        )
+        prepared = []
+        for inv in invoices:
+            if inv.gl_journal_id:
+                results[inv.pk] = _result(inv.pk, inv.number, ALREADY_POSTED, inv.gl_journal_id)
+            elif require_approval and inv.approval_status != "APPROVED":
+                results[inv.pk] = _result(
+                    inv.pk, inv.number, FAILED,
+                    error=f"Invoice must be APPROVED before posting. Current status: {inv.approval_status or 'DRAFT'}",
+                )
+            else:
+                try:
+                    prepared.append((inv, _prepare(inv, ctx)))
+                except Exception as e:
+                    results[inv.pk] = _result(inv.pk, inv.number, FAILED, error=str(e))
+
+        errors = _check_segments(prepared)
+        for inv, _ in prepared:
+            if inv.pk in errors:
+                results[inv.pk] = _result(inv.pk, inv.number, FAILED, error=errors[inv.pk])
+        prepared = [p for p in prepared if p[0].pk not in errors]
+        if not prepared:
+            return results
+
+        entries = bulk_create_with_history([entry for _, (entry, _) in prepared], JournalEntry)
+        lines, line_pairs, balance_rows = [], [], []
+        for (inv, (_, inv_lines)), entry in zip(prepared, entries):
+            for line, pairs in inv_lines:
+                line.entry_id = entry.pk
+                lines.append(line)
+                line_pairs.append(pairs)
+                balance_rows.append((entry.date, line.account_id, entry.currency_id, segment_key(pairs),
+                                     line.debit, line.credit))
+        lines = JournalLine.objects.bulk_create(lines, batch_size=1000)
+        JournalLineSegment.objects.bulk_create([
+            JournalLineSegment(journal_line_id=line.pk, segment_type_id=seg_type, segment_id=seg_id)
+            for line, pairs in zip(lines, line_pairs)
+            for seg_type, seg_id in pairs
+        ], batch_size=1000)
+        apply_lines_to_balances(balance_rows)
+
+        now = timezone.now()
+        for (inv, _), entry in zip(prepared, entries):
+            inv.gl_journal = entry
+            inv.is_posted = True
+            inv.posted_at = now
+            results[inv.pk] = _result(inv.pk, inv.number, POSTED, entry.pk)
+        model.objects.bulk_update([inv for inv, _ in prepared], _INVOICE_FIELDS)
+        # bulk_create/bulk_update send no signals
+        mark_data_changed(LEDGER)
+    return results
+
+
+def bulk_post_invoices(kind: str, invoice_ids, chunk_size: int = BULK_POST_CHUNK_SIZE, require_approval: bool = True):
+    """
+    Post many AR or AP invoices to the GL.
+
+    kind: "AR" or "AP". Invoices are processed in chunks of chunk_size, each in
+    its own transaction; a failed chunk write marks that chunk FAILED and the
+    batch continues. Returns {"results": [per-invoice dicts in input order],
+    "posted", "already_posted", "failed", "seconds", "invoices_per_second"}.
+    """
+    kind = kind.upper()
+    if kind not in _KINDS:
+        raise ValueError(f"Unknown invoice kind '{kind}' (expected AR or AP)")
+    ids = list(dict.fromkeys(int(i) for i in invoice_ids))
+    ctx = _PostingContext(kind)
+
+    started = time.perf_counter()
+    results = {}
+    for start in range(0, len(ids), chunk_size):
+        chunk = ids[start:start + chunk_size]
+        try:
+            results.update(_post_chunk(ctx, chunk, require_approval))
+        except Exception as e:
+            logger.exception(f"Bulk {kind} posting chunk failed")
+            for inv_id in chunk:
+                results[inv_id] = _result(inv_id, None, FAILED, error=str(e))
+    elapsed = time.perf_counter() - started
+
+    ordered = [results.get(i) or _result(i, None, FAILED, error="Invoice not found") for i in ids]
+    counts = {status: sum(1 for r in ordered if r["status"] == status) for status in (POSTED, ALREADY_POSTED, FAILED)}
+    logger.info(f"Bulk {kind} posting: {counts[POSTED]} posted, {counts[ALREADY_POSTED]} already posted, "
+                f"{counts[FAILED]} failed in {elapsed:.2f}s")
+    return {
+        "results": ordered,
+        "posted": counts[POSTED],
+        "already_posted": counts[ALREADY_POSTED],
+        "failed": counts[FAILED],
+        "seconds": round(elapsed, 3),
+        "invoices_per_second": round(counts[POSTED] / elapsed, 1) if elapsed else None,
+    }
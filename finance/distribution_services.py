@@ -1,10 +1,13 @@
 """
 Auto-generation of GL distributions with dynamic segment assignments.
 """
+import threading
 from decimal import Decimal
 from typing import List, Dict, Any, Optional
 from django.db import transaction
+from core.cache_versions import VersionGuard
 from segment.models import XX_Segment, XX_SegmentType
+from segment.registry import segment_registry
 from finance.models import SegmentAssignmentRule, JournalEntry, JournalLine, JournalLineSegment
 from ar.models import ARInvoice
 from ap.models import APInvoice
@@ -13,6 +16,78 @@ import logging
 logger = logging.getLogger(__name__)
 
 
+class SegmentRuleMatcher:
+    """
+    Active SegmentAssignmentRule rows compiled into dictionaries.
+
+    For every account the best rule (lowest priority, then newest) is kept per
+    customer, per supplier and for the default (no customer/supplier) case,
+    together with its precomputed segment assignments. A rule or segment
+    change bumps the "finance:segment_rules" CacheVersion row (see
+    finance.signals and core.cache_versions), and every process rebuilds on
+    its next lookup after that.
+    """
+    VERSION_KEY = "finance:segment_rules"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._guard = VersionGuard(self.VERSION_KEY)
+        self._compiled = False
+        self.builds = 0
+
+    def _build(self):
+        rules = SegmentAssignmentRule.objects.filter(is_active=True).select_related(
+            'account_segment', 'department_segment', 'cost_center_segment',
+            'project_segment', 'product_segment',
+        ).order_by('priority', '-created_at', 'pk')
+        by_customer, by_supplier, default = {}, {}, {}
+        assignments = {}
+        for rule in rules:
+            account_id = rule.account_segment_id
+            if rule.customer_id:
+                by_customer.setdefault((account_id, rule.customer_id), rule)
+            if rule.supplier_id:
+                by_supplier.setdefault((account_id, rule.supplier_id), rule)
+            if not rule.customer_id and not rule.supplier_id:
+                default.setdefault(account_id, rule)
+            assignments[rule.pk] = [
+                {'segment_type': seg_type_id, 'segment': seg_id}
+                for seg_type_id, seg_id in rule.get_segment_assignments().items()
+            ]
+        self._by_customer, self._by_supplier, self._default = by_customer, by_supplier, default
+        self._assignments = assignments
+        self._compiled = True
+        self.builds += 1
+
+    def _ensure_compiled(self):
+        with self._lock:
+            if not self._guard.is_current() or not self._compiled:
+                self._build()
+
+    def match(self, account_id, customer_id=None, supplier_id=None):
+        """Most specific active rule: customer, then supplier, then default; or None"""
+        self._ensure_compiled()
+        rule = None
+        if customer_id:
+            rule = self._by_customer.get((account_id, customer_id))
+        if rule is None and supplier_id:
+            rule = self._by_supplier.get((account_id, supplier_id))
+        if rule is None:
+            rule = self._default.get(account_id)
+        return rule
+
+    def assignments(self, rule) -> List[Dict[str, int]]:
+        """Copy of the rule's [{'segment_type', 'segment'}] list"""
+        return [dict(a) for a in self._assignments[rule.pk]]
+
+    def invalidate(self):
+        """Rebuild in every process (this one on its next lookup, others after commit)"""
+        self._guard.bump()
+
+
+rule_matcher = SegmentRuleMatcher()
+
+
 def get_segment_rule(account_segment, customer=None, supplier=None):
     """
     Get the most specific segment assignment rule for given context.
@@ -29,26 +104,11 @@ def get_segment_rule(account_segment, customer=None, supplier=None):
     Returns:
         SegmentAssignmentRule instance or None
     """
-    rules = SegmentAssignmentRule.objects.filter(
-        is_active=True,
-        account_segment=account_segment
-    ).order_by('priority')
-    
-    # Try customer-specific first
-    if customer:
-        rule = rules.filter(customer=customer).first()
-        if rule:
-            return rule
-    
-    # Try supplier-specific
-    if supplier:
-        rule = rules.filter(supplier=supplier).first()
-        if rule:
-            return rule
-    
-    # Fall back to default (no customer/supplier)
-    rule = rules.filter(customer__isnull=True, supplier__isnull=True).first()
-    return rule
+    return rule_matcher.match(
+        account_segment.pk,
+        customer_id=getattr(customer, 'pk', None),
+        supplier_id=getattr(supplier, 'pk', None),
+    )
 
 
 def get_default_segments_for_account(account_code: str, customer=None, supplier=None) -> List[Dict[str, int]]:
@@ -63,23 +123,23 @@ def get_default_segments_for_account(account_code: str, customer=None, supplier=
     Returns:
         List of {'segment_type': int, 'segment': int} dicts
     """
-    try:
-        # Get account segment
-        account_segment = XX_Segment.objects.get(code=account_code, node_type='child')
-    except XX_Segment.DoesNotExist:
+    # Get account segment
+    matches = segment_registry.child_segments_by_code(account_code)
+    if not matches:
         logger.error(f"Account segment {account_code} not found")
         raise ValueError(f"Account segment {account_code} does not exist")
+    if len(matches) > 1:
+        raise XX_Segment.MultipleObjectsReturned(
+            f"{len(matches)} child segments have code {account_code}"
+        )
+    account_segment = matches[0]
     
     # Get rule
     rule = get_segment_rule(account_segment, customer=customer, supplier=supplier)
     
     if rule:
         # Use rule assignments
-        assignments = rule.get_segment_assignments()
-        return [
-            {'segment_type': seg_type_id, 'segment': seg_id}
-            for seg_type_id, seg_id in assignments.items()
-        ]
+        return rule_matcher.assignments(rule)
     else:
         # No rule found - use just the account
         logger.warning(f"No segment rule found for account {account_code}, using account only")
@@ -91,7 +151,7 @@ def get_default_segments_for_account(account_code: str, customer=None, supplier=
         ]
 
 
-def auto_generate_ar_invoice_distributions(invoice: ARInvoice) -> List[Dict[str, Any]]:
+def auto_generate_ar_invoice_distributions(invoice: ARInvoice, segment_lookup=None) -> List[Dict[str, Any]]:
     """
     Auto-generate GL distributions for AR invoice.
     
@@ -101,14 +161,17 @@ def auto_generate_ar_invoice_distributions(invoice: ARInvoice) -> List[Dict[str,
     
     Args:
         invoice: ARInvoice instance
+        segment_lookup: Replacement for get_default_segments_for_account
+            (bulk posting passes a memoized one)
     
     Returns:
         List of distribution dicts with amounts, line_type, description, segments
     """
+    lookup = segment_lookup or get_default_segments_for_account
     distributions = []
     
     # DEBIT: Accounts Receivable
-    ar_segments = get_default_segments_for_account(
+    ar_segments = lookup(
         account_code='1200',  # AR Control Account
         customer=invoice.customer
     )
@@ -124,7 +187,7 @@ def auto_generate_ar_invoice_distributions(invoice: ARInvoice) -> List[Dict[str,
     if invoice.items.exists():
         # Create one credit line per invoice item
         for item in invoice.items.all():
-            revenue_segments = get_default_segments_for_account(
+            revenue_segments = lookup(
                 account_code='4000',  # Revenue Account
                 customer=invoice.customer
             )
@@ -140,7 +203,7 @@ def auto_generate_ar_invoice_distributions(invoice: ARInvoice) -> List[Dict[str,
             })
     else:
         # Single credit line for total
-        revenue_segments = get_default_segments_for_account(
+        revenue_segments = lookup(
             account_code='4000',  # Revenue Account
             customer=invoice.customer
         )
@@ -156,7 +219,7 @@ def auto_generate_ar_invoice_distributions(invoice: ARInvoice) -> List[Dict[str,
     return distributions
 
 
-def auto_generate_ap_invoice_distributions(invoice: APInvoice) -> List[Dict[str, Any]]:
+def auto_generate_ap_invoice_distributions(invoice: APInvoice, segment_lookup=None) -> List[Dict[str, Any]]:
     """
     Auto-generate GL distributions for AP invoice.
     
@@ -166,17 +229,20 @@ def auto_generate_ap_invoice_distributions(invoice: APInvoice) -> List[Dict[str,
     
     Args:
         invoice: APInvoice instance
+        segment_lookup: Replacement for get_default_segments_for_account
+            (bulk posting passes a memoized one)
     
     Returns:
         List of distribution dicts with amounts, line_type, description, segments
     """
+    lookup = segment_lookup or get_default_segments_for_account
     distributions = []
     
     # DEBIT: Expense (one line per item or single line)
     if invoice.items.exists():
         # Create one debit line per invoice item
         for item in invoice.items.all():
-            expense_segments = get_default_segments_for_account(
+            expense_segments = lookup(
                 account_code='5000',  # Expense Account
                 supplier=invoice.supplier
             )
@@ -192,7 +258,7 @@ def auto_generate_ap_invoice_distributions(invoice: APInvoice) -> List[Dict[str,
             })
     else:
         # Single debit line for total
-        expense_segments = get_default_segments_for_account(
+        expense_segments = lookup(
             account_code='5000',  # Expense Account
             supplier=invoice.supplier
         )
@@ -205,7 +271,7 @@ def auto_generate_ap_invoice_distributions(invoice: APInvoice) -> List[Dict[str,
         })
     
     # CREDIT: Accounts Payable
-    ap_segments = get_default_segments_for_account(
+    ap_segments = lookup(
         account_code='2100',  # AP Control Account
         supplier=invoice.supplier
     )
@@ -267,7 +333,9 @@ def create_journal_entry_from_distributions(
         # Find account segment
         account_segment_id = None
         for seg in segments_data:
-            seg_type = XX_SegmentType.objects.get(pk=seg['segment_type'])
+            seg_type = segment_registry.segment_type_by_id(seg['segment_type'])
+            if seg_type is None:
+                raise XX_SegmentType.DoesNotExist(f"Segment type {seg['segment_type']} does not exist")
             if seg_type.segment_name.lower() == 'account':
                 account_segment_id = seg['segment']
                 break
@@ -275,7 +343,9 @@ def create_journal_entry_from_distributions(
         if not account_segment_id:
             raise ValueError(f"Distribution must include an account segment")
         
-        account_segment = XX_Segment.objects.get(pk=account_segment_id)
+        account_segment = segment_registry.segment(account_segment_id)
+        if account_segment is None:
+            raise XX_Segment.DoesNotExist(f"Segment {account_segment_id} does not exist")
         
         # Create journal line
         journal_line = JournalLine.objects.create(
@@ -0,0 +1,80 @@
+"""
+Streaming CSV/XLSX responses for finance exports.
+
+CSV rows are formatted through a pseudo-buffer and sent as they are
+produced, so the first bytes leave before the query finishes. XLSX uses
+openpyxl write-only mode, which spools worksheet rows to a temporary file
+instead of keeping cells in memory; the finished workbook is then streamed
+from disk in chunks. Both take any iterable of row lists, so callers pass
+generators over `.iterator()` querysets to keep memory flat.
+
+write_csv/write_xlsx write the same files to disk for stored report jobs.
+"""
+import csv
+import tempfile
+
+from django.http import FileResponse, StreamingHttpResponse
+
+try:
+    from openpyxl import Workbook
+    OPENPYXL_OK = True
+except ImportError:
+    OPENPYXL_OK = False
+
+XLSX_CONTENT_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+EXPORT_CHUNK_SIZE = 2000
+
+
+class _Echo:
+    """File-like object whose write() returns the value, for csv.writer"""
+
+    def write(self, value):
+        return value
+
+
+def csv_response(rows, header, filename):
+    """StreamingHttpResponse writing header + rows as UTF-8 CSV with an Excel BOM"""
+    writer = csv.writer(_Echo())
+
+    def stream():
+        yield '\ufeff'  # Excel-friendly BOM
+        yield writer.writerow(header)
+        for row in rows:
+            yield writer.writerow(row)
+
+    resp = StreamingHttpResponse(stream(), content_type="text/csv; charset=utf-8")
+    resp["Content-Disposition"] = f'attachment; filename="{filename}"'
+    return resp
+
+
+def write_csv(fileobj, rows, header):
+    """Write header + rows as CSV with an Excel BOM to a text file; returns the data row count"""
+    fileobj.write('\ufeff')
+    writer = csv.writer(fileobj)
+    writer.writerow(header)
+    count = 0
+    for row in rows:
+        writer.writerow(row)
+        count += 1
+    return count
+
+
+def write_xlsx(target, rows, header, title):
+    """Save a write-only workbook of header + rows to a path or binary file; returns the data row count"""
+    wb = Workbook(write_only=True)
+    ws = wb.create_sheet(title[:31])
+    ws.append(header)
+    count = 0
+    for row in rows:
+        ws.append(row)
+        count += 1
+    wb.save(target)
+    return count
+
+
+def xlsx_response(rows, header, filename, title):
+    """FileResponse streaming a write-only workbook built from header + rows"""
+    spool = tempfile.TemporaryFile()
+    write_xlsx(spool, rows, header, title)
+    spool.seek(0)
+    return FileResponse(spool, as_attachment=True, filename=filename, content_type=XLSX_CONTENT_TYPE)
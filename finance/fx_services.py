@@ -3,13 +3,18 @@ FX (Foreign Exchange) Service Functions
 Handles currency conversion, exchange rate lookups, and FX gain/loss calculations
 """
 
+from bisect import bisect_right
+from collections import OrderedDict
 from decimal import Decimal, ROUND_HALF_UP
+import threading
+from django.conf import settings
 from django.db import transaction
 from django.utils import timezone
 from datetime import date, datetime
 from typing import Optional, Tuple
 from django.core.exceptions import ValidationError
 
+from core.cache_versions import VersionGuard
 from core.models import Currency, ExchangeRate, FXGainLossAccount
 from .models import JournalEntry, JournalLine
 from segment.models import XX_Segment
@@ -29,6 +34,103 @@ def get_base_currency() -> Currency:
         raise ValidationError("Multiple base currencies found. Only one currency should have is_base=True.")
 
 
+class ExchangeRateCache:
+    """
+    Process-level cache of active ExchangeRate rows.
+
+    Each (from, to, rate_type) pair is loaded once into a date-sorted
+    timeline; lookups bisect it for the latest rate on or before the date
+    and are memoized by (from, to, date, rate_type), keeping the
+    settings.FX_LOOKUP_CACHE_SIZE most recently used. Every ExchangeRate
+    save/delete bumps the "finance:fx_rates" CacheVersion row (see
+    finance.signals and core.cache_versions), so every process drops its
+    copies from its next request on.
+    """
+    VERSION_KEY = "finance:fx_rates"
+    LOOKUP_CACHE_SIZE = 10000
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._guard = VersionGuard(self.VERSION_KEY)
+        self._timelines = {}
+        self._lookups = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def _sync_version(self):
+        if not self._guard.is_current():
+            self._timelines.clear()
+            self._lookups.clear()
+
+    def _timeline(self, from_id, to_id, rate_type):
+        key = (from_id, to_id, rate_type)
+        timeline = self._timelines.get(key)
+        if timeline is None:
+            rows = ExchangeRate.objects.filter(
+                from_currency_id=from_id,
+                to_currency_id=to_id,
+                rate_type=rate_type,
+                is_active=True
+            ).order_by('rate_date').values_list('rate_date', 'rate')
+            dates, rates = [], []
+            for rate_date, rate in rows:
+                dates.append(rate_date)
+                rates.append(rate)
+            timeline = self._timelines[key] = (dates, rates)
+        return timeline
+
+    def _latest(self, from_id, to_id, rate_date, rate_type):
+        dates, rates = self._timeline(from_id, to_id, rate_type)
+        i = bisect_right(dates, rate_date)
+        return rates[i - 1] if i else None
+
+    def lookup(self, from_id, to_id, rate_date, rate_type):
+        """Return the rate, or None if neither the pair nor its inverse has one on or before rate_date"""
+        if isinstance(rate_date, datetime):
+            rate_date = rate_date.date()
+        key = (from_id, to_id, rate_date, rate_type)
+        with self._lock:
+            self._sync_version()
+            if key in self._lookups:
+                self.hits += 1
+                self._lookups.move_to_end(key)
+                return self._lookups[key]
+            self.misses += 1
+            rate = self._latest(from_id, to_id, rate_date, rate_type)
+            if rate is None:
+                inverse = self._latest(to_id, from_id, rate_date, rate_type)
+                if inverse:
+                    rate = Decimal('1.000000') / inverse
+            self._lookups[key] = rate
+            if len(self._lookups) > getattr(settings, 'FX_LOOKUP_CACHE_SIZE', self.LOOKUP_CACHE_SIZE):
+                self._lookups.popitem(last=False)
+            return rate
+
+    def invalidate(self):
+        with self._lock:
+            self._guard.bump()
+            self._timelines.clear()
+            self._lookups.clear()
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_ratio": round(self.hits / total, 4) if total else 0.0,
+            "pairs": len(self._timelines),
+            "lookups": len(self._lookups),
+        }
+
+
+rate_cache = ExchangeRateCache()
+
+
+def invalidate_rate_cache():
+    """Drop cached exchange rates in every process (called on ExchangeRate save/delete)"""
+    rate_cache.invalidate()
+
+
 def get_exchange_rate(
     from_currency: Currency,
     to_currency: Currency,
@@ -38,6 +140,9 @@ def get_exchange_rate(
     """
     Get the exchange rate for converting from one currency to another on a specific date.
     
+    Uses the latest active rate on or before rate_date, falling back to the
+    reciprocal of the inverse pair. Lookups are served from rate_cache.
+    
     Args:
         from_currency: Source currency
         to_currency: Target currency
@@ -54,48 +159,13 @@ def get_exchange_rate(
     if from_currency.id == to_currency.id:
         return Decimal('1.000000')
     
-    # Try to get the exact date rate
-    try:
-        rate_obj = ExchangeRate.objects.filter(
-            from_currency=from_currency,
-            to_currency=to_currency,
-            rate_date=rate_date,
-            rate_type=rate_type,
-            is_active=True
-        ).latest('rate_date')
-        return rate_obj.rate
-    except ExchangeRate.DoesNotExist:
-        pass
-    
-    # Try to get the most recent rate before the date
-    try:
-        rate_obj = ExchangeRate.objects.filter(
-            from_currency=from_currency,
-            to_currency=to_currency,
-            rate_date__lte=rate_date,
-            rate_type=rate_type,
-            is_active=True
-        ).latest('rate_date')
-        return rate_obj.rate
-    except ExchangeRate.DoesNotExist:
-        pass
-    
-    # Try inverse rate (to/from) and calculate reciprocal
-    try:
-        rate_obj = ExchangeRate.objects.filter(
-            from_currency=to_currency,
-            to_currency=from_currency,
-            rate_date__lte=rate_date,
-            rate_type=rate_type,
-            is_active=True
-        ).latest('rate_date')
-        # Inverse the rate
-        return Decimal('1.000000') / rate_obj.rate
-    except ExchangeRate.DoesNotExist:
+    rate = rate_cache.lookup(from_currency.id, to_currency.id, rate_date, rate_type)
+    if rate is None:
         raise ValidationError(
             f"No exchange rate found for {from_currency.code}/{to_currency.code} "
             f"on or before {rate_date} (type: {rate_type})"
         )
+    return rate
 
 
 def convert_amount(
@@ -0,0 +1,97 @@
+"""
+Benchmark bulk GL posting of AR invoices against the one-invoice-at-a-time path.
+
+Generates approved invoices inside a transaction, posts a sample through
+gl_post_from_ar_balanced and the rest through bulk_post_invoices, reports
+throughput in invoices per second, and rolls everything back.
+
+Usage: python manage.py benchmark_bulk_gl_posting --invoices 20000
+"""
+import random
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from ar.models import ARInvoice, ARItem, Customer
+from core.models import Currency
+from finance.bulk_posting_services import BULK_POST_CHUNK_SIZE, bulk_post_invoices
+from finance.services import gl_post_from_ar_balanced
+from segment.models import XX_Segment, XX_SegmentType
+
+
+class Command(BaseCommand):
+    help = 'Benchmark bulk AR invoice GL posting vs. per-invoice posting (invoices/second)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--invoices', type=int, default=20_000, help='Number of invoices to bulk post')
+        parser.add_argument('--items', type=int, default=5, help='Line items per invoice')
+        parser.add_argument('--single-sample', type=int, default=200,
+                            help='Invoices posted one at a time for comparison (0 to skip)')
+        parser.add_argument('--chunk-size', type=int, default=BULK_POST_CHUNK_SIZE)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        with transaction.atomic():
+            invoices = self._generate(rng, options)
+            self._run(invoices, options)
+            transaction.set_rollback(True)
+        self.stdout.write(self.style.SUCCESS('Benchmark data rolled back'))
+
+    def _generate(self, rng, options):
+        currency = Currency.objects.filter(is_base=True).first()
+        if currency is None:
+            currency = Currency.objects.create(code='BMK', name='Benchmark', is_base=True)
+        seg_type, _ = XX_SegmentType.objects.get_or_create(
+            segment_name='Account', defaults={'segment_type': 'account', 'length': 50}
+        )
+        for code, alias in (('1200', 'Accounts Receivable'), ('4000', 'Revenue')):
+            if not XX_Segment.objects.filter(code=code, node_type='child').exists():
+                XX_Segment.objects.create(segment_type=seg_type, code=code, alias=alias, node_type='child')
+        customer = Customer.objects.create(code='BMK-CUST', name='Benchmark Customer', currency=currency)
+
+        n = options['invoices'] + options['single_sample']
+        self.stdout.write(f'Generating {n:,} invoices x {options["items"]} items...')
+        t0 = time.perf_counter()
+        start = date.today() - timedelta(days=365)
+        invoices = ARInvoice.objects.bulk_create([
+            ARInvoice(customer=customer, number=f'BMK-{i:07d}', date=start + timedelta(days=rng.randrange(365)),
+                      due_date=start + timedelta(days=400), currency=currency, approval_status='APPROVED')
+            for i in range(n)
+        ], batch_size=5000)
+        invoices = list(ARInvoice.objects.filter(number__startswith='BMK-').order_by('id').values_list('id', flat=True))
+        ARItem.objects.bulk_create([
+            ARItem(invoice_id=inv_id, description='Benchmark item', quantity=rng.randrange(1, 10),
+                   unit_price=Decimal(rng.randrange(100, 100_000)) / 100)
+            for inv_id in invoices for _ in range(options['items'])
+        ], batch_size=5000)
+        self.stdout.write(f'  generated in {time.perf_counter() - t0:.1f}s')
+        return invoices
+
+    def _run(self, invoices, options):
+        sample = options['single_sample']
+        single_ids, bulk_ids = invoices[:sample], invoices[sample:]
+
+        self.stdout.write(self.style.NOTICE('\n=== GL posting ==='))
+        single_rate = None
+        if single_ids:
+            t0 = time.perf_counter()
+            for inv in ARInvoice.objects.filter(pk__in=single_ids):
+                gl_post_from_ar_balanced(inv)
+            elapsed = time.perf_counter() - t0
+            single_rate = len(single_ids) / elapsed if elapsed else 0
+            self.stdout.write(f'  single  {len(single_ids):>8,} invoices {elapsed:8.2f}s  {single_rate:10.1f} inv/s')
+
+        result = bulk_post_invoices('AR', bulk_ids, chunk_size=options['chunk_size'])
+        self.stdout.write(
+            f'  bulk    {result["posted"]:>8,} invoices {result["seconds"]:8.2f}s  '
+            f'{result["invoices_per_second"] or 0:10.1f} inv/s'
+        )
+        if result['failed']:
+            first = next(r for r in result['results'] if r['status'] == 'FAILED')
+            self.stdout.write(self.style.ERROR(f'  {result["failed"]} failed, e.g. {first["error"]}'))
+        if single_rate and result['invoices_per_second']:
+            self.stdout.write(self.style.SUCCESS(f'Speed-up x{result["invoices_per_second"] / single_rate:.1f}'))
@@ -0,0 +1,121 @@
+"""
+Benchmark distribution generation for a large invoice with the compiled
+segment rule matcher against the original query-per-line rule lookup.
+
+Creates one AR invoice with N items plus a set of assignment rules inside a
+transaction, times auto_generate_ar_invoice_distributions both ways, checks
+that the distributions agree, and rolls everything back.
+
+Usage: python manage.py benchmark_segment_rules --lines 1000
+"""
+import time
+from datetime import date
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from ar.models import ARInvoice, ARItem, Customer
+from core.models import Currency
+from finance.distribution_services import auto_generate_ar_invoice_distributions
+from finance.models import SegmentAssignmentRule
+from segment.models import XX_Segment, XX_SegmentType
+
+
+def legacy_default_segments(account_code, customer=None, supplier=None):
+    """Reference implementation: the original per-call queries."""
+    account_segment = XX_Segment.objects.get(code=account_code, node_type='child')
+    rules = SegmentAssignmentRule.objects.filter(is_active=True, account_segment=account_segment).order_by('priority')
+    rule = None
+    if customer:
+        rule = rules.filter(customer=customer).first()
+    if rule is None and supplier:
+        rule = rules.filter(supplier=supplier).first()
+    if rule is None:
+        rule = rules.filter(customer__isnull=True, supplier__isnull=True).first()
+    if rule is None:
+        return [{'segment_type': account_segment.segment_type_id, 'segment': account_segment.id}]
+    return [{'segment_type': t, 'segment': s} for t, s in rule.get_segment_assignments().items()]
+
+
+class Command(BaseCommand):
+    help = 'Benchmark compiled segment rule matching on a large invoice'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lines', type=int, default=1000, help='Invoice line items')
+        parser.add_argument('--customers', type=int, default=200, help='Customers with their own rules')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            invoice = self._generate(options)
+            self._run(invoice)
+            transaction.set_rollback(True)
+        self.stdout.write(self.style.SUCCESS('Benchmark data rolled back'))
+
+    def _generate(self, options):
+        currency = Currency.objects.filter(is_base=True).first() or Currency.objects.create(
+            code='BMK', name='Benchmark', is_base=True
+        )
+        account_type, _ = XX_SegmentType.objects.get_or_create(
+            segment_name='Account', defaults={'segment_type': 'account', 'length': 50}
+        )
+        dept_type, _ = XX_SegmentType.objects.get_or_create(
+            segment_name='BMK Department', defaults={'segment_type': 'department', 'length': 50}
+        )
+        accounts = {}
+        for code, alias in (('1200', 'Accounts Receivable'), ('4000', 'Revenue')):
+            accounts[code] = XX_Segment.objects.filter(code=code, node_type='child').first() or \
+                XX_Segment.objects.create(segment_type=account_type, code=code, alias=alias, node_type='child')
+        depts = XX_Segment.objects.bulk_create([
+            XX_Segment(segment_type=dept_type, code=f'BMKD{i:04d}', alias=f'Dept {i}', node_type='child')
+            for i in range(options['customers'] + 1)
+        ])
+        depts = list(XX_Segment.objects.filter(segment_type=dept_type, code__startswith='BMKD').order_by('code'))
+
+        customers = Customer.objects.bulk_create([
+            Customer(code=f'BMK-C{i:05d}', name=f'Benchmark {i}', currency=currency)
+            for i in range(options['customers'])
+        ])
+        customers = list(Customer.objects.filter(code__startswith='BMK-C').order_by('code'))
+        rules = [SegmentAssignmentRule(name='BMK default', account_segment=a, department_segment=depts[-1])
+                 for a in accounts.values()]
+        rules += [
+            SegmentAssignmentRule(name=f'BMK {c.code}', account_segment=a, customer=c,
+                                  department_segment=depts[i], priority=10)
+            for i, c in enumerate(customers) for a in accounts.values()
+        ]
+        SegmentAssignmentRule.objects.bulk_create(rules)
+        # bulk_create sends no signals
+        from finance.distribution_services import rule_matcher
+        rule_matcher.invalidate()
+
+        invoice = ARInvoice.objects.create(
+            customer=customers[len(customers) // 2], number='BMK-RULES', date=date.today(),
+            due_date=date.today(), currency=currency,
+        )
+        ARItem.objects.bulk_create([
+            ARItem(invoice=invoice, description=f'Line {i}', quantity=1, unit_price=Decimal('10.00'))
+            for i in range(options['lines'])
+        ])
+        invoice.calculate_and_save_totals()
+        self.stdout.write(f'Generated {len(rules)} rules and a {options["lines"]}-line invoice')
+        return invoice
+
+    def _time(self, label, lookup, invoice):
+        with CaptureQueriesContext(connection) as queries:
+            t0 = time.perf_counter()
+            dists = auto_generate_ar_invoice_distributions(invoice, segment_lookup=lookup)
+            elapsed = time.perf_counter() - t0
+        self.stdout.write(f'  {label:<10} {elapsed * 1000:9.1f} ms  {len(queries):6} queries')
+        return dists, elapsed
+
+    def _run(self, invoice):
+        self.stdout.write(self.style.NOTICE('\n=== Distribution generation ==='))
+        self._time('warm-up', None, invoice)
+        new, new_t = self._time('compiled', None, invoice)
+        old, old_t = self._time('legacy', legacy_default_segments, invoice)
+        if old != new:
+            self.stdout.write(self.style.ERROR('Distributions differ between matchers'))
+            return
+        self.stdout.write(self.style.SUCCESS(f'Distributions identical; speed-up x{old_t / new_t if new_t else 0:.1f}'))
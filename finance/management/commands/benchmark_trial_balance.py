@@ -0,0 +1,127 @@
+"""
+Benchmark the database-aggregated trial balance against the legacy Python loop.
+
+Generates a synthetic posted ledger inside a transaction, runs both engines,
+checks that they agree, and rolls everything back.
+
+Usage: python manage.py benchmark_trial_balance --lines 1000000
+"""
+import random
+import time
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.models import Currency
+from finance.models import JournalEntry, JournalLine
+from finance.services import build_trial_balance, q2
+from segment.models import XX_Segment, XX_SegmentType
+
+
+def legacy_trial_balance(date_from=None, date_to=None):
+    """Reference implementation: the original per-line Python accumulation."""
+    qs = JournalLine.objects.select_related("entry", "account").filter(entry__posted=True)
+    if date_from:
+        qs = qs.filter(entry__date__gte=date_from)
+    if date_to:
+        qs = qs.filter(entry__date__lte=date_to)
+
+    rows = {}
+    for jl in qs:
+        code = jl.account.code
+        if code not in rows:
+            rows[code] = {"code": code, "name": jl.account.name, "debit": Decimal("0.00"), "credit": Decimal("0.00")}
+        rows[code]["debit"] += Decimal(jl.debit or 0)
+        rows[code]["credit"] += Decimal(jl.credit or 0)
+
+    data = []
+    total_debit = Decimal("0.00")
+    total_credit = Decimal("0.00")
+    for code in sorted(rows):
+        r = rows[code]
+        r["debit"] = q2(r["debit"])
+        r["credit"] = q2(r["credit"])
+        total_debit += r["debit"]
+        total_credit += r["credit"]
+        data.append(r)
+
+    data.append({"code": "TOTAL", "name": "", "debit": q2(total_debit), "credit": q2(total_credit)})
+    return data
+
+
+class Command(BaseCommand):
+    help = 'Benchmark SQL-aggregated trial balance vs. the legacy Python loop on a generated ledger'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lines', type=int, default=1_000_000, help='Number of journal lines to generate')
+        parser.add_argument('--accounts', type=int, default=200, help='Number of account segments to spread lines over')
+        parser.add_argument('--lines-per-entry', type=int, default=10, help='Journal lines per journal entry (even number)')
+        parser.add_argument('--batch-size', type=int, default=5000, help='bulk_create batch size')
+        parser.add_argument('--skip-legacy', action='store_true', help='Only time the new engine')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        with transaction.atomic():
+            self._generate(rng, options)
+            self._run(options)
+            transaction.set_rollback(True)
+        self.stdout.write(self.style.SUCCESS('Benchmark data rolled back'))
+
+    def _generate(self, rng, options):
+        n_lines = options['lines']
+        per_entry = max(2, options['lines_per_entry'] - options['lines_per_entry'] % 2)
+        batch = options['batch_size']
+
+        currency, _ = Currency.objects.get_or_create(code='BMK', defaults={'name': 'Benchmark'})
+        seg_type, _ = XX_SegmentType.objects.get_or_create(
+            segment_name='Account', defaults={'segment_type': 'account', 'length': 50}
+        )
+        accounts = XX_Segment.objects.bulk_create([
+            XX_Segment(segment_type=seg_type, code=f'BMK{i:05d}', alias=f'Benchmark {i}', node_type='child')
+            for i in range(options['accounts'])
+        ])
+        accounts = list(XX_Segment.objects.filter(code__startswith='BMK', segment_type=seg_type))
+
+        n_entries = n_lines // per_entry
+        start = date(2020, 1, 1)
+        self.stdout.write(f'Generating {n_entries:,} entries / {n_entries * per_entry:,} lines...')
+        t0 = time.perf_counter()
+        created = 0
+        while created < n_entries:
+            size = min(batch // per_entry or 1, n_entries - created)
+            entries = JournalEntry.objects.bulk_create([
+                JournalEntry(date=start + timedelta(days=rng.randrange(1500)), currency=currency,
+                             memo='benchmark', posted=True)
+                for _ in range(size)
+            ])
+            lines = []
+            for entry in entries:
+                for _ in range(per_entry // 2):
+                    amount = Decimal(rng.randrange(1, 1_000_000)) / 100
+                    lines.append(JournalLine(entry=entry, account=rng.choice(accounts), debit=amount, credit=0))
+                    lines.append(JournalLine(entry=entry, account=rng.choice(accounts), debit=0, credit=amount))
+            JournalLine.objects.bulk_create(lines, batch_size=batch)
+            created += size
+        self.stdout.write(f'  generated in {time.perf_counter() - t0:.1f}s')
+
+    def _time(self, label, fn):
+        t0 = time.perf_counter()
+        result = fn()
+        elapsed = time.perf_counter() - t0
+        self.stdout.write(f'  {label:<10} {elapsed:8.2f}s  ({len(result) - 1} accounts)')
+        return result, elapsed
+
+    def _run(self, options):
+        self.stdout.write(self.style.NOTICE('\n=== Trial balance ==='))
+        new_rows, new_t = self._time('sql', build_trial_balance)
+        if options['skip_legacy']:
+            return
+        old_rows, old_t = self._time('legacy', legacy_trial_balance)
+
+        if old_rows != new_rows:
+            self.stdout.write(self.style.ERROR('Results differ between engines'))
+            return
+        self.stdout.write(self.style.SUCCESS(f'Results identical; speed-up x{old_t / new_t if new_t else 0:.1f}'))
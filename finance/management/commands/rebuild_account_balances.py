@@ -0,0 +1,76 @@
+"""
+Management command to rebuild or verify the AccountPeriodBalance store
+from raw posted journal lines.
+
+Usage:
+    python manage.py rebuild_account_balances               # rebuild every monthly period
+    python manage.py rebuild_account_balances --verify      # report drift, change nothing
+    python manage.py rebuild_account_balances --period 2025-01
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from finance.balance_services import BALANCE_PERIOD_TYPE, diff_period_balances, rebuild_period_balances
+from periods.models import FiscalPeriod
+
+
+class Command(BaseCommand):
+    help = 'Rebuild or verify account-period balances from raw journal lines'
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Only compare the store with raw lines and report drift',
+        )
+        parser.add_argument(
+            '--period',
+            action='append',
+            dest='periods',
+            help='Period code to process (repeatable). Defaults to all monthly periods',
+        )
+        parser.add_argument(
+            '--closed-only',
+            action='store_true',
+            help='Process only CLOSED periods',
+        )
+
+    def handle(self, *args, **options):
+        periods = FiscalPeriod.objects.filter(period_type=BALANCE_PERIOD_TYPE).order_by('start_date')
+        if options['periods']:
+            periods = periods.filter(period_code__in=options['periods'])
+            missing = set(options['periods']) - set(periods.values_list('period_code', flat=True))
+            if missing:
+                raise CommandError(f"Unknown {BALANCE_PERIOD_TYPE} period(s): {', '.join(sorted(missing))}")
+        if options['closed_only']:
+            periods = periods.filter(status='CLOSED')
+
+        if options['verify']:
+            self.verify(periods)
+        else:
+            self.rebuild(periods)
+
+    def rebuild(self, periods):
+        total = 0
+        for period in periods:
+            rows = rebuild_period_balances(period)
+            total += rows
+            self.stdout.write(f'  {period.period_code}: {rows} balance row(s)')
+        self.stdout.write(self.style.SUCCESS(f'\n✓ Rebuilt {periods.count()} period(s), {total} row(s)'))
+
+    def verify(self, periods):
+        drifted = 0
+        for period in periods:
+            drift = diff_period_balances(period)
+            if not drift:
+                continue
+            drifted += 1
+            self.stdout.write(self.style.WARNING(f'  {period.period_code}: {len(drift)} drifted row(s)'))
+            for (account_id, currency_id, segment_key), stored, expected in drift[:20]:
+                self.stdout.write(
+                    f'    account={account_id} currency={currency_id} segments="{segment_key}": '
+                    f'stored Dr {stored[0]} Cr {stored[1]} / expected Dr {expected[0]} Cr {expected[1]}'
+                )
+
+        if drifted:
+            raise CommandError(f'{drifted} period(s) drifted; run without --verify to rebuild')
+        self.stdout.write(self.style.SUCCESS(f'✓ {periods.count()} period(s) match raw journal lines'))
@@ -0,0 +1,62 @@
+"""
+Management command to recompute stored invoice payment state
+(amount_paid, amount_outstanding, payment_status, paid_at) from payment
+allocations.
+
+Run it once after migrating to fill the new columns. After that, run it
+whenever allocations were written without model signals (raw SQL, imports,
+a failed on-commit update).
+
+Usage:
+    python manage.py repair_invoice_payment_state            # AR and AP
+    python manage.py repair_invoice_payment_state --verify   # report drift, change nothing
+    python manage.py repair_invoice_payment_state --ap-only
+"""
+from django.core.management.base import BaseCommand, CommandError
+
+from ap.models import APInvoice
+from ar.models import ARInvoice
+from finance.payment_state_services import recompute_payment_state
+
+
+class Command(BaseCommand):
+    help = 'Recompute stored invoice paid/outstanding amounts and payment status from allocations'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--ar-only', action='store_true', help='Process only AR invoices')
+        parser.add_argument('--ap-only', action='store_true', help='Process only AP invoices')
+        parser.add_argument(
+            '--verify',
+            action='store_true',
+            help='Only report invoices whose stored state differs',
+        )
+
+    def handle(self, *args, **options):
+        models = []
+        if not options['ap_only']:
+            models.append(('AR', ARInvoice))
+        if not options['ar_only']:
+            models.append(('AP', APInvoice))
+
+        drifted = 0
+        for label, model in models:
+            before = {
+                pk: (paid, outstanding, status)
+                for pk, paid, outstanding, status in model.objects.values_list(
+                    'pk', 'amount_paid', 'amount_outstanding', 'payment_status')
+            }
+            changed = recompute_payment_state(model, dry_run=options['verify'])
+            drifted += len(changed)
+            for invoice in changed[:20]:
+                paid, outstanding, status = before[invoice.pk]
+                self.stdout.write(
+                    f'  {label} {invoice.number}: paid {paid} → {invoice.amount_paid}, '
+                    f'outstanding {outstanding} → {invoice.amount_outstanding}, '
+                    f'{status} → {invoice.payment_status}'
+                )
+            self.stdout.write(f'{label}: {len(changed)} of {len(before)} invoice(s) '
+                              f'{"differ" if options["verify"] else "repaired"}')
+
+        if options['verify'] and drifted:
+            raise CommandError(f'{drifted} invoice(s) drifted; run without --verify to repair')
+        self.stdout.write(self.style.SUCCESS('✓ Invoice payment state matches allocations'))
@@ -0,0 +1,116 @@
+"""
+Build queued report jobs in a pool of worker processes.
+
+Claims QUEUED ReportJob rows oldest first, builds each artifact in a
+separate process (spawned, so no database connection is shared with the
+parent) and records the outcome on the job. Several workers may run against
+the same database; a job is claimed by exactly one of them.
+
+Usage:
+    python manage.py run_report_worker --processes 4
+    python manage.py run_report_worker --once          # drain the queue and exit
+    python manage.py run_report_worker --processes 0   # build in this process (debugging)
+"""
+import multiprocessing
+import os
+import time
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+# Spawned workers import this module before django.setup() runs, so model
+# and service imports stay inside the functions below.
+
+
+def _init_worker(settings_module):
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", settings_module)
+    import django
+    django.setup()
+
+
+def _build(job_id):
+    from finance.report_job_services import run_report_job
+    return run_report_job(job_id)
+
+
+class Command(BaseCommand):
+    help = 'Process queued report jobs with a local process pool'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=min(4, os.cpu_count() or 1),
+                            help='Worker processes (0 builds reports in this process)')
+        parser.add_argument('--poll-interval', type=float, default=2.0, help='Seconds between queue polls')
+        parser.add_argument('--once', action='store_true', help='Exit once the queue is empty')
+        parser.add_argument('--stale-minutes', type=int, default=60,
+                            help='Requeue jobs RUNNING for longer than this at startup')
+        parser.add_argument('--purge-days', type=int, default=0,
+                            help='Delete finished jobs and artifacts older than this at startup (0 keeps all)')
+
+    def handle(self, *args, **options):
+        from finance.report_job_services import purge_report_jobs, requeue_stale_jobs
+
+        requeued = requeue_stale_jobs(timedelta(minutes=options['stale_minutes']))
+        if requeued:
+            self.stdout.write(self.style.WARNING(f'Requeued {requeued} stale job(s)'))
+        if options['purge_days']:
+            purged = purge_report_jobs(timedelta(days=options['purge_days']))
+            self.stdout.write(f'Purged {purged} old job(s)')
+
+        try:
+            if options['processes'] <= 0:
+                self._run_inline(options)
+            else:
+                self._run_pool(options)
+        except KeyboardInterrupt:
+            self.stdout.write(self.style.WARNING('Stopped; unfinished jobs are requeued on the next start'))
+
+    def _report(self, job_id, status):
+        style = self.style.SUCCESS if status == 'SUCCEEDED' else self.style.ERROR
+        self.stdout.write(style(f'Job {job_id}: {status}'))
+
+    def _run_inline(self, options):
+        from finance.report_job_services import claim_jobs, run_report_job
+
+        while True:
+            claimed = claim_jobs(1)
+            for job_id in claimed:
+                self._report(job_id, run_report_job(job_id))
+            if not claimed:
+                if options['once']:
+                    return
+                time.sleep(options['poll_interval'])
+
+    def _run_pool(self, options):
+        from finance.report_job_services import claim_jobs, fail_report_job
+
+        processes = options['processes']
+        self.stdout.write(f'Report worker started with {processes} process(es)')
+        pool = ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=_init_worker,
+            initargs=(os.environ['DJANGO_SETTINGS_MODULE'],),
+        )
+        running = {}
+        with pool:
+            while True:
+                claimed = claim_jobs(processes - len(running))
+                for job_id in claimed:
+                    running[pool.submit(_build, job_id)] = job_id
+                if not running:
+                    if options['once']:
+                        return
+                    time.sleep(options['poll_interval'])
+                    continue
+
+                done, _ = wait(running, timeout=options['poll_interval'], return_when=FIRST_COMPLETED)
+                for future in done:
+                    job_id = running.pop(future)
+                    try:
+                        status = future.result()
+                    except Exception as e:
+                        # The worker process died before it could record the outcome
+                        fail_report_job(job_id, e)
+                        status = 'FAILED'
+                    self._report(job_id, status)
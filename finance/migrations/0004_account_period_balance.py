@@ -0,0 +1,47 @@
+# Generated by Django 5.2.7 on 2026-10-16 05:53
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+        ('finance', '0003_remove_legacy_invoice_tables'),
+        ('periods', '0001_initial'),
+        ('segment', '0002_alter_xx_segmenttype_segment_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AccountBalanceRebuild',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('rebuilt_at', models.DateTimeField()),
+                ('row_count', models.IntegerField(default=0)),
+                ('period', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='balance_rebuild', to='periods.fiscalperiod')),
+            ],
+            options={
+                'db_table': 'finance_account_balance_rebuild',
+            },
+        ),
+        migrations.CreateModel(
+            name='AccountPeriodBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('segment_key', models.CharField(blank=True, default='', help_text="Sorted 'type_id:segment_id' pairs of the line's segments (empty if none)", max_length=255)),
+                ('debit', models.DecimalField(decimal_places=2, default=0, max_digits=18)),
+                ('credit', models.DecimalField(decimal_places=2, default=0, max_digits=18)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='period_balances', to='segment.xx_segment')),
+                ('currency', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, to='core.currency')),
+                ('period', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='account_balances', to='periods.fiscalperiod')),
+            ],
+            options={
+                'db_table': 'finance_account_period_balance',
+                'indexes': [models.Index(fields=['period', 'account'], name='finance_acc_period__bc013e_idx')],
+                'unique_together': {('account', 'period', 'currency', 'segment_key')},
+            },
+        ),
+    ]
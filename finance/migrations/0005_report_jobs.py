@@ -0,0 +1,49 @@
+# Generated by Django 5.2.7 on 2026-10-16 06:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('finance', '0004_account_period_balance'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReportDataVersion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('source', models.CharField(max_length=32, unique=True)),
+                ('version', models.PositiveBigIntegerField(default=0)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+            options={
+                'db_table': 'finance_report_data_version',
+            },
+        ),
+        migrations.CreateModel(
+            name='ReportJob',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('report_type', models.CharField(max_length=64)),
+                ('file_format', models.CharField(choices=[('csv', 'CSV'), ('xlsx', 'Excel'), ('json', 'JSON')], default='csv', max_length=8)),
+                ('params', models.JSONField(blank=True, default=dict)),
+                ('params_hash', models.CharField(help_text='sha256 of report type, format and normalized params', max_length=64)),
+                ('data_version', models.PositiveBigIntegerField(default=0, help_text="ReportDataVersion of the report's source the result was built from")),
+                ('status', models.CharField(choices=[('QUEUED', 'Queued'), ('RUNNING', 'Running'), ('SUCCEEDED', 'Succeeded'), ('FAILED', 'Failed')], default='QUEUED', max_length=16)),
+                ('artifact_path', models.CharField(blank=True, max_length=255)),
+                ('row_count', models.IntegerField(blank=True, null=True)),
+                ('error', models.TextField(blank=True)),
+                ('requested_by', models.CharField(blank=True, max_length=128)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('started_at', models.DateTimeField(blank=True, null=True)),
+                ('finished_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'db_table': 'finance_report_job',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['status', 'created_at'], name='finance_rep_status_81c685_idx'), models.Index(fields=['params_hash', 'data_version'], name='finance_rep_params__998c97_idx')],
+            },
+        ),
+    ]
@@ -74,6 +74,106 @@ class JournalLineSegment(models.Model):
 
 
 
+class AccountPeriodBalance(models.Model):
+    """
+    Materialized debit/credit totals of posted journal lines per
+    account × monthly fiscal period × currency (× segment combination).
+    Maintained incrementally by the posting services and rebuilt from raw
+    lines by `manage.py rebuild_account_balances`.
+    """
+    account = models.ForeignKey('segment.XX_Segment', on_delete=models.PROTECT, related_name='period_balances')
+    period = models.ForeignKey('periods.FiscalPeriod', on_delete=models.CASCADE, related_name='account_balances')
+    currency = models.ForeignKey(Currency, on_delete=models.PROTECT)
+    segment_key = models.CharField(
+        max_length=255, blank=True, default="",
+        help_text="Sorted 'type_id:segment_id' pairs of the line's segments (empty if none)"
+    )
+    debit = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+    credit = models.DecimalField(max_digits=18, decimal_places=2, default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = "finance_account_period_balance"
+        unique_together = ("account", "period", "currency", "segment_key")
+        indexes = [
+            models.Index(fields=["period", "account"]),
+        ]
+
+    def __str__(self):
+        return f"{self.account_id}@{self.period_id} {self.currency_id} Dr {self.debit} Cr {self.credit}"
+
+
+class AccountBalanceRebuild(models.Model):
+    """Marks a period whose AccountPeriodBalance rows were rebuilt from raw journal lines"""
+    period = models.OneToOneField('periods.FiscalPeriod', on_delete=models.CASCADE, related_name='balance_rebuild')
+    rebuilt_at = models.DateTimeField()
+    row_count = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = "finance_account_balance_rebuild"
+
+    def __str__(self):
+        return f"{self.period_id} rebuilt {self.rebuilt_at}"
+
+
+class ReportDataVersion(models.Model):
+    """
+    Change counter of a report data source ("ledger", "procurement").
+    Bumped by finance.signals after every committed change to the source's
+    models, so stored report results can be reused until the counter moves.
+    """
+    source = models.CharField(max_length=32, unique=True)
+    version = models.PositiveBigIntegerField(default=0)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        db_table = "finance_report_data_version"
+
+    def __str__(self):
+        return f"{self.source} v{self.version}"
+
+
+class ReportJob(models.Model):
+    """
+    A report requested through /api/reports/jobs/ and built by
+    `manage.py run_report_worker`. The finished artifact is written under
+    settings.REPORT_ARTIFACT_ROOT and served by the download endpoint.
+    """
+    QUEUED = "QUEUED"
+    RUNNING = "RUNNING"
+    SUCCEEDED = "SUCCEEDED"
+    FAILED = "FAILED"
+    STATUS_CHOICES = [(QUEUED, "Queued"), (RUNNING, "Running"), (SUCCEEDED, "Succeeded"), (FAILED, "Failed")]
+    FORMAT_CHOICES = [("csv", "CSV"), ("xlsx", "Excel"), ("json", "JSON")]
+
+    report_type = models.CharField(max_length=64)
+    file_format = models.CharField(max_length=8, choices=FORMAT_CHOICES, default="csv")
+    params = models.JSONField(default=dict, blank=True)
+    params_hash = models.CharField(max_length=64, help_text="sha256 of report type, format and normalized params")
+    data_version = models.PositiveBigIntegerField(
+        default=0, help_text="ReportDataVersion of the report's source the result was built from"
+    )
+    status = models.CharField(max_length=16, choices=STATUS_CHOICES, default=QUEUED)
+    artifact_path = models.CharField(max_length=255, blank=True)
+    row_count = models.IntegerField(null=True, blank=True)
+    error = models.TextField(blank=True)
+    requested_by = models.CharField(max_length=128, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        db_table = "finance_report_job"
+        ordering = ["-created_at"]
+        indexes = [
+            models.Index(fields=["status", "created_at"]),
+            models.Index(fields=["params_hash", "data_version"]),
+        ]
+
+    def __str__(self):
+        return f"{self.report_type}.{self.file_format} #{self.pk} {self.status}"
+
+
 class CorporateTaxRule(models.Model):
     COUNTRY_CHOICES = [("AE","UAE"),("SA","KSA"),("EG","Egypt"),("IN","India")]
     country = models.CharField(max_length=2, choices=COUNTRY_CHOICES)
@@ -0,0 +1,276 @@
+"""
+Stored payment state of AR/AP invoices.
+
+ARInvoice/APInvoice store amount_paid and amount_outstanding next to
+payment_status and paid_at. Allocation signals no longer recompute an
+invoice on every allocation save. They record the allocation's state before
+and after the change. Once the transaction commits, each touched invoice
+receives its net change in paid amount exactly once:
+- one UPDATE per DELTA_CHUNK_SIZE invoices adds each its delta to amount_paid;
+- one UPDATE for all touched invoices derives amount_outstanding,
+  payment_status and paid_at from amount_paid and the invoice total.
+
+Before anything is applied, the recorded states are checked against the
+committed allocation rows. A change undone by a rolled-back savepoint is
+dropped. An invoice is recomputed from its allocations instead when its
+rows no longer match what was recorded, or when its amount_paid has never
+been computed (NULL). The repair_invoice_payment_state command runs the
+same recompute over every invoice.
+"""
+import threading
+from collections import defaultdict, namedtuple
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, DateTimeField, DecimalField, F, Value, When
+from django.db.models.lookups import GreaterThan, LessThanOrEqual
+from django.utils import timezone
+
+from .services import annotate_open_balances, apply_unrated_fx_adjustments, invoice_total_expression, q2
+import logging
+
+logger = logging.getLogger(__name__)
+
+REPAIR_CHUNK_SIZE = 1000
+DELTA_CHUNK_SIZE = 500
+
+AllocationState = namedtuple("AllocationState", "invoice_id payment_id amount rate")
+
+_local = threading.local()
+
+
+def allocation_state(allocation):
+    """The fields of an allocation that decide its paid contribution"""
+    rate = allocation.current_exchange_rate
+    return AllocationState(
+        allocation.invoice_id,
+        allocation.payment_id,
+        Decimal(str(allocation.amount)),
+        Decimal(str(rate)) if rate is not None else None,
+    )
+
+
+def payment_status_for(outstanding, paid):
+    """payment_status for an invoice, as the allocation signals have always set it"""
+    if outstanding <= Decimal("0.00"):
+        return "PAID"
+    if paid > Decimal("0.00"):
+        return "PARTIALLY_PAID"
+    return "UNPAID"
+
+
+class PendingPaymentState:
+    """Allocation changes of one transaction, applied to their invoices on commit"""
+
+    def __init__(self, using):
+        self.using = using
+        # (allocation model, allocation id) -> [before, after]; None for created / deleted
+        self.changes = {}
+
+    def record(self, allocation_model, allocation_id, before, after):
+        change = self.changes.get((allocation_model, allocation_id))
+        if change is None:
+            self.changes[(allocation_model, allocation_id)] = [before, after]
+        else:
+            change[1] = after
+
+    def is_registered(self, connection):
+        return connection.in_atomic_block and any(entry[1] == self.flush for entry in connection.run_on_commit)
+
+    def flush(self):
+        batches = getattr(_local, "batches", {})
+        if batches.get(self.using) is self:
+            del batches[self.using]
+        by_model = defaultdict(list)
+        for (allocation_model, allocation_id), (before, after) in self.changes.items():
+            by_model[allocation_model].append((allocation_id, before, after))
+        for allocation_model, changes in by_model.items():
+            try:
+                _apply_changes(allocation_model, changes)
+            except Exception:
+                # The allocations are committed; repair_invoice_payment_state brings the invoices back in line
+                logger.exception("Failed to update invoice payment state for %s", allocation_model.__name__)
+
+
+def record_allocation_change(allocation_model, allocation_id, before, after, using="default"):
+    """
+    Queue an allocation change for its invoice's stored payment state.
+
+    before/after are AllocationStates (None for a created or deleted
+    allocation). Changes of one transaction are applied together on commit;
+    outside a transaction they are applied at once. Bulk writers that skip
+    model signals call this for each allocation they write.
+    """
+    connection = transaction.get_connection(using)
+    batches = _local.__dict__.setdefault("batches", {})
+    batch = batches.get(using)
+    if batch is not None and batch.is_registered(connection):
+        batch.record(allocation_model, allocation_id, before, after)
+        return
+    batch = batches[using] = PendingPaymentState(using)
+    batch.record(allocation_model, allocation_id, before, after)
+    transaction.on_commit(batch.flush, using=using)
+
+
+def _apply_changes(allocation_model, changes):
+    invoice_model = allocation_model.invoice.field.related_model
+    committed = {
+        pk: AllocationState(*state)
+        for pk, *state in allocation_model.objects.filter(pk__in=[c[0] for c in changes])
+        .values_list("pk", "invoice_id", "payment_id", "amount", "current_exchange_rate")
+    }
+    applied, recompute = [], set()
+    for allocation_id, before, after in changes:
+        actual = committed.get(allocation_id)
+        if actual == after:
+            applied.append((before, after))
+        elif actual != before:
+            recompute.update(state.invoice_id for state in (before, after, actual) if state)
+        # actual == before: the change was rolled back
+
+    contributions = paid_contributions(allocation_model, [s for pair in applied for s in pair if s])
+    deltas = defaultdict(Decimal)
+    for before, after in applied:
+        for state, sign in ((before, -1), (after, 1)):
+            if state is None:
+                continue
+            if contributions[state] is None:
+                recompute.add(state.invoice_id)
+            else:
+                deltas[state.invoice_id] += sign * contributions[state]
+    apply_paid_deltas(invoice_model, deltas, recompute)
+
+
+def paid_contributions(allocation_model, states):
+    """
+    {AllocationState: amount it pays in invoice currency}, converted as
+    ARInvoice/APInvoice.paid_amount() converts each allocation. None when
+    the payment no longer exists (deleted with its allocations).
+    """
+    from core.models import Currency
+    from finance.fx_services import get_exchange_rate
+
+    states = set(states)
+    if not states:
+        return {}
+    invoice_model = allocation_model.invoice.field.related_model
+    payment_model = allocation_model.payment.field.related_model
+    invoice_currency = dict(
+        invoice_model.objects.filter(pk__in={s.invoice_id for s in states}).values_list("pk", "currency_id")
+    )
+    payments = {
+        pk: (currency_id, paid_on)
+        for pk, currency_id, paid_on in payment_model.objects.filter(pk__in={s.payment_id for s in states})
+        .values_list("pk", "currency_id", "date")
+    }
+    currencies = {}
+
+    def currency(pk):
+        if pk not in currencies:
+            currencies[pk] = Currency.objects.get(pk=pk)
+        return currencies[pk]
+
+    result = {}
+    for state in states:
+        if state.payment_id not in payments:
+            result[state] = None
+            continue
+        amount = state.amount
+        payment_currency, paid_on = payments[state.payment_id]
+        to_currency = invoice_currency.get(state.invoice_id)
+        if payment_currency != to_currency:
+            if state.rate:
+                amount = state.amount / state.rate
+            elif payment_currency is not None and to_currency is not None:
+                try:
+                    rate = get_exchange_rate(
+                        from_currency=currency(payment_currency),
+                        to_currency=currency(to_currency),
+                        rate_date=paid_on,
+                        rate_type="SPOT",
+                    )
+                    amount = state.amount * rate
+                except Exception:
+                    pass  # keep the face amount if no rate is available
+        result[state] = amount
+    return result
+
+
+def apply_paid_deltas(invoice_model, deltas, recompute=()):
+    """
+    Add {invoice_id: paid delta} to stored amount_paid, recompute the
+    invoices in `recompute` (and any never computed) from their allocations,
+    then refresh outstanding amount and status of all of them.
+    """
+    touched = set(deltas) | set(recompute)
+    if not touched:
+        return
+    pending = [(pk, q2(delta)) for pk, delta in deltas.items() if pk not in recompute and q2(delta)]
+    with transaction.atomic():
+        for start in range(0, len(pending), DELTA_CHUNK_SIZE):
+            chunk = pending[start:start + DELTA_CHUNK_SIZE]
+            delta = Case(
+                *[When(pk=pk, then=Value(amount)) for pk, amount in chunk],
+                output_field=DecimalField(max_digits=14, decimal_places=2),
+            )
+            invoice_model.objects.filter(pk__in=[pk for pk, _ in chunk]).update(amount_paid=F("amount_paid") + delta)
+        uncomputed = set(
+            invoice_model.objects.filter(pk__in=touched, amount_paid__isnull=True).values_list("pk", flat=True)
+        )
+        recompute = set(recompute) | uncomputed
+        if recompute:
+            recompute_payment_state(invoice_model, invoice_model.objects.filter(pk__in=recompute))
+        refresh_payment_status(invoice_model.objects.filter(pk__in=touched - recompute))
+
+
+def refresh_payment_status(queryset):
+    """Derive amount_outstanding, payment_status and paid_at from stored amount_paid in one UPDATE"""
+    outstanding = invoice_total_expression(queryset.model) - F("amount_paid")
+    is_paid = LessThanOrEqual(outstanding, Value(Decimal("0")))
+    return queryset.update(
+        amount_outstanding=outstanding,
+        payment_status=Case(
+            When(is_paid, then=Value("PAID")),
+            When(GreaterThan(F("amount_paid"), Value(Decimal("0"))), then=Value("PARTIALLY_PAID")),
+            default=Value("UNPAID"),
+        ),
+        paid_at=Case(
+            When(is_paid, then=Case(
+                When(paid_at__isnull=True, then=Value(timezone.now())),
+                default=F("paid_at"),
+            )),
+            default=Value(None),
+            output_field=DateTimeField(),
+        ),
+    )
+
+
+def recompute_payment_state(invoice_model, queryset=None, dry_run=False):
+    """
+    Recompute amount_paid, amount_outstanding, payment_status and paid_at
+    from allocations, REPAIR_CHUNK_SIZE invoices per query. Returns the
+    invoices whose stored state differed (saved unless dry_run).
+    """
+    queryset = invoice_model.objects.all() if queryset is None else queryset
+    ids = list(queryset.order_by("pk").values_list("pk", flat=True))
+    fields = ["amount_paid", "amount_outstanding", "payment_status", "paid_at"]
+    now = timezone.now()
+    changed = []
+    for start in range(0, len(ids), REPAIR_CHUNK_SIZE):
+        chunk = ids[start:start + REPAIR_CHUNK_SIZE]
+        invoices = apply_unrated_fx_adjustments(list(annotate_open_balances(invoice_model.objects.filter(pk__in=chunk))))
+        stale = []
+        for invoice in invoices:
+            paid = q2(invoice.paid_total)
+            outstanding = q2(invoice.open_total) - paid
+            status = payment_status_for(outstanding, paid)
+            paid_at = (invoice.paid_at or now) if status == "PAID" else None
+            if (invoice.amount_paid, invoice.amount_outstanding, invoice.payment_status, invoice.paid_at) \
+                    != (paid, outstanding, status, paid_at):
+                invoice.amount_paid, invoice.amount_outstanding = paid, outstanding
+                invoice.payment_status, invoice.paid_at = status, paid_at
+                stale.append(invoice)
+        if stale and not dry_run:
+            invoice_model.objects.bulk_update(stale, fields)
+        changed += stale
+    return changed
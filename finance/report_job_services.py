@@ -0,0 +1,390 @@
+"""
+Asynchronous report jobs with stored results.
+
+Reports too slow for a request (trial balance, GL detail, aging, procurement
+analytics) are submitted as ReportJob rows, built by
+`manage.py run_report_worker` in a process pool and written to disk under
+settings.REPORT_ARTIFACT_ROOT as CSV, XLSX or JSON.
+
+Each report reads one data source ("ledger" or "procurement") whose
+ReportDataVersion is bumped after every committed change to its models (see
+finance.signals). A submission whose report type, format and normalized
+params match a queued, running or finished job of the current version reuses
+that job instead of queuing a new one.
+"""
+import hashlib
+import json
+import os
+from collections import namedtuple
+from datetime import date, datetime, timedelta
+
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import IntegrityError, transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .exports import EXPORT_CHUNK_SIZE, OPENPYXL_OK, XLSX_CONTENT_TYPE, write_csv, write_xlsx
+from .models import JournalLine, ReportDataVersion, ReportJob
+from .services import build_ap_aging, build_ar_aging, build_trial_balance
+import logging
+
+logger = logging.getLogger(__name__)
+
+LEDGER = "ledger"
+PROCUREMENT = "procurement"
+
+FILE_FORMATS = {"csv": "text/csv; charset=utf-8", "xlsx": XLSX_CONTENT_TYPE, "json": "application/json"}
+
+# header: column names; rows: iterable of row lists; data: JSON payload (None = rows keyed by header)
+ReportOutput = namedtuple("ReportOutput", "header rows data")
+_Report = namedtuple("_Report", "source title normalize build")
+
+
+def artifact_root():
+    return getattr(settings, "REPORT_ARTIFACT_ROOT", os.path.join(settings.MEDIA_ROOT, "reports"))
+
+
+def artifact_file(job):
+    """Absolute path of a job's artifact, or None before it has one"""
+    return os.path.join(artifact_root(), job.artifact_path) if job.artifact_path else None
+
+
+def download_name(job):
+    return f"{job.report_type}_{job.pk}.{job.file_format}"
+
+
+# ============================================================================
+# DATA VERSIONS
+# ============================================================================
+
+def current_data_version(source: str) -> int:
+    return ReportDataVersion.objects.filter(source=source).values_list("version", flat=True).first() or 0
+
+
+def bump_data_version(source: str):
+    if ReportDataVersion.objects.filter(source=source).update(version=F("version") + 1, updated_at=timezone.now()):
+        return
+    try:
+        with transaction.atomic():
+            ReportDataVersion.objects.create(source=source, version=1)
+    except IntegrityError:
+        # Another process created the row first
+        ReportDataVersion.objects.filter(source=source).update(version=F("version") + 1, updated_at=timezone.now())
+
+
+def mark_data_changed(source: str):
+    """Bump the source's version once the current transaction commits (immediately in autocommit)"""
+    transaction.on_commit(lambda: bump_data_version(source))
+
+
+# ============================================================================
+# PARAMS
+# ============================================================================
+
+def _date_param(params, key, default=None):
+    value = params.get(key) or default
+    if value is None or isinstance(value, date):
+        return value.isoformat() if value else None
+    try:
+        return datetime.strptime(str(value).strip(), "%Y-%m-%d").date().isoformat()
+    except ValueError:
+        raise ValueError(f"{key} must be a date in YYYY-MM-DD format")
+
+
+def _int_param(params, key, default):
+    try:
+        return int(params.get(key, default))
+    except (TypeError, ValueError):
+        raise ValueError(f"{key} must be an integer")
+
+
+def _bool_param(params, key):
+    value = params.get(key, False)
+    if isinstance(value, str):
+        return value.strip().lower() in ("1", "true", "yes")
+    return bool(value)
+
+
+def _cell(value):
+    """CSV/XLSX-safe cell: nested lists/dicts are written as JSON text"""
+    if isinstance(value, (list, dict)):
+        return json.dumps(value, cls=DjangoJSONEncoder)
+    return value
+
+
+# ============================================================================
+# REPORTS
+# ============================================================================
+
+def _trial_balance_params(params):
+    return {
+        "date_from": _date_param(params, "date_from"),
+        "date_to": _date_param(params, "date_to"),
+        "segment_type": str(params["segment_type"]) if params.get("segment_type") else None,
+    }
+
+
+def _trial_balance(p):
+    rows = list(build_trial_balance(p["date_from"], p["date_to"], segment_type=p["segment_type"]))
+    header = ["Account Code", "Account Name", "Debit", "Credit"]
+    if p["segment_type"]:
+        header.insert(2, "Segment")
+
+    def table():
+        for r in rows:
+            line = [r.get("code", ""), r.get("name", ""), r.get("debit", 0), r.get("credit", 0)]
+            if p["segment_type"]:
+                line.insert(2, r.get("segment") or "")
+            yield line
+    return ReportOutput(header, table(), rows)
+
+
+def _journal_lines_params(params):
+    return {
+        "date_from": _date_param(params, "date_from"),
+        "date_to": _date_param(params, "date_to"),
+        "posted_only": _bool_param(params, "posted_only"),
+    }
+
+
+def _journal_lines(p):
+    lines = JournalLine.objects.all()
+    if p["date_from"]:
+        lines = lines.filter(entry__date__gte=p["date_from"])
+    if p["date_to"]:
+        lines = lines.filter(entry__date__lte=p["date_to"])
+    if p["posted_only"]:
+        lines = lines.filter(entry__posted=True)
+    lines = lines.order_by("entry__date", "entry_id", "id").values_list(
+        "entry_id", "entry__date", "entry__currency__code", "entry__memo", "entry__posted",
+        "account__code", "account__alias", "debit", "credit",
+    )
+    header = ["Journal ID", "Date", "Currency", "Memo", "Posted", "Account Code", "Account Name", "Debit", "Credit"]
+
+    def table():
+        for entry_id, entry_date, currency, memo, posted, code, alias, debit, credit in \
+                lines.iterator(chunk_size=EXPORT_CHUNK_SIZE):
+            yield [entry_id, entry_date, currency or "", memo, "Yes" if posted else "No",
+                   code, alias or code, debit, credit]
+    return ReportOutput(header, table(), None)
+
+
+def _aging_params(params):
+    return {
+        "as_of": _date_param(params, "as_of", date.today()),
+        "b1": _int_param(params, "b1", 30),
+        "b2": _int_param(params, "b2", 30),
+        "b3": _int_param(params, "b3", 30),
+        "open_only": _bool_param(params, "open_only"),
+    }
+
+
+def _aging(build, party_field, party_label):
+    def run(p):
+        as_of = datetime.strptime(p["as_of"], "%Y-%m-%d").date()
+        data = build(as_of, p["b1"], p["b2"], p["b3"], open_only=p["open_only"])
+        header = ["Invoice ID", "Number", party_label, "Date", "Due Date", "Days Overdue", "Bucket", "Balance"]
+
+        def table():
+            for r in data["invoices"]:
+                yield [r["invoice_id"], r["number"], r[party_field], r["date"], r["due_date"],
+                       r["days_overdue"], r["bucket"], r["balance"]]
+            yield []
+            yield ["Summary"]
+            for k in data["buckets"]:
+                yield [k, "", "", "", "", "", "", data["summary"][k]]
+            yield ["TOTAL", "", "", "", "", "", "", data["summary"]["TOTAL"]]
+        return ReportOutput(header, table(), data)
+    return run
+
+
+def _procurement_params(params):
+    end = _date_param(params, "end_date", date.today())
+    start = _date_param(params, "start_date",
+                        datetime.strptime(end, "%Y-%m-%d").date() - timedelta(days=30))
+    p = {"start_date": start, "end_date": end}
+    if "group_by" in params:
+        p["group_by"] = str(params["group_by"])
+    return p
+
+
+def _procurement(method, table_key=None, **defaults):
+    """Report over a ProcurementAnalytics metric; table_key picks the list exported as rows"""
+    def run(p):
+        from procurement.reports.analytics import ProcurementAnalytics
+
+        analytics = ProcurementAnalytics(
+            datetime.strptime(p["start_date"], "%Y-%m-%d").date(),
+            datetime.strptime(p["end_date"], "%Y-%m-%d").date(),
+        )
+        kwargs = {k: p.get(k, v) for k, v in defaults.items()}
+        data = getattr(analytics, method)(**kwargs)
+        records = (data.get(table_key) or []) if table_key else [data]
+        header = list(dict.fromkeys(k for r in records for k in r))
+        rows = ([_cell(r.get(k)) for k in header] for r in records)
+        return ReportOutput(header, rows, data)
+    return run
+
+
+REPORTS = {
+    "trial_balance": _Report(LEDGER, "Trial Balance", _trial_balance_params, _trial_balance),
+    "journal_lines": _Report(LEDGER, "Journal Entries", _journal_lines_params, _journal_lines),
+    "ar_aging": _Report(LEDGER, "AR Aging", _aging_params, _aging(build_ar_aging, "customer", "Customer")),
+    "ap_aging": _Report(LEDGER, "AP Aging", _aging_params, _aging(build_ap_aging, "supplier", "Supplier")),
+    "po_cycle_time": _Report(PROCUREMENT, "PO Cycle Time", _procurement_params,
+                             _procurement("get_po_cycle_time_metrics")),
+    "on_time_delivery": _Report(PROCUREMENT, "On-Time Delivery", _procurement_params,
+                                _procurement("get_on_time_delivery_metrics", "by_supplier")),
+    "price_variance": _Report(PROCUREMENT, "Price Variance", _procurement_params,
+                              _procurement("get_price_variance_metrics", "top_variances")),
+    "spend_analysis": _Report(PROCUREMENT, "Spend Analysis", _procurement_params,
+                              _procurement("get_spend_analysis", "breakdown", group_by="supplier")),
+    "procurement_exceptions": _Report(PROCUREMENT, "Exceptions", _procurement_params,
+                                      _procurement("get_exceptions_and_blocked_invoices", "top_blocking_exceptions")),
+}
+
+
+def report_types():
+    return [{"report_type": name, "title": r.title, "source": r.source} for name, r in REPORTS.items()]
+
+
+# ============================================================================
+# QUEUE
+# ============================================================================
+
+def _params_hash(report_type, file_format, params):
+    payload = json.dumps({"report_type": report_type, "format": file_format, "params": params}, sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def submit_report_job(report_type: str, file_format: str = "csv", params=None, requested_by: str = ""):
+    """
+    Queue a report, or reuse an equivalent job built from the current data.
+    Returns (job, created); raises ValueError for unknown types, formats or bad params.
+    """
+    report = REPORTS.get(report_type)
+    if report is None:
+        raise ValueError(f"Unknown report type '{report_type}'")
+    file_format = (file_format or "csv").lower()
+    if file_format not in FILE_FORMATS:
+        raise ValueError(f"Unknown format '{file_format}' (expected csv, xlsx or json)")
+    if file_format == "xlsx" and not OPENPYXL_OK:
+        raise ValueError("openpyxl not installed")
+
+    params = report.normalize(params or {})
+    params_hash = _params_hash(report_type, file_format, params)
+    version = current_data_version(report.source)
+    existing = (
+        ReportJob.objects.filter(params_hash=params_hash, data_version=version,
+                                 status__in=[ReportJob.QUEUED, ReportJob.RUNNING, ReportJob.SUCCEEDED])
+        .order_by("-created_at").first()
+    )
+    if existing and (existing.status != ReportJob.SUCCEEDED or os.path.exists(artifact_file(existing))):
+        return existing, False
+
+    job = ReportJob.objects.create(
+        report_type=report_type, file_format=file_format, params=params, params_hash=params_hash,
+        data_version=version, requested_by=requested_by,
+    )
+    return job, True
+
+
+def claim_jobs(limit: int):
+    """Move up to `limit` of the oldest queued jobs to RUNNING; returns the ids this caller claimed"""
+    ids = list(ReportJob.objects.filter(status=ReportJob.QUEUED).order_by("created_at", "pk")
+               .values_list("pk", flat=True)[:limit])
+    claimed = []
+    for pk in ids:
+        # Conditional update: only one worker wins a job
+        if ReportJob.objects.filter(pk=pk, status=ReportJob.QUEUED).update(
+                status=ReportJob.RUNNING, started_at=timezone.now()):
+            claimed.append(pk)
+    return claimed
+
+
+def fail_report_job(job_id, error):
+    ReportJob.objects.filter(pk=job_id).update(status=ReportJob.FAILED, error=str(error), finished_at=timezone.now())
+
+
+def _write_artifact(path, job, report, output):
+    if job.file_format == "csv":
+        with open(path, "w", newline="", encoding="utf-8") as f:
+            return write_csv(f, ([_cell(v) for v in row] for row in output.rows), output.header)
+    if job.file_format == "xlsx":
+        return write_xlsx(path, ([_cell(v) for v in row] for row in output.rows), output.header, report.title)
+
+    # Written member by member so the rows stream straight to disk
+    encoder = DjangoJSONEncoder()
+    meta = {"report_type": job.report_type, "params": job.params, "generated_at": timezone.now()}
+    with open(path, "w", encoding="utf-8") as f:
+        f.write("{")
+        for key, value in meta.items():
+            f.write(f"{encoder.encode(key)}: ")
+            f.writelines(encoder.iterencode(value))
+            f.write(", ")
+        f.write('"data": ')
+        if output.data is not None:
+            f.writelines(encoder.iterencode(output.data))
+            count = len(output.data) if isinstance(output.data, list) else None
+        else:
+            f.write("[")
+            count = 0
+            for row in output.rows:
+                f.write(", " if count else "")
+                f.writelines(encoder.iterencode(dict(zip(output.header, row))))
+                count += 1
+            f.write("]")
+        f.write("}")
+    return count
+
+
+def run_report_job(job_id) -> str:
+    """Build a claimed job's artifact and record the outcome; returns the final status"""
+    job = ReportJob.objects.get(pk=job_id)
+    report = REPORTS.get(job.report_type)
+    if report is None:
+        fail_report_job(job_id, f"Unknown report type '{job.report_type}'")
+        return ReportJob.FAILED
+
+    # Read before building: any change made while the report runs bumps past it
+    version = current_data_version(report.source)
+    relative = os.path.join(job.report_type, f"{job.pk}.{job.file_format}")
+    path = os.path.join(artifact_root(), relative)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    partial = f"{path}.part"
+    try:
+        count = _write_artifact(partial, job, report, report.build(job.params))
+        os.replace(partial, path)
+    except Exception as e:
+        logger.exception(f"Report job {job_id} ({job.report_type}) failed")
+        if os.path.exists(partial):
+            os.remove(partial)
+        ReportJob.objects.filter(pk=job_id).update(
+            status=ReportJob.FAILED, error=str(e), data_version=version, finished_at=timezone.now()
+        )
+        return ReportJob.FAILED
+
+    ReportJob.objects.filter(pk=job_id).update(
+        status=ReportJob.SUCCEEDED, artifact_path=relative, row_count=count, error="",
+        data_version=version, finished_at=timezone.now(),
+    )
+    return ReportJob.SUCCEEDED
+
+
+def requeue_stale_jobs(older_than: timedelta) -> int:
+    """Put RUNNING jobs started longer ago than `older_than` (dead workers) back in the queue"""
+    return ReportJob.objects.filter(status=ReportJob.RUNNING, started_at__lt=timezone.now() - older_than) \
+        .update(status=ReportJob.QUEUED, started_at=None)
+
+
+def purge_report_jobs(older_than: timedelta) -> int:
+    """Delete finished jobs and their artifacts older than `older_than`; returns the number deleted"""
+    jobs = ReportJob.objects.filter(status__in=[ReportJob.SUCCEEDED, ReportJob.FAILED],
+                                    finished_at__lt=timezone.now() - older_than)
+    for job in jobs.iterator():
+        path = artifact_file(job)
+        if path and os.path.exists(path):
+            os.remove(path)
+    deleted, _ = jobs.delete()
+    return deleted
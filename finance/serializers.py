@@ -1,12 +1,12 @@
 
 from decimal import Decimal
 from rest_framework import serializers
-from .models import JournalEntry, JournalLine, JournalLineSegment, BankAccount
+from .models import JournalEntry, JournalLine, JournalLineSegment, BankAccount, ReportJob
 from segment.models import XX_Segment, XX_SegmentType
 from ar.models import ARInvoice, ARItem, ARPayment, ARPaymentAllocation, InvoiceGLLine
 from ap.models import APInvoice, APItem, APPayment, APPaymentAllocation, APInvoiceGLLine
 from core.models import Currency, TaxRate
-from .services import ar_totals, ap_totals
+from .services import ar_totals, ap_totals, annotated_totals
 from django.core.exceptions import ValidationError as DjangoValidationError
 
 class CurrencySerializer(serializers.ModelSerializer):
@@ -335,7 +335,8 @@ class ARInvoiceSerializer(serializers.ModelSerializer):
     def _get_cached_totals(self, obj):
         """Cache totals calculation to avoid multiple database queries"""
         if not hasattr(obj, '_cached_totals'):
-            obj._cached_totals = ar_totals(obj)
+            # List views annotate paid amounts; detail views compute them per invoice
+            obj._cached_totals = annotated_totals(obj) or ar_totals(obj)
         return obj._cached_totals
     
     def get_totals(self, obj): 
@@ -915,7 +916,8 @@ class APInvoiceSerializer(serializers.ModelSerializer):
     def _get_cached_totals(self, obj):
         """Cache totals calculation to avoid multiple database queries"""
         if not hasattr(obj, '_cached_totals'):
-            obj._cached_totals = ap_totals(obj)
+            # List views annotate paid amounts; detail views compute them per invoice
+            obj._cached_totals = annotated_totals(obj) or ap_totals(obj)
         return obj._cached_totals
     
     def get_totals(self, obj): 
@@ -1234,6 +1236,29 @@ class CorpTaxAccrualRequestSerializer(serializers.Serializer):
     date_to = serializers.DateField()
 
 
+class ReportJobSerializer(serializers.ModelSerializer):
+    download_url = serializers.SerializerMethodField()
+
+    class Meta:
+        model = ReportJob
+        fields = ["id", "report_type", "file_format", "params", "status", "data_version", "row_count", "error",
+                  "requested_by", "created_at", "started_at", "finished_at", "download_url"]
+        read_only_fields = fields
+
+    def get_download_url(self, obj):
+        if obj.status != ReportJob.SUCCEEDED:
+            return None
+        path = f"/api/reports/jobs/{obj.pk}/download/"
+        request = self.context.get("request")
+        return request.build_absolute_uri(path) if request else path
+
+
+class ReportJobRequestSerializer(serializers.Serializer):
+    report_type = serializers.CharField()
+    file_format = serializers.ChoiceField(choices=ReportJob.FORMAT_CHOICES, default="csv")
+    params = serializers.DictField(required=False, default=dict)
+
+
 # ============================================================================
 # REMOVED: Legacy Invoice Serializers
 # ============================================================================
@@ -2,15 +2,20 @@
 from decimal import Decimal, ROUND_HALF_UP
 from django.db import transaction
 from django.conf import settings
-from django.db.models import Sum, F, Q
+from django.db.models import (
+    Sum, F, Q, Max, FilteredRelation, Case, When, Value, CharField, DecimalField,
+    ExpressionWrapper, OuterRef, Subquery,
+)
+from django.db.models.functions import Coalesce
 from .models import JournalEntry, JournalLine, BankAccount,CorporateTaxRule,CorporateTaxFiling
+from .balance_services import apply_entry_to_balances, grouped_totals
 from segment.models import XX_Segment
 from segment.utils import SegmentHelper
 from ar.models import ARInvoice, ARPayment
 from ap.models import APInvoice, APPayment
 from django.utils import timezone
 from django.db import transaction
-from datetime import datetime, date
+from datetime import datetime, date, timedelta
 from decimal import Decimal
 from core.models import TaxRate
 from django.core.exceptions import ValidationError
@@ -24,126 +29,313 @@ def get_account_by_code(code: str) -> XX_Segment:
     return SegmentHelper.get_account_by_code(code)
 
 
-def build_trial_balance(date_from=None, date_to=None):
+def _resolve_segment_type_id(segment_type):
+    """Accept an XX_SegmentType, its primary key or its segment_name."""
+    from segment.models import XX_SegmentType
+    if isinstance(segment_type, XX_SegmentType):
+        return segment_type.segment_id
+    if isinstance(segment_type, int) or str(segment_type).isdigit():
+        return int(segment_type)
+    return SegmentHelper.get_segment_type(segment_type).segment_id
+
+
+def build_trial_balance(date_from=None, date_to=None, segment_type=None):
     """
     Returns list of dicts: [{code, name, debit, credit}], with final TOTAL row.
     Filters by JournalEntry.date in [date_from, date_to], posted only.
+
+    Debits and credits are grouped and summed by the database, so memory use
+    depends on the number of accounts, not the number of journal lines.
+    Closed periods are read from AccountPeriodBalance (see balance_services).
+    If segment_type is given (name, id or XX_SegmentType), rows are further
+    split by that JournalLineSegment dimension and carry a "segment" key
+    (None for lines without an assignment of that type).
     """
-    qs = JournalLine.objects.select_related("entry", "account").filter(entry__posted=True)
+    if segment_type is None:
+        merged = {}
+        for (code, alias), (debit, credit) in grouped_totals(["account__code", "account__alias"], date_from, date_to).items():
+            m = merged.setdefault(code, {"alias": None, "debit": Decimal("0"), "credit": Decimal("0")})
+            if alias and (m["alias"] is None or alias > m["alias"]):
+                m["alias"] = alias
+            m["debit"] += debit
+            m["credit"] += credit
+        grouped = [
+            {"account__code": code, "alias": m["alias"], "debit": m["debit"], "credit": m["credit"]}
+            for code, m in sorted(merged.items())
+        ]
+        return _trial_balance_rows(grouped)
+
+    qs = JournalLine.objects.filter(entry__posted=True)
     if date_from:
         qs = qs.filter(entry__date__gte=date_from)
     if date_to:
         qs = qs.filter(entry__date__lte=date_to)
 
-    rows = {}
-    for jl in qs:
-        code = jl.account.code
-        if code not in rows:
-            rows[code] = {"code": code, "name": jl.account.name, "debit": Decimal("0.00"), "credit": Decimal("0.00")}
-        rows[code]["debit"] += Decimal(jl.debit or 0)
-        rows[code]["credit"] += Decimal(jl.credit or 0)
+    qs = qs.annotate(dimension=FilteredRelation(
+        "segments",
+        condition=Q(segments__segment_type_id=_resolve_segment_type_id(segment_type)),
+    ))
+    group_by = ["account__code", "dimension__segment__code"]
+    grouped = (
+        qs.values(*group_by)
+        .annotate(alias=Max("account__alias"), debit=Sum("debit"), credit=Sum("credit"))
+        .order_by(*group_by)
+    )
+    return _trial_balance_rows(grouped, with_segment=True)
 
+
+def _trial_balance_rows(grouped, with_segment=False):
     data = []
     total_debit = Decimal("0.00")
     total_credit = Decimal("0.00")
-    for code in sorted(rows):
-        r = rows[code]
-        r["debit"] = q2(r["debit"])
-        r["credit"] = q2(r["credit"])
+    for g in grouped:
+        code = g["account__code"]
+        r = {
+            "code": code,
+            "name": g["alias"] or code,
+            "debit": q2(g["debit"] or 0),
+            "credit": q2(g["credit"] or 0),
+        }
+        if with_segment:
+            r["segment"] = g["dimension__segment__code"]
         total_debit += r["debit"]
         total_credit += r["credit"]
         data.append(r)
 
-    data.append({"code": "TOTAL", "name": "", "debit": q2(total_debit), "credit": q2(total_credit)})
+    total = {"code": "TOTAL", "name": "", "debit": q2(total_debit), "credit": q2(total_credit)}
+    if with_segment:
+        total["segment"] = None
+    data.append(total)
     return data
 
 
-def _aging_bucket(days_overdue, b1=30, b2=30, b3=30):
-    if days_overdue <= 0:
-        return "Current"
-    if 1 <= days_overdue <= b1:
-        return f"1–{b1}"
-    if b1 < days_overdue <= b1 + b2:
-        return f"{b1+1}–{b1+b2}"
-    if b1 + b2 < days_overdue <= b1 + b2 + b3:
-        return f"{b1+b2+1}–{b1+b2+b3}"
-    return f">{b1+b2+b3}"
+def build_segment_rollup(segment_type, root=None, date_from=None, date_to=None):
+    """
+    Posted debit/credit per segment of a type, each including all of its
+    descendants: [{id, code, name, parent_code, debit, credit, balance}].
+    With root (a segment id) only the subtree under it is returned.
+
+    Lines are joined to the segment closure table and grouped by ancestor,
+    so all subtree totals come from one grouped query. Account segments go
+    through grouped_totals (closed periods are read from AccountPeriodBalance);
+    other segment types through the lines' JournalLineSegment rows.
+    """
+    type_id = _resolve_segment_type_id(segment_type)
+    nodes = XX_Segment.objects.filter(segment_type_id=type_id)
+    if root is not None:
+        nodes = nodes.filter(ancestor_links__ancestor_id=root)
+    nodes = list(nodes.order_by("level", "code").values_list("id", "code", "alias", "parent_code"))
+
+    try:
+        is_account = SegmentHelper.get_segment_type("Account").segment_id == type_id
+    except ValueError:
+        is_account = False
+    if is_account:
+        totals = grouped_totals(["account__ancestor_links__ancestor_id"], date_from, date_to)
+    else:
+        lines = JournalLine.objects.filter(entry__posted=True, segments__segment_type_id=type_id)
+        if date_from:
+            lines = lines.filter(entry__date__gte=date_from)
+        if date_to:
+            lines = lines.filter(entry__date__lte=date_to)
+        group = "segments__segment__ancestor_links__ancestor_id"
+        totals = {
+            (g[group],): (g["dr"] or Decimal("0"), g["cr"] or Decimal("0"))
+            for g in lines.values(group).annotate(dr=Sum("debit"), cr=Sum("credit")).order_by()
+        }
 
+    rows = []
+    for pk, code, alias, parent_code in nodes:
+        debit, credit = totals.get((pk,), (Decimal("0"), Decimal("0")))
+        rows.append({
+            "id": pk,
+            "code": code,
+            "name": alias or code,
+            "parent_code": parent_code,
+            "debit": q2(debit),
+            "credit": q2(credit),
+            "balance": q2(debit - credit),
+        })
+    return rows
 
-def _ar_balance(inv: ARInvoice):
-    t = ar_totals(inv)
-    return q2(t["balance"])
 
-def _ap_balance(inv: APInvoice):
-    t = ap_totals(inv)
-    return q2(t["balance"])
+def _aging_labels(b1=30, b2=30, b3=30):
+    return ["Current", f"1–{b1}", f"{b1+1}–{b1+b2}", f"{b1+b2+1}–{b1+b2+b3}", f">{b1+b2+b3}"]
 
 
+def _aging_bucket_expr(as_of, b1=30, b2=30, b3=30):
+    """
+    SQL CASE assigning each invoice its bucket label from due_date.
+    days_overdue = as_of - due_date, so "1–b1" means due_date in [as_of-b1, as_of-1].
+    """
+    labels = _aging_labels(b1, b2, b3)
+    return Case(
+        When(due_date__gte=as_of, then=Value(labels[0])),
+        When(due_date__gte=as_of - timedelta(days=b1), then=Value(labels[1])),
+        When(due_date__gte=as_of - timedelta(days=b1 + b2), then=Value(labels[2])),
+        When(due_date__gte=as_of - timedelta(days=b1 + b2 + b3), then=Value(labels[3])),
+        default=Value(labels[4]),
+        output_field=CharField(),
+    )
 
 
-def build_ar_aging(as_of=None, b1=30, b2=30, b3=30):
+def invoice_total_expression(model):
     """
-    Returns dict:
-      {
-        "as_of": ISO, "buckets": ["Current","1–30","31–60","61–90",">90"],
-        "invoices": [... per invoice ...],
-        "summary": {"Current": ..., "1–30": ..., ... , "TOTAL": ...}
-      }
+    Stored invoice total, or for invoices saved before totals were stored the
+    sum of their items with the calculate_and_save_totals formula.
     """
-    as_of = as_of or timezone.now().date()
-    buckets = ["Current", f"1–{b1}", f"{b1+1}–{b1+b2}", f"{b1+b2+1}–{b1+b2+b3}", f">{b1+b2+b3}"]
-    rows = []
-    sums = {k: Decimal("0.00") for k in buckets}
-    total = Decimal("0.00")
+    money = DecimalField(max_digits=24, decimal_places=6)
+    item_model = model.items.rel.related_model
+    items_total = (
+        item_model.objects.filter(invoice=OuterRef("pk"))
+        .values("invoice")
+        .annotate(s=Sum(
+            F("quantity") * F("unit_price") * (1 + Coalesce("tax_rate__rate", Value(Decimal("0"))) / 100),
+            output_field=money,
+        ))
+        .values("s")
+    )
+    return Coalesce("total", Subquery(items_total, output_field=money), Value(Decimal("0")), output_field=money)
 
-    for inv in ARInvoice.objects.select_related("customer").all():
-        bal = _ar_balance(inv)
-        if bal <= 0:
-            continue
-        days = (as_of - inv.due_date).days if inv.due_date else 0
-        bucket = _aging_bucket(days, b1, b2, b3)
-        row = {
-            "invoice_id": inv.id,
-            "number": inv.number,
-            "customer": getattr(inv.customer, "name", ""),
-            "date": inv.date.isoformat() if inv.date else None,
-            "due_date": inv.due_date.isoformat() if inv.due_date else None,
-            "days_overdue": max(days, 0),
-            "balance": float(bal),
-            "bucket": bucket,
-        }
-        rows.append(row)
-        sums[bucket] += bal
-        total += bal
 
-    summary = {k: float(q2(v)) for k, v in sums.items()}
-    summary["TOTAL"] = float(q2(total))
-    return {"as_of": as_of.isoformat(), "buckets": buckets, "invoices": rows, "summary": summary}
+def annotate_open_balances(qs):
+    """
+    Annotate an AR/AP invoice queryset with open_total, paid_total and open_balance.
+
+    open_total is the stored invoice total (see calculate_and_save_totals);
+    invoices saved before totals were stored fall back to summing their items
+    with the same formula. paid_total sums the payment allocations converted
+    to the invoice currency with the allocation's current_exchange_rate;
+    allocations without one are corrected by _unrated_fx_adjustments.
+    """
+    model = qs.model
+    money = DecimalField(max_digits=24, decimal_places=6)
+    alloc_model = model.payment_allocations.rel.related_model
+
+    converted = Case(
+        When(
+            Q(current_exchange_rate__gt=0) & ~Q(payment__currency_id=F("invoice__currency_id")),
+            then=F("amount") / F("current_exchange_rate"),
+        ),
+        default=F("amount"),
+        output_field=money,
+    )
+    paid = (
+        alloc_model.objects.filter(invoice=OuterRef("pk"))
+        .values("invoice")
+        .annotate(s=Sum(converted))
+        .values("s")
+    )
+
+    zero = Value(Decimal("0"), output_field=money)
+    return qs.annotate(
+        open_total=invoice_total_expression(model),
+        paid_total=Coalesce(Subquery(paid, output_field=money), zero, output_field=money),
+    ).annotate(
+        open_balance=ExpressionWrapper(F("open_total") - F("paid_total"), output_field=money),
+    )
+
+
+def _open_balance_queryset(model, as_of, b1=30, b2=30, b3=30, open_only=False):
+    """Annotate AR/AP invoices with total, paid, balance and aging bucket in one query"""
+    qs = model.objects.all()
+    if open_only:
+        qs = qs.filter(is_cancelled=False).exclude(payment_status=model.PAID)
+    return annotate_open_balances(qs).annotate(bucket=_aging_bucket_expr(as_of, b1, b2, b3))
+
+
+def apply_unrated_fx_adjustments(invoices):
+    """
+    Correct paid_total/open_balance of invoices loaded through
+    annotate_open_balances for allocations without a stored exchange rate.
+    One query for the whole list.
+    """
+    if not invoices:
+        return invoices
+    adjustments = _unrated_fx_adjustments(type(invoices[0]), [inv.pk for inv in invoices])
+    for inv in invoices:
+        adjustment = adjustments.get(inv.pk)
+        if adjustment:
+            inv.paid_total += adjustment
+            inv.open_balance -= adjustment
+    return invoices
+
+
+def annotated_totals(invoice):
+    """
+    ar_totals/ap_totals-shaped totals from stored columns and the
+    annotate_open_balances annotations, without further queries. None when
+    the invoice was not annotated or has no stored totals.
+    """
+    if getattr(invoice, "paid_total", None) is None or invoice.total is None:
+        return None
+    subtotal = invoice.subtotal if invoice.subtotal is not None else invoice.total - (invoice.tax_amount or 0)
+    return {
+        "subtotal": q2(subtotal),
+        "tax": q2(invoice.tax_amount or Decimal("0")),
+        "total": q2(invoice.total),
+        "paid": q2(invoice.paid_total),
+        "balance": q2(invoice.total - q2(invoice.paid_total)),
+    }
+
+
+def _unrated_fx_adjustments(model, invoices):
+    """
+    Allocations paid in another currency without a stored exchange rate are
+    counted at face value by the aging query. Convert them with the rate on
+    the payment date and return {invoice_id: paid correction}.
+    """
+    from finance.fx_services import get_exchange_rate
+    alloc_model = model.payment_allocations.rel.related_model
+    allocs = (
+        alloc_model.objects.filter(invoice__in=invoices, payment__currency__isnull=False)
+        .exclude(payment__currency_id=F("invoice__currency_id"))
+        .filter(Q(current_exchange_rate__isnull=True) | Q(current_exchange_rate=0))
+        .select_related("payment__currency", "invoice__currency")
+    )
+    adjustments = {}
+    for alloc in allocs:
+        try:
+            rate = get_exchange_rate(
+                from_currency=alloc.payment.currency,
+                to_currency=alloc.invoice.currency,
+                rate_date=alloc.payment.date,
+                rate_type="SPOT",
+            )
+        except Exception:
+            continue  # keep the face amount if no rate is available
+        adjustments[alloc.invoice_id] = adjustments.get(alloc.invoice_id, Decimal("0")) + alloc.amount * rate - alloc.amount
+    return adjustments
+
 
-def build_ap_aging(as_of=None, b1=30, b2=30, b3=30):
+def _build_aging(model, party_field, as_of=None, b1=30, b2=30, b3=30, open_only=False):
     as_of = as_of or timezone.now().date()
-    buckets = ["Current", f"1–{b1}", f"{b1+1}–{b1+b2}", f"{b1+b2+1}–{b1+b2+b3}", f">{b1+b2+b3}"]
-    rows = []
+    buckets = _aging_labels(b1, b2, b3)
     sums = {k: Decimal("0.00") for k in buckets}
     total = Decimal("0.00")
 
-    for inv in APInvoice.objects.select_related("supplier").all():
-        bal = _ap_balance(inv)
+    qs = _open_balance_queryset(model, as_of, b1, b2, b3, open_only)
+    adjustments = _unrated_fx_adjustments(model, qs.values("pk"))
+    qs = qs.filter(Q(open_balance__gt=0) | Q(pk__in=list(adjustments)))
+
+    rows = []
+    fields = ("id", "number", f"{party_field}__name", "date", "due_date", "open_balance", "bucket")
+    for inv_id, number, party, inv_date, due_date, balance, bucket in \
+            qs.order_by("id").values_list(*fields).iterator(chunk_size=2000):
+        bal = q2(balance - adjustments.get(inv_id, Decimal("0")))
         if bal <= 0:
             continue
-        days = (as_of - inv.due_date).days if inv.due_date else 0
-        bucket = _aging_bucket(days, b1, b2, b3)
-        row = {
-            "invoice_id": inv.id,
-            "number": inv.number,
-            "supplier": getattr(inv.supplier, "name", ""),
-            "date": inv.date.isoformat() if inv.date else None,
-            "due_date": inv.due_date.isoformat() if inv.due_date else None,
+        days = (as_of - due_date).days if due_date else 0
+        rows.append({
+            "invoice_id": inv_id,
+            "number": number,
+            party_field: party or "",
+            "date": inv_date.isoformat() if inv_date else None,
+            "due_date": due_date.isoformat() if due_date else None,
             "days_overdue": max(days, 0),
             "balance": float(bal),
             "bucket": bucket,
-        }
-        rows.append(row)
+        })
         sums[bucket] += bal
         total += bal
 
@@ -152,6 +344,23 @@ def build_ap_aging(as_of=None, b1=30, b2=30, b3=30):
     return {"as_of": as_of.isoformat(), "buckets": buckets, "invoices": rows, "summary": summary}
 
 
+def build_ar_aging(as_of=None, b1=30, b2=30, b3=30, open_only=False):
+    """
+    Returns dict:
+      {
+        "as_of": ISO, "buckets": ["Current","1–30","31–60","61–90",">90"],
+        "invoices": [... per invoice ...],
+        "summary": {"Current": ..., "1–30": ..., ... , "TOTAL": ...}
+      }
+    Balances come from stored invoice totals minus allocations, bucketed in SQL.
+    open_only skips cancelled and fully PAID invoices before balances are computed.
+    """
+    return _build_aging(ARInvoice, "customer", as_of, b1, b2, b3, open_only)
+
+def build_ap_aging(as_of=None, b1=30, b2=30, b3=30, open_only=False):
+    return _build_aging(APInvoice, "supplier", as_of, b1, b2, b3, open_only)
+
+
 def _bank_account_to_gl_account(payment_bank: BankAccount | None) -> XX_Segment:
     """
     If BankAccount has a mapped GL code, use it, else fall back to FINANCE_ACCOUNTS['BANK'].
@@ -254,7 +463,10 @@ def post_entry(entry: JournalEntry):
     tc = sum((l.credit for l in entry.lines.all()), start=Decimal("0"))
     if q2(td) != q2(tc):
         raise ValueError("Unbalanced journal")
-    entry.posted = True; entry.save(update_fields=["posted"]); return entry
+    with transaction.atomic():
+        entry.posted = True; entry.save(update_fields=["posted"])
+        apply_entry_to_balances(entry)
+    return entry
 
 
 DEFAULT_ACCOUNTS = {
@@ -406,6 +618,7 @@ def gl_post_from_ar_balanced(invoice: ARInvoice):
     # Mark as posted
     je.posted = True
     je.save()
+    apply_entry_to_balances(je)
 
     # mark invoice posted
     inv.gl_journal = je
@@ -526,6 +739,7 @@ def gl_post_from_ap_balanced(invoice: APInvoice):
     # Mark as posted
     je.posted = True
     je.save()
+    apply_entry_to_balances(je)
 
     inv.gl_journal = je
     inv.posted_at = timezone.now()
@@ -540,6 +754,77 @@ def gl_post_from_ap_balanced(invoice: APInvoice):
 
     logger.info(f"Successfully posted AP Invoice {inv.number} to GL (JE #{je.id})")
     return je, True
+
+
+def _allocation_posting_totals(payment, base_currency, payment_currency):
+    """
+    (invoice-side reduction, cash, FX impact) of a multi-allocation payment
+    in base currency. Allocations and their invoices are read in one query
+    and each exchange rate is looked up once; every allocation is still
+    converted and rounded on its own, as convert_amount does.
+    """
+    from finance.fx_services import get_exchange_rate
+
+    rates = {}
+
+    def to_base(amount, currency):
+        if currency.id not in rates:
+            rates[currency.id] = get_exchange_rate(currency, base_currency, payment.date)
+        return (amount * rates[currency.id]).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+    # Rate when the payment was made
+    if payment.invoice_currency_id and payment.exchange_rate and payment.currency_id \
+            and payment.invoice_currency_id != payment.currency_id:
+        payment_rate = payment.exchange_rate
+    else:
+        payment_rate = Decimal('1.0')
+    foreign_payment = payment_currency.id != base_currency.id
+
+    total_reduction = total_cash = total_fx_impact = Decimal("0")
+    for allocation in payment.allocations.select_related('invoice__currency'):
+        invoice = allocation.invoice
+        amount = allocation.amount
+        # Rate when the invoice was posted
+        invoice_rate = invoice.exchange_rate or Decimal('1.0')
+
+        if invoice.currency.id != base_currency.id:
+            total_reduction += to_base(amount / invoice_rate, invoice.currency)
+        else:
+            total_reduction += amount
+        total_cash += to_base(amount, payment_currency) if foreign_payment else amount
+
+        if invoice_rate != payment_rate:
+            fx_diff = amount / payment_rate * (payment_rate - invoice_rate)
+            total_fx_impact += to_base(fx_diff, payment_currency) if foreign_payment else fx_diff
+    return total_reduction, total_cash, total_fx_impact
+
+
+def _update_allocated_invoice_status(payment, totals_fn):
+    """
+    Mark the invoices a payment is allocated to PAID or PARTIALLY_PAID from
+    their balances, read in one query. Returns the numbers of closed invoices.
+    """
+    invoice_model = payment.allocations.model.invoice.field.related_model
+    invoices = apply_unrated_fx_adjustments(list(
+        annotate_open_balances(invoice_model.objects.filter(payment_allocations__payment=payment))
+    ))
+    now = timezone.now()
+    closed, changed = [], []
+    for invoice in invoices:
+        totals = annotated_totals(invoice) or totals_fn(invoice)
+        if totals['balance'] == 0:
+            invoice.payment_status = "PAID"
+            invoice.paid_at = now
+            closed.append(invoice.number)
+        elif totals['paid'] > 0:
+            invoice.payment_status = "PARTIALLY_PAID"
+        else:
+            continue
+        changed.append(invoice)
+    invoice_model.objects.bulk_update(changed, ['payment_status', 'paid_at'])
+    return closed
+
+
 # NEW: safe creator that strips unknown kwargs (like 'organization')
 @transaction.atomic
 def post_ar_payment(payment):
@@ -590,66 +875,9 @@ def post_ar_payment(payment):
     
     # Process allocations (new system)
     if payment.allocations.exists():
-        for allocation in payment.allocations.all():
-            invoice = allocation.invoice
-            allocation_amount = allocation.amount
-            
-            # Get invoice exchange rate (rate when invoice was posted)
-            invoice_rate = invoice.exchange_rate or Decimal('1.0')
-            
-            # Get payment exchange rate (rate when payment was received)
-            if payment.invoice_currency and payment.exchange_rate and payment.currency:
-                if payment.invoice_currency.id != payment.currency.id:
-                    payment_rate = payment.exchange_rate
-                else:
-                    payment_rate = Decimal('1.0')
-            else:
-                payment_rate = Decimal('1.0')
-            
-            # Convert allocation amount to base currency using invoice rate
-            # (this is the AR value we're reducing)
-            if invoice.currency.id != base_currency.id:
-                ar_reduction_base = convert_amount(
-                    allocation_amount / invoice_rate if invoice_rate else allocation_amount,
-                    invoice.currency,
-                    base_currency,
-                    payment.date
-                )
-            else:
-                ar_reduction_base = allocation_amount
-            
-            # Convert cash received to base currency using payment rate
-            if payment_currency.id != base_currency.id:
-                bank_received_base = convert_amount(
-                    allocation_amount,
-                    payment_currency,
-                    base_currency,
-                    payment.date
-                )
-            else:
-                bank_received_base = allocation_amount
-            
-            total_ar_reduction += ar_reduction_base
-            total_bank_received += bank_received_base
-            
-            # FX impact for this allocation (if rates differ)
-            if invoice_rate and payment_rate and invoice_rate != payment_rate:
-                # Calculate FX gain/loss in payment currency
-                amount_in_invoice_curr = allocation_amount / payment_rate if payment_rate else allocation_amount
-                fx_diff_payment_curr = amount_in_invoice_curr * (payment_rate - invoice_rate)
-                
-                # Convert FX difference to base currency
-                if payment_currency.id != base_currency.id:
-                    fx_impact = convert_amount(
-                        fx_diff_payment_curr,
-                        payment_currency,
-                        base_currency,
-                        payment.date
-                    )
-                else:
-                    fx_impact = fx_diff_payment_curr
-                
-                total_fx_impact += fx_impact
+        total_ar_reduction, total_bank_received, total_fx_impact = _allocation_posting_totals(
+            payment, base_currency, payment_currency
+        )
     
     # Fallback to old single-invoice system
     elif payment.invoice:
@@ -720,6 +948,8 @@ def post_ar_payment(payment):
             )
             print(f"AR Payment {payment.reference}: FX Loss {abs(total_fx_impact)} {base_currency.code}")
 
+    apply_entry_to_balances(entry)
+
     payment.gl_journal = entry
     payment.posted_at = timezone.now()
     payment.save()
@@ -727,19 +957,7 @@ def post_ar_payment(payment):
     # Update invoice payment status for all allocated invoices
     invoice_closed_list = []
     if payment.allocations.exists():
-        for allocation in payment.allocations.all():
-            invoice = allocation.invoice
-            totals = ar_totals(invoice)
-            invoice_closed = (totals['balance'] == 0)
-            
-            if invoice_closed:
-                invoice.payment_status = "PAID"
-                invoice.paid_at = timezone.now()
-                invoice.save(update_fields=['payment_status', 'paid_at'])
-                invoice_closed_list.append(invoice.number)
-            elif totals['paid'] > 0:
-                invoice.payment_status = "PARTIALLY_PAID"
-                invoice.save(update_fields=['payment_status'])
+        invoice_closed_list = _update_allocated_invoice_status(payment, ar_totals)
     elif payment.invoice:
         # Old system - single invoice
         invoice = payment.invoice
@@ -807,66 +1025,9 @@ def post_ap_payment(payment: APPayment):
     
     # Process allocations (new system)
     if payment.allocations.exists():
-        for allocation in payment.allocations.all():
-            invoice = allocation.invoice
-            allocation_amount = allocation.amount
-            
-            # Get invoice exchange rate (rate when invoice was posted)
-            invoice_rate = invoice.exchange_rate or Decimal('1.0')
-            
-            # Get payment exchange rate (rate when payment was made)
-            if payment.invoice_currency and payment.exchange_rate and payment.currency:
-                if payment.invoice_currency.id != payment.currency.id:
-                    payment_rate = payment.exchange_rate
-                else:
-                    payment_rate = Decimal('1.0')
-            else:
-                payment_rate = Decimal('1.0')
-            
-            # Convert allocation amount to base currency using invoice rate
-            # (this is the AP value we're reducing)
-            if invoice.currency.id != base_currency.id:
-                ap_reduction_base = convert_amount(
-                    allocation_amount / invoice_rate if invoice_rate else allocation_amount,
-                    invoice.currency,
-                    base_currency,
-                    payment.date
-                )
-            else:
-                ap_reduction_base = allocation_amount
-            
-            # Convert cash paid to base currency using payment rate
-            if payment_currency.id != base_currency.id:
-                bank_paid_base = convert_amount(
-                    allocation_amount,
-                    payment_currency,
-                    base_currency,
-                    payment.date
-                )
-            else:
-                bank_paid_base = allocation_amount
-            
-            total_ap_reduction += ap_reduction_base
-            total_bank_paid += bank_paid_base
-            
-            # FX impact for this allocation (if rates differ)
-            if invoice_rate and payment_rate and invoice_rate != payment_rate:
-                # Calculate FX gain/loss in payment currency
-                amount_in_invoice_curr = allocation_amount / payment_rate if payment_rate else allocation_amount
-                fx_diff_payment_curr = amount_in_invoice_curr * (payment_rate - invoice_rate)
-                
-                # Convert FX difference to base currency
-                if payment_currency.id != base_currency.id:
-                    fx_impact = convert_amount(
-                        fx_diff_payment_curr,
-                        payment_currency,
-                        base_currency,
-                        payment.date
-                    )
-                else:
-                    fx_impact = fx_diff_payment_curr
-                
-                total_fx_impact += fx_impact
+        total_ap_reduction, total_bank_paid, total_fx_impact = _allocation_posting_totals(
+            payment, base_currency, payment_currency
+        )
     
     # Fallback to old single-invoice system
     elif payment.invoice:
@@ -939,6 +1100,8 @@ def post_ap_payment(payment: APPayment):
             )
             print(f"AP Payment {payment.reference}: FX Gain {abs(total_fx_impact)} {base_currency.code}")
 
+    apply_entry_to_balances(entry)
+
     payment.gl_journal = entry
     payment.posted_at = timezone.now()
     payment.save()
@@ -946,19 +1109,7 @@ def post_ap_payment(payment: APPayment):
     # Update invoice payment status for all allocated invoices
     invoice_closed_list = []
     if payment.allocations.exists():
-        for allocation in payment.allocations.all():
-            invoice = allocation.invoice
-            totals = ap_totals(invoice)
-            invoice_closed = (totals['balance'] == 0)
-            
-            if invoice_closed:
-                invoice.payment_status = "PAID"
-                invoice.paid_at = timezone.now()
-                invoice.save(update_fields=['payment_status', 'paid_at'])
-                invoice_closed_list.append(invoice.number)
-            elif totals['paid'] > 0:
-                invoice.payment_status = "PARTIALLY_PAID"
-                invoice.save(update_fields=['payment_status'])
+        invoice_closed_list = _update_allocated_invoice_status(payment, ap_totals)
     elif payment.invoice:
         # Old system - single invoice
         invoice = payment.invoice
@@ -977,6 +1128,7 @@ def post_ap_payment(payment: APPayment):
     return entry, False, invoice_closed_list
 
 
+@transaction.atomic
 def reverse_journal(entry: JournalEntry) -> JournalEntry:
     reversed_entry = JournalEntry.objects.create(
         date=timezone.now().date(),
@@ -993,6 +1145,7 @@ def reverse_journal(entry: JournalEntry) -> JournalEntry:
             credit=line.debit
         )
 
+    apply_entry_to_balances(reversed_entry)
     return reversed_entry
 
 
@@ -1053,14 +1206,22 @@ def accrue_corporate_tax(country: str, date_from: date, date_to: date, org_id: i
         raise ValueError(f"No active CorporateTaxRule configured for country={country}")
 
     # Sum posted JournalLines in period by account type
-    lines = JournalLine.objects.select_related("entry","account") \
-          .filter(entry__posted=True, entry__date__gte=date_from, entry__date__lte=date_to)
-    lines = _with_org_filter(lines, org_id)
+    if org_id and _has_field(JournalEntry, "organization"):
+        # Balance store is not org-scoped; aggregate raw lines instead
+        lines = _with_org_filter(JournalLine.objects.filter(
+            entry__posted=True, entry__date__gte=date_from, entry__date__lte=date_to), org_id)
+        by_type = {
+            (g["account__segment_type__segment_type"],): (g["dr"] or Decimal("0"), g["cr"] or Decimal("0"))
+            for g in lines.values("account__segment_type__segment_type")
+                          .annotate(dr=Sum("debit"), cr=Sum("credit")).order_by()
+        }
+    else:
+        by_type = grouped_totals(["account__segment_type__segment_type"], date_from, date_to)
     income = Decimal("0"); expense = Decimal("0")
-    for ln in lines:
-       acc_type = ln.account.type.upper()
-       if acc_type in ("INCOME", "IN"): income += (Decimal(ln.credit) - Decimal(ln.debit))
-       elif acc_type in ("EXPENSE", "EX"): expense += (Decimal(ln.debit) - Decimal(ln.credit))
+    for (acc_type,), (debit, credit) in by_type.items():
+       acc_type = (acc_type or "").upper()
+       if acc_type in ("INCOME", "IN"): income += (Decimal(credit) - Decimal(debit))
+       elif acc_type in ("EXPENSE", "EX"): expense += (Decimal(debit) - Decimal(credit))
     profit = q2(income - expense)
     
     if profit <= 0:
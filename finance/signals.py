@@ -4,108 +4,214 @@ Django signals for finance module.
 Handles automatic updates for payment allocations and invoice statuses.
 """
 
-from django.db.models.signals import post_save, post_delete
+from django.db.models.signals import post_save, post_delete, pre_delete, pre_save
 from django.dispatch import receiver
 
+# ============================================================================
+# PAYMENT ALLOCATIONS - Keep stored invoice payment state in step
+# ============================================================================
+
+@receiver(pre_save, sender='ar.ARPaymentAllocation')
+@receiver(pre_save, sender='ap.APPaymentAllocation')
+def remember_allocation_state(sender, instance, **kwargs):
+    """
+    Capture the stored state of an allocation about to be edited, so only
+    the difference reaches the invoice.
+    """
+    from finance.payment_state_services import AllocationState
+    
+    if instance._state.adding or instance.pk is None:
+        return
+    row = sender.objects.filter(pk=instance.pk).values_list(
+        "invoice_id", "payment_id", "amount", "current_exchange_rate"
+    ).first()
+    instance._payment_state_before = AllocationState(*row) if row else None
+
+
 @receiver(post_save, sender='ar.ARPaymentAllocation')
-def update_ar_invoice_payment_status_on_allocation(sender, instance, created, **kwargs):
+@receiver(post_save, sender='ap.APPaymentAllocation')
+def update_invoice_payment_state_on_allocation(sender, instance, created, **kwargs):
     """
-    Automatically update AR invoice payment status when a payment allocation is created or updated.
-    Sets status to: PAID, PARTIALLY_PAID, or UNPAID based on outstanding amount.
+    Queue the allocation's change in paid amount for its invoice. Stored
+    amount_paid/amount_outstanding, payment_status (PAID, PARTIALLY_PAID,
+    UNPAID) and paid_at are updated once per invoice when the transaction
+    commits.
     """
-    invoice = instance.invoice
-    update_ar_invoice_payment_status(invoice)
+    from finance.payment_state_services import allocation_state, record_allocation_change
+    
+    before = None if created else instance.__dict__.pop("_payment_state_before", None)
+    record_allocation_change(sender, instance.pk, before, allocation_state(instance), using=kwargs.get("using") or "default")
 
 
 @receiver(post_delete, sender='ar.ARPaymentAllocation')
-def update_ar_invoice_payment_status_on_delete(sender, instance, **kwargs):
+@receiver(post_delete, sender='ap.APPaymentAllocation')
+def update_invoice_payment_state_on_delete(sender, instance, **kwargs):
+    """Queue the removal of a deleted allocation's paid amount from its invoice"""
+    from finance.payment_state_services import allocation_state, record_allocation_change
+    
+    record_allocation_change(sender, instance.pk, allocation_state(instance), None, using=kwargs.get("using") or "default")
+
+
+# ============================================================================
+# ACCOUNT PERIOD BALANCES - Rebuild a period's balances when it is closed
+# ============================================================================
+
+@receiver(pre_save, sender='periods.FiscalPeriod')
+def remember_period_status(sender, instance, **kwargs):
+    """Capture the stored status of a period about to be saved"""
+    if instance._state.adding or instance.pk is None:
+        instance._status_before = None
+        return
+    instance._status_before = sender.objects.filter(pk=instance.pk).values_list("status", flat=True).first()
+
+
+@receiver(post_save, sender='periods.FiscalPeriod')
+def rebuild_balances_on_period_close(sender, instance, **kwargs):
     """
-    Automatically update AR invoice payment status when a payment allocation is deleted.
+    Recompute AccountPeriodBalance rows from raw journal lines when a monthly
+    period becomes CLOSED, so reports can trust the store for it. Saving a
+    period that was already closed does not rebuild again.
     """
-    invoice = instance.invoice
-    update_ar_invoice_payment_status(invoice)
+    from finance.balance_services import BALANCE_PERIOD_TYPE, rebuild_period_balances
+    
+    before = instance.__dict__.pop("_status_before", None)
+    if instance.status == 'CLOSED' and before != 'CLOSED' and instance.period_type == BALANCE_PERIOD_TYPE:
+        rebuild_period_balances(instance)
+
 
+# ============================================================================
+# CLOSED PERIODS - Posted journals dated in a closed period cannot change
+# ============================================================================
 
-def update_ar_invoice_payment_status(invoice):
+@receiver(pre_save, sender='finance.JournalEntry')
+@receiver(pre_delete, sender='finance.JournalEntry')
+def guard_closed_period_entry(sender, instance, **kwargs):
     """
-    Update the payment status of an AR invoice based on its outstanding amount.
-    
-    Logic:
-    - outstanding = 0 → PAID
-    - outstanding > 0 and paid > 0 → PARTIALLY_PAID
-    - outstanding = total (no payments) → UNPAID
+    Refuse to post an entry into a closed period, or to edit, unpost, move
+    or delete a posted entry dated in one (PeriodClosed).
     """
-    from decimal import Decimal
-    from django.utils import timezone
+    from finance.balance_services import ensure_period_open
     
-    total = invoice.calculate_total()
-    paid = invoice.paid_amount()
-    outstanding = invoice.outstanding_amount()
+    if instance.posted:
+        ensure_period_open(instance.date)
+    if instance._state.adding or instance.pk is None or kwargs.get("signal") is pre_delete:
+        return
+    before = sender.objects.filter(pk=instance.pk).values_list("posted", "date").first()
+    if before and before[0] and (before[1] != instance.date or not instance.posted):
+        ensure_period_open(before[1])
+
+
+@receiver(pre_save, sender='finance.JournalLine')
+@receiver(pre_delete, sender='finance.JournalLine')
+def guard_closed_period_line(sender, instance, **kwargs):
+    """Refuse to add, edit or delete a line of a posted entry dated in a closed period"""
+    from finance.balance_services import ensure_period_open
     
-    # Determine payment status
-    if outstanding <= Decimal('0.00'):
-        # Fully paid
-        invoice.payment_status = 'PAID'
-        if not invoice.paid_at:
-            invoice.paid_at = timezone.now()
-    elif paid > Decimal('0.00'):
-        # Partially paid
-        invoice.payment_status = 'PARTIALLY_PAID'
-        invoice.paid_at = None  # Clear paid_at for partial payments
-    else:
-        # Unpaid
-        invoice.payment_status = 'UNPAID'
-        invoice.paid_at = None
+    entry = instance.entry
+    if entry.posted:
+        ensure_period_open(entry.date)
+
+
+@receiver(pre_save, sender='finance.JournalLineSegment')
+@receiver(pre_delete, sender='finance.JournalLineSegment')
+def guard_closed_period_line_segment(sender, instance, **kwargs):
+    """Refuse to change the segments of a posted line dated in a closed period"""
+    from finance.balance_services import ensure_period_open
+    from finance.models import JournalEntry
     
-    invoice.save()
+    entry = JournalEntry.objects.filter(lines=instance.journal_line_id).values_list("posted", "date").first()
+    if entry and entry[0]:
+        ensure_period_open(entry[1])
+
 
 
 # ============================================================================
-# AP PAYMENT ALLOCATION SIGNALS - Auto-update invoice payment status
+# FX RATE CACHE - Invalidate cached exchange rates when rates change
 # ============================================================================
 
-@receiver(post_save, sender='ap.APPaymentAllocation')
-def update_ap_invoice_payment_status_on_allocation(sender, instance, created, **kwargs):
+@receiver(post_save, sender='core.ExchangeRate')
+@receiver(post_delete, sender='core.ExchangeRate')
+def invalidate_fx_rate_cache(sender, instance, **kwargs):
     """
-    Automatically update AP invoice payment status when a payment allocation is created or updated.
+    Drop cached exchange rates whenever a rate is created, edited,
+    deactivated or deleted (viewset, create_exchange_rate, admin, loaders).
+    The version bump commits with the change, so other processes reload
+    once they can see it.
     """
-    invoice = instance.invoice
-    update_ap_invoice_payment_status(invoice)
+    from finance.fx_services import invalidate_rate_cache
+    
+    invalidate_rate_cache()
 
 
-@receiver(post_delete, sender='ap.APPaymentAllocation')
-def update_ap_invoice_payment_status_on_delete(sender, instance, **kwargs):
+# ============================================================================
+# SEGMENT RULES - Recompile the in-memory rule matcher when rules change
+# ============================================================================
+
+@receiver(post_save, sender='finance.SegmentAssignmentRule')
+@receiver(post_delete, sender='finance.SegmentAssignmentRule')
+@receiver(post_save, sender='segment.XX_Segment')
+@receiver(post_delete, sender='segment.XX_Segment')
+def invalidate_segment_rule_matcher(sender, instance, **kwargs):
     """
-    Automatically update AP invoice payment status when a payment allocation is deleted.
+    Rules embed their segments' types in the compiled assignments, so
+    segment changes also trigger a rebuild.
     """
-    invoice = instance.invoice
-    update_ap_invoice_payment_status(invoice)
+    from finance.distribution_services import rule_matcher
+    
+    rule_matcher.invalidate()
+
 
+# ============================================================================
+# REPORT JOBS - Bump report data versions so stored results are rebuilt
+# ============================================================================
 
-def update_ap_invoice_payment_status(invoice):
+@receiver(post_save, sender='finance.JournalEntry')
+@receiver(post_delete, sender='finance.JournalEntry')
+@receiver(post_save, sender='finance.JournalLine')
+@receiver(post_delete, sender='finance.JournalLine')
+@receiver(post_save, sender='finance.JournalLineSegment')
+@receiver(post_delete, sender='finance.JournalLineSegment')
+@receiver(post_save, sender='ar.ARInvoice')
+@receiver(post_delete, sender='ar.ARInvoice')
+@receiver(post_save, sender='ar.ARItem')
+@receiver(post_delete, sender='ar.ARItem')
+@receiver(post_save, sender='ar.ARPayment')
+@receiver(post_delete, sender='ar.ARPayment')
+@receiver(post_save, sender='ar.ARPaymentAllocation')
+@receiver(post_delete, sender='ar.ARPaymentAllocation')
+@receiver(post_save, sender='ap.APInvoice')
+@receiver(post_delete, sender='ap.APInvoice')
+@receiver(post_save, sender='ap.APItem')
+@receiver(post_delete, sender='ap.APItem')
+@receiver(post_save, sender='ap.APPayment')
+@receiver(post_delete, sender='ap.APPayment')
+@receiver(post_save, sender='ap.APPaymentAllocation')
+@receiver(post_delete, sender='ap.APPaymentAllocation')
+@receiver(post_save, sender='core.ExchangeRate')
+@receiver(post_delete, sender='core.ExchangeRate')
+def mark_ledger_reports_stale(sender, instance, **kwargs):
     """
-    Update the payment status of an AP invoice based on its outstanding amount.
+    Journals (with their lines and line segments), invoices, payments and
+    rates feed the GL and aging reports;
+    any committed change makes their stored report results stale.
     """
-    from decimal import Decimal
-    from django.utils import timezone
-    
-    total = invoice.calculate_total()
-    paid = invoice.paid_amount()
-    outstanding = invoice.outstanding_amount()
+    from finance.report_job_services import LEDGER, mark_data_changed
     
-    # Determine payment status
-    if outstanding <= Decimal('0.00'):
-        # Fully paid
-        invoice.payment_status = 'PAID'
-        if not invoice.paid_at:
-            invoice.paid_at = timezone.now()
-    elif paid > Decimal('0.00'):
-        # Partially paid
-        invoice.payment_status = 'PARTIALLY_PAID'
-        invoice.paid_at = None
-    else:
-        # Unpaid
-        invoice.payment_status = 'UNPAID'
-        invoice.paid_at = None
+    mark_data_changed(LEDGER)
+
+
+@receiver(post_save, sender='requisitions.PRHeader')
+@receiver(post_delete, sender='requisitions.PRHeader')
+@receiver(post_save, sender='receiving.GoodsReceipt')
+@receiver(post_delete, sender='receiving.GoodsReceipt')
+@receiver(post_save, sender='vendor_bills.VendorBill')
+@receiver(post_delete, sender='vendor_bills.VendorBill')
+@receiver(post_save, sender='vendor_bills.VendorBillLine')
+@receiver(post_delete, sender='vendor_bills.VendorBillLine')
+@receiver(post_save, sender='vendor_bills.MatchException')
+@receiver(post_delete, sender='vendor_bills.MatchException')
+def mark_procurement_reports_stale(sender, instance, **kwargs):
+    """Requisitions, receipts and vendor bills feed the procurement analytics reports"""
+    from finance.report_job_services import PROCUREMENT, mark_data_changed
     
-    invoice.save()
+    mark_data_changed(PROCUREMENT)
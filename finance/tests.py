@@ -0,0 +1,816 @@
+# Finance app tests
+from datetime import date
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.core.exceptions import ValidationError
+from django.db import connection, transaction
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+
+from core.models import Currency
+from segment.models import XX_Segment, XX_SegmentType
+from .models import JournalEntry, JournalLine, JournalLineSegment
+from .services import build_segment_rollup, build_trial_balance, q2
+
+
+class LedgerTestMixin:
+    """Small chart of accounts plus a department dimension"""
+
+    def setUp(self):
+        self.currency = Currency.objects.create(code="AED", name="Dirham", is_base=True)
+        self.account_type = XX_SegmentType.objects.create(
+            segment_name="Account", segment_type="account", length=4
+        )
+        self.dept_type = XX_SegmentType.objects.create(
+            segment_name="Department", segment_type="department", length=3
+        )
+        self.bank = XX_Segment.objects.create(segment_type=self.account_type, code="1000", alias="Bank")
+        self.revenue = XX_Segment.objects.create(segment_type=self.account_type, code="4000", alias="Revenue")
+        self.sales = XX_Segment.objects.create(segment_type=self.dept_type, code="100", alias="Sales")
+
+    def make_entry(self, entry_date, amount, account_dr, account_cr, posted=True, dept=None):
+        entry = JournalEntry.objects.create(date=entry_date, currency=self.currency, posted=posted)
+        dr = JournalLine.objects.create(entry=entry, account=account_dr, debit=amount, credit=0)
+        cr = JournalLine.objects.create(entry=entry, account=account_cr, debit=0, credit=amount)
+        if dept:
+            JournalLineSegment.objects.create(journal_line=cr, segment_type=self.dept_type, segment=dept)
+        return entry, dr, cr
+
+
+class TrialBalanceTestCase(LedgerTestMixin, TestCase):
+    def test_totals_grouped_by_account(self):
+        """Posted lines are summed per account with a TOTAL row"""
+        self.make_entry(date(2025, 1, 5), Decimal("100.00"), self.bank, self.revenue)
+        self.make_entry(date(2025, 1, 6), Decimal("50.25"), self.bank, self.revenue)
+        self.make_entry(date(2025, 1, 7), Decimal("999.00"), self.bank, self.revenue, posted=False)
+
+        rows = build_trial_balance()
+        self.assertEqual([r["code"] for r in rows], ["1000", "4000", "TOTAL"])
+        self.assertEqual(rows[0], {"code": "1000", "name": "Bank", "debit": Decimal("150.25"), "credit": Decimal("0.00")})
+        self.assertEqual(rows[1]["credit"], Decimal("150.25"))
+        self.assertEqual(rows[2]["debit"], rows[2]["credit"])
+
+    def test_date_filter(self):
+        """Only entries inside the date range are included"""
+        self.make_entry(date(2025, 1, 5), Decimal("100.00"), self.bank, self.revenue)
+        self.make_entry(date(2025, 2, 5), Decimal("40.00"), self.bank, self.revenue)
+
+        rows = build_trial_balance("2025-02-01", "2025-02-28")
+        self.assertEqual(rows[-1]["debit"], Decimal("40.00"))
+
+    def test_split_by_segment_dimension(self):
+        """Rows are split by the requested segment type, unassigned lines keep segment=None"""
+        self.make_entry(date(2025, 1, 5), Decimal("100.00"), self.bank, self.revenue, dept=self.sales)
+        self.make_entry(date(2025, 1, 6), Decimal("20.00"), self.bank, self.revenue)
+
+        rows = build_trial_balance(segment_type="Department")
+        revenue = {r["segment"]: r["credit"] for r in rows if r["code"] == "4000"}
+        self.assertEqual(revenue, {None: Decimal("20.00"), "100": Decimal("100.00")})
+        self.assertEqual(rows[-1]["credit"], Decimal("120.00"))
+
+
+class AccountPeriodBalanceTestCase(LedgerTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        from periods.models import FiscalYear, FiscalPeriod
+        year = FiscalYear.objects.create(year=2025, start_date=date(2025, 1, 1), end_date=date(2025, 12, 31))
+        self.jan = FiscalPeriod.objects.create(
+            fiscal_year=year, period_number=1, period_code="2025-01", period_name="January 2025",
+            start_date=date(2025, 1, 1), end_date=date(2025, 1, 31),
+        )
+        self.feb = FiscalPeriod.objects.create(
+            fiscal_year=year, period_number=2, period_code="2025-02", period_name="February 2025",
+            start_date=date(2025, 2, 1), end_date=date(2025, 2, 28),
+        )
+
+    def test_post_entry_updates_store(self):
+        """post_entry adds the entry to its period; applying with sign=-1 nets it out"""
+        from .balance_services import apply_entry_to_balances
+        from .models import AccountPeriodBalance
+        from .services import post_entry
+
+        entry, _, _ = self.make_entry(date(2025, 1, 5), Decimal("70.00"), self.bank, self.revenue, posted=False)
+        post_entry(entry)
+        bank = AccountPeriodBalance.objects.get(account=self.bank, period=self.jan)
+        self.assertEqual((bank.debit, bank.credit), (Decimal("70.00"), Decimal("0.00")))
+
+        apply_entry_to_balances(entry, sign=-1)
+        bank.refresh_from_db()
+        self.assertEqual(bank.debit, Decimal("0.00"))
+
+    def test_closing_period_rebuilds_and_reports_match_raw(self):
+        """Closed periods are served from the store and agree with raw lines"""
+        from .balance_services import diff_period_balances, grouped_totals
+
+        self.make_entry(date(2025, 1, 5), Decimal("100.00"), self.bank, self.revenue, dept=self.sales)
+        self.make_entry(date(2025, 2, 5), Decimal("40.00"), self.bank, self.revenue)
+        raw = build_trial_balance()
+
+        self.jan.close_period()
+        self.assertEqual(diff_period_balances(self.jan), [])
+        self.assertEqual(build_trial_balance(), raw)
+        self.assertEqual(build_trial_balance("2025-01-01", "2025-01-31")[-1]["debit"], Decimal("100.00"))
+        self.assertEqual(
+            grouped_totals(["account__code"], use_store=True),
+            grouped_totals(["account__code"], use_store=False),
+        )
+
+    def test_closed_period_refuses_postings(self):
+        """Paths that skip the store cannot post into a closed period; saving it again does not rebuild"""
+        from .balance_services import PeriodClosed
+        from .models import AccountBalanceRebuild
+
+        entry, dr, cr = self.make_entry(date(2025, 1, 5), Decimal("100.00"), self.bank, self.revenue)
+        self.jan.close_period()
+        rebuilt_at = AccountBalanceRebuild.objects.get(period=self.jan).rebuilt_at
+
+        # Direct creation, as fixed-asset and payment postings do
+        with self.assertRaises(PeriodClosed):
+            JournalEntry.objects.create(date=date(2025, 1, 20), currency=self.currency, posted=True)
+        with self.assertRaises(PeriodClosed):
+            JournalLine.objects.create(entry=entry, account=self.bank, debit=Decimal("5.00"), credit=0)
+        with self.assertRaises(PeriodClosed):
+            JournalLineSegment.objects.create(journal_line=dr, segment_type=self.dept_type, segment=self.sales)
+        with self.assertRaises(PeriodClosed), transaction.atomic():
+            entry.delete()
+        entry.date = date(2025, 2, 5)
+        with self.assertRaises(PeriodClosed):
+            entry.save()
+        # Drafts and other periods are unaffected
+        JournalEntry.objects.create(date=date(2025, 1, 20), currency=self.currency, posted=False)
+        self.make_entry(date(2025, 2, 5), Decimal("40.00"), self.bank, self.revenue)
+        self.assertEqual(build_trial_balance("2025-01-01", "2025-01-31")[-1]["debit"], Decimal("100.00"))
+
+        self.jan.period_name = "January"
+        self.jan.save()
+        self.assertEqual(AccountBalanceRebuild.objects.get(period=self.jan).rebuilt_at, rebuilt_at)
+
+        self.jan.open_period()
+        self.make_entry(date(2025, 1, 20), Decimal("5.00"), self.bank, self.revenue)
+        self.jan.close_period()
+        self.assertEqual(build_trial_balance("2025-01-01", "2025-01-31")[-1]["debit"], Decimal("105.00"))
+
+    def test_verify_detects_drift(self):
+        """diff_period_balances reports rows that no longer match raw lines"""
+        from .balance_services import diff_period_balances
+        from .models import AccountPeriodBalance
+
+        self.make_entry(date(2025, 1, 5), Decimal("100.00"), self.bank, self.revenue)
+        self.jan.close_period()
+        AccountPeriodBalance.objects.filter(account=self.bank).update(debit=Decimal("1.00"))
+        self.assertEqual(len(diff_period_balances(self.jan)), 1)
+
+
+class AgingTestCase(TestCase):
+    def setUp(self):
+        from ar.models import Customer
+        self.aed = Currency.objects.create(code="AED", name="Dirham", is_base=True)
+        self.usd = Currency.objects.create(code="USD", name="US Dollar")
+        self.customer = Customer.objects.create(code="C1", name="Acme", currency=self.aed)
+
+    def make_invoice(self, number, due_date, amount, store_totals=True):
+        from ar.models import ARInvoice, ARItem
+        inv = ARInvoice.objects.create(
+            customer=self.customer, number=number, date=date(2025, 1, 1),
+            due_date=due_date, currency=self.aed,
+        )
+        ARItem.objects.create(invoice=inv, description="Service", quantity=1, unit_price=amount)
+        if store_totals:
+            inv.calculate_and_save_totals()
+        return inv
+
+    def pay(self, inv, amount, currency=None, rate=None):
+        from ar.models import ARPayment, ARPaymentAllocation
+        payment = ARPayment.objects.create(
+            customer=self.customer, reference=f"P-{inv.number}-{amount}", date=date(2025, 1, 10),
+            total_amount=amount, currency=currency or self.aed,
+        )
+        return ARPaymentAllocation.objects.create(
+            payment=payment, invoice=inv, amount=amount,
+            invoice_currency=self.aed, current_exchange_rate=rate,
+        )
+
+    def test_buckets_and_balances_match_per_invoice_totals(self):
+        """Set-based aging agrees with ar_totals and buckets by days overdue"""
+        from .services import ar_totals, build_ar_aging
+
+        current = self.make_invoice("INV-1", date(2025, 3, 10), Decimal("100.00"))
+        overdue = self.make_invoice("INV-2", date(2025, 2, 1), Decimal("200.00"))
+        legacy = self.make_invoice("INV-3", date(2024, 11, 1), Decimal("50.00"), store_totals=False)
+        paid = self.make_invoice("INV-4", date(2025, 2, 1), Decimal("80.00"))
+        self.pay(overdue, Decimal("50.00"))
+        self.pay(overdue, Decimal("27.50"), currency=self.usd, rate=Decimal("0.275"))
+        self.pay(paid, Decimal("80.00"))
+
+        data = build_ar_aging(date(2025, 3, 1))
+        rows = {r["number"]: r for r in data["invoices"]}
+        self.assertEqual(sorted(rows), ["INV-1", "INV-2", "INV-3"])
+        for inv in (current, overdue, legacy):
+            self.assertEqual(rows[inv.number]["balance"], float(ar_totals(inv)["balance"]))
+        self.assertEqual(rows["INV-1"]["bucket"], "Current")
+        self.assertEqual((rows["INV-2"]["bucket"], rows["INV-2"]["days_overdue"]), ("1–30", 28))
+        self.assertEqual(rows["INV-3"]["bucket"], ">90")
+        self.assertEqual(data["summary"]["TOTAL"], 100.0 + 50.0 + 50.0)
+
+    def test_open_only_skips_cancelled(self):
+        from .services import build_ar_aging
+
+        inv = self.make_invoice("INV-1", date(2025, 2, 1), Decimal("100.00"))
+        inv.is_cancelled = True
+        inv.save()
+        self.assertEqual(len(build_ar_aging(date(2025, 3, 1))["invoices"]), 1)
+        self.assertEqual(build_ar_aging(date(2025, 3, 1), open_only=True)["invoices"], [])
+
+
+class ExchangeRateCacheTestCase(TestCase):
+    def setUp(self):
+        from .fx_services import invalidate_rate_cache
+        self.aed = Currency.objects.create(code="AED", name="Dirham", is_base=True)
+        self.usd = Currency.objects.create(code="USD", name="US Dollar")
+        invalidate_rate_cache()
+
+    def test_lookups_are_cached_and_invalidated_on_change(self):
+        from core.models import ExchangeRate
+        from .fx_services import create_exchange_rate, get_exchange_rate, rate_cache
+
+        create_exchange_rate("USD", "AED", Decimal("3.6725"), date(2025, 1, 1))
+        hits = rate_cache.hits
+        with self.assertNumQueries(3):  # cache version, USD/AED timeline, then AED/USD for the inverse
+            self.assertEqual(get_exchange_rate(self.usd, self.aed, date(2025, 1, 15)), Decimal("3.6725"))
+            self.assertEqual(get_exchange_rate(self.aed, self.usd, date(2025, 1, 15)), Decimal("1") / Decimal("3.6725"))
+        with self.assertNumQueries(0):
+            get_exchange_rate(self.usd, self.aed, date(2025, 1, 15))
+        self.assertEqual(rate_cache.hits, hits + 1)
+
+        create_exchange_rate("USD", "AED", Decimal("3.7000"), date(2025, 1, 10))
+        self.assertEqual(get_exchange_rate(self.usd, self.aed, date(2025, 1, 15)), Decimal("3.7000"))
+
+        ExchangeRate.objects.filter(rate_date=date(2025, 1, 10)).get().delete()
+        self.assertEqual(get_exchange_rate(self.usd, self.aed, date(2025, 1, 15)), Decimal("3.6725"))
+
+    def test_changes_from_other_processes_and_lookup_bound(self):
+        from core.cache_versions import bump_version
+        from core.models import ExchangeRate
+        from .fx_services import create_exchange_rate, get_exchange_rate, rate_cache
+
+        create_exchange_rate("USD", "AED", Decimal("3.6725"), date(2025, 1, 1))
+        self.assertEqual(get_exchange_rate(self.usd, self.aed, date(2025, 1, 15)), Decimal("3.6725"))
+        # Another process deactivates the rate: only the shared version row tells this one
+        ExchangeRate.objects.update(is_active=False)
+        bump_version(rate_cache.VERSION_KEY)
+        with override_settings(CACHE_VERSION_CHECK_SECONDS=0), self.assertRaises(ValidationError):
+            get_exchange_rate(self.usd, self.aed, date(2025, 1, 15))
+
+        ExchangeRate.objects.update(is_active=True)
+        rate_cache.invalidate()
+        with override_settings(FX_LOOKUP_CACHE_SIZE=5):
+            for day in range(1, 21):
+                get_exchange_rate(self.usd, self.aed, date(2025, 2, day))
+        self.assertEqual(rate_cache.stats()["lookups"], 5)
+
+
+class BulkPostingTestCase(TestCase):
+    def setUp(self):
+        from ar.models import Customer
+        self.aed = Currency.objects.create(code="AED", name="Dirham", is_base=True)
+        account_type = XX_SegmentType.objects.create(segment_name="Account", segment_type="account", length=4)
+        self.receivable = XX_Segment.objects.create(segment_type=account_type, code="1200", alias="Receivable")
+        self.revenue = XX_Segment.objects.create(segment_type=account_type, code="4000", alias="Revenue")
+        self.customer = Customer.objects.create(code="C1", name="Acme", currency=self.aed)
+
+    def make_invoice(self, number, amounts, approval_status="APPROVED"):
+        from ar.models import ARInvoice, ARItem
+        inv = ARInvoice.objects.create(
+            customer=self.customer, number=number, date=date(2025, 1, 1), due_date=date(2025, 1, 31),
+            currency=self.aed, approval_status=approval_status,
+        )
+        for amount in amounts:
+            ARItem.objects.create(invoice=inv, description="Service", quantity=1, unit_price=amount)
+        return inv
+
+    def journal_lines(self, inv):
+        inv.refresh_from_db()
+        return sorted(
+            (l.account.code, l.debit, l.credit, tuple(sorted(l.segments.values_list("segment_id", flat=True))))
+            for l in inv.gl_journal.lines.all()
+        )
+
+    def test_bulk_matches_single_posting_and_is_idempotent(self):
+        from .bulk_posting_services import bulk_post_invoices
+        from .services import gl_post_from_ar_balanced
+
+        single = self.make_invoice("INV-1", [Decimal("100.00"), Decimal("25.00")])
+        bulk = self.make_invoice("INV-2", [Decimal("100.00"), Decimal("25.00")])
+        draft = self.make_invoice("INV-3", [Decimal("10.00")], approval_status="DRAFT")
+        empty = self.make_invoice("INV-4", [])
+        gl_post_from_ar_balanced(single)
+
+        result = bulk_post_invoices("AR", [bulk.pk, draft.pk, empty.pk, single.pk, 999999])
+        self.assertEqual([r["status"] for r in result["results"]],
+                         ["POSTED", "FAILED", "FAILED", "ALREADY_POSTED", "FAILED"])
+        self.assertEqual(self.journal_lines(bulk), self.journal_lines(single))
+        self.assertTrue(bulk.is_posted)
+        self.assertEqual(bulk.total, Decimal("125.00"))
+        self.assertTrue(bulk.gl_journal.posted)
+
+        again = bulk_post_invoices("AR", [bulk.pk])
+        self.assertEqual(again["results"][0]["status"], "ALREADY_POSTED")
+        self.assertEqual(JournalEntry.objects.count(), 2)
+
+
+class SegmentRollupTestCase(LedgerTestMixin, TestCase):
+    """Subtree totals joined through the segment closure table"""
+
+    def test_accounts_and_dimensions_roll_up(self):
+        assets = XX_Segment.objects.create(segment_type=self.account_type, code="1999", alias="Assets")
+        self.bank.parent_code = "1999"
+        self.bank.save()
+        petty = XX_Segment.objects.create(segment_type=self.account_type, code="1010", parent_code="1000")
+        division = XX_Segment.objects.create(segment_type=self.dept_type, code="900", alias="Division")
+        self.sales.parent_code = "900"
+        self.sales.save()
+
+        self.make_entry(date(2025, 1, 5), Decimal("100.00"), self.bank, self.revenue, dept=self.sales)
+        self.make_entry(date(2025, 1, 6), Decimal("30.00"), petty, self.revenue, dept=division)
+        self.make_entry(date(2025, 1, 7), Decimal("5.00"), petty, self.revenue, posted=False)
+
+        build_segment_rollup("Account")  # warms the segment registry
+        # Segments, closed periods, one grouped join
+        with self.assertNumQueries(3):
+            rows = {r["code"]: r for r in build_segment_rollup("Account", root=assets.pk)}
+        self.assertEqual(set(rows), {"1999", "1000", "1010"})
+        self.assertEqual(rows["1999"]["debit"], Decimal("130.00"))
+        self.assertEqual(rows["1000"]["balance"], Decimal("130.00"))
+        self.assertEqual(rows["1010"]["debit"], Decimal("30.00"))
+
+        rows = {r["code"]: r for r in build_segment_rollup(self.dept_type.pk)}
+        self.assertEqual((rows["900"]["credit"], rows["100"]["credit"]), (Decimal("130.00"), Decimal("100.00")))
+
+        resp = self.client.get("/api/reports/segment-rollup/", {"segment_type": "Department", "root": self.sales.pk})
+        self.assertEqual([(r["code"], r["credit"]) for r in resp.json()["data"]], [("100", 100.0)])
+
+
+class SegmentRuleMatcherTestCase(LedgerTestMixin, TestCase):
+    def setUp(self):
+        super().setUp()
+        from ar.models import Customer
+        from .models import SegmentAssignmentRule
+        self.customer = Customer.objects.create(code="C1", name="Acme", currency=self.currency)
+        self.other = Customer.objects.create(code="C2", name="Other", currency=self.currency)
+        self.marketing = XX_Segment.objects.create(segment_type=self.dept_type, code="200", alias="Marketing")
+        SegmentAssignmentRule.objects.create(name="Default", account_segment=self.revenue, department_segment=self.sales)
+        self.specific = SegmentAssignmentRule.objects.create(
+            name="Acme", account_segment=self.revenue, customer=self.customer,
+            department_segment=self.marketing, priority=10,
+        )
+
+    def test_most_specific_rule_is_resolved_in_memory(self):
+        from .distribution_services import get_default_segments_for_account
+
+        get_default_segments_for_account("4000", customer=self.customer)
+        with self.assertNumQueries(0):
+            acme = get_default_segments_for_account("4000", customer=self.customer)
+            other = get_default_segments_for_account("4000", customer=self.other)
+        self.assertIn({"segment_type": self.dept_type.pk, "segment": self.marketing.pk}, acme)
+        self.assertIn({"segment_type": self.dept_type.pk, "segment": self.sales.pk}, other)
+
+        self.specific.is_active = False
+        self.specific.save()
+        acme = get_default_segments_for_account("4000", customer=self.customer)
+        self.assertIn({"segment_type": self.dept_type.pk, "segment": self.sales.pk}, acme)
+
+    def test_rule_changes_from_other_processes_are_picked_up(self):
+        from core.cache_versions import bump_version
+        from .distribution_services import get_default_segments_for_account, rule_matcher
+        from .models import SegmentAssignmentRule
+
+        get_default_segments_for_account("4000", customer=self.customer)
+        # Another process deactivates the rule: only the shared version row tells this one
+        SegmentAssignmentRule.objects.filter(pk=self.specific.pk).update(is_active=False)
+        bump_version(rule_matcher.VERSION_KEY)
+        with override_settings(CACHE_VERSION_CHECK_SECONDS=0):
+            acme = get_default_segments_for_account("4000", customer=self.customer)
+        self.assertIn({"segment_type": self.dept_type.pk, "segment": self.sales.pk}, acme)
+
+
+class StreamingExportTestCase(LedgerTestMixin, TestCase):
+    def test_journal_csv_is_streamed(self):
+        """Journal export streams one CSV row per line"""
+        self.make_entry(date(2025, 1, 5), Decimal("100.00"), self.bank, self.revenue)
+        self.make_entry(date(2025, 1, 6), Decimal("7.50"), self.bank, self.revenue)
+
+        resp = self.client.get("/api/journals/export/", {"file_type": "csv"})
+        self.assertTrue(resp.streaming)
+        body = b"".join(resp.streaming_content).decode("utf-8-sig").splitlines()
+        self.assertEqual(len(body), 1 + 4)
+        self.assertTrue(body[1].endswith("1000,Bank,100.00,0.00"))
+
+    def test_journal_xlsx_is_written_in_write_only_mode(self):
+        from io import BytesIO
+        from openpyxl import load_workbook
+
+        self.make_entry(date(2025, 1, 5), Decimal("100.00"), self.bank, self.revenue)
+        resp = self.client.get("/api/journals/export/", {"file_type": "xlsx"})
+        ws = load_workbook(BytesIO(b"".join(resp.streaming_content))).active
+        self.assertEqual(ws.max_row, 3)
+        self.assertEqual(ws.cell(row=2, column=8).value, 100.0)
+
+
+class ReportJobTestCase(LedgerTestMixin, TestCase):
+    def setUp(self):
+        import tempfile
+        from django.test import override_settings
+
+        super().setUp()
+        self.artifacts = tempfile.TemporaryDirectory()
+        self.addCleanup(self.artifacts.cleanup)
+        settings_override = override_settings(REPORT_ARTIFACT_ROOT=self.artifacts.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
+    def submit(self, **params):
+        resp = self.client.post("/api/reports/jobs/", {
+            "report_type": "trial_balance", "file_format": "csv", "params": params,
+        }, content_type="application/json")
+        return resp.status_code, resp.json()
+
+    def test_submit_build_download_and_dedupe_until_ledger_changes(self):
+        from .report_job_services import claim_jobs, run_report_job
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.make_entry(date(2025, 1, 5), Decimal("100.00"), self.bank, self.revenue)
+
+        code, job = self.submit(date_from="2025-01-01")
+        self.assertEqual((code, job["status"], job["deduplicated"]), (202, "QUEUED", False))
+        self.assertEqual(self.client.get(f"/api/reports/jobs/{job['id']}/download/").status_code, 409)
+
+        self.assertEqual(claim_jobs(5), [job["id"]])
+        self.assertEqual(claim_jobs(5), [])
+        self.assertEqual(run_report_job(job["id"]), "SUCCEEDED")
+
+        resp = self.client.get(f"/api/reports/jobs/{job['id']}/download/")
+        body = b"".join(resp.streaming_content).decode("utf-8-sig").splitlines()
+        self.assertEqual(body[0], "Account Code,Account Name,Debit,Credit")
+        self.assertEqual(body[1], "1000,Bank,100.00,0.00")
+
+        # Same params (in another spelling) reuse the stored result
+        code, again = self.submit(date_from="2025-1-1")
+        self.assertEqual((code, again["id"], again["deduplicated"]), (200, job["id"], True))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            _, dr, cr = self.make_entry(date(2025, 1, 6), Decimal("5.00"), self.bank, self.revenue)
+        code, fresh = self.submit(date_from="2025-01-01")
+        self.assertEqual(code, 202)
+        self.assertNotEqual(fresh["id"], job["id"])
+
+        # Editing a line alone also makes stored results stale
+        claim_jobs(5)
+        run_report_job(fresh["id"])
+        with self.captureOnCommitCallbacks(execute=True):
+            for line, field in ((dr, "debit"), (cr, "credit")):
+                setattr(line, field, Decimal("7.00"))
+                line.save()
+        code, edited = self.submit(date_from="2025-01-01")
+        self.assertEqual(code, 202)
+        self.assertNotEqual(edited["id"], fresh["id"])
+
+    def test_json_artifact(self):
+        import json
+        from .report_job_services import claim_jobs, run_report_job, submit_report_job
+
+        self.make_entry(date(2025, 1, 5), Decimal("100.00"), self.bank, self.revenue)
+        job, _ = submit_report_job("journal_lines", "json", {})
+        claim_jobs(1)
+        self.assertEqual(run_report_job(job.pk), "SUCCEEDED")
+        resp = self.client.get(f"/api/reports/jobs/{job.pk}/download/")
+        body = json.loads(b"".join(resp.streaming_content))
+        self.assertEqual(body["report_type"], "journal_lines")
+        self.assertEqual([(row["Account Code"], row["Debit"]) for row in body["data"]],
+                         [("1000", "100.00"), ("4000", "0.00")])
+
+    def test_failed_build_is_recorded(self):
+        from .models import ReportJob
+        from .report_job_services import claim_jobs, run_report_job, submit_report_job
+
+        job, _ = submit_report_job("trial_balance", "json", {"segment_type": "Nope"})
+        claim_jobs(1)
+        self.assertEqual(run_report_job(job.pk), "FAILED")
+        job.refresh_from_db()
+        self.assertEqual(job.status, ReportJob.FAILED)
+        self.assertTrue(job.error)
+        with self.assertRaises(ValueError):
+            submit_report_job("no_such_report")
+
+
+class InvoiceListQueryCountTestCase(TestCase):
+    """Invoice list endpoints read annotated totals instead of computing them per invoice"""
+
+    def setUp(self):
+        from ap.models import Supplier
+        from ar.models import Customer
+        self.aed = Currency.objects.create(code="AED", name="Dirham", is_base=True)
+        self.usd = Currency.objects.create(code="USD", name="US Dollar")
+        self.customer = Customer.objects.create(code="C1", name="Acme", currency=self.aed)
+        self.supplier = Supplier.objects.create(code="S1", name="Supplier 1")
+
+    def make_ar(self, n):
+        from ar.models import ARInvoice, ARItem, ARPayment, ARPaymentAllocation
+        inv = ARInvoice.objects.create(customer=self.customer, number=f"AR-{n}", date=date(2025, 1, 1),
+                                       due_date=date(2025, 1, 31), currency=self.aed)
+        for amount in (Decimal("100.00"), Decimal("20.50")):
+            ARItem.objects.create(invoice=inv, description="Service", quantity=1, unit_price=amount)
+        inv.calculate_and_save_totals()
+        payment = ARPayment.objects.create(customer=self.customer, reference=f"ARP-{n}", date=date(2025, 1, 10),
+                                           total_amount=Decimal("11.00"), currency=self.usd)
+        ARPaymentAllocation.objects.create(payment=payment, invoice=inv, amount=Decimal("11.00"),
+                                           invoice_currency=self.aed, current_exchange_rate=Decimal("0.275"))
+        return inv
+
+    def make_ap(self, n):
+        from ap.models import APInvoice, APItem, APPayment, APPaymentAllocation
+        inv = APInvoice.objects.create(supplier=self.supplier, number=f"AP-{n}", date=date(2025, 1, 1),
+                                       due_date=date(2025, 1, 31), currency=self.aed)
+        APItem.objects.create(invoice=inv, description="Goods", quantity=2, unit_price=Decimal("30.00"))
+        inv.calculate_and_save_totals()
+        payment = APPayment.objects.create(supplier=self.supplier, reference=f"APP-{n}", date=date(2025, 1, 10),
+                                           total_amount=Decimal("25.00"), currency=self.aed)
+        APPaymentAllocation.objects.create(payment=payment, invoice=inv, amount=Decimal("25.00"),
+                                           invoice_currency=self.aed)
+        return inv
+
+    def list_queries(self, url):
+        with CaptureQueriesContext(connection) as queries:
+            resp = self.client.get(url)
+        self.assertEqual(resp.status_code, 200)
+        return len(queries), resp.json()["results"]
+
+    def assert_constant_list_queries(self, url, make):
+        make(0)
+        small, _ = self.list_queries(url)
+        for n in range(1, 8):
+            make(n)
+        large, rows = self.list_queries(url)
+        self.assertEqual(len(rows), 8)
+        self.assertEqual(large, small)
+        return rows
+
+    def test_ar_list(self):
+        rows = self.assert_constant_list_queries("/api/ar/invoices/", self.make_ar)
+        detail = self.client.get(f"/api/ar/invoices/{rows[0]['id']}/").json()
+        # 11.00 USD at 0.275 is 40.00 AED
+        self.assertEqual((rows[0]["paid_amount"], rows[0]["balance"]), ("40.00", "80.50"))
+        self.assertEqual((detail["paid_amount"], detail["balance"]), ("40.00", "80.50"))
+
+    def test_ap_list(self):
+        rows = self.assert_constant_list_queries("/api/ap/invoices/", self.make_ap)
+        detail = self.client.get(f"/api/ap/invoices/{rows[0]['id']}/").json()
+        self.assertEqual((rows[0]["paid_amount"], rows[0]["balance"]), ("25.00", "35.00"))
+        self.assertEqual((detail["paid_amount"], detail["balance"]), ("25.00", "35.00"))
+
+
+class ListPaginationTestCase(LedgerTestMixin, TestCase):
+    """Keyset pagination and ?fields= projection on the finance list endpoints"""
+
+    def test_cursor_pages_cover_every_row_once(self):
+        entries = [self.make_entry(date(2025, 1, 1 + n % 3), Decimal("10.00"), self.bank, self.revenue)[0]
+                   for n in range(7)]
+        url, seen = "/api/journals/?page_size=3", []
+        while url:
+            data = self.client.get(url).json()
+            seen += [row["id"] for row in data["results"]]
+            if len(seen) == 3:
+                # Rows added while paging land on the first page, not in the middle
+                self.make_entry(date(2025, 1, 1), Decimal("1.00"), self.bank, self.revenue)
+            url = data["next"]
+        self.assertEqual(seen, sorted((e.pk for e in entries), reverse=True))
+
+    def test_lookup_tables_are_not_paginated(self):
+        self.client.force_login(User.objects.create_user("clerk"))
+        for url in ("/api/currencies/", "/api/procurement/payments/rates/", "/api/segment/types/"):
+            resp = self.client.get(url)
+            self.assertEqual(resp.status_code, 200, url)
+            self.assertIsInstance(resp.json(), list, url)
+
+    def test_fields_projection_skips_nested_rows(self):
+        from ar.models import ARInvoice, ARItem, Customer
+        customer = Customer.objects.create(code="C1", name="Acme", currency=self.currency)
+        for n in range(3):
+            inv = ARInvoice.objects.create(customer=customer, number=f"INV-{n}", date=date(2025, 1, 1),
+                                           due_date=date(2025, 1, 31), currency=self.currency)
+            ARItem.objects.create(invoice=inv, description="Service", quantity=1, unit_price=Decimal("50.00"))
+            inv.calculate_and_save_totals()
+
+        with CaptureQueriesContext(connection) as full:
+            self.client.get("/api/ar/invoices/")
+        with CaptureQueriesContext(connection) as slim:
+            resp = self.client.get("/api/ar/invoices/", {"fields": "id,number,balance"})
+        rows = resp.json()["results"]
+        self.assertEqual([set(row) for row in rows], [{"id", "number", "balance"}] * 3)
+        self.assertEqual(rows[0]["balance"], "50.00")
+        self.assertLess(len(slim), len(full))
+
+        detail = self.client.get(f"/api/ar/invoices/{rows[0]['id']}/", {"fields": "number,total"}).json()
+        self.assertEqual(detail, {"number": "INV-2", "total": "50.00"})
+
+
+class InvoicePaymentStateTestCase(TestCase):
+    """Stored paid/outstanding amounts follow allocation changes on commit"""
+
+    def setUp(self):
+        from ar.models import ARInvoice, ARItem, Customer
+        self.aed = Currency.objects.create(code="AED", name="Dirham", is_base=True)
+        self.usd = Currency.objects.create(code="USD", name="US Dollar")
+        self.customer = Customer.objects.create(code="C1", name="Acme", currency=self.aed)
+        self.invoice = ARInvoice.objects.create(customer=self.customer, number="INV-1", date=date(2025, 1, 1),
+                                                due_date=date(2025, 1, 31), currency=self.aed)
+        ARItem.objects.create(invoice=self.invoice, description="Service", quantity=1, unit_price=Decimal("100.00"))
+        self.invoice.calculate_and_save_totals()
+        self.payments = 0
+
+    def allocate(self, amount, currency=None, rate=None):
+        from ar.models import ARPayment, ARPaymentAllocation
+        self.payments += 1
+        payment = ARPayment.objects.create(
+            customer=self.customer, reference=f"P-{self.payments}", date=date(2025, 1, 10),
+            total_amount=amount, currency=currency or self.aed,
+        )
+        return ARPaymentAllocation.objects.create(payment=payment, invoice=self.invoice, amount=amount,
+                                                  invoice_currency=self.aed, current_exchange_rate=rate)
+
+    def state(self):
+        self.invoice.refresh_from_db()
+        return self.invoice.amount_paid, self.invoice.amount_outstanding, self.invoice.payment_status
+
+    def test_deltas_are_applied_once_per_invoice_on_commit(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            self.allocate(Decimal("30.00"))
+        self.assertEqual(self.state(), (Decimal("30.00"), Decimal("70.00"), "PARTIALLY_PAID"))
+
+        with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+            allocations = [self.allocate(Decimal("10.00")) for _ in range(5)]
+            # 11.00 USD at 0.275 pays 40.00 AED
+            allocations.append(self.allocate(Decimal("11.00"), currency=self.usd, rate=Decimal("0.275")))
+            self.assertEqual(self.state()[0], Decimal("30.00"))
+        # One delta UPDATE and one status UPDATE for six allocations
+        invoice_updates = [q for q in queries if q["sql"].startswith('UPDATE "ar_arinvoice"')]
+        self.assertEqual(len(invoice_updates), 2)
+        self.assertEqual(self.state(), (Decimal("120.00"), Decimal("-20.00"), "PAID"))
+        self.assertIsNotNone(self.invoice.paid_at)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            allocations[0].amount = Decimal("5.00")
+            allocations[0].save()
+            allocations[-1].delete()
+            allocations[1].delete()
+        self.assertEqual(self.state(), (Decimal("65.00"), Decimal("35.00"), "PARTIALLY_PAID"))
+        self.assertIsNone(self.invoice.paid_at)
+        self.assertEqual(self.invoice.amount_paid, q2(self.invoice.paid_amount()))
+
+    def test_rolled_back_savepoint_and_uncomputed_invoice(self):
+        from django.db import transaction
+        from ar.models import ARInvoice
+
+        with self.captureOnCommitCallbacks(execute=True):
+            self.allocate(Decimal("40.00"))
+            try:
+                with transaction.atomic():
+                    self.allocate(Decimal("60.00"))
+                    raise ValueError("rolled back")
+            except ValueError:
+                pass
+        self.assertEqual(self.state(), (Decimal("40.00"), Decimal("60.00"), "PARTIALLY_PAID"))
+
+        # Invoices from before the columns existed are recomputed on their next allocation
+        ARInvoice.objects.filter(pk=self.invoice.pk).update(amount_paid=None, amount_outstanding=None)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.allocate(Decimal("60.00"))
+        self.assertEqual(self.state(), (Decimal("100.00"), Decimal("0.00"), "PAID"))
+
+    def test_repair_command(self):
+        from io import StringIO
+        from django.core.management import CommandError, call_command
+        from ar.models import ARInvoice
+
+        self.allocate(Decimal("25.00"))  # on-commit update never runs inside the test transaction
+        with self.assertRaisesMessage(CommandError, "1 invoice(s) drifted"):
+            call_command("repair_invoice_payment_state", "--verify", "--ar-only", stdout=StringIO())
+        self.assertIsNone(ARInvoice.objects.get(pk=self.invoice.pk).amount_paid)
+
+        out = StringIO()
+        call_command("repair_invoice_payment_state", "--ar-only", stdout=out)
+        self.assertIn("AR: 1 of 1 invoice(s) repaired", out.getvalue())
+        self.assertEqual(self.state(), (Decimal("25.00"), Decimal("75.00"), "PARTIALLY_PAID"))
+        call_command("repair_invoice_payment_state", "--verify", stdout=StringIO())
+
+
+class BulkAllocationTestCase(TestCase):
+    """One payment allocated to many invoices in a single request"""
+
+    def setUp(self):
+        from ar.models import Customer
+        from core.models import ExchangeRate
+        self.aed = Currency.objects.create(code="AED", name="Dirham", is_base=True)
+        self.usd = Currency.objects.create(code="USD", name="US Dollar")
+        ExchangeRate.objects.create(from_currency=self.usd, to_currency=self.aed, rate_date=date(2025, 1, 1),
+                                    rate=Decimal("3.672500"))
+        account_type = XX_SegmentType.objects.create(segment_name="Account", segment_type="account", length=4)
+        for code in ("1000", "1100", "7150", "8150"):
+            XX_Segment.objects.create(segment_type=account_type, code=code, alias=code)
+        self.customer = Customer.objects.create(code="C1", name="Acme", currency=self.aed)
+        self.invoices = 0
+
+    def make_invoices(self, count, amount=Decimal("100.00"), customer=None):
+        from ar.models import ARInvoice, ARItem
+        invoices = []
+        for _ in range(count):
+            self.invoices += 1
+            inv = ARInvoice.objects.create(customer=customer or self.customer, number=f"INV-{self.invoices}",
+                                           date=date(2025, 1, 1), due_date=date(2025, 1, 31), currency=self.aed)
+            ARItem.objects.create(invoice=inv, description="Service", quantity=1, unit_price=amount)
+            inv.calculate_and_save_totals()
+            invoices.append(inv)
+        return invoices
+
+    def make_payment(self, reference, total, currency=None):
+        from ar.models import ARPayment
+        return ARPayment.objects.create(customer=self.customer, reference=reference, date=date(2025, 1, 10),
+                                        total_amount=total, currency=currency or self.aed)
+
+    def journal(self, payment):
+        payment.refresh_from_db()
+        return sorted((l.account.code, l.debit, l.credit) for l in payment.gl_journal.lines.all())
+
+    def test_matches_single_allocation_posting(self):
+        from ar.models import ARPaymentAllocation
+        from .bulk_allocation_services import bulk_allocate_payment
+        from .services import post_ar_payment
+
+        amounts = [Decimal("27.00"), Decimal("10.10"), Decimal("5.55")]
+        single = self.make_payment("P-1", Decimal("50.00"), currency=self.usd)
+        with self.captureOnCommitCallbacks(execute=True):
+            for inv, amount in zip(self.make_invoices(3), amounts):
+                ARPaymentAllocation.objects.create(payment=single, invoice=inv, amount=amount)
+            post_ar_payment(single)
+
+        bulk = self.make_payment("P-2", Decimal("50.00"), currency=self.usd)
+        invoices = self.make_invoices(3)
+        with self.captureOnCommitCallbacks(execute=True):
+            result = bulk_allocate_payment("AR", bulk.pk, [
+                {"invoice": inv.pk, "amount": str(amount)} for inv, amount in zip(invoices, amounts)
+            ], post=True)
+        self.assertEqual((result["allocations"], result["allocated_total"]), (3, "42.65"))
+        self.assertEqual(self.journal(bulk), self.journal(single))
+        self.assertEqual(
+            list(bulk.allocations.order_by("invoice_id").values_list("invoice_currency_id", "current_exchange_rate")),
+            list(single.allocations.order_by("invoice_id").values_list("invoice_currency_id", "current_exchange_rate")),
+        )
+        invoices[0].refresh_from_db()
+        self.assertEqual(invoices[0].amount_paid, q2(invoices[0].paid_amount()))
+        self.assertEqual(invoices[0].payment_status, "PARTIALLY_PAID")
+
+    def test_query_count_independent_of_invoice_count(self):
+        from .bulk_allocation_services import bulk_allocate_payment
+
+        def run(count):
+            payment = self.make_payment(f"P-{count}", Decimal("1000.00"))
+            rows = [{"invoice": inv.pk, "amount": "100.00"} for inv in self.make_invoices(count)]
+            with CaptureQueriesContext(connection) as queries, self.captureOnCommitCallbacks(execute=True):
+                result = bulk_allocate_payment("AR", payment.pk, rows, post=True)
+            self.assertEqual(len(result["invoices_closed"]), count)
+            return len(queries)
+
+        run(1)  # creates the report version row
+        self.assertEqual(run(2), run(10))
+
+    def test_rejected_rows_write_nothing(self):
+        from ar.models import ARPaymentAllocation, Customer
+        other = Customer.objects.create(code="C2", name="Other", currency=self.aed)
+        ok, small = self.make_invoices(2)
+        foreign, = self.make_invoices(1, customer=other)
+        payment = self.make_payment("P-1", Decimal("500.00"))
+
+        resp = self.client.post(f"/api/ar/payments/{payment.pk}/bulk-allocate/", {"allocations": [
+            {"invoice": ok.pk, "amount": "60.00"},
+            {"invoice": small.pk, "amount": "100.01"},
+            {"invoice": foreign.pk, "amount": "1.00"},
+            {"invoice": ok.pk, "amount": "1.00"},
+            {"invoice": 999999, "amount": "1.00"},
+            {"invoice": ok.pk, "amount": "-5"},
+        ]}, content_type="application/json")
+        self.assertEqual(resp.status_code, 400)
+        self.assertEqual([(e["index"], e["error"]) for e in resp.json()["errors"]], [
+            (1, "Amount 100.01 exceeds open balance 100.00"),
+            (2, "Invoice belongs to a different customer"),
+            (3, "Invoice appears more than once"),
+            (4, "Invoice not found"),
+            (5, "Amount must be greater than zero"),
+        ])
+        self.assertFalse(ARPaymentAllocation.objects.exists())
+
+        resp = self.client.post(f"/api/ar/payments/{payment.pk}/bulk-allocate/", {"allocations": [
+            {"invoice": ok.pk, "amount": "60.00"}, {"invoice": small.pk, "amount": "100.00"},
+        ]}, content_type="application/json")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()["journal_entry"], None)
+        self.assertEqual(payment.unallocated_amount(), Decimal("340.00"))
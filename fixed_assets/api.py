@@ -23,6 +23,7 @@ from .serializers import (
     AssetAdjustmentSerializer, AssetApprovalSerializer
 )
 from .services import AssetDepreciationService, AssetGLService
+from .depreciation_engine import BatchDepreciationService
 
 
 class AssetCategoryViewSet(viewsets.ModelViewSet):
@@ -129,8 +130,7 @@ class AssetViewSet(viewsets.ModelViewSet):
                 asset.save()
                 
                 # Generate depreciation schedule
-                service = AssetDepreciationService()
-                service.generate_depreciation_schedule(asset)
+                BatchDepreciationService().generate_depreciation_schedules([asset])
             
             serializer = AssetSerializer(asset)
             return Response(serializer.data)
@@ -952,7 +952,7 @@ class DepreciationScheduleViewSet(viewsets.ModelViewSet):
             )
         
         try:
-            service = AssetDepreciationService()
+            service = BatchDepreciationService()
             schedules = service.calculate_monthly_depreciation(period_date)
             
             serializer = DepreciationScheduleSerializer(schedules, many=True)
@@ -1339,8 +1339,7 @@ class AssetAdjustmentViewSet(viewsets.ModelViewSet):
                 elif adjustment.adjustment_type == 'USEFUL_LIFE':
                     asset.useful_life_months = int(adjustment.new_value)
                     # Regenerate depreciation schedule
-                    service = AssetDepreciationService()
-                    service.generate_depreciation_schedule(asset)
+                    BatchDepreciationService().generate_depreciation_schedules([asset])
                 elif adjustment.adjustment_type == 'DEPRECIATION':
                     asset.accumulated_depreciation = Decimal(adjustment.new_value)
                     asset.update_net_book_value()
@@ -1529,8 +1528,7 @@ class AssetApprovalViewSet(viewsets.ReadOnlyModelViewSet):
                 asset.save()
                 
                 # Generate depreciation schedule
-                service = AssetDepreciationService()
-                service.generate_depreciation_schedule(asset)
+                BatchDepreciationService().generate_depreciation_schedules([asset])
                 
                 # Update approval
                 approval.approval_status = 'APPROVED'
@@ -0,0 +1 @@
+# Fixed assets management commands
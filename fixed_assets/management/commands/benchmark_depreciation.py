@@ -0,0 +1,102 @@
+"""
+Benchmark the batch depreciation engine against the per-asset service.
+
+Generates an asset register inside a transaction, builds full schedules for a
+sample of assets one at a time and for the whole register in batch, checks
+that the sample's schedules are identical, and rolls everything back.
+
+Usage: python manage.py benchmark_depreciation --assets 150000 --sample 200
+"""
+import random
+import time
+from datetime import date
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.models import Currency
+from fixed_assets.depreciation_engine import BatchDepreciationService
+from fixed_assets.models import Asset, AssetCategory, AssetLocation, DepreciationSchedule
+from fixed_assets.services import AssetDepreciationService
+from segment.models import XX_Segment, XX_SegmentType
+
+METHODS = ['STRAIGHT_LINE', 'DECLINING_BALANCE', 'SUM_OF_YEARS']
+
+
+class Command(BaseCommand):
+    help = 'Benchmark batch (NumPy) depreciation schedules vs. per-asset generation'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--assets', type=int, default=150_000, help='Assets in the generated register')
+        parser.add_argument('--sample', type=int, default=200, help='Assets generated one at a time for comparison')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        with transaction.atomic():
+            ids = self._generate(rng, options)
+            self._run(ids, options)
+            transaction.set_rollback(True)
+        self.stdout.write(self.style.SUCCESS('Benchmark data rolled back'))
+
+    def _generate(self, rng, options):
+        currency = Currency.objects.filter(is_base=True).first() or Currency.objects.create(
+            code='BMK', name='Benchmark', is_base=True
+        )
+        seg_type, _ = XX_SegmentType.objects.get_or_create(
+            segment_name='Account', defaults={'segment_type': 'account', 'length': 50}
+        )
+        account = XX_Segment.objects.filter(code='BMK-FA', node_type='child').first() or \
+            XX_Segment.objects.create(segment_type=seg_type, code='BMK-FA', alias='Benchmark Assets', node_type='child')
+        category = AssetCategory.objects.create(code='BMK', name='Benchmark', asset_account=account)
+        location = AssetLocation.objects.create(code='BMK', name='Benchmark')
+
+        n = options['assets']
+        self.stdout.write(f'Generating {n:,} assets...')
+        assets = []
+        for i in range(n):
+            cost = Decimal(rng.randrange(10_000, 10_000_000)) / 100
+            start = date(rng.randrange(2015, 2025), rng.randrange(1, 13), rng.choice([1, 15]))
+            assets.append(Asset(
+                asset_number=f'BMK-{i:07d}', name=f'Benchmark asset {i}', category=category, location=location,
+                acquisition_date=start, acquisition_cost=cost, currency=currency,
+                depreciation_method=rng.choice(METHODS), useful_life_years=Decimal(rng.randrange(3, 11)),
+                salvage_value=(cost / 10).quantize(Decimal('0.01')), depreciation_start_date=start,
+                status='CAPITALIZED', asset_account=account, accumulated_depreciation_account=account,
+                depreciation_expense_account=account,
+            ))
+        Asset.objects.bulk_create(assets, batch_size=5000)
+        return list(Asset.objects.filter(asset_number__startswith='BMK-').order_by('pk').values_list('pk', flat=True))
+
+    def _schedules(self, ids):
+        return list(DepreciationSchedule.objects.filter(asset_id__in=ids).order_by('asset_id', 'period_date')
+                    .values_list('asset_id', 'period_date', 'depreciation_amount', 'accumulated_depreciation',
+                                 'net_book_value'))
+
+    def _run(self, ids, options):
+        sample = ids[:options['sample']]
+        self.stdout.write(self.style.NOTICE('\n=== Full depreciation schedules ==='))
+
+        service = AssetDepreciationService()
+        t0 = time.perf_counter()
+        for asset in Asset.objects.filter(pk__in=sample):
+            service.generate_depreciation_schedule(asset)
+        single = time.perf_counter() - t0
+        expected = self._schedules(sample)
+        DepreciationSchedule.objects.filter(asset_id__in=sample).delete()
+        self.stdout.write(f'  per-asset {len(sample):>9,} assets {single:9.2f}s  {len(sample) / single:10.1f} assets/s')
+
+        engine = BatchDepreciationService()
+        t0 = time.perf_counter()
+        result = engine.generate_depreciation_schedules(Asset.objects.filter(pk__in=ids))
+        batch = time.perf_counter() - t0
+        self.stdout.write(f'  batch     {result["assets"]:>9,} assets {batch:9.2f}s  '
+                          f'{result["assets"] / batch:10.1f} assets/s  '
+                          f'({result["created"]:,} schedules, {result["fallbacks"]} Decimal fallbacks)')
+
+        if self._schedules(sample) != expected:
+            self.stdout.write(self.style.ERROR('Sample schedules differ from the per-asset service'))
+            return
+        speedup = (result['assets'] / batch) / (len(sample) / single)
+        self.stdout.write(self.style.SUCCESS(f'Sample schedules identical; speed-up x{speedup:.1f}'))
@@ -1,3 +1,82 @@
+import random
+from datetime import date
+from decimal import Decimal
+
 from django.test import TestCase
 
-# Create your tests here.
+from core.models import Currency
+from segment.models import XX_Segment, XX_SegmentType
+from .depreciation_engine import BatchDepreciationService
+from .models import Asset, AssetCategory, AssetLocation, DepreciationSchedule
+from .services import AssetDepreciationService
+
+
+class BatchDepreciationTestCase(TestCase):
+    """The batch engine must write exactly what the per-asset service writes"""
+
+    def setUp(self):
+        rng = random.Random(7)
+        currency = Currency.objects.create(code="AED", name="Dirham", is_base=True)
+        account_type = XX_SegmentType.objects.create(segment_name="Account", segment_type="account", length=4)
+        account = XX_Segment.objects.create(segment_type=account_type, code="1500", alias="Fixed Assets")
+        category = AssetCategory.objects.create(code="EQ", name="Equipment", asset_account=account)
+        location = AssetLocation.objects.create(code="HQ", name="Head Office")
+
+        params = [
+            # Declining balance sitting exactly on a half cent: the Decimal code rounds it down
+            ("DECLINING_BALANCE", Decimal("0.21"), Decimal("0.00"), Decimal("7.00"), date(2024, 1, 1)),
+            ("SUM_OF_YEARS", Decimal("1000.00"), Decimal("100.00"), Decimal("3.00"), date(2024, 2, 29)),
+            ("UNITS_OF_PRODUCTION", Decimal("500.00"), Decimal("0.00"), Decimal("2.00"), date(2024, 1, 1)),
+        ]
+        methods = ["STRAIGHT_LINE", "DECLINING_BALANCE", "SUM_OF_YEARS"]
+        for _ in range(30):
+            cost = Decimal(rng.randrange(100, 5_000_000)) / 100
+            params.append((
+                rng.choice(methods), cost, (cost * Decimal(rng.choice([0, 0, 5, 10])) / 100).quantize(Decimal("0.01")),
+                Decimal(rng.randrange(1, 8)), date(2023, rng.randrange(1, 13), rng.choice([1, 1, 15, 28])),
+            ))
+        self.assets = [
+            Asset.objects.create(
+                asset_number=f"FA-{n:04d}", name=f"Asset {n}", category=category, location=location,
+                acquisition_date=start, acquisition_cost=cost, currency=currency, depreciation_method=method,
+                useful_life_years=life, salvage_value=salvage, depreciation_start_date=start, status="CAPITALIZED",
+                asset_account=account, accumulated_depreciation_account=account, depreciation_expense_account=account,
+            )
+            for n, (method, cost, salvage, life, start) in enumerate(params)
+        ]
+        # A mid-month schedule that later months must carry forward from
+        DepreciationSchedule.objects.create(
+            asset=self.assets[3], period_date=date(2023, 12, 20), depreciation_amount=Decimal("1.00"),
+            accumulated_depreciation=Decimal("1.00"), net_book_value=self.assets[3].acquisition_cost - 1,
+        )
+
+    def snapshot_and_reset(self):
+        rows = list(
+            DepreciationSchedule.objects.order_by("asset_id", "period_date").values_list(
+                "asset_id", "period_date", "depreciation_amount", "accumulated_depreciation", "net_book_value")
+        )
+        DepreciationSchedule.objects.exclude(period_date=date(2023, 12, 20)).delete()
+        return rows
+
+    def test_full_schedules_match_per_asset_generation(self):
+        reference = AssetDepreciationService()
+        for asset in self.assets:
+            reference.generate_depreciation_schedule(asset)
+        expected = self.snapshot_and_reset()
+
+        engine = BatchDepreciationService()
+        result = engine.generate_depreciation_schedules(Asset.objects.all(), chunk_size=25)
+        self.assertEqual(result["assets"], len(self.assets))
+        self.assertEqual(self.snapshot_and_reset(), expected)
+        self.assertGreater(result["fallbacks"], 0)
+
+    def test_monthly_runs_match_per_asset_calculation(self):
+        months = [date(2024, 1, 1), date(2024, 2, 1), date(2024, 3, 15)]
+        reference = AssetDepreciationService()
+        expected_counts = [len(reference.calculate_monthly_depreciation(m)) for m in months]
+        expected = self.snapshot_and_reset()
+
+        engine = BatchDepreciationService()
+        counts = [len(engine.calculate_monthly_depreciation(m)) for m in months]
+        self.assertEqual(counts, expected_counts)
+        self.assertEqual(self.snapshot_and_reset(), expected)
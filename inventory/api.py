@@ -6,8 +6,16 @@ from rest_framework import viewsets, status, filters
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
+from rest_framework.views import APIView
 from django_filters.rest_framework import DjangoFilterBackend
 from django.db.models import Sum, F, Q
+from decimal import Decimal
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+
+from core.mixins import FieldProjectionMixin
+from core.pagination import KeysetCursorPagination
+from finance.exports import csv_response
 
 from .models import (
     InventoryBalance, StockMovement, StockAdjustment, StockAdjustmentLine,
@@ -18,6 +26,17 @@ from .serializers import (
     StockAdjustmentSerializer, StockAdjustmentLineSerializer,
     StockTransferSerializer, StockTransferLineSerializer
 )
+from .snapshot_services import nearest_snapshot, stock_as_of, valuation_by_warehouse
+
+
+def _as_of_date(value):
+    """A YYYY-MM-DD query parameter as a date (today when empty); None when malformed"""
+    if not value:
+        return timezone.localdate()
+    try:
+        return parse_date(value)
+    except ValueError:
+        return None
 
 
 class InventoryBalanceViewSet(viewsets.ModelViewSet):
@@ -78,10 +97,48 @@ class InventoryBalanceViewSet(viewsets.ModelViewSet):
         balances = self.get_queryset().filter(catalog_item_id=item_id)
         serializer = self.get_serializer(balances, many=True)
         return Response(serializer.data)
+    
+    @action(detail=False, methods=['get'])
+    def as_of(self, request):
+        """
+        Stock and weighted-average value at the end of ?date=YYYY-MM-DD,
+        replayed from the nearest inventory snapshot. Optional item_id,
+        warehouse_id and lot_number narrow the positions.
+        """
+        day = _as_of_date(request.query_params.get('date'))
+        if day is None:
+            return Response({"error": "date must be YYYY-MM-DD"}, status=status.HTTP_400_BAD_REQUEST)
+        item_id = request.query_params.get('item_id')
+        warehouse_id = request.query_params.get('warehouse_id')
+        if not all(v.isdigit() for v in (item_id, warehouse_id) if v):
+            return Response({"error": "item_id and warehouse_id must be ids"}, status=status.HTTP_400_BAD_REQUEST)
+        
+        positions = stock_as_of(
+            day,
+            catalog_item=int(item_id) if item_id else None,
+            warehouse=int(warehouse_id) if warehouse_id else None,
+            lot_number=request.query_params.get('lot_number'),
+        )
+        snapshot = nearest_snapshot(day)
+        return Response({
+            "as_of": day,
+            "snapshot_date": snapshot.snapshot_date if snapshot else None,
+            "positions": [
+                {
+                    "catalog_item": item,
+                    "warehouse": warehouse,
+                    "lot_number": lot,
+                    "quantity": str(quantity),
+                    "value": str(value.quantize(Decimal('0.01'))),
+                }
+                for (item, warehouse, lot), (quantity, value) in sorted(positions.items())
+            ],
+        })
 
 
-class StockMovementViewSet(viewsets.ModelViewSet):
+class StockMovementViewSet(FieldProjectionMixin, viewsets.ModelViewSet):
     """API for Stock Movement tracking"""
+    pagination_class = KeysetCursorPagination
     queryset = StockMovement.objects.select_related(
         'catalog_item', 'from_warehouse', 'to_warehouse', 'created_by'
     )
@@ -244,3 +301,51 @@ class StockTransferViewSet(viewsets.ModelViewSet):
 
 # Import timezone at top
 from django.utils import timezone
+
+
+class InventoryValuationReport(APIView):
+    """
+    Inventory valuation at the end of ?as_of=YYYY-MM-DD (default today), per
+    warehouse and item/lot. ?warehouse_id limits it to one warehouse;
+    ?format=csv streams the report one warehouse at a time.
+    """
+    # Same as the inventory viewsets: stock values are not public
+    permission_classes = [IsAuthenticated]
+    
+    def get(self, request):
+        day = _as_of_date(request.GET.get("as_of"))
+        if day is None:
+            return Response({"detail": "as_of must be YYYY-MM-DD"}, status=status.HTTP_400_BAD_REQUEST)
+        warehouse_id = request.GET.get("warehouse_id")
+        if warehouse_id and not warehouse_id.isdigit():
+            return Response({"detail": "warehouse_id must be a warehouse id"}, status=status.HTTP_400_BAD_REQUEST)
+        warehouses = valuation_by_warehouse(day, int(warehouse_id) if warehouse_id else None)
+        
+        if (request.GET.get("format") or request.GET.get("file_type") or "").lower() == "csv":
+            def rows():
+                for wh in warehouses:
+                    for line in wh["lines"]:
+                        yield [wh["warehouse"], line["sku"], line["item_name"], line["lot_number"],
+                               line["quantity"], f"{line['unit_cost']:.4f}", f"{line['value']:.2f}"]
+                    yield [wh["warehouse"], "", "Warehouse total", "", wh["quantity"], "", f"{wh['value']:.2f}"]
+            
+            header = ["Warehouse", "SKU", "Item", "Lot", "Quantity", "Unit Cost", "Value"]
+            return csv_response(rows(), header, f"inventory_valuation_{day}.csv")
+        
+        data = []
+        for wh in warehouses:
+            data.append({
+                **wh,
+                "quantity": str(wh["quantity"]),
+                "value": str(wh["value"]),
+                "lines": [
+                    {**line, "quantity": str(line["quantity"]), "value": str(line["value"]),
+                     "unit_cost": str(line["unit_cost"])}
+                    for line in wh["lines"]
+                ],
+            })
+        return Response({
+            "as_of": day,
+            "warehouses": data,
+            "total_value": str(sum((Decimal(wh["value"]) for wh in data), Decimal("0"))),
+        })
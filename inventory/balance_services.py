@@ -0,0 +1,322 @@
+"""
+Inventory balance engine.
+
+InventoryBalance quantities are never read, changed in Python and saved.
+Every change is one UPDATE that computes the new value from the stored one
+with F-expressions, so concurrent movements add up instead of overwriting
+each other:
+- stock in: quantity_on_hand + q, and for receipts the weighted average
+  cost (on hand * unit cost + value) / (on hand + q) from the same row;
+- stock out: quantity_on_hand - q WHERE quantity_on_hand - quantity_reserved >= q
+  (or quantity_on_hand >= q for adjustments and scrap, which may take
+  reserved stock);
+- reserve: quantity_reserved + q WHERE quantity_on_hand - quantity_reserved >= q;
+- release: quantity_reserved - q, never below zero.
+A conditional UPDATE that matches no row raises InsufficientStock; nothing is
+checked first and then written.
+
+retry_on_conflict wraps the service entry points: each call runs in its own
+transaction, and a lock conflict (database locked, deadlock, serialization
+failure) rolls it back and runs it again, up to BALANCE_RETRIES times.
+
+post_receipts() posts a batch of RECEIPT movements (a whole GRN) with a
+block of movement numbers, one bulk insert and one UPDATE per balance key
+(item, warehouse, location, lot).
+
+Posting a movement also updates the inventory snapshots its date falls into
+(snapshot_services.refresh_snapshots).
+"""
+import functools
+import random
+import time
+from collections import defaultdict
+from decimal import Decimal
+
+from django.db import OperationalError, transaction
+from django.db.models import Case, DecimalField, F, Func, Sum, Value, When
+from django.db.models.functions import Coalesce
+from django.db.models.lookups import GreaterThan, GreaterThanOrEqual
+from django.utils import timezone
+
+from core.sequences import next_document_numbers
+from .models import InventoryBalance, StockMovement
+import logging
+
+logger = logging.getLogger(__name__)
+
+INBOUND_TYPES = ('RECEIPT', 'TRANSFER_IN', 'PRODUCTION_IN', 'ADJUSTMENT_IN', 'PURCHASE_RETURN')
+OUTBOUND_TYPES = ('ISSUE', 'TRANSFER_OUT', 'PRODUCTION_OUT', 'ADJUSTMENT_OUT', 'SCRAP', 'SALES_RETURN')
+# Outbound movements that may only take unreserved stock
+AVAILABLE_ONLY_TYPES = ('ISSUE', 'TRANSFER_OUT', 'PRODUCTION_OUT')
+
+BALANCE_RETRIES = 5
+RETRY_DELAY = 0.05  # seconds, doubled per attempt
+MOVEMENT_BATCH_SIZE = 1000
+
+QUANTITY_FIELD = DecimalField(max_digits=15, decimal_places=4)
+
+
+class InsufficientStock(ValueError):
+    """A stock-out or reservation asked for more than the balance allows"""
+
+    def __init__(self, key, required, available):
+        self.key, self.required, self.available = key, required, available
+        super().__init__(f"Insufficient stock. Required: {required}, Available: {available}")
+
+
+def retry_on_conflict(func):
+    """
+    Run func in a transaction of its own and retry it on lock conflicts.
+
+    Inside an outer transaction func runs once: a conflict aborts the outer
+    transaction, so only its owner can retry.
+    """
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        if transaction.get_connection().in_atomic_block:
+            return func(*args, **kwargs)
+        for attempt in range(1, BALANCE_RETRIES + 1):
+            try:
+                with transaction.atomic():
+                    return func(*args, **kwargs)
+            except OperationalError as e:
+                if attempt == BALANCE_RETRIES:
+                    raise
+                logger.info("%s: lock conflict (%s), retry %d of %d", func.__qualname__, e, attempt, BALANCE_RETRIES - 1)
+                time.sleep(RETRY_DELAY * 2 ** (attempt - 1) * (1 + random.random()))
+    return wrapper
+
+
+def balance_key(catalog_item, warehouse, storage_location=None, lot_number=''):
+    """(catalog_item_id, warehouse_id, storage_location_id, lot_number); accepts instances or pks"""
+    def pk(value):
+        return getattr(value, 'pk', value)
+    return (pk(catalog_item), pk(warehouse), pk(storage_location), lot_number or '')
+
+
+def _quantity(value):
+    return Value(Decimal(value), output_field=QUANTITY_FIELD)
+
+
+class _DecimalDivide(Func):
+    """
+    lhs / rhs as a decimal. SQLite has no decimal arithmetic and divides
+    integer-valued NUMERICs as integers (7 / 2 = 3), so there the dividend
+    is taken as REAL; other databases divide the decimals as they are.
+    """
+    arg_joiner = ' / '
+    template = '(%(expressions)s)'
+    output_field = QUANTITY_FIELD
+
+    def as_sqlite(self, compiler, connection, **extra_context):
+        lhs, rhs = self.get_source_expressions()
+        lhs_sql, lhs_params = compiler.compile(lhs)
+        rhs_sql, rhs_params = compiler.compile(rhs)
+        return f"(CAST({lhs_sql} AS REAL) / {rhs_sql})", (*lhs_params, *rhs_params)
+
+
+def _available():
+    return F('quantity_on_hand') - F('quantity_reserved')
+
+
+def _balance_id(key):
+    item, warehouse, location, lot = key
+    return InventoryBalance.objects.filter(
+        catalog_item_id=item, warehouse_id=warehouse, storage_location_id=location, lot_number=lot,
+    ).values_list('pk', flat=True).first()
+
+
+def _balance_ids(keys):
+    """{balance key: InventoryBalance pk}, creating the rows that do not exist yet"""
+    def existing():
+        rows = InventoryBalance.objects.filter(
+            catalog_item_id__in={k[0] for k in keys},
+            warehouse_id__in={k[1] for k in keys},
+        ).values_list('pk', 'catalog_item_id', 'warehouse_id', 'storage_location_id', 'lot_number')
+        return {tuple(key): pk for pk, *key in rows if tuple(key) in keys}
+
+    ids = existing()
+    missing = [key for key in keys if key not in ids]
+    if missing:
+        InventoryBalance.objects.bulk_create(
+            [
+                InventoryBalance(catalog_item_id=item, warehouse_id=warehouse, storage_location_id=location, lot_number=lot)
+                for item, warehouse, location, lot in missing
+            ],
+            ignore_conflicts=True,
+        )
+        ids = existing()
+    return ids
+
+
+def _shortfall(key, quantity, balance_id, allow_reserved=False):
+    """InsufficientStock with what the balance held when the conditional UPDATE missed"""
+    row = InventoryBalance.objects.filter(pk=balance_id).values('quantity_on_hand', 'quantity_reserved').first()
+    if row is None:
+        available = Decimal('0')
+    elif allow_reserved:
+        available = row['quantity_on_hand']
+    else:
+        available = row['quantity_on_hand'] - row['quantity_reserved']
+    return InsufficientStock(key, quantity, available)
+
+
+def apply_inbound_deltas(totals):
+    """
+    Add {balance key: (quantity, value, last movement date)} to the balances
+    with one UPDATE per key. For a receipt the new unit cost is
+    (on hand * unit cost + value) / (on hand + quantity); pass value=None to
+    keep the balance's cost (transfers, adjustments).
+    """
+    ids = _balance_ids(set(totals))
+    now = timezone.now()
+    for key, (quantity, value, moved_at) in totals.items():
+        new_quantity = F('quantity_on_hand') + _quantity(quantity)
+        changes = {'quantity_on_hand': new_quantity, 'updated_at': now}
+        if moved_at is not None:
+            changes['last_movement_date'] = moved_at
+        if value is not None:
+            new_cost = _DecimalDivide(F('quantity_on_hand') * F('unit_cost') + _quantity(value), new_quantity)
+            changes['unit_cost'] = Case(
+                When(GreaterThan(new_quantity, _quantity(0)), then=new_cost),
+                default=F('unit_cost'),
+                output_field=QUANTITY_FIELD,
+            )
+        InventoryBalance.objects.filter(pk=ids[key]).update(**changes)
+
+
+def add_stock(key, quantity, value=None, moved_at=None):
+    """Add quantity to a balance (created if missing); value moves the weighted average cost"""
+    apply_inbound_deltas({key: (quantity, value, moved_at)})
+
+
+def remove_stock(key, quantity, moved_at=None, allow_reserved=False):
+    """
+    Take quantity off a balance if it has that much unreserved stock (any
+    stock on hand with allow_reserved). Raises InsufficientStock otherwise.
+    """
+    balance_id = _balance_id(key)
+    enough = GreaterThanOrEqual(F('quantity_on_hand') if allow_reserved else _available(), _quantity(quantity))
+    changes = {'quantity_on_hand': F('quantity_on_hand') - _quantity(quantity), 'updated_at': timezone.now()}
+    if moved_at is not None:
+        changes['last_movement_date'] = moved_at
+    if balance_id is None or not InventoryBalance.objects.filter(enough, pk=balance_id).update(**changes):
+        raise _shortfall(key, quantity, balance_id, allow_reserved)
+
+
+def reserve(key, quantity):
+    """Reserve quantity of a balance's unreserved stock; raises InsufficientStock if there is not enough"""
+    balance_id = _balance_id(key)
+    enough = GreaterThanOrEqual(_available(), _quantity(quantity))
+    if balance_id is None or not InventoryBalance.objects.filter(enough, pk=balance_id).update(
+        quantity_reserved=F('quantity_reserved') + _quantity(quantity), updated_at=timezone.now(),
+    ):
+        raise _shortfall(key, quantity, balance_id)
+    return balance_id
+
+
+def release(key, quantity):
+    """Release up to quantity of a balance's reservation; returns the balance pk, or None without a balance"""
+    balance_id = _balance_id(key)
+    if balance_id is not None:
+        InventoryBalance.objects.filter(pk=balance_id).update(
+            quantity_reserved=Case(
+                When(GreaterThanOrEqual(F('quantity_reserved'), _quantity(quantity)),
+                     then=F('quantity_reserved') - _quantity(quantity)),
+                default=_quantity(0),
+                output_field=QUANTITY_FIELD,
+            ),
+            updated_at=timezone.now(),
+        )
+    return balance_id
+
+
+def post_movement(movement):
+    """Apply a saved StockMovement to the balances it moves stock out of and into"""
+    from .snapshot_services import refresh_snapshots
+    refresh_snapshots(movement.movement_date, [
+        (movement.catalog_item_id, warehouse_id, movement.lot_number)
+        for types, warehouse_id in ((OUTBOUND_TYPES, movement.from_warehouse_id), (INBOUND_TYPES, movement.to_warehouse_id))
+        if movement.movement_type in types and warehouse_id
+    ])
+    if movement.movement_type in OUTBOUND_TYPES and movement.from_warehouse_id:
+        remove_stock(
+            balance_key(movement.catalog_item_id, movement.from_warehouse_id, movement.from_location_id, movement.lot_number),
+            movement.quantity,
+            moved_at=movement.movement_date,
+            allow_reserved=movement.movement_type not in AVAILABLE_ONLY_TYPES,
+        )
+    if movement.movement_type in INBOUND_TYPES and movement.to_warehouse_id:
+        add_stock(
+            balance_key(movement.catalog_item_id, movement.to_warehouse_id, movement.to_location_id, movement.lot_number),
+            movement.quantity,
+            # Only receipts move the weighted average cost
+            value=movement.quantity * movement.unit_cost if movement.movement_type == 'RECEIPT' else None,
+            moved_at=movement.movement_date,
+        )
+
+
+@transaction.atomic
+def post_receipts(movements):
+    """
+    Write unsaved RECEIPT StockMovements and add them to their balances.
+
+    Movements are numbered as one block and written with bulk_create
+    (MOVEMENT_BATCH_SIZE rows per insert). Returns the saved movements.
+    """
+    movements = list(movements)
+    if not movements:
+        return []
+    for movement in movements:
+        if movement.movement_type != 'RECEIPT' or not movement.to_warehouse_id:
+            raise ValueError("Only RECEIPT movements with a receiving warehouse can be posted as receipts")
+
+    prefix = f"STK-{timezone.now().strftime('%Y%m')}"
+    numbers = next_document_numbers(StockMovement, 'movement_number', prefix, len(movements), width=5)
+    totals = defaultdict(lambda: [Decimal('0'), Decimal('0'), None])
+    for movement, number in zip(movements, numbers):
+        movement.movement_number = number
+        movement.total_value = movement.quantity * movement.unit_cost
+        total = totals[balance_key(movement.catalog_item_id, movement.to_warehouse_id, movement.to_location_id, movement.lot_number)]
+        total[0] += movement.quantity
+        total[1] += movement.quantity * movement.unit_cost
+        total[2] = movement.movement_date if total[2] is None else max(total[2], movement.movement_date)
+    saved = StockMovement.objects.bulk_create(movements, batch_size=MOVEMENT_BATCH_SIZE)
+    from .snapshot_services import refresh_snapshots
+    refresh_snapshots(min(movement.movement_date for movement in movements),
+                      {(movement.catalog_item_id, movement.to_warehouse_id, movement.lot_number) for movement in movements})
+    apply_inbound_deltas({key: tuple(total) for key, total in totals.items()})
+    return saved
+
+
+def movement_totals(balances=None):
+    """
+    {balance key: quantity_on_hand implied by stock movements} (inbound minus
+    outbound), for all balances or the given InventoryBalance queryset.
+    """
+    totals = defaultdict(Decimal)
+    for sign, side, types in ((1, 'to', INBOUND_TYPES), (-1, 'from', OUTBOUND_TYPES)):
+        rows = StockMovement.objects.filter(movement_type__in=types, **{f'{side}_warehouse__isnull': False})
+        if balances is not None:
+            rows = rows.filter(catalog_item_id__in=balances.values('catalog_item_id'))
+        rows = rows.values_list('catalog_item_id', f'{side}_warehouse_id', f'{side}_location_id', 'lot_number') \
+            .annotate(total=Coalesce(Sum('quantity'), _quantity(0))).order_by()
+        for item, warehouse, location, lot, total in rows:
+            totals[(item, warehouse, location, lot or '')] += sign * total
+    return totals
+
+
+def balance_drift(balances=None):
+    """
+    Balances whose quantity on hand disagrees with their movements, or
+    whose quantities went negative: [(balance, quantity implied by movements)].
+    """
+    balances = InventoryBalance.objects.all() if balances is None else balances
+    expected = movement_totals(balances)
+    drift = []
+    for balance in balances:
+        key = balance_key(balance.catalog_item_id, balance.warehouse_id, balance.storage_location_id, balance.lot_number)
+        implied = expected.get(key, Decimal('0'))
+        if balance.quantity_on_hand != implied or balance.quantity_on_hand < 0 or balance.quantity_reserved < 0:
+            drift.append((balance, implied))
+    return drift
@@ -0,0 +1,55 @@
+"""
+Management command to store inventory snapshots, the starting points from
+which stock and value as of a past date are replayed.
+
+Schedule it after each month end (or more often for busy warehouses). It
+also re-takes snapshots that back-dated movements removed.
+
+Usage:
+    python manage.py take_inventory_snapshot                       # end of last month
+    python manage.py take_inventory_snapshot --date 2026-03-31
+    python manage.py take_inventory_snapshot --since 2025-01       # every month end from Jan 2025
+"""
+from datetime import datetime, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.utils import timezone
+
+from inventory.snapshot_services import take_snapshot
+
+
+def _month_ends(first, last):
+    """Month-end dates from first's month up to last (inclusive)"""
+    day = first.replace(day=1)
+    while True:
+        next_month = (day.replace(day=28) + timedelta(days=4)).replace(day=1)
+        month_end = next_month - timedelta(days=1)
+        if month_end > last:
+            return
+        yield month_end
+        day = next_month
+
+
+class Command(BaseCommand):
+    help = 'Store inventory snapshots (stock and weighted-average value per item, warehouse and lot)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--date', help='Snapshot the end of this day (YYYY-MM-DD)')
+        parser.add_argument('--since', help='Snapshot every month end from this month (YYYY-MM) to last month')
+
+    def handle(self, *args, **options):
+        last_month_end = timezone.localdate().replace(day=1) - timedelta(days=1)
+        try:
+            if options['date']:
+                days = [datetime.strptime(options['date'], '%Y-%m-%d').date()]
+            elif options['since']:
+                days = list(_month_ends(datetime.strptime(options['since'], '%Y-%m').date(), last_month_end))
+            else:
+                days = [last_month_end]
+        except ValueError as e:
+            raise CommandError(str(e))
+
+        for day in days:
+            snapshot = take_snapshot(day)
+            self.stdout.write(f'  {day}: {snapshot.line_count} position(s)')
+        self.stdout.write(self.style.SUCCESS(f'✓ Took {len(days)} inventory snapshot(s)'))
@@ -0,0 +1,47 @@
+# Generated by Django 5.2.7 on 2026-10-16 07:09
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0001_initial'),
+        ('inventory', '0002_initial'),
+        ('receiving', '0002_goodsreceipt_receipt_date_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='InventorySnapshot',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('snapshot_date', models.DateField(unique=True)),
+                ('taken_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('line_count', models.IntegerField(default=0)),
+            ],
+            options={
+                'db_table': 'inventory_snapshot',
+                'ordering': ['-snapshot_date'],
+            },
+        ),
+        migrations.CreateModel(
+            name='InventorySnapshotLine',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('lot_number', models.CharField(blank=True, max_length=100)),
+                ('quantity', models.DecimalField(decimal_places=4, max_digits=15)),
+                ('value', models.DecimalField(decimal_places=4, max_digits=18)),
+                ('catalog_item', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='catalog.catalogitem')),
+                ('snapshot', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lines', to='inventory.inventorysnapshot')),
+                ('warehouse', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='receiving.warehouse')),
+            ],
+            options={
+                'db_table': 'inventory_snapshot_line',
+                'indexes': [models.Index(fields=['snapshot', 'warehouse'], name='inventory_s_snapsho_ab802a_idx')],
+                'unique_together': {('snapshot', 'catalog_item', 'warehouse', 'lot_number')},
+            },
+        ),
+    ]
@@ -10,13 +10,14 @@ Features:
 - Cycle counting and stock adjustments
 """
 
-from django.db import models
+from django.db import models, transaction
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator
 from django.utils import timezone
 from django.db.models import Sum, F, Q
 from decimal import Decimal
 import json
+from core.sequences import next_document_number
 
 
 class InventoryBalance(models.Model):
@@ -259,69 +260,22 @@ class StockMovement(models.Model):
         self.total_value = self.quantity * self.unit_cost
         
         is_new = self.pk is None
-        super().save(*args, **kwargs)
-        
-        # Update inventory balances
-        if is_new:
-            self.update_inventory_balances()
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            
+            # Update inventory balances; a stock-out that does not fit rolls the movement back
+            if is_new:
+                self.update_inventory_balances()
     
     def _generate_movement_number(self):
         """Generate unique movement number"""
-        from django.db.models import Max
-        
         prefix = f"STK-{timezone.now().strftime('%Y%m')}"
-        last_movement = StockMovement.objects.filter(
-            movement_number__startswith=prefix
-        ).aggregate(Max('movement_number'))['movement_number__max']
-        
-        if last_movement:
-            last_number = int(last_movement.split('-')[-1])
-            new_number = last_number + 1
-        else:
-            new_number = 1
-        
-        return f"{prefix}-{new_number:05d}"
+        return next_document_number(StockMovement, 'movement_number', prefix, width=5)
     
     def update_inventory_balances(self):
-        """Update inventory balance records based on movement"""
-        
-        # Outbound movements (decrease inventory)
-        if self.movement_type in ['ISSUE', 'TRANSFER_OUT', 'PRODUCTION_OUT', 
-                                   'ADJUSTMENT_OUT', 'SCRAP', 'SALES_RETURN']:
-            if self.from_warehouse:
-                balance = InventoryBalance.get_or_create_balance(
-                    self.catalog_item,
-                    self.from_warehouse,
-                    self.from_location,
-                    self.lot_number
-                )
-                balance.quantity_on_hand -= self.quantity
-                balance.last_movement_date = self.movement_date
-                balance.save()
-        
-        # Inbound movements (increase inventory)
-        if self.movement_type in ['RECEIPT', 'TRANSFER_IN', 'PRODUCTION_IN', 
-                                   'ADJUSTMENT_IN', 'PURCHASE_RETURN']:
-            if self.to_warehouse:
-                balance = InventoryBalance.get_or_create_balance(
-                    self.catalog_item,
-                    self.to_warehouse,
-                    self.to_location,
-                    self.lot_number
-                )
-                balance.quantity_on_hand += self.quantity
-                balance.last_movement_date = self.movement_date
-                
-                # Update weighted average cost for receipts
-                if self.movement_type == 'RECEIPT':
-                    old_value = balance.quantity_on_hand * balance.unit_cost
-                    new_value = self.quantity * self.unit_cost
-                    new_qty = balance.quantity_on_hand + self.quantity
-                    
-                    if new_qty > 0:
-                        balance.unit_cost = (old_value + new_value) / new_qty
-                
-                balance.save()
+        """Update inventory balance records based on movement (atomic SQL updates, see balance_services)"""
+        from .balance_services import post_movement
+        post_movement(self)
 
 
 class StockAdjustment(models.Model):
@@ -415,21 +369,10 @@ class StockAdjustment(models.Model):
     
     def _generate_adjustment_number(self):
         """Generate unique adjustment number"""
-        from django.db.models import Max
-        
         prefix = f"ADJ-{timezone.now().strftime('%Y%m')}"
-        last_adj = StockAdjustment.objects.filter(
-            adjustment_number__startswith=prefix
-        ).aggregate(Max('adjustment_number'))['adjustment_number__max']
-        
-        if last_adj:
-            last_number = int(last_adj.split('-')[-1])
-            new_number = last_number + 1
-        else:
-            new_number = 1
-        
-        return f"{prefix}-{new_number:05d}"
+        return next_document_number(StockAdjustment, 'adjustment_number', prefix, width=5)
     
+    @transaction.atomic
     def post(self, user):
         """Post adjustment and create stock movements"""
         if self.status != 'APPROVED':
@@ -603,21 +546,10 @@ class StockTransfer(models.Model):
     
     def _generate_transfer_number(self):
         """Generate unique transfer number"""
-        from django.db.models import Max
-        
         prefix = f"TRF-{timezone.now().strftime('%Y%m')}"
-        last_transfer = StockTransfer.objects.filter(
-            transfer_number__startswith=prefix
-        ).aggregate(Max('transfer_number'))['transfer_number__max']
-        
-        if last_transfer:
-            last_number = int(last_transfer.split('-')[-1])
-            new_number = last_number + 1
-        else:
-            new_number = 1
-        
-        return f"{prefix}-{new_number:05d}"
+        return next_document_number(StockTransfer, 'transfer_number', prefix, width=5)
     
+    @transaction.atomic
     def ship(self, user):
         """Ship the transfer (create outbound movements)"""
         if self.status != 'DRAFT':
@@ -644,6 +576,7 @@ class StockTransfer(models.Model):
         self.status = 'IN_TRANSIT'
         self.save()
     
+    @transaction.atomic
     def receive(self, user):
         """Receive the transfer (create inbound movements)"""
         if self.status != 'IN_TRANSIT':
@@ -731,3 +664,41 @@ class StockTransferLine(models.Model):
     
     def __str__(self):
         return f"{self.transfer.transfer_number} - Line {self.line_number}"
+
+
+class InventorySnapshot(models.Model):
+    """
+    Stock position at the end of snapshot_date, per item, warehouse and lot
+    (see snapshot_services). Removed when a movement dated on or before
+    snapshot_date is posted, since its lines no longer hold.
+    """
+    snapshot_date = models.DateField(unique=True)
+    taken_at = models.DateTimeField(default=timezone.now)
+    line_count = models.IntegerField(default=0)
+
+    class Meta:
+        db_table = 'inventory_snapshot'
+        ordering = ['-snapshot_date']
+
+    def __str__(self):
+        return f"Inventory snapshot {self.snapshot_date}"
+
+
+class InventorySnapshotLine(models.Model):
+    """Quantity and weighted-average value of one item/warehouse/lot in a snapshot"""
+    snapshot = models.ForeignKey(InventorySnapshot, on_delete=models.CASCADE, related_name='lines')
+    catalog_item = models.ForeignKey('catalog.CatalogItem', on_delete=models.CASCADE, related_name='+')
+    warehouse = models.ForeignKey('receiving.Warehouse', on_delete=models.CASCADE, related_name='+')
+    lot_number = models.CharField(max_length=100, blank=True)
+    quantity = models.DecimalField(max_digits=15, decimal_places=4)
+    value = models.DecimalField(max_digits=18, decimal_places=4)
+
+    class Meta:
+        db_table = 'inventory_snapshot_line'
+        unique_together = [['snapshot', 'catalog_item', 'warehouse', 'lot_number']]
+        indexes = [
+            models.Index(fields=['snapshot', 'warehouse']),
+        ]
+
+    def __str__(self):
+        return f"{self.snapshot.snapshot_date} {self.catalog_item_id}@{self.warehouse_id}: {self.quantity}"
@@ -4,17 +4,22 @@ Inventory Management Services
 Business logic for inventory operations and integration with other modules.
 """
 
+from datetime import datetime, time
 from decimal import Decimal
-from django.db import transaction
+from django.db.models import F, Sum
 from django.utils import timezone
+from .balance_services import balance_key, post_receipts, release, reserve, retry_on_conflict
 from .models import InventoryBalance, StockMovement
+import logging
+
+logger = logging.getLogger(__name__)
 
 
 class InventoryService:
     """Service class for inventory operations"""
     
     @staticmethod
-    @transaction.atomic
+    @retry_on_conflict
     def receive_goods(grn, user):
         """
         Create inventory receipt from GoodsReceipt.
@@ -28,33 +33,41 @@ class InventoryService:
         Args:
             grn: GoodsReceipt instance
             user: User posting the receipt
+        
+        Returns:
+            The posted StockMovements
         """
         # Only CATEGORIZED_GOODS post to inventory
         if grn.grn_type != 'CATEGORIZED_GOODS':
             # Uncategorized goods and services don't post to inventory
-            print(f"✓ GRN {grn.grn_number}: {grn.grn_type} type - skipping inventory posting (goes to expenses)")
-            return
+            logger.info("GRN %s: %s type - skipping inventory posting (goes to expenses)", grn.grn_number, grn.grn_type)
+            return []
         
         # CATEGORIZED_GOODS: Post to inventory
-        print(f"✓ GRN {grn.grn_number}: CATEGORIZED_GOODS type - posting to inventory")
-        
-        for line in grn.lines.all():
+        logger.info("GRN %s: CATEGORIZED_GOODS type - posting to inventory", grn.grn_number)
+        
+        movement_date = timezone.now()
+        if grn.receipt_date:
+            # receipt_date is a date; movements are stamped at the start of that day
+            movement_date = timezone.make_aware(datetime.combine(grn.receipt_date, time.min))
+        notes = f"Goods Receipt from PO {grn.po_header.po_number if grn.po_header else grn.po_reference}"
+        movements = []
+        for line in grn.lines.select_related('catalog_item').order_by('line_number'):
             # Skip if no quantity received
             if line.received_quantity <= 0:
                 continue
             
             # Skip if no catalog item
             if not line.catalog_item:
-                print(f"  ⚠ Line {line.line_number}: No catalog item - skipping")
+                logger.warning("GRN %s line %s: no catalog item - skipping", grn.grn_number, line.line_number)
                 continue
             
-            # Create stock movement for cataloged items
-            movement = StockMovement.objects.create(
+            movements.append(StockMovement(
                 movement_type='RECEIPT',
-                movement_date=grn.receipt_date or timezone.now(),
+                movement_date=movement_date,
                 catalog_item=line.catalog_item,
-                to_warehouse=grn.warehouse,
-                to_location=line.put_away_location,
+                to_warehouse_id=grn.warehouse_id,
+                to_location_id=line.storage_location_id,
                 quantity=line.received_quantity,
                 lot_number=line.lot_number or '',
                 serial_numbers=line.serial_numbers or [],
@@ -62,26 +75,20 @@ class InventoryService:
                 reference_type='GoodsReceipt',
                 reference_id=grn.id,
                 reference_number=grn.grn_number,
-                notes=f"Goods Receipt from PO {grn.po_header.po_number if grn.po_header else grn.po_reference}",
+                notes=notes,
                 created_by=user
-            )
-            
-            print(f"  ✓ Line {line.line_number}: Posted {line.received_quantity} {line.uom} of {line.catalog_item.item_name}")
-            
-            # Update inventory balance (already handled by StockMovement.save())
-            # But we can explicitly verify/update
-            balance = InventoryBalance.get_or_create_balance(
-                catalog_item=line.catalog_item,
-                warehouse=grn.warehouse,
-                storage_location=line.put_away_location,
-                lot_number=line.lot_number or ''
-            )
+            ))
+        
+        # Numbers, movements and balance updates are written in bulk, not line by line
+        post_receipts(movements)
+        logger.info("GRN %s: posted %d line(s) to warehouse %s", grn.grn_number, len(movements), grn.warehouse.code)
+        return movements
     
     @staticmethod
-    @transaction.atomic
+    @retry_on_conflict
     def issue_goods(catalog_item, warehouse, quantity, user, notes='', 
                     storage_location=None, lot_number='', reference_type='',
-                    reference_id=None, reference_number=''):
+                    reference_id=None, reference_number='', reserved=False):
         """
         Issue goods from inventory (for sales orders, production, etc.)
         
@@ -96,6 +103,8 @@ class InventoryService:
             reference_type: Type of reference document (e.g., 'SalesOrder')
             reference_id: ID of reference document
             reference_number: Number of reference document
+            reserved: The quantity was reserved for this issue (reserve_stock);
+                the reservation is released in the same transaction
         
         Returns:
             StockMovement instance
@@ -103,7 +112,11 @@ class InventoryService:
         Raises:
             ValueError: If insufficient stock
         """
-        # Check available quantity
+        if reserved:
+            release(balance_key(catalog_item, warehouse, storage_location, lot_number), quantity)
+        
+        # Early check for a clear error and the issue cost; the stock-out
+        # itself is a conditional UPDATE (see balance_services.remove_stock)
         balance = InventoryBalance.objects.filter(
             catalog_item=catalog_item,
             warehouse=warehouse,
@@ -137,7 +150,7 @@ class InventoryService:
         return movement
     
     @staticmethod
-    @transaction.atomic
+    @retry_on_conflict
     def transfer_stock(catalog_item, from_warehouse, to_warehouse, quantity, user,
                       from_location=None, to_location=None, lot_number='', notes=''):
         """
@@ -161,7 +174,8 @@ class InventoryService:
         Raises:
             ValueError: If insufficient stock
         """
-        # Check available quantity
+        # Early check for a clear error and the transfer cost; the stock-out
+        # itself is a conditional UPDATE (see balance_services.remove_stock)
         balance = InventoryBalance.objects.filter(
             catalog_item=catalog_item,
             warehouse=from_warehouse,
@@ -232,18 +246,21 @@ class InventoryService:
         if lot_number:
             query = query.filter(lot_number=lot_number)
         
-        total = Decimal('0')
-        for balance in query:
-            total += balance.quantity_available
-        
-        return total
+        total = query.aggregate(
+            available=Sum(F('quantity_on_hand') - F('quantity_reserved'))
+        )['available']
+        return total if total is not None else Decimal('0')
     
     @staticmethod
+    @retry_on_conflict
     def reserve_stock(catalog_item, warehouse, quantity, storage_location=None, 
                      lot_number=''):
         """
         Reserve stock for sales orders or production.
         
+        The reservation is one conditional UPDATE, so two concurrent
+        reservations can never both take the last available units.
+        
         Args:
             catalog_item: CatalogItem instance
             warehouse: Warehouse instance
@@ -255,31 +272,17 @@ class InventoryService:
             InventoryBalance instance
         
         Raises:
-            ValueError: If insufficient available stock
+            InsufficientStock (a ValueError): If insufficient available stock
         """
-        balance = InventoryBalance.get_or_create_balance(
-            catalog_item=catalog_item,
-            warehouse=warehouse,
-            storage_location=storage_location,
-            lot_number=lot_number
-        )
-        
-        if balance.quantity_available < quantity:
-            raise ValueError(
-                f"Insufficient available stock. Required: {quantity}, "
-                f"Available: {balance.quantity_available}"
-            )
-        
-        balance.quantity_reserved += quantity
-        balance.save()
-        
-        return balance
+        balance_id = reserve(balance_key(catalog_item, warehouse, storage_location, lot_number), quantity)
+        return InventoryBalance.objects.get(pk=balance_id)
     
     @staticmethod
+    @retry_on_conflict
     def unreserve_stock(catalog_item, warehouse, quantity, storage_location=None,
                        lot_number=''):
         """
-        Release reserved stock.
+        Release reserved stock (the reservation never goes below zero).
         
         Args:
             catalog_item: CatalogItem instance
@@ -289,20 +292,7 @@ class InventoryService:
             lot_number: Optional lot number
         
         Returns:
-            InventoryBalance instance
+            InventoryBalance instance, or None if there is no balance
         """
-        balance = InventoryBalance.objects.filter(
-            catalog_item=catalog_item,
-            warehouse=warehouse,
-            storage_location=storage_location,
-            lot_number=lot_number
-        ).first()
-        
-        if balance:
-            balance.quantity_reserved = max(
-                Decimal('0'),
-                balance.quantity_reserved - quantity
-            )
-            balance.save()
-        
-        return balance
+        balance_id = release(balance_key(catalog_item, warehouse, storage_location, lot_number), quantity)
+        return InventoryBalance.objects.get(pk=balance_id) if balance_id else None
@@ -0,0 +1,233 @@
+"""
+Point-in-time inventory: stock and value as of a past date.
+
+InventoryBalance holds only the current position. The position at the end
+of any day is rebuilt from StockMovements, starting from the nearest
+InventorySnapshot on or before that day, so a query replays only the
+movements since that snapshot rather than the whole history. Taking a
+snapshot regularly (take_inventory_snapshot, e.g. at every month end) keeps
+that replay bounded whatever the table size.
+
+Positions are per (catalog item, warehouse, lot) and valued at weighted
+average cost, as the balance engine values them: receipts add their cost,
+other inbound movements and all outbound movements move stock at the
+running average.
+
+Posting a movement dated on or before a snapshot day brings the snapshots
+from that day on up to date (refresh_snapshots). Only the positions the
+movement touched are replayed, from the last snapshot before it, so the
+snapshots stay usable without rerunning the command.
+"""
+from collections import defaultdict
+from datetime import datetime, time, timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from procurement.catalog.models import CatalogItem
+from procurement.receiving.models import Warehouse
+from .balance_services import INBOUND_TYPES, OUTBOUND_TYPES
+from .models import InventorySnapshot, InventorySnapshotLine, StockMovement
+
+SNAPSHOT_BATCH_SIZE = 2000
+REPLAY_CHUNK_SIZE = 5000
+
+ZERO = Decimal('0')
+
+
+def day_end(day):
+    """Aware datetime at which `day` ends (the start of the next day)"""
+    return timezone.make_aware(datetime.combine(day + timedelta(days=1), time.min))
+
+
+def _movements(after, until, catalog_item=None, warehouse=None, lot_number=None):
+    """Movement rows dated in [after, until), in posting order"""
+    rows = StockMovement.objects.filter(movement_date__lt=until)
+    if after is not None:
+        rows = rows.filter(movement_date__gte=after)
+    if catalog_item is not None:
+        rows = rows.filter(catalog_item=catalog_item)
+    if warehouse is not None:
+        rows = rows.filter(Q(from_warehouse=warehouse) | Q(to_warehouse=warehouse))
+    if lot_number is not None:
+        rows = rows.filter(lot_number=lot_number)
+    return rows.order_by('movement_date', 'pk').values_list(
+        'movement_type', 'catalog_item_id', 'from_warehouse_id', 'to_warehouse_id', 'lot_number', 'quantity', 'unit_cost',
+    ).iterator(chunk_size=REPLAY_CHUNK_SIZE)
+
+
+def _replay(positions, movements, warehouse_id=None):
+    """Apply movement rows to {(item, warehouse, lot): [quantity, value]}"""
+    for movement_type, item, from_warehouse, to_warehouse, lot, quantity, unit_cost in movements:
+        if movement_type in OUTBOUND_TYPES and from_warehouse and warehouse_id in (None, from_warehouse):
+            position = positions[(item, from_warehouse, lot or '')]
+            on_hand, value = position
+            position[0] = on_hand - quantity
+            position[1] = value - quantity * value / on_hand if on_hand > 0 and position[0] > 0 else ZERO
+        if movement_type in INBOUND_TYPES and to_warehouse and warehouse_id in (None, to_warehouse):
+            position = positions[(item, to_warehouse, lot or '')]
+            on_hand, value = position
+            if movement_type == 'RECEIPT':
+                position[1] = value + quantity * unit_cost
+            elif on_hand > 0:
+                position[1] = value + quantity * value / on_hand
+            position[0] = on_hand + quantity
+
+
+def refresh_snapshots(moved_at, keys):
+    """
+    Update the snapshots a just-posted movement dated `moved_at` (date or
+    datetime) falls into, for the (catalog_item_id, warehouse_id, lot_number)
+    positions it changed. The positions are replayed from the last snapshot
+    before `moved_at` through the latest snapshot in one pass, and each
+    snapshot's lines for them are rewritten.
+    """
+    if isinstance(moved_at, datetime):
+        moved_at = timezone.localtime(moved_at).date() if timezone.is_aware(moved_at) else moved_at.date()
+    # Locked so concurrent back-dated postings rewrite the lines one after the other
+    snapshots = list(InventorySnapshot.objects.select_for_update().filter(snapshot_date__gte=moved_at)
+                     .order_by('snapshot_date'))
+    if not snapshots:
+        return
+    keys = {(item, warehouse, lot or '') for item, warehouse, lot in keys}
+    items, warehouses = {key[0] for key in keys}, {key[1] for key in keys}
+
+    positions = defaultdict(lambda: [ZERO, ZERO])
+    rows = StockMovement.objects.filter(
+        Q(from_warehouse__in=warehouses) | Q(to_warehouse__in=warehouses),
+        catalog_item__in=items, movement_date__lt=day_end(snapshots[-1].snapshot_date),
+    )
+    base = InventorySnapshot.objects.filter(snapshot_date__lt=moved_at).order_by('-snapshot_date').first()
+    if base is not None:
+        for item, warehouse, lot, quantity, value in base.lines.filter(
+                catalog_item__in=items, warehouse__in=warehouses).values_list(
+                'catalog_item_id', 'warehouse_id', 'lot_number', 'quantity', 'value'):
+            positions[(item, warehouse, lot)] = [quantity, value]
+        rows = rows.filter(movement_date__gte=day_end(base.snapshot_date))
+    rows = rows.order_by('movement_date', 'pk').values_list(
+        'movement_date', 'movement_type', 'catalog_item_id', 'from_warehouse_id', 'to_warehouse_id', 'lot_number',
+        'quantity', 'unit_cost',
+    ).iterator(chunk_size=REPLAY_CHUNK_SIZE)
+
+    states = {}
+    row = next(rows, None)
+    for snapshot in snapshots:
+        end = day_end(snapshot.snapshot_date)
+        while row is not None and row[0] < end:
+            _replay(positions, (row[1:],))
+            row = next(rows, None)
+        for position in positions.values():
+            # As stored, so later snapshots continue from what a reader sees
+            position[1] = position[1].quantize(Decimal('0.0001'))
+        states[snapshot.pk] = {key: tuple(positions[key]) for key in keys}
+
+    existing = {
+        (line.snapshot_id, line.catalog_item_id, line.warehouse_id, line.lot_number): line
+        for line in InventorySnapshotLine.objects.filter(
+            snapshot__in=snapshots, catalog_item__in=items, warehouse__in=warehouses)
+    }
+    updated, created, deleted, counts = [], [], [], {}
+    for snapshot in snapshots:
+        for (item, warehouse, lot), (quantity, value) in states[snapshot.pk].items():
+            line = existing.get((snapshot.pk, item, warehouse, lot))
+            if not (quantity or value):
+                if line is not None:
+                    deleted.append(line.pk)
+                    counts[snapshot.pk] = counts.get(snapshot.pk, 0) - 1
+            elif line is None:
+                created.append(InventorySnapshotLine(snapshot=snapshot, catalog_item_id=item, warehouse_id=warehouse,
+                                                     lot_number=lot, quantity=quantity, value=value))
+                counts[snapshot.pk] = counts.get(snapshot.pk, 0) + 1
+            elif (line.quantity, line.value) != (quantity, value):
+                line.quantity, line.value = quantity, value
+                updated.append(line)
+    InventorySnapshotLine.objects.bulk_update(updated, ['quantity', 'value'], batch_size=SNAPSHOT_BATCH_SIZE)
+    InventorySnapshotLine.objects.bulk_create(created, batch_size=SNAPSHOT_BATCH_SIZE)
+    InventorySnapshotLine.objects.filter(pk__in=deleted).delete()
+    for snapshot_id, change in counts.items():
+        if change:
+            InventorySnapshot.objects.filter(pk=snapshot_id).update(line_count=F('line_count') + change)
+
+
+def nearest_snapshot(day):
+    """The latest snapshot taken for `day` or before, or None"""
+    return InventorySnapshot.objects.filter(snapshot_date__lte=day).order_by('-snapshot_date').first()
+
+
+def stock_as_of(day, catalog_item=None, warehouse=None, lot_number=None):
+    """
+    {(catalog_item_id, warehouse_id, lot_number): (quantity, value)} at the
+    end of `day`, optionally for one item, warehouse and/or lot. Positions
+    with neither quantity nor value are left out.
+    """
+    positions = defaultdict(lambda: [ZERO, ZERO])
+    after = None
+    snapshot = nearest_snapshot(day)
+    if snapshot is not None:
+        lines = snapshot.lines.all()
+        if catalog_item is not None:
+            lines = lines.filter(catalog_item=catalog_item)
+        if warehouse is not None:
+            lines = lines.filter(warehouse=warehouse)
+        if lot_number is not None:
+            lines = lines.filter(lot_number=lot_number)
+        for item, warehouse_id, lot, quantity, value in lines.values_list(
+                'catalog_item_id', 'warehouse_id', 'lot_number', 'quantity', 'value'):
+            positions[(item, warehouse_id, lot)] = [quantity, value]
+        after = day_end(snapshot.snapshot_date)
+    warehouse_id = getattr(warehouse, 'pk', warehouse)
+    _replay(positions, _movements(after, day_end(day), catalog_item, warehouse, lot_number), warehouse_id)
+    return {key: (quantity, value) for key, (quantity, value) in positions.items() if quantity or value}
+
+
+@transaction.atomic
+def take_snapshot(day):
+    """Store the position at the end of `day`, replacing any snapshot of that day"""
+    InventorySnapshot.objects.filter(snapshot_date=day).delete()
+    positions = stock_as_of(day)
+    snapshot = InventorySnapshot.objects.create(snapshot_date=day, line_count=len(positions))
+    InventorySnapshotLine.objects.bulk_create(
+        [
+            InventorySnapshotLine(snapshot=snapshot, catalog_item_id=item, warehouse_id=warehouse, lot_number=lot,
+                                  quantity=quantity, value=value.quantize(Decimal('0.0001')))
+            for (item, warehouse, lot), (quantity, value) in positions.items()
+        ],
+        batch_size=SNAPSHOT_BATCH_SIZE,
+    )
+    return snapshot
+
+
+def valuation_by_warehouse(day, warehouse=None):
+    """
+    Yield the valuation at the end of `day` one warehouse at a time:
+    {"warehouse", "warehouse_name", "lines": [{"sku", "item_name",
+    "lot_number", "quantity", "value", "unit_cost"}], "quantity", "value"}.
+    Only one warehouse's positions are held in memory at once.
+    """
+    warehouses = Warehouse.objects.order_by('code')
+    if warehouse is not None:
+        warehouses = warehouses.filter(pk=getattr(warehouse, 'pk', warehouse))
+    for wh in warehouses:
+        positions = stock_as_of(day, warehouse=wh)
+        if not positions:
+            continue
+        items = CatalogItem.objects.in_bulk({item for item, _, _ in positions})
+        lines = []
+        for (item, _, lot), (quantity, value) in sorted(positions.items(), key=lambda p: (items[p[0][0]].sku, p[0][2])):
+            lines.append({
+                "sku": items[item].sku,
+                "item_name": items[item].name,
+                "lot_number": lot,
+                "quantity": quantity,
+                "value": value.quantize(Decimal('0.01')),
+                "unit_cost": (value / quantity).quantize(Decimal('0.0001')) if quantity else ZERO,
+            })
+        yield {
+            "warehouse": wh.code,
+            "warehouse_name": wh.name,
+            "lines": lines,
+            "quantity": sum((line["quantity"] for line in lines), ZERO),
+            "value": sum((line["value"] for line in lines), ZERO),
+        }
@@ -0,0 +1,325 @@
+import multiprocessing
+import os
+import random
+import sqlite3
+import tempfile
+from datetime import date, datetime, time
+from decimal import Decimal
+from unittest import skipUnless
+
+from django.apps import apps
+from django.contrib.auth.models import User
+from django.core.management.sql import emit_post_migrate_signal
+from django.db import connection, connections
+from django.test import SimpleTestCase, TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from ap.models import Supplier
+from core.models import Currency
+from procurement.catalog.models import CatalogCategory, CatalogItem, UnitOfMeasure
+from procurement.purchase_orders.models import POHeader, POLine
+from procurement.receiving.models import GoodsReceipt, GRNLine, Warehouse
+from .balance_services import InsufficientStock, balance_drift, retry_on_conflict
+from .models import InventoryBalance, InventorySnapshot, StockMovement
+from .services import InventoryService
+from .snapshot_services import stock_as_of, take_snapshot
+
+
+class BulkReceiptTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user("receiver")
+        self.currency = Currency.objects.create(code="AED", name="Dirham", is_base=True)
+        self.supplier = Supplier.objects.create(code="S1", name="Supplier 1")
+        self.uom = UnitOfMeasure.objects.create(code="EA", name="Each")
+        category = CatalogCategory.objects.create(code="GEN", name="General")
+        self.items = [
+            CatalogItem.objects.create(sku=f"SKU-{n}", item_code=f"IT-{n}", name=f"Item {n}",
+                                       category=category, unit_of_measure=self.uom, list_price=Decimal("5.00"), currency=self.currency)
+            for n in range(3)
+        ]
+        self.warehouse = Warehouse.objects.create(code="WH1", name="Main")
+
+    def receive(self, lines, po_header=None):
+        """lines: (item, quantity, unit price, lot) or (item, quantity, unit price, lot, PO line)"""
+        grn = GoodsReceipt.objects.create(
+            supplier=self.supplier, warehouse=self.warehouse, received_by=self.user,
+            receipt_date=date(2026, 3, 1), status="IN_PROGRESS", grn_type="CATEGORIZED_GOODS", po_header=po_header,
+        )
+        GRNLine.objects.bulk_create([
+            GRNLine(goods_receipt=grn, line_number=n, catalog_item=item, item_description=item.name,
+                    ordered_quantity=quantity, received_quantity=quantity, unit_price=price,
+                    unit_of_measure=self.uom, lot_number=lot, po_line_reference=str(po_line[0].pk) if po_line else "")
+            for n, (item, quantity, price, lot, *po_line) in enumerate(lines, 1)
+        ])
+        return grn
+
+    def balance(self, item, lot=""):
+        return InventoryBalance.objects.get(catalog_item=item, warehouse=self.warehouse, lot_number=lot)
+
+    def test_receipt_posts_in_bulk(self):
+        a, b, c = self.items
+        # 10 on hand at 2.00 before the receipt
+        StockMovement.objects.create(movement_type="RECEIPT", catalog_item=a, to_warehouse=self.warehouse,
+                                     quantity=Decimal("10"), unit_cost=Decimal("2.00"), created_by=self.user)
+        lines = [(a, Decimal("1"), Decimal("3.00"), "")] * 5 + [(b, Decimal("2"), Decimal("4.00"), "L1")] * 30 \
+            + [(b, Decimal("1"), Decimal("1.00"), "L2"), (c, Decimal("3"), Decimal("0.50"), "")]
+
+        self.receive(lines[:4] + lines[5:7] + lines[-2:]).post_to_inventory(posted_by=self.user)
+        small = self.receive(lines[:1] + lines[5:6] + lines[-2:])
+        with CaptureQueriesContext(connection) as small_queries:
+            small.post_to_inventory(posted_by=self.user)
+        large = self.receive(lines)
+        with CaptureQueriesContext(connection) as large_queries:
+            large.post_to_inventory(posted_by=self.user)
+        # Same (existing) balance keys, so the same statements whatever the line count
+        self.assertEqual(len(large_queries), len(small_queries))
+
+        self.assertEqual(self.balance(a).quantity_on_hand, Decimal("20"))
+        # (10 x 2.00 + 10 x 3.00) / 20, then more at 3.00 on top of that
+        self.assertEqual(self.balance(a).unit_cost, Decimal("2.5000"))
+        self.assertEqual(self.balance(b, "L1").quantity_on_hand, Decimal("66"))
+        self.assertEqual(self.balance(b, "L1").unit_cost, Decimal("4.0000"))
+        self.assertEqual(self.balance(b, "L2").quantity_on_hand, Decimal("3"))
+        self.assertEqual(self.balance(c).quantity_on_hand, Decimal("9"))
+        self.assertEqual(InventoryBalance.objects.count(), 4)
+
+        movements = StockMovement.objects.filter(reference_number=large.grn_number).order_by("movement_number")
+        self.assertEqual(movements.count(), len(lines))
+        numbers = [int(number.rsplit("-", 1)[1]) for number in movements.values_list("movement_number", flat=True)]
+        self.assertEqual(numbers, list(range(numbers[0], numbers[0] + len(lines))))
+        self.assertEqual(movements.filter(catalog_item=c).get().total_value, Decimal("1.50"))
+
+    def test_receipt_updates_po_received_quantities(self):
+        a, b, _ = self.items
+        po = POHeader.objects.create(title="Order", currency=self.currency, created_by=self.user)
+        line_a = POLine.objects.create(po_header=po, line_number=1, item_description="Item 0", catalog_item=a,
+                                       quantity=Decimal("10"), unit_of_measure=self.uom, unit_price=Decimal("5.00"))
+        line_b = POLine.objects.create(po_header=po, line_number=2, item_description="Item 1", catalog_item=b,
+                                       quantity=Decimal("4"), unit_of_measure=self.uom, unit_price=Decimal("5.00"))
+
+        self.receive([(a, Decimal("4"), Decimal("5.00"), "", line_a), (a, Decimal("6"), Decimal("5.00"), "", line_a),
+                      (b, Decimal("1"), Decimal("5.00"), "", line_b)], po_header=po).post_to_inventory(posted_by=self.user)
+        line_a.refresh_from_db()
+        line_b.refresh_from_db()
+        po.refresh_from_db()
+        self.assertEqual((line_a.quantity_received, line_b.quantity_received), (Decimal("10"), Decimal("1")))
+        self.assertEqual(po.status, "PARTIALLY_RECEIVED")
+
+
+def _use_database(path):
+    """Pool initializer: run the forked worker on the SQLite file at path"""
+    db = connections["default"]
+    db.settings_dict["NAME"] = path
+    # Writers queue on the database lock rather than failing after 5s; IMMEDIATE
+    # takes it up front, as a read lock upgraded mid-transaction cannot wait
+    db.settings_dict["OPTIONS"] = {**db.settings_dict.get("OPTIONS", {}), "timeout": 30,
+                                   "transaction_mode": "IMMEDIATE"}
+    db.close()
+
+
+def _stress_setup():
+    """The user, item and warehouse the workers move stock of; returns their ids"""
+    # What migrate would add to the bare tables (content types, search index, ...)
+    emit_post_migrate_signal(verbosity=0, interactive=False, db="default")
+    user = User.objects.create_user("stress")
+    currency = Currency.objects.create(code="AED", name="Dirham", is_base=True)
+    uom = UnitOfMeasure.objects.create(code="EA", name="Each")
+    category = CatalogCategory.objects.create(code="GEN", name="General")
+    item = CatalogItem.objects.create(sku="SKU-1", item_code="IT-1", name="Item 1", category=category,
+                                      unit_of_measure=uom, list_price=Decimal("5.00"), currency=currency)
+    warehouse = Warehouse.objects.create(code="WH1", name="Main")
+    return user.pk, item.pk, warehouse.pk
+
+
+def _stress_worker(seed, user_id, item_id, warehouse_id, rounds):
+    """Random receipts, issues, reservations and releases on one balance; returns the quantity still reserved"""
+    rng = random.Random(seed)
+    receive = retry_on_conflict(StockMovement.objects.create)
+    item, warehouse, user = CatalogItem.objects.get(pk=item_id), Warehouse.objects.get(pk=warehouse_id), User(pk=user_id)
+    held = Decimal("0")
+    for _ in range(rounds):
+        quantity = Decimal(rng.randint(1, 5))
+        action = rng.choice(("receive", "issue", "reserve", "release"))
+        try:
+            if action == "receive":
+                receive(movement_type="RECEIPT", catalog_item=item, to_warehouse=warehouse,
+                        quantity=quantity, unit_cost=Decimal(rng.randint(1, 9)), created_by=user)
+            elif action == "issue":
+                InventoryService.issue_goods(item, warehouse, quantity, user)
+            elif action == "reserve":
+                InventoryService.reserve_stock(item, warehouse, quantity)
+                held += quantity
+            elif held:
+                quantity = min(quantity, held)
+                InventoryService.unreserve_stock(item, warehouse, quantity)
+                held -= quantity
+        except ValueError as e:
+            # Not enough stock at that moment (issue_goods checks before the conditional UPDATE does)
+            if not str(e).startswith("Insufficient"):
+                raise
+    return held
+
+
+def _stress_result():
+    """(drift, reserved, on hand, any issues) of the balance after the run"""
+    balance = InventoryBalance.objects.get()
+    return (balance_drift(), balance.quantity_reserved, balance.quantity_on_hand,
+            StockMovement.objects.filter(movement_type="ISSUE").exists())
+
+
+class BalanceEngineTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user("stock")
+        currency = Currency.objects.create(code="AED", name="Dirham", is_base=True)
+        uom = UnitOfMeasure.objects.create(code="EA", name="Each")
+        category = CatalogCategory.objects.create(code="GEN", name="General")
+        self.item = CatalogItem.objects.create(sku="SKU-1", item_code="IT-1", name="Item 1", category=category,
+                                               unit_of_measure=uom, list_price=Decimal("5.00"), currency=currency)
+        self.warehouse = Warehouse.objects.create(code="WH1", name="Main")
+
+    def movement(self, movement_type, quantity, unit_cost="0", outbound=False):
+        side = {"from_warehouse": self.warehouse} if outbound else {"to_warehouse": self.warehouse}
+        return StockMovement.objects.create(movement_type=movement_type, catalog_item=self.item, quantity=Decimal(quantity),
+                                            unit_cost=Decimal(unit_cost), created_by=self.user, **side)
+
+    def test_reservations_and_stock_outs_are_conditional(self):
+        self.movement("RECEIPT", "10", "2.00")
+        self.movement("RECEIPT", "5", "5.00")
+        InventoryService.reserve_stock(self.item, self.warehouse, Decimal("12"))
+        with self.assertRaises(InsufficientStock) as refused:
+            InventoryService.reserve_stock(self.item, self.warehouse, Decimal("4"))
+        self.assertEqual(refused.exception.available, Decimal("3"))
+        # An issue may not take reserved stock and leaves no movement behind
+        with self.assertRaises(InsufficientStock):
+            self.movement("ISSUE", "4", outbound=True)
+        self.assertEqual(StockMovement.objects.filter(movement_type="ISSUE").count(), 0)
+
+        InventoryService.issue_goods(self.item, self.warehouse, Decimal("12"), self.user, reserved=True)
+        # Scrap may take any stock on hand, but not more
+        self.movement("SCRAP", "3", outbound=True)
+        with self.assertRaises(InsufficientStock):
+            self.movement("SCRAP", "1", outbound=True)
+        InventoryService.unreserve_stock(self.item, self.warehouse, Decimal("5"))
+
+        balance = InventoryBalance.objects.get()
+        self.assertEqual((balance.quantity_on_hand, balance.quantity_reserved), (Decimal("0"), Decimal("0")))
+        # (10 x 2.00 + 5 x 5.00) / 15
+        self.assertEqual(balance.unit_cost, Decimal("3.0000"))
+        self.assertEqual(balance_drift(), [])
+
+
+class InventorySnapshotTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user("valuer")
+        currency = Currency.objects.create(code="AED", name="Dirham", is_base=True)
+        uom = UnitOfMeasure.objects.create(code="EA", name="Each")
+        category = CatalogCategory.objects.create(code="GEN", name="General")
+        self.item = CatalogItem.objects.create(sku="SKU-1", item_code="IT-1", name="Item 1", category=category,
+                                               unit_of_measure=uom, list_price=Decimal("5.00"), currency=currency)
+        self.main = Warehouse.objects.create(code="WH1", name="Main")
+        self.annex = Warehouse.objects.create(code="WH2", name="Annex")
+
+    def move(self, day, movement_type, quantity, unit_cost="0", source=None, target=None):
+        return StockMovement.objects.create(
+            movement_type=movement_type, movement_date=timezone.make_aware(datetime.combine(day, time(12))),
+            catalog_item=self.item, from_warehouse=source, to_warehouse=target, quantity=Decimal(quantity),
+            unit_cost=Decimal(unit_cost), created_by=self.user,
+        )
+
+    def history(self):
+        self.move(date(2026, 1, 5), "RECEIPT", "10", "2.00", target=self.main)
+        self.move(date(2026, 1, 20), "RECEIPT", "10", "4.00", target=self.main)
+        self.move(date(2026, 2, 3), "ISSUE", "5", source=self.main)
+        self.move(date(2026, 2, 10), "TRANSFER_OUT", "5", source=self.main)
+        self.move(date(2026, 2, 10), "TRANSFER_IN", "5", target=self.annex)
+        self.move(date(2026, 3, 2), "RECEIPT", "5", "6.00", target=self.main)
+
+    def test_as_of_replays_from_nearest_snapshot(self):
+        self.history()
+        replayed = {day: stock_as_of(day) for day in (date(2026, 1, 31), date(2026, 2, 28), date(2026, 3, 31))}
+        self.assertEqual(replayed[date(2026, 1, 31)], {(self.item.pk, self.main.pk, ""): (Decimal("20"), Decimal("60"))})
+        self.assertEqual(replayed[date(2026, 2, 28)], {
+            (self.item.pk, self.main.pk, ""): (Decimal("10"), Decimal("30")),
+            (self.item.pk, self.annex.pk, ""): (Decimal("5"), Decimal("0")),
+        })
+
+        take_snapshot(date(2026, 1, 31))
+        take_snapshot(date(2026, 2, 28))
+        for day, expected in replayed.items():
+            self.assertEqual(stock_as_of(day), expected)
+        # Snapshot lookup, its lines, movements since
+        with self.assertNumQueries(3):
+            stock_as_of(date(2026, 3, 31), warehouse=self.main.pk)
+
+        # Back-dated movements update the snapshots they fall into, matching a full replay
+        self.move(date(2026, 2, 15), "RECEIPT", "1", "3.00", target=self.annex)
+        self.move(date(2026, 1, 10), "ISSUE", "4", source=self.main)
+        self.move(date(2026, 1, 12), "ISSUE", "6", source=self.main)
+        snapshots = InventorySnapshot.objects.order_by("snapshot_date")
+        self.assertEqual([(s.snapshot_date, s.line_count) for s in snapshots],
+                         [(date(2026, 1, 31), 1), (date(2026, 2, 28), 1)])  # main emptied by Feb 28
+        self.assertEqual(stock_as_of(date(2026, 2, 28))[(self.item.pk, self.annex.pk, "")], (Decimal("6"), Decimal("3")))
+        refreshed = {day: stock_as_of(day) for day in replayed}
+        InventorySnapshot.objects.all().delete()
+        self.assertEqual(refreshed, {day: stock_as_of(day) for day in replayed})
+
+    def test_valuation_report(self):
+        self.history()
+        take_snapshot(date(2026, 1, 31))
+        self.client.force_login(self.user)
+
+        resp = self.client.get("/api/reports/inventory-valuation/", {"as_of": "2026-03-31"})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual([(wh["warehouse"], wh["quantity"], wh["value"]) for wh in resp.json()["warehouses"]],
+                         [("WH1", "15.0000", "60.00"), ("WH2", "5.0000", "0.00")])
+        self.assertEqual(resp.json()["total_value"], "60.00")
+
+        resp = self.client.get("/api/reports/inventory-valuation/", {"as_of": "2026-03-31", "file_type": "csv"})
+        rows = b"".join(resp.streaming_content).decode("utf-8-sig").splitlines()
+        self.assertEqual(rows[1], "WH1,SKU-1,Item 1,,15.0000,4.0000,60.00")
+        self.assertEqual(rows[2], "WH1,,Warehouse total,,15.0000,,60.00")
+
+        resp = self.client.get("/api/inventory/balances/as_of/", {"date": "2026-02-28", "warehouse_id": self.main.pk})
+        self.assertEqual(resp.json()["snapshot_date"], "2026-01-31")
+        self.assertEqual([(p["quantity"], p["value"]) for p in resp.json()["positions"]], [("10.0000", "30.00")])
+
+
+@skipUnless(hasattr(os, "fork"), "needs fork()")
+class BalanceStressTestCase(SimpleTestCase):
+    """
+    Concurrent processes on one balance.
+
+    The workers need a database they can all open, so the test builds a
+    throwaway SQLite file with the project's tables and runs every query,
+    setup and checks included, in the worker processes.
+    """
+
+    databases = {"default"}  # only to render the table DDL
+    WORKERS = 4
+    ROUNDS = 40
+
+    def test_balance_equals_movements_under_concurrency(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, "stress.sqlite3")
+            with connection.schema_editor(collect_sql=True) as editor:
+                for model in apps.get_models():
+                    if model._meta.managed and not model._meta.proxy:
+                        editor.create_model(model)
+            db = sqlite3.connect(path)
+            db.executescript(";".join(editor.collected_sql))
+            db.close()
+
+            with multiprocessing.get_context("fork").Pool(self.WORKERS, _use_database, (path,)) as pool:
+                user_id, item_id, warehouse_id = pool.apply(_stress_setup)
+                args = [(seed, user_id, item_id, warehouse_id, self.ROUNDS) for seed in range(self.WORKERS)]
+                held = pool.starmap(_stress_worker, args)
+                drift, reserved, on_hand, issued = pool.apply(_stress_result)
+
+        self.assertEqual(drift, [])
+        self.assertEqual(reserved, sum(held))
+        self.assertGreaterEqual(on_hand, reserved)
+        self.assertTrue(issued)
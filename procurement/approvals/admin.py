@@ -8,7 +8,7 @@ from django.utils import timezone
 from django.db.models import Sum, Count
 from .models import (
     ApprovalWorkflow, ApprovalStep, ApprovalInstance,
-    ApprovalStepInstance, ApprovalAction, ApprovalDelegation,
+    ApprovalStepInstance, ApprovalAction, ApprovalDelegation, ApprovalAssignment,
     BudgetAllocation, BudgetCheck
 )
 
@@ -397,16 +397,33 @@ class ApprovalDelegationAdmin(admin.ModelAdmin):
     get_is_active_display.short_description = 'Currently Active'
     
     def action_activate(self, request, queryset):
-        count = queryset.update(is_active=True)
+        # save() per row so approval assignments follow the delegation
+        count = 0
+        for delegation in queryset.filter(is_active=False):
+            delegation.is_active = True
+            delegation.save(update_fields=['is_active'])
+            count += 1
         self.message_user(request, f"Activated {count} delegation(s)")
     action_activate.short_description = "Activate selected delegations"
     
     def action_deactivate(self, request, queryset):
-        count = queryset.update(is_active=False)
+        count = 0
+        for delegation in queryset.filter(is_active=True):
+            delegation.is_active = False
+            delegation.save(update_fields=['is_active'])
+            count += 1
         self.message_user(request, f"Deactivated {count} delegation(s)")
     action_deactivate.short_description = "Deactivate selected delegations"
 
 
+@admin.register(ApprovalAssignment)
+class ApprovalAssignmentAdmin(admin.ModelAdmin):
+    list_display = ['user', 'approval_instance', 'step_instance', 'delegated_from', 'delegation']
+    list_select_related = ['user', 'delegated_from', 'step_instance__workflow_step', 'delegation']
+    search_fields = ['user__username', 'delegated_from__username']
+    readonly_fields = ['user', 'approval_instance', 'step_instance', 'delegated_from', 'delegation']
+
+
 @admin.register(BudgetAllocation)
 class BudgetAllocationAdmin(admin.ModelAdmin):
     list_display = [
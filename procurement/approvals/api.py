@@ -13,7 +13,7 @@ from django.utils import timezone
 
 from .models import (
     ApprovalWorkflow, ApprovalStep, ApprovalInstance,
-    ApprovalStepInstance, ApprovalAction, ApprovalDelegation,
+    ApprovalStepInstance, ApprovalAction, ApprovalDelegation, ApprovalAssignment,
     BudgetAllocation, BudgetCheck
 )
 from .serializers import (
@@ -62,19 +62,8 @@ class ApprovalInstanceViewSet(viewsets.ModelViewSet):
             serializer = self.get_serializer(instances, many=True)
             return Response(serializer.data)
         
-        # Find step instances where user can approve
-        pending_steps = ApprovalStepInstance.objects.filter(
-            status='ACTIVE'
-        )
-        
-        # Filter to steps where current user is an approver
-        user_approvals = []
-        for step_inst in pending_steps:
-            approvers = step_inst.workflow_step.get_approvers(
-                step_inst.approval_instance.content_object
-            )
-            if request.user in approvers:
-                user_approvals.append(step_inst.approval_instance.id)
+        # Active steps the user is assigned to, directly or through a delegation
+        user_approvals = ApprovalAssignment.pending_for_user(request.user).values('approval_instance_id')
         
         instances = self.queryset.filter(id__in=user_approvals)
         serializer = self.get_serializer(instances, many=True)
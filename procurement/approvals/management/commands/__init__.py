@@ -0,0 +1 @@
+# Procurement approval management commands
@@ -0,0 +1,22 @@
+"""
+Management command to rebuild ApprovalAssignment rows for every active step.
+
+Assignments are written when a step is activated and backfilled by the
+0003 migration; run this again whenever approver lists changed underneath
+active steps (group membership, step approvers, managers).
+
+Usage:
+    python manage.py rebuild_approval_assignments
+"""
+from django.core.management.base import BaseCommand
+
+from procurement.approvals.models import ApprovalAssignment
+
+
+class Command(BaseCommand):
+    help = 'Rebuild approver assignments for all active approval steps'
+
+    def handle(self, *args, **options):
+        count = ApprovalAssignment.rebuild()
+        total = ApprovalAssignment.objects.count()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt assignments for {count} active step(s): {total} row(s)'))
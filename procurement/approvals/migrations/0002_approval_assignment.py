@@ -0,0 +1,33 @@
+# Generated by Django 5.2.7 on 2026-10-16 09:48
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('approvals', '0001_initial'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ApprovalAssignment',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('approval_instance', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='assignments', to='approvals.approvalinstance')),
+                ('delegated_from', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='delegated_approval_assignments', to=settings.AUTH_USER_MODEL)),
+                ('delegation', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='assignments', to='approvals.approvaldelegation')),
+                ('step_instance', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='assignments', to='approvals.approvalstepinstance')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='approval_assignments', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'verbose_name': 'Approval Assignment',
+                'verbose_name_plural': 'Approval Assignments',
+                'db_table': 'approval_approvalassignment',
+                'indexes': [models.Index(fields=['user', 'approval_instance'], name='approval_ap_user_id_d19c69_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+from django.db import migrations
+
+
+def backfill_assignments(apps, schema_editor):
+    """Assign approvers to steps that were already active before the table existed"""
+    from procurement.approvals.models import ApprovalAssignment
+
+    ApprovalAssignment.rebuild()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('approvals', '0002_approval_assignment'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill_assignments, migrations.RunPython.noop),
+    ]
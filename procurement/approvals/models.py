@@ -9,7 +9,7 @@ Features:
 - Approval history and audit trail
 """
 
-from django.db import models
+from django.db import models, transaction
 from django.db.models import Q
 from django.contrib.auth.models import User, Group
 from django.contrib.contenttypes.fields import GenericForeignKey
@@ -383,6 +383,9 @@ class ApprovalInstance(models.Model):
             status='CANCELLED',
             completed_at=timezone.now()
         )
+        
+        # Drop out of every approver's inbox
+        self.assignments.all().delete()
 
 
 class ApprovalStepInstance(models.Model):
@@ -446,6 +449,7 @@ class ApprovalStepInstance(models.Model):
             self.due_at = self.activated_at + timedelta(hours=self.workflow_step.sla_hours)
         
         self.save()
+        ApprovalAssignment.assign_step(self)
         
         # TODO: Send notifications to approvers
     
@@ -472,6 +476,7 @@ class ApprovalStepInstance(models.Model):
             self.status = 'APPROVED'
             self.completed_at = timezone.now()
             self.save()
+            self.assignments.all().delete()
             
             # Update approval instance and activate next step
             self.approval_instance.check_and_update_status()
@@ -489,6 +494,7 @@ class ApprovalStepInstance(models.Model):
         self.status = 'REJECTED'
         self.completed_at = timezone.now()
         self.save()
+        self.assignments.all().delete()
         
         # Update approval instance
         self.approval_instance.check_and_update_status()
@@ -607,6 +613,10 @@ class ApprovalDelegation(models.Model):
     def __str__(self):
         return f"{self.from_user} → {self.to_user} ({self.start_date} to {self.end_date})"
     
+    def save(self, *args, **kwargs):
+        super().save(*args, **kwargs)
+        ApprovalAssignment.sync_delegation(self)
+    
     def is_valid_now(self):
         """Check if delegation is currently valid."""
         today = timezone.now().date()
@@ -641,6 +651,142 @@ class ApprovalDelegation(models.Model):
         return delegation.to_user if delegation else None
 
 
+class ApprovalAssignment(models.Model):
+    """
+    Who can act on an active approval step, denormalized for inbox queries.
+    
+    Written when a step is activated: one row per approver returned by
+    ApprovalStep.get_approvers(), plus one per delegate of those approvers.
+    Delegate rows point at their ApprovalDelegation so its date range and
+    active flag are checked at query time. Rows are removed when the step
+    completes or the approval is cancelled.
+    """
+    
+    step_instance = models.ForeignKey(
+        ApprovalStepInstance,
+        on_delete=models.CASCADE,
+        related_name='assignments'
+    )
+    approval_instance = models.ForeignKey(
+        ApprovalInstance,
+        on_delete=models.CASCADE,
+        related_name='assignments'
+    )
+    user = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        related_name='approval_assignments'
+    )
+    
+    # Set on rows granted through delegation
+    delegation = models.ForeignKey(
+        ApprovalDelegation,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='assignments'
+    )
+    delegated_from = models.ForeignKey(
+        User,
+        on_delete=models.CASCADE,
+        null=True,
+        blank=True,
+        related_name='delegated_approval_assignments'
+    )
+    
+    class Meta:
+        db_table = 'approval_approvalassignment'
+        verbose_name = 'Approval Assignment'
+        verbose_name_plural = 'Approval Assignments'
+        indexes = [
+            models.Index(fields=['user', 'approval_instance']),
+        ]
+    
+    def __str__(self):
+        via = f" (for {self.delegated_from})" if self.delegated_from_id else ""
+        return f"{self.user}{via} - {self.step_instance}"
+    
+    @classmethod
+    def pending_for_user(cls, user):
+        """Assignments of active steps the user can act on today."""
+        today = timezone.now().date()
+        return cls.objects.filter(user=user, step_instance__status='ACTIVE').filter(
+            Q(delegation__isnull=True) |
+            Q(delegation__is_active=True, delegation__start_date__lte=today, delegation__end_date__gte=today)
+        )
+    
+    @classmethod
+    def _delegations_for(cls, approval_instance):
+        """Delegations that may cover the given approval, today or later."""
+        return ApprovalDelegation.objects.filter(
+            Q(workflow_id=approval_instance.workflow_id) | Q(workflow__isnull=True),
+            Q(amount_limit__gte=approval_instance.amount) | Q(amount_limit__isnull=True),
+            is_active=True,
+            end_date__gte=timezone.now().date(),
+        )
+    
+    @classmethod
+    def assign_step(cls, step_instance):
+        """Replace the assignments of an active step with its current approvers and their delegates."""
+        instance = step_instance.approval_instance
+        approver_ids = list(
+            step_instance.workflow_step.get_approvers(instance.content_object).values_list('id', flat=True)
+        )
+        rows = [
+            cls(step_instance=step_instance, approval_instance=instance, user_id=user_id)
+            for user_id in approver_ids
+        ]
+        if approver_ids:
+            rows += [
+                cls(step_instance=step_instance, approval_instance=instance, user_id=d.to_user_id,
+                    delegation=d, delegated_from_id=d.from_user_id)
+                for d in cls._delegations_for(instance).filter(from_user_id__in=approver_ids)
+            ]
+        
+        cls.objects.filter(step_instance=step_instance).delete()
+        cls.objects.bulk_create(rows)
+    
+    @classmethod
+    @transaction.atomic
+    def rebuild(cls):
+        """Rewrite the assignments of every active step; returns the number of steps."""
+        steps = (
+            ApprovalStepInstance.objects
+            .filter(status='ACTIVE')
+            .exclude(approval_instance__status__in=['APPROVED', 'REJECTED', 'CANCELLED'])
+            .select_related('approval_instance', 'workflow_step')
+        )
+        cls.objects.exclude(step_instance__in=steps).delete()
+        count = 0
+        for step in steps.iterator():
+            cls.assign_step(step)
+            count += 1
+        return count
+    
+    @classmethod
+    def sync_delegation(cls, delegation):
+        """Rebuild the delegate rows of one delegation after it was created or edited."""
+        cls.objects.filter(delegation=delegation).delete()
+        if not delegation.is_active or delegation.end_date < timezone.now().date():
+            return
+        
+        direct = cls.objects.filter(
+            user_id=delegation.from_user_id,
+            delegation__isnull=True,
+            step_instance__status='ACTIVE',
+        )
+        if delegation.workflow_id:
+            direct = direct.filter(approval_instance__workflow_id=delegation.workflow_id)
+        if delegation.amount_limit is not None:
+            direct = direct.filter(approval_instance__amount__lte=delegation.amount_limit)
+        
+        cls.objects.bulk_create([
+            cls(step_instance_id=a.step_instance_id, approval_instance_id=a.approval_instance_id,
+                user_id=delegation.to_user_id, delegation=delegation, delegated_from_id=delegation.from_user_id)
+            for a in direct.only('step_instance_id', 'approval_instance_id')
+        ])
+
+
 class BudgetAllocation(models.Model):
     """
     Budget allocation for cost centers and projects.
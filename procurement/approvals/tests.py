@@ -0,0 +1,122 @@
+from datetime import timedelta
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.auth.models import Group, User
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from .models import (
+    ApprovalAssignment, ApprovalDelegation, ApprovalStep, ApprovalWorkflow
+)
+
+
+class MyPendingTestCase(TestCase):
+
+    URL = "/api/procurement/approvals/instances/my_pending/"
+
+    def setUp(self):
+        self.alice = User.objects.create_user("alice")
+        self.bob = User.objects.create_user("bob")
+        self.carol = User.objects.create_user("carol")
+        self.dave = User.objects.create_user("dave")
+        finance = Group.objects.create(name="Finance approvers")
+        self.carol.groups.add(finance)
+
+        self.workflow = ApprovalWorkflow.objects.create(name="PR approval", document_type="requisition.PRHeader")
+        step1 = ApprovalStep.objects.create(workflow=self.workflow, sequence=1, name="Manager")
+        step1.approvers.add(self.alice, self.bob)
+        ApprovalStep.objects.create(workflow=self.workflow, sequence=2, name="Finance",
+                                    approver_type="GROUP", approver_group=finance)
+
+    def start(self, amount=Decimal("500.00")):
+        # The approved document only matters to dynamic approver types
+        return self.workflow.initiate_approval(self.dave, amount, self.dave)
+
+    def pending_ids(self, user):
+        self.client.force_login(user)
+        resp = self.client.get(self.URL)
+        self.assertEqual(resp.status_code, 200)
+        return sorted(row["id"] for row in resp.json())
+
+    def delegate(self, **kwargs):
+        today = timezone.now().date()
+        fields = dict(from_user=self.alice, to_user=self.dave,
+                      start_date=today - timedelta(days=1), end_date=today + timedelta(days=5))
+        fields.update(kwargs)
+        return ApprovalDelegation.objects.create(**fields)
+
+    def test_inbox_follows_the_active_step(self):
+        first, second = self.start(), self.start()
+        self.assertEqual(self.pending_ids(self.alice), [first.id, second.id])
+        self.assertEqual(self.pending_ids(self.carol), [])
+
+        first.step_instances.get(workflow_step__sequence=1).approve(self.bob)
+        self.assertEqual(self.pending_ids(self.alice), [second.id])
+        self.assertEqual(self.pending_ids(self.carol), [first.id])
+
+        second.cancel(self.dave, "no longer needed")
+        self.assertEqual(self.pending_ids(self.alice), [])
+
+    def test_query_count_independent_of_other_approvals(self):
+        self.start()
+        other = ApprovalWorkflow.objects.create(name="Contract approval", document_type="contracts.Contract")
+        ApprovalStep.objects.create(workflow=other, sequence=1, name="Legal").approvers.add(self.bob)
+        self.client.force_login(self.alice)
+
+        with CaptureQueriesContext(connection) as before:
+            self.client.get(self.URL)
+        for _ in range(10):
+            other.initiate_approval(self.dave, Decimal("500.00"), self.dave)
+        with CaptureQueriesContext(connection) as after:
+            resp = self.client.get(self.URL)
+        self.assertEqual(len(resp.json()), 1)
+        self.assertEqual(len(after), len(before))
+
+    def test_delegation_created_after_activation(self):
+        instance = self.start()
+        self.assertEqual(self.pending_ids(self.dave), [])
+
+        delegation = self.delegate()
+        self.assertEqual(self.pending_ids(self.dave), [instance.id])
+
+        delegation.is_active = False
+        delegation.save()
+        self.assertEqual(self.pending_ids(self.dave), [])
+        self.assertFalse(ApprovalAssignment.objects.filter(delegation=delegation).exists())
+
+    def test_delegation_scope_and_dates(self):
+        today = timezone.now().date()
+        self.delegate(amount_limit=Decimal("100.00"))
+        future = self.delegate(start_date=today + timedelta(days=2))
+        instance = self.start()
+
+        # Over the first delegation's limit; the second one has not started yet
+        self.assertEqual(self.pending_ids(self.dave), [])
+        self.assertTrue(ApprovalAssignment.objects.filter(delegation=future).exists())
+
+        ApprovalDelegation.objects.filter(pk=future.pk).update(start_date=today)
+        self.assertEqual(self.pending_ids(self.dave), [instance.id])
+
+        future.delete()
+        self.assertEqual(self.pending_ids(self.dave), [])
+
+    def test_rebuild_command_restores_assignments(self):
+        instance = self.start()
+        self.delegate()
+        ApprovalAssignment.objects.all().delete()
+
+        call_command("rebuild_approval_assignments", stdout=StringIO())
+        self.assertEqual(self.pending_ids(self.alice), [instance.id])
+        self.assertEqual(self.pending_ids(self.dave), [instance.id])
+
+    def test_leftover_assignments_of_finished_steps_are_ignored(self):
+        instance = self.start()
+        step = instance.step_instances.get(workflow_step__sequence=1)
+        # A step closed without going through approve(), e.g. by a bulk update
+        type(step).objects.filter(pk=step.pk).update(status="SKIPPED")
+        self.assertTrue(ApprovalAssignment.objects.filter(step_instance=step).exists())
+        self.assertEqual(self.pending_ids(self.alice), [])
@@ -6,7 +6,9 @@ from rest_framework.permissions import IsAuthenticated, AllowAny
 from django_filters.rest_framework import DjangoFilterBackend
 from django.db.models import Q, Count, Sum, Avg, F
 from django.utils import timezone
-from decimal import Decimal
+from decimal import Decimal, InvalidOperation
+
+from core.mixins import FieldProjectionMixin
 
 from .models import (
     UnitOfMeasure, CatalogCategory, CatalogItem, SupplierPriceTier,
@@ -21,6 +23,8 @@ from .serializers import (
     CallOffOrderDetailSerializer, CallOffOrderCreateUpdateSerializer,
     CallOffLineSerializer
 )
+from .pricing import resolve_prices
+from .search import search_items, suggest_items
 
 
 class UnitOfMeasureViewSet(viewsets.ModelViewSet):
@@ -78,7 +82,7 @@ class CatalogCategoryViewSet(viewsets.ModelViewSet):
         return Response(tree)
 
 
-class CatalogItemViewSet(viewsets.ModelViewSet):
+class CatalogItemViewSet(FieldProjectionMixin, viewsets.ModelViewSet):
     """ViewSet for Catalog Items"""
     queryset = CatalogItem.objects.all()
     permission_classes = [AllowAny]  # TODO: Change back to IsAuthenticated in production
@@ -156,6 +160,57 @@ class CatalogItemViewSet(viewsets.ModelViewSet):
             'total': str(effective_price * quantity)
         })
     
+    @action(detail=False, methods=['post'])
+    def bulk_prices(self, request):
+        """
+        Effective prices for many lines at once.
+        
+        Body: {"lines": [{"item_id", "quantity", "supplier_id"}, ...]}, where
+        supplier_id is optional. Returns one {item_id, sku, supplier_id,
+        quantity, unit_price, currency, total} per line, in order.
+        """
+        lines = request.data.get('lines')
+        if not isinstance(lines, list) or not all(isinstance(line, dict) for line in lines):
+            return Response({'error': 'lines must be a list of {item_id, quantity, supplier_id}'},
+                            status=status.HTTP_400_BAD_REQUEST)
+        
+        parsed = []
+        for n, line in enumerate(lines):
+            try:
+                quantity = Decimal(str(line.get('quantity', 1)))
+            except InvalidOperation:
+                quantity = None
+            if quantity is None or not quantity.is_finite() or quantity <= 0:
+                return Response({'error': f'Line {n + 1}: quantity must be a positive number'},
+                                status=status.HTTP_400_BAD_REQUEST)
+            supplier_id = line.get('supplier_id') or None
+            if supplier_id is not None and not isinstance(supplier_id, int):
+                return Response({'error': f'Line {n + 1}: supplier_id must be an id'},
+                                status=status.HTTP_400_BAD_REQUEST)
+            parsed.append((line.get('item_id'), quantity, supplier_id))
+        
+        items = self.get_queryset().select_related('currency').in_bulk(
+            {item_id for item_id, _, _ in parsed if isinstance(item_id, int)}
+        )
+        unknown = [item_id for item_id, _, _ in parsed if item_id not in items]
+        if unknown:
+            return Response({'error': 'Unknown catalog items', 'item_ids': unknown},
+                            status=status.HTTP_400_BAD_REQUEST)
+        
+        prices = resolve_prices([(items[item_id], quantity, supplier_id) for item_id, quantity, supplier_id in parsed])
+        return Response([
+            {
+                'item_id': item_id,
+                'sku': items[item_id].sku,
+                'supplier_id': supplier_id,
+                'quantity': str(quantity),
+                'unit_price': str(price),
+                'currency': items[item_id].currency.code,
+                'total': str((price * quantity).quantize(Decimal('0.01'))),
+            }
+            for (item_id, quantity, supplier_id), price in zip(parsed, prices)
+        ])
+    
     @action(detail=False, methods=['get'])
     def search_catalog(self, request):
         """Advanced catalog search"""
@@ -167,15 +222,6 @@ class CatalogItemViewSet(viewsets.ModelViewSet):
         
         queryset = self.get_queryset().filter(is_active=True, is_purchasable=True)
         
-        if query:
-            queryset = queryset.filter(
-                Q(sku__icontains=query) |
-                Q(name__icontains=query) |
-                Q(short_description__icontains=query) |
-                Q(manufacturer__icontains=query) |
-                Q(brand__icontains=query)
-            )
-        
         if category:
             queryset = queryset.filter(category_id=category)
         
@@ -188,8 +234,37 @@ class CatalogItemViewSet(viewsets.ModelViewSet):
         if max_price:
             queryset = queryset.filter(list_price__lte=Decimal(max_price))
         
-        serializer = self.get_serializer(queryset[:50], many=True)  # Limit to 50 results
+        if query:
+            # Ranked, prefix- and typo-tolerant matches from the search index
+            items = search_items(query, queryset, limit=50)
+        else:
+            items = queryset[:50]  # Limit to 50 results
+        serializer = self.get_serializer(items, many=True)
         return Response(serializer.data)
+    
+    @action(detail=False, methods=['post'])
+    def suggest(self, request):
+        """
+        Catalog suggestions for many free-text lines at once.
+        
+        Body: {"lines": ["description", ...], "limit": 5}. Returns one list
+        of {id, sku, name, unit_price} per line, best match first.
+        """
+        lines = request.data.get('lines')
+        if not isinstance(lines, list) or not all(isinstance(line, str) for line in lines):
+            return Response({'error': 'lines must be a list of descriptions'}, status=status.HTTP_400_BAD_REQUEST)
+        try:
+            limit = min(max(int(request.data.get('limit', 5)), 1), 20)
+        except (TypeError, ValueError):
+            return Response({'error': 'limit must be a number'}, status=status.HTTP_400_BAD_REQUEST)
+        
+        return Response([
+            [
+                {'id': item.id, 'sku': item.sku, 'name': item.name, 'unit_price': str(item.list_price)}
+                for item in items
+            ]
+            for items in suggest_items(lines, per_line=limit)
+        ])
 
 
 class SupplierPriceTierViewSet(viewsets.ModelViewSet):
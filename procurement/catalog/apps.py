@@ -6,3 +6,10 @@ class CatalogConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'procurement.catalog'
     verbose_name = 'Product Catalog'
+
+    def ready(self):
+        """Import signal handlers when Django starts"""
+        from django.db.models.signals import post_migrate
+
+        from .signals import create_search_index
+        post_migrate.connect(create_search_index, sender=self)
@@ -0,0 +1,30 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    """FTS5 catalog search tables, on SQLite builds with FTS5 only"""
+    from procurement.catalog.search import FTS5Backend, has_fts5
+
+    connection = schema_editor.connection
+    if connection.vendor == 'sqlite' and has_fts5(connection):
+        with connection.cursor() as cursor:
+            FTS5Backend().create(cursor)
+
+
+def drop_search_index(apps, schema_editor):
+    from procurement.catalog.search import FTS5Backend
+
+    if schema_editor.connection.vendor == 'sqlite':
+        with schema_editor.connection.cursor() as cursor:
+            FTS5Backend().drop(cursor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('catalog', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -4,6 +4,7 @@ from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.utils import timezone
 from decimal import Decimal
+from core.sequences import next_document_number
 
 
 class UnitOfMeasure(models.Model):
@@ -195,23 +196,10 @@ class CatalogItem(models.Model):
     def get_effective_price(self, quantity=1, supplier=None):
         """
         Get effective price considering price tiers
+        (see pricing.resolve_prices to price many lines at once)
         """
-        # Check for supplier-specific price tiers
-        if supplier:
-            price_tiers = self.supplier_price_tiers.filter(
-                supplier=supplier,
-                is_active=True,
-                valid_from__lte=timezone.now().date()
-            ).filter(
-                models.Q(valid_to__isnull=True) | models.Q(valid_to__gte=timezone.now().date())
-            ).filter(
-                min_quantity__lte=quantity
-            ).order_by('-min_quantity').first()
-            
-            if price_tiers:
-                return price_tiers.unit_price
-        
-        return self.list_price
+        from .pricing import effective_price
+        return effective_price(self, quantity, supplier)
 
 
 class SupplierPriceTier(models.Model):
@@ -393,21 +381,9 @@ class FrameworkAgreement(models.Model):
     
     def generate_agreement_number(self):
         """Generate unique agreement number"""
-        from django.db.models import Max
         today = timezone.now().date()
         prefix = f"FA-{today.strftime('%Y%m%d')}"
-        
-        last_agreement = FrameworkAgreement.objects.filter(
-            agreement_number__startswith=prefix
-        ).aggregate(Max('agreement_number'))
-        
-        if last_agreement['agreement_number__max']:
-            last_num = int(last_agreement['agreement_number__max'].split('-')[-1])
-            new_num = last_num + 1
-        else:
-            new_num = 1
-        
-        return f"{prefix}-{new_num:03d}"
+        return next_document_number(FrameworkAgreement, 'agreement_number', prefix, width=3)
     
     def is_active(self):
         """Check if agreement is currently active"""
@@ -614,21 +590,9 @@ class CallOffOrder(models.Model):
     
     def generate_calloff_number(self):
         """Generate unique call-off number"""
-        from django.db.models import Max
         today = timezone.now().date()
         prefix = f"CO-{today.strftime('%Y%m%d')}"
-        
-        last_calloff = CallOffOrder.objects.filter(
-            calloff_number__startswith=prefix
-        ).aggregate(Max('calloff_number'))
-        
-        if last_calloff['calloff_number__max']:
-            last_num = int(last_calloff['calloff_number__max'].split('-')[-1])
-            new_num = last_num + 1
-        else:
-            new_num = 1
-        
-        return f"{prefix}-{new_num:03d}"
+        return next_document_number(CallOffOrder, 'calloff_number', prefix, width=3)
     
     def calculate_totals(self):
         """Calculate order totals from lines"""
@@ -0,0 +1,158 @@
+"""
+Catalog price resolution.
+
+CatalogItem.get_effective_price used to query supplier_price_tiers on every
+call, so pricing a many-line document cost one query per line. Prices are
+now resolved from a per-process tier cache:
+
+- The tiers valid on a day for an (item, supplier) pair are held as two
+  parallel lists, min_quantity ascending and unit_price. The price for a
+  quantity is the tier with the largest min_quantity not above it, found
+  by binary search; with no such tier the item's list price applies.
+- resolve_prices() loads the tiers of every uncached pair it is asked
+  about with one query, so a whole requisition or order prices in one or
+  two queries, and repeated lookups in none.
+- SupplierPriceTier save/delete signals bump the "catalog:price_tiers"
+  CacheVersion row (see core.cache_versions), so every process drops its
+  tiers from its next request on. Writes that skip signals (bulk_create,
+  queryset.update, imports) should call invalidate_prices(). Entries are
+  also reloaded when the pricing day changes.
+- At most PRICE_CACHE_SIZE pairs (settings.CATALOG_PRICE_CACHE_SIZE) are
+  kept, least recently used first out.
+
+When several tiers of a pair share a min_quantity on the same day, the one
+valid from the latest date wins.
+"""
+import threading
+from bisect import bisect_right
+from collections import OrderedDict
+from decimal import Decimal
+
+from django.conf import settings
+from django.db.models import Q
+from django.utils import timezone
+
+from core.cache_versions import VersionGuard
+
+from .models import CatalogItem, SupplierPriceTier
+
+VERSION_KEY = "catalog:price_tiers"
+PRICE_CACHE_SIZE = 50000
+# Pairs per tier query; keeps the OR'ed lookup under SQLite's parameter limit
+PAIR_BATCH_SIZE = 400
+
+# (catalog_item_id, supplier_id) -> (day, min_quantities, unit_prices), least recently used first
+_tiers = OrderedDict()
+_lock = threading.Lock()
+_guard = VersionGuard(VERSION_KEY)
+
+
+def clear_price_cache():
+    """Forget every cached tier table in this process"""
+    with _lock:
+        _tiers.clear()
+
+
+def invalidate_prices():
+    """Forget cached tiers in every process (this one at once, others after commit)"""
+    _guard.bump()
+    clear_price_cache()
+
+
+def _cached(pair, day):
+    with _lock:
+        entry = _tiers.get(pair)
+        if entry is None or entry[0] != day:
+            return None
+        _tiers.move_to_end(pair)
+        return entry
+
+
+def _store(tables, day):
+    limit = getattr(settings, 'CATALOG_PRICE_CACHE_SIZE', PRICE_CACHE_SIZE)
+    with _lock:
+        for pair, (quantities, prices) in tables.items():
+            _tiers[pair] = (day, quantities, prices)
+            _tiers.move_to_end(pair)
+        while len(_tiers) > limit:
+            _tiers.popitem(last=False)
+
+
+def _load(pairs, day):
+    """Fetch and cache the tiers valid on `day` for these pairs; returns {pair: (quantities, prices)}"""
+    pairs = list(pairs)
+    loaded = {}
+    for start in range(0, len(pairs), PAIR_BATCH_SIZE):
+        chunk = pairs[start:start + PAIR_BATCH_SIZE]
+        match = Q()
+        for item_id, supplier_id in chunk:
+            match |= Q(catalog_item_id=item_id, supplier_id=supplier_id)
+        rows = SupplierPriceTier.objects.filter(match, is_active=True, valid_from__lte=day).filter(
+            Q(valid_to__isnull=True) | Q(valid_to__gte=day)
+        ).order_by('catalog_item_id', 'supplier_id', 'min_quantity', 'valid_from').values_list(
+            'catalog_item_id', 'supplier_id', 'min_quantity', 'unit_price'
+        )
+        tables = {pair: ([], []) for pair in chunk}
+        for item_id, supplier_id, min_quantity, unit_price in rows:
+            quantities, prices = tables[(item_id, supplier_id)]
+            if quantities and quantities[-1] == min_quantity:
+                # Same break valid from a later date replaces the earlier one
+                prices[-1] = unit_price
+            else:
+                quantities.append(min_quantity)
+                prices.append(unit_price)
+        _store(tables, day)
+        loaded.update(tables)
+    return loaded
+
+
+def tier_price(quantities, prices, quantity):
+    """Price of the largest quantity break not above quantity, or None"""
+    position = bisect_right(quantities, quantity)
+    return prices[position - 1] if position else None
+
+
+def resolve_prices(lines, day=None):
+    """
+    Unit prices for (catalog_item, quantity, supplier) lines, in order.
+    catalog_item and supplier are instances or ids; supplier may be None for
+    the list price. Uncached tiers are loaded with one query, and the list
+    prices of items given by id with one more (plus the version check, once
+    per request).
+    """
+    day = day or timezone.now().date()
+    if not _guard.is_current():
+        clear_price_cache()
+    lines = [
+        (getattr(item, 'pk', item), Decimal(str(quantity)), getattr(supplier, 'pk', supplier), item)
+        for item, quantity, supplier in lines
+    ]
+    tables, missing = {}, set()
+    for item_id, _, supplier_id, _ in lines:
+        if supplier_id is None or (item_id, supplier_id) in tables:
+            continue
+        entry = _cached((item_id, supplier_id), day)
+        if entry is None:
+            missing.add((item_id, supplier_id))
+        else:
+            tables[(item_id, supplier_id)] = entry[1:]
+    if missing:
+        tables.update(_load(missing, day))
+
+    list_prices = {item.pk: item.list_price for *_, item in lines if isinstance(item, CatalogItem)}
+    unloaded = {item_id for item_id, *_ in lines} - set(list_prices)
+    if unloaded:
+        list_prices.update(CatalogItem.objects.filter(pk__in=unloaded).values_list('pk', 'list_price'))
+
+    prices = []
+    for item_id, quantity, supplier_id, _ in lines:
+        price = None
+        if supplier_id is not None:
+            price = tier_price(*tables[(item_id, supplier_id)], quantity)
+        prices.append(list_prices[item_id] if price is None else price)
+    return prices
+
+
+def effective_price(catalog_item, quantity=1, supplier=None, day=None):
+    """Unit price of one item for a quantity, from the supplier's tiers or the list price"""
+    return resolve_prices([(catalog_item, quantity, supplier)], day)[0]
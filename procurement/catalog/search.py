@@ -0,0 +1,335 @@
+"""
+Catalog item search index.
+
+Catalog search used to OR icontains filters over several columns, which scans
+the whole item table on every keystroke. Searches now go through a backend:
+
+- FTS5Backend (SQLite): an FTS5 table over SEARCH_FIELDS, keyed by item id,
+  with prefix indexes. Results are ranked by bm25 with FIELD_WEIGHTS (a SKU
+  or part number hit counts more than a description hit). Every query term
+  also matches as a prefix. Terms of MIN_TYPO_LENGTH characters or more also
+  match index terms within one edit (two from 8 characters) that share
+  their first letter; candidates come from the fts5vocab table.
+  A queryset passed to search() is applied inside the ranking query (rowid
+  IN the queryset's ids), so filtered searches rank only matching items.
+  search_many() ranks many queries in one SQL statement (a VALUES list
+  joined to the index).
+- DatabaseBackend, for other databases: ranked icontains queries through
+  the ORM, one query per search, without typo tolerance.
+
+settings.CATALOG_SEARCH_BACKEND (a dotted class path) overrides the choice.
+
+CatalogItem save/delete signals keep the index in step. Writes that skip
+signals (bulk_create, queryset.update, imports) should be followed by
+`manage.py rebuild_catalog_search_index`. The FTS5 tables are created and
+filled by migration catalog 0002, or after migrate for databases built
+without migrations (see signals.create_search_index); searches and index
+updates assume they exist.
+"""
+import re
+import unicodedata
+
+from django.conf import settings
+from django.core.exceptions import EmptyResultSet
+from django.db import connection, transaction
+from django.db.models import Case, IntegerField, Q, Value, When
+from django.utils.module_loading import import_string
+
+from .models import CatalogItem
+import logging
+
+logger = logging.getLogger(__name__)
+
+SEARCH_FIELDS = ('sku', 'name', 'short_description', 'manufacturer', 'brand', 'manufacturer_part_number')
+# bm25 column weights, in SEARCH_FIELDS order
+FIELD_WEIGHTS = (10.0, 5.0, 1.0, 2.0, 2.0, 8.0)
+
+CANDIDATE_LIMIT = 500
+INDEX_BATCH_SIZE = 2000
+SUGGEST_BATCH_SIZE = 200
+MIN_TYPO_LENGTH = 4
+# Words in free-text descriptions that say nothing about the item
+SUGGEST_STOPWORDS = frozenset({'and', 'for', 'the', 'with', 'of', 'to', 'in', 'per', 'pcs', 'each', 'new'})
+
+_WORD = re.compile(r'\w+')
+
+
+def tokenize(text):
+    """Lowercased words of text without diacritics, as the FTS5 unicode61 tokenizer splits them"""
+    text = unicodedata.normalize('NFKD', text or '')
+    text = ''.join(ch for ch in text if not unicodedata.combining(ch))
+    return _WORD.findall(text.lower())
+
+
+def edit_distance(a, b, limit):
+    """Levenshtein distance of a and b, or limit + 1 once it exceeds limit"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, ca in enumerate(a, 1):
+        current = [i]
+        for j, cb in enumerate(b, 1):
+            current.append(min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + (ca != cb)))
+        if min(current) > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+def typo_limit(term):
+    """Edits a query term may be away from an index term"""
+    if len(term) < MIN_TYPO_LENGTH:
+        return 0
+    return 1 if len(term) < 8 else 2
+
+
+class SearchBackend:
+    """Index and rank catalog items by text; subclasses implement the storage"""
+
+    def index(self, items):
+        """Add or refresh these CatalogItems"""
+
+    def remove(self, ids):
+        """Drop these item ids"""
+
+    def rebuild(self):
+        """Re-index every catalog item; returns the number indexed"""
+        return 0
+
+    def search(self, query, limit=CANDIDATE_LIMIT, queryset=None):
+        """Ids of items (of queryset, default all) matching every word of query, best first"""
+        raise NotImplementedError
+
+    def search_many(self, queries, limit=5):
+        """For each query, ids of items matching any of its words, best first"""
+        return [self.search(query, limit) for query in queries]
+
+
+class FTS5Backend(SearchBackend):
+    table = 'catalog_item_search'
+    vocab_table = 'catalog_item_search_vocab'
+
+    def create(self, cursor):
+        """Create and fill the index tables unless they exist; returns the number of items indexed"""
+        cursor.execute("SELECT 1 FROM sqlite_master WHERE name = %s", [self.table])
+        if cursor.fetchone():
+            return 0
+        cursor.execute(
+            f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.table} USING fts5({', '.join(SEARCH_FIELDS)}, "
+            f"tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3')"
+        )
+        cursor.execute(f"CREATE VIRTUAL TABLE IF NOT EXISTS {self.vocab_table} USING fts5vocab({self.table}, 'row')")
+        meta = CatalogItem._meta
+        values = ', '.join(f"COALESCE({meta.get_field(field).column}, '')" for field in SEARCH_FIELDS)
+        cursor.execute(
+            f"INSERT INTO {self.table} (rowid, {', '.join(SEARCH_FIELDS)}) "
+            f"SELECT {meta.pk.column}, {values} FROM {meta.db_table}"
+        )
+        return cursor.rowcount
+
+    def drop(self, cursor):
+        cursor.execute(f"DROP TABLE IF EXISTS {self.vocab_table}")
+        cursor.execute(f"DROP TABLE IF EXISTS {self.table}")
+
+    def _fill(self, cursor, queryset):
+        rows = queryset.order_by('pk').values_list('pk', *SEARCH_FIELDS).iterator(chunk_size=INDEX_BATCH_SIZE)
+        sql = f"INSERT INTO {self.table} (rowid, {', '.join(SEARCH_FIELDS)}) VALUES ({', '.join(['%s'] * (len(SEARCH_FIELDS) + 1))})"
+        count, batch = 0, []
+        for row in rows:
+            batch.append([value or '' for value in row])
+            if len(batch) >= INDEX_BATCH_SIZE:
+                cursor.executemany(sql, batch)
+                count, batch = count + len(batch), []
+        if batch:
+            cursor.executemany(sql, batch)
+        return count + len(batch)
+
+    def _delete(self, cursor, ids):
+        ids = list(ids)
+        for start in range(0, len(ids), INDEX_BATCH_SIZE):
+            chunk = ids[start:start + INDEX_BATCH_SIZE]
+            cursor.execute(f"DELETE FROM {self.table} WHERE rowid IN ({', '.join(['%s'] * len(chunk))})", chunk)
+
+    def index(self, items):
+        ids = [item.pk for item in items]
+        with connection.cursor() as cursor:
+            self._delete(cursor, ids)
+            self._fill(cursor, CatalogItem.objects.filter(pk__in=ids))
+
+    def remove(self, ids):
+        with connection.cursor() as cursor:
+            self._delete(cursor, ids)
+
+    def rebuild(self):
+        with transaction.atomic(), connection.cursor() as cursor:
+            self.drop(cursor)
+            return self.create(cursor)
+
+    def _typo_variants(self, cursor, terms):
+        """{term: index terms within its typo_limit}, from one vocabulary query"""
+        terms = {term for term in terms if typo_limit(term)}
+        if not terms:
+            return {}
+        firsts = sorted({term[0] for term in terms})
+        cursor.execute(
+            f"SELECT term FROM {self.vocab_table} WHERE substr(term, 1, 1) IN ({', '.join(['%s'] * len(firsts))}) "
+            f"AND length(term) BETWEEN %s AND %s",
+            [*firsts, min(map(len, terms)) - 2, max(map(len, terms)) + 2],
+        )
+        vocabulary = [row[0] for row in cursor.fetchall()]
+        variants = {}
+        for term in terms:
+            limit = typo_limit(term)
+            variants[term] = [
+                word for word in vocabulary
+                # Words the term's prefix match already covers are left out
+                if not word.startswith(term) and word[0] == term[0] and edit_distance(term, word, limit) <= limit
+            ]
+        return variants
+
+    @staticmethod
+    def _match(terms, variants, operator):
+        """FTS5 query: each term as a prefix or one of its typo variants, joined by operator"""
+        groups = []
+        for term in terms:
+            options = [f'"{term}"*'] + [f'"{word}"' for word in variants.get(term, ())]
+            groups.append(f"({' OR '.join(options)})" if len(options) > 1 else options[0])
+        return f' {operator} '.join(groups)
+
+    def search(self, query, limit=CANDIDATE_LIMIT, queryset=None):
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        restrict, restrict_params = '', []
+        if queryset is not None:
+            try:
+                subquery, restrict_params = queryset.values('pk').order_by().query.sql_with_params()
+            except EmptyResultSet:
+                return []
+            restrict = f"AND rowid IN ({subquery}) "
+        with connection.cursor() as cursor:
+            expression = self._match(terms, self._typo_variants(cursor, terms), 'AND')
+            cursor.execute(
+                f"SELECT rowid FROM {self.table} WHERE {self.table} MATCH %s {restrict}"
+                f"ORDER BY bm25({self.table}, {', '.join(map(str, FIELD_WEIGHTS))}) LIMIT %s",
+                [expression, *restrict_params, limit],
+            )
+            return [row[0] for row in cursor.fetchall()]
+
+    def search_many(self, queries, limit=5):
+        term_lists = [
+            [term for term in dict.fromkeys(tokenize(query)) if len(term) > 2 and term not in SUGGEST_STOPWORDS]
+            for query in queries
+        ]
+        results = [[] for _ in queries]
+        if not any(term_lists):
+            return results
+        with connection.cursor() as cursor:
+            variants = self._typo_variants(cursor, {term for terms in term_lists for term in terms})
+            lines = [(n, self._match(terms, variants, 'OR')) for n, terms in enumerate(term_lists) if terms]
+            weights = ', '.join(map(str, FIELD_WEIGHTS))
+            for start in range(0, len(lines), SUGGEST_BATCH_SIZE):
+                chunk = lines[start:start + SUGGEST_BATCH_SIZE]
+                cursor.execute(
+                    f"WITH queries(line, expression) AS (VALUES {', '.join(['(%s, %s)'] * len(chunk))}) "
+                    f"SELECT line, item_id FROM ("
+                    f"  SELECT line, item_id, row_number() OVER (PARTITION BY line ORDER BY score) AS position FROM ("
+                    f"    SELECT queries.line AS line, {self.table}.rowid AS item_id, bm25({self.table}, {weights}) AS score"
+                    f"    FROM queries JOIN {self.table} ON {self.table} MATCH queries.expression"
+                    f"  )"
+                    f") WHERE position <= %s ORDER BY line, position",
+                    [value for line in chunk for value in line] + [limit],
+                )
+                for line, item_id in cursor.fetchall():
+                    results[line].append(item_id)
+        return results
+
+
+class DatabaseBackend(SearchBackend):
+    """Ranked icontains search through the ORM, for databases without FTS5"""
+
+    # (lookup, score) per field; an item's score is the sum over matching terms
+    SCORES = (('sku__iexact', 20), ('sku__istartswith', 10), ('manufacturer_part_number__iexact', 15),
+              ('name__istartswith', 6), ('name__icontains', 4), ('brand__icontains', 2),
+              ('manufacturer__icontains', 2), ('short_description__icontains', 1))
+
+    def _ranked(self, terms, require_all, queryset=None):
+        match = Q()
+        score = Value(0)
+        for term in terms:
+            term_match = Q()
+            for field in SEARCH_FIELDS:
+                term_match |= Q(**{f'{field}__icontains': term})
+            match = (match & term_match) if require_all else (match | term_match)
+            for lookup, points in self.SCORES:
+                score = score + Case(When(Q(**{lookup: term}), then=Value(points)), default=Value(0),
+                                     output_field=IntegerField())
+        items = CatalogItem.objects.filter(match)
+        if queryset is not None:
+            items = items.filter(pk__in=queryset.values('pk'))
+        return items.annotate(search_score=score).order_by('-search_score', 'pk')
+
+    def search(self, query, limit=CANDIDATE_LIMIT, queryset=None):
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        return list(self._ranked(terms, require_all=True, queryset=queryset).values_list('pk', flat=True)[:limit])
+
+    def search_many(self, queries, limit=5):
+        results = []
+        for query in queries:
+            terms = [t for t in dict.fromkeys(tokenize(query)) if len(t) > 2 and t not in SUGGEST_STOPWORDS]
+            results.append(list(self._ranked(terms, require_all=False).values_list('pk', flat=True)[:limit]) if terms else [])
+        return results
+
+
+_backends = {}
+
+
+def get_backend():
+    """The search backend for the default database (CATALOG_SEARCH_BACKEND, else by vendor)"""
+    path = getattr(settings, 'CATALOG_SEARCH_BACKEND', None)
+    key = path or connection.vendor
+    if key not in _backends:
+        if path:
+            _backends[key] = import_string(path)()
+        elif connection.vendor == 'sqlite' and has_fts5(connection):
+            _backends[key] = FTS5Backend()
+        else:
+            _backends[key] = DatabaseBackend()
+    return _backends[key]
+
+
+def has_fts5(connection):
+    """Whether the SQLite behind connection was built with FTS5"""
+    with connection.cursor() as cursor:
+        cursor.execute("PRAGMA compile_options")
+        options = {row[0] for row in cursor.fetchall()}
+    if 'ENABLE_FTS5' not in options:
+        logger.warning("SQLite was built without FTS5; catalog search falls back to icontains queries")
+        return False
+    return True
+
+
+def search_items(query, queryset=None, limit=50):
+    """
+    Items of queryset (default: all) matching query, best first. The
+    queryset's filters are part of the ranking query, so every matching item
+    of the queryset can be found, however many other items rank above it.
+    """
+    queryset = CatalogItem.objects.all() if queryset is None else queryset
+    ranked = get_backend().search(query, limit, queryset)
+    position = {pk: n for n, pk in enumerate(ranked)}
+    return sorted(queryset.filter(pk__in=ranked), key=lambda item: position[item.pk])
+
+
+def suggest_items(descriptions, per_line=5):
+    """
+    Active catalog items for each free-text description (e.g. all lines of a
+    requisition), best first: [[CatalogItem, ...], ...]. The ranking is one
+    pass over all descriptions; the items are loaded with one more query.
+    """
+    # Fetch extra candidates so inactive items can be dropped
+    ranked = get_backend().search_many(descriptions, per_line * 2)
+    items = CatalogItem.objects.filter(is_active=True).in_bulk({pk for ids in ranked for pk in ids})
+    return [[items[pk] for pk in ids if pk in items][:per_line] for ids in ranked]
@@ -0,0 +1,48 @@
+"""
+Django signals for the catalog app.
+Keep the catalog search index in step with CatalogItem and the price
+cache in step with SupplierPriceTier.
+"""
+from django.db import DEFAULT_DB_ALIAS, connections
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .models import CatalogItem
+from .pricing import invalidate_prices
+from .search import FTS5Backend, get_backend, has_fts5
+
+
+def create_search_index(sender, using=DEFAULT_DB_ALIAS, **kwargs):
+    """
+    post_migrate: create the FTS5 search tables on SQLite databases built
+    without migrations (test databases with MIGRATE off). Databases migrated
+    past catalog 0002 already have them, and this is a no-op.
+    """
+    connection = connections[using]
+    if connection.vendor != 'sqlite':
+        return
+    with connection.cursor() as cursor:
+        if CatalogItem._meta.db_table not in connection.introspection.table_names(cursor):
+            return
+        if has_fts5(connection):
+            FTS5Backend().create(cursor)
+
+
+@receiver(post_save, sender='catalog.CatalogItem')
+def index_catalog_item(sender, instance, raw=False, **kwargs):
+    """Add or refresh a saved item in the search index"""
+    if not raw:
+        get_backend().index([instance])
+
+
+@receiver(post_delete, sender='catalog.CatalogItem')
+def unindex_catalog_item(sender, instance, **kwargs):
+    """Drop a deleted item from the search index"""
+    get_backend().remove([instance.pk])
+
+
+@receiver(post_save, sender='catalog.SupplierPriceTier')
+@receiver(post_delete, sender='catalog.SupplierPriceTier')
+def invalidate_tier_prices(sender, instance, **kwargs):
+    """Drop cached tiers in every process after any tier change"""
+    invalidate_prices()
@@ -0,0 +1,178 @@
+from datetime import date
+from decimal import Decimal
+
+from django.contrib.auth.models import User
+from django.test import TestCase, override_settings
+
+from ap.models import Supplier
+from core.models import Currency
+from procurement.requisitions.models import PRHeader, PRLine
+from .models import CatalogCategory, CatalogItem, SupplierPriceTier, UnitOfMeasure
+from .pricing import clear_price_cache, resolve_prices
+from .search import DatabaseBackend, FTS5Backend, get_backend, search_items, suggest_items
+
+
+class CatalogSearchTestCase(TestCase):
+
+    def setUp(self):
+        self.currency = Currency.objects.create(code="AED", name="Dirham", is_base=True)
+        self.uom = UnitOfMeasure.objects.create(code="EA", name="Each")
+        self.category = CatalogCategory.objects.create(code="GEN", name="General")
+        self.bolt = self.item("BOLT-M8", "Steel hex bolt M8", brand="Fastco")
+        self.washer = self.item("WSH-10", "Stainless steel washer", short_description="Fits M8 bolts")
+        self.wire = self.item("CW-2", "Copper wire 2mm", manufacturer="Wirex")
+        self.cable = self.item("CBL-5", "Network cable Cat6", is_active=False)
+        # Enough other items for bm25 to weigh rare words
+        for n in range(10):
+            self.item(f"GEN-{n}", f"Office chair model {n}")
+
+    def item(self, sku, name, **fields):
+        return CatalogItem.objects.create(sku=sku, item_code=sku, name=name, category=self.category,
+                                          unit_of_measure=self.uom, list_price=Decimal("5.00"),
+                                          currency=self.currency, **fields)
+
+    def skus(self, items):
+        return [item.sku for item in items]
+
+    def test_ranked_prefix_and_typo_matches(self):
+        self.assertIsInstance(get_backend(), FTS5Backend)
+        # Prefix of the last word, as typed
+        self.assertEqual(self.skus(search_items("stee")), ["BOLT-M8", "WSH-10"])
+        # A name hit outranks a description hit
+        self.assertEqual(self.skus(search_items("bolt")), ["BOLT-M8", "WSH-10"])
+        # One typo
+        self.assertEqual(self.skus(search_items("coper wire")), ["CW-2"])
+        self.assertEqual(self.skus(search_items("bolt", CatalogItem.objects.filter(sku="WSH-10"))), ["WSH-10"])
+
+        # Signals keep the index in step
+        self.wire.name = "Aluminium wire 2mm"
+        self.wire.save()
+        self.assertEqual(self.skus(search_items("copper")), [])
+        self.assertEqual(self.skus(search_items("alumin")), ["CW-2"])
+        self.bolt.delete()
+        self.assertEqual(self.skus(search_items("bolt")), ["WSH-10"])
+
+        self.assertEqual(get_backend().rebuild(), 13)
+        self.assertEqual(self.skus(search_items("stee")), ["WSH-10"])
+
+    def test_queryset_filters_apply_before_ranking(self):
+        # Many better "bolt" matches than the washer, none of them in the queryset
+        for n in range(30):
+            self.item(f"BLT-{n}", f"Bolt {n}", is_purchasable=False)
+        queryset = CatalogItem.objects.filter(is_purchasable=True)
+        for backend in (FTS5Backend(), DatabaseBackend()):
+            self.assertEqual(backend.search("bolt", 5, queryset), [self.bolt.pk, self.washer.pk])
+            self.assertEqual(backend.search("bolt", 5, queryset.filter(sku="WSH-10")), [self.washer.pk])
+            self.assertEqual(backend.search("bolt", 5, queryset.none()), [])
+        self.assertEqual(self.skus(search_items("bolt", queryset.exclude(sku="BOLT-M8"), limit=1)), ["WSH-10"])
+
+    def test_suggestions_for_all_lines_in_one_pass(self):
+        descriptions = ["hex bolts for the frame", "copper wiring", "network cable", "paint"]
+        with self.assertNumQueries(3):  # vocabulary, ranking, items
+            suggestions = suggest_items(descriptions)
+        self.assertEqual([self.skus(items) for items in suggestions], [["BOLT-M8", "WSH-10"], ["CW-2"], [], []])
+        with self.assertNumQueries(3):
+            suggest_items(descriptions * 25)
+
+        user = User.objects.create_user("requestor")
+        pr = PRHeader.objects.create(requestor=user, title="Workshop", required_date=date(2026, 12, 1), currency=self.currency)
+        for n, description in enumerate(descriptions, 1):
+            PRLine.objects.create(pr_header=pr, line_number=n, item_description=description, quantity=Decimal("1"),
+                                  unit_of_measure=self.uom, need_by_date=date(2026, 12, 1))
+        self.assertEqual(pr.generate_catalog_suggestions(), 2)
+        line = pr.lines.get(line_number=2)
+        self.assertEqual([s["sku"] for s in line.suggested_catalog_items], ["CW-2"])
+
+        resp = self.client.post("/api/procurement/catalog/items/suggest/",
+                                {"lines": ["steel washer", ""]}, content_type="application/json")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual([[s["sku"] for s in line] for line in resp.json()], [["WSH-10", "BOLT-M8"], []])
+
+    @override_settings(CATALOG_SEARCH_BACKEND="procurement.catalog.search.DatabaseBackend")
+    def test_database_backend(self):
+        self.assertIsInstance(get_backend(), DatabaseBackend)
+        self.assertEqual(self.skus(search_items("steel")), ["BOLT-M8", "WSH-10"])
+        self.assertEqual(self.skus(search_items("bolt-m8")), ["BOLT-M8", "WSH-10"])
+        self.assertEqual([self.skus(items) for items in suggest_items(["copper wiring", "cable"])], [["CW-2"], []])
+
+
+class PriceResolutionTestCase(TestCase):
+
+    def setUp(self):
+        clear_price_cache()
+        self.currency = Currency.objects.create(code="AED", name="Dirham", is_base=True)
+        uom = UnitOfMeasure.objects.create(code="EA", name="Each")
+        category = CatalogCategory.objects.create(code="GEN", name="General")
+        self.supplier = Supplier.objects.create(code="S1", name="Supplier 1")
+        self.other = Supplier.objects.create(code="S2", name="Supplier 2")
+        self.items = [
+            CatalogItem.objects.create(sku=f"ITM-{n}", item_code=f"ITM-{n}", name=f"Item {n}", category=category,
+                                       unit_of_measure=uom, list_price=Decimal("10.00"), currency=self.currency)
+            for n in range(3)
+        ]
+        for item in self.items:
+            for min_quantity, price in (("1", "9.00"), ("10", "8.00"), ("100", "7.00")):
+                self.tier(item, min_quantity, price)
+        # Expired and not yet valid tiers are ignored
+        self.tier(self.items[0], "50", "1.00", valid_from=date(2020, 1, 1), valid_to=date(2020, 12, 31))
+        self.tier(self.items[0], "5", "1.00", valid_from=date(2999, 1, 1))
+
+    def tier(self, item, min_quantity, price, **fields):
+        fields.setdefault("valid_from", date(2024, 1, 1))
+        return SupplierPriceTier.objects.create(catalog_item=item, supplier=self.supplier, currency=self.currency,
+                                                min_quantity=Decimal(min_quantity), unit_price=Decimal(price), **fields)
+
+    def test_quantity_breaks_resolved_in_bulk(self):
+        item = self.items[0]
+        lines = [(item, quantity, self.supplier) for quantity in ("0.5", "1", "9.999", "10", "99", "100", "5000")]
+        lines += [(item, 10, None), (item, 10, self.other)]
+        lines += [(other, 100, self.supplier) for other in self.items[1:]] * 200
+        with self.assertNumQueries(2):  # cache version, then one tier query for every pair
+            prices = resolve_prices(lines)
+        self.assertEqual(prices[:9], [Decimal(p) for p in ("10.00", "9.00", "9.00", "8.00", "8.00", "7.00", "7.00",
+                                                           "10.00", "10.00")])
+        self.assertEqual(set(prices[9:]), {Decimal("7.00")})
+        with self.assertNumQueries(0):
+            self.assertEqual(item.get_effective_price(Decimal("20"), self.supplier), Decimal("8.00"))
+
+        # Saving or deleting a tier drops the cached pair
+        tier = SupplierPriceTier.objects.get(catalog_item=item, min_quantity=10)
+        tier.unit_price = Decimal("7.50")
+        tier.save()
+        self.assertEqual(item.get_effective_price(20, self.supplier), Decimal("7.50"))
+        tier.delete()
+        self.assertEqual(item.get_effective_price(20, self.supplier), Decimal("9.00"))
+
+    def test_changes_from_other_processes_and_size_bound(self):
+        from core.cache_versions import bump_version
+        from .pricing import VERSION_KEY, _tiers
+
+        item = self.items[0]
+        self.assertEqual(item.get_effective_price(20, self.supplier), Decimal("8.00"))
+        # Another process reprices: no signal here, only its version bump
+        SupplierPriceTier.objects.filter(catalog_item=item, min_quantity=10).update(unit_price=Decimal("6.00"))
+        bump_version(VERSION_KEY)
+        with override_settings(CACHE_VERSION_CHECK_SECONDS=0):
+            self.assertEqual(item.get_effective_price(20, self.supplier), Decimal("6.00"))
+
+        with override_settings(CATALOG_PRICE_CACHE_SIZE=2):
+            resolve_prices([(other, 1, supplier) for other in self.items for supplier in (self.supplier, self.other)])
+        self.assertEqual(len(_tiers), 2)
+
+    def test_bulk_prices_endpoint(self):
+        item, other = self.items[:2]
+        lines = [{"item_id": item.id, "quantity": 12, "supplier_id": self.supplier.id},
+                 {"item_id": other.id, "quantity": "2.5"}]
+        with self.assertNumQueries(3):  # cache version, items, tiers
+            resp = self.client.post("/api/procurement/catalog/items/bulk_prices/", {"lines": lines},
+                                    content_type="application/json")
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual([(line["sku"], line["unit_price"], line["total"]) for line in resp.json()],
+                         [("ITM-0", "8.00", "96.00"), ("ITM-1", "10.00", "25.00")])
+
+        resp = self.client.post("/api/procurement/catalog/items/bulk_prices/",
+                                {"lines": [{"item_id": 999999, "quantity": 1}]}, content_type="application/json")
+        self.assertEqual((resp.status_code, resp.json()["item_ids"]), (400, [999999]))
+        resp = self.client.post("/api/procurement/catalog/items/bulk_prices/",
+                                {"lines": [{"item_id": item.id, "quantity": "-1"}]}, content_type="application/json")
+        self.assertEqual(resp.status_code, 400)
@@ -11,6 +11,9 @@ from rest_framework.permissions import IsAuthenticated, AllowAny
 from django.db.models import Sum, Count, Q
 from django.utils import timezone
 
+from core.mixins import FieldProjectionMixin
+from core.pagination import KeysetCursorPagination
+
 from .models import (
     ClauseLibrary, Contract, ContractClause,
     ContractSLA, ContractPenalty, ContractPenaltyInstance,
@@ -60,7 +63,7 @@ class ClauseLibraryViewSet(viewsets.ModelViewSet):
         serializer.save(created_by=self.request.user)
 
 
-class ContractViewSet(viewsets.ModelViewSet):
+class ContractViewSet(FieldProjectionMixin, viewsets.ModelViewSet):
     """
     ViewSet for Contracts.
     
@@ -78,6 +81,7 @@ class ContractViewSet(viewsets.ModelViewSet):
     - update_status: Update contract status based on dates (POST)
     - summary: Get summary (GET)
     """
+    pagination_class = KeysetCursorPagination
     
     queryset = Contract.objects.all().select_related(
         'currency', 'contract_owner', 'legal_reviewer',
@@ -21,6 +21,7 @@ from django.utils import timezone
 from decimal import Decimal
 from datetime import timedelta
 import json
+from core.sequences import next_document_number
 
 
 class ClauseLibrary(models.Model):
@@ -248,17 +249,7 @@ class Contract(models.Model):
         """Generate contract number: CTR-YYYYMM-NNNN"""
         today = timezone.now()
         prefix = f"CTR-{today.year}{today.month:02d}"
-        last_contract = Contract.objects.filter(
-            contract_number__startswith=prefix
-        ).order_by('-contract_number').first()
-        
-        if last_contract:
-            last_num = int(last_contract.contract_number.split('-')[-1])
-            new_num = last_num + 1
-        else:
-            new_num = 1
-        
-        return f"{prefix}-{new_num:04d}"
+        return next_document_number(Contract, 'contract_number', prefix)
     
     def update_status(self):
         """Update contract status based on current date"""
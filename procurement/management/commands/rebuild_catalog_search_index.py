@@ -0,0 +1,22 @@
+"""
+Management command to rebuild the catalog search index from CatalogItem.
+
+CatalogItem signals keep the index current on every save and delete, so
+run this after items were written without signals (bulk imports,
+queryset.update, raw SQL) or after switching CATALOG_SEARCH_BACKEND.
+
+Usage:
+    python manage.py rebuild_catalog_search_index
+"""
+from django.core.management.base import BaseCommand
+
+from procurement.catalog.search import get_backend
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the catalog item search index'
+
+    def handle(self, *args, **options):
+        backend = get_backend()
+        count = backend.rebuild()
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt catalog search index ({type(backend).__name__}): {count} item(s)'))
@@ -12,6 +12,9 @@ from django.db.models import Sum, Count, Q
 from django.utils import timezone
 from django.core.exceptions import ValidationError
 
+from core.mixins import FieldProjectionMixin
+from core.pagination import KeysetCursorPagination
+
 from .models import (
     TaxJurisdiction, TaxRate, TaxComponent,
     APPaymentBatch, APPaymentLine,
@@ -125,7 +128,7 @@ class TaxComponentViewSet(viewsets.ModelViewSet):
         return queryset.order_by('tax_rate', 'component_type')
 
 
-class APPaymentBatchViewSet(viewsets.ModelViewSet):
+class APPaymentBatchViewSet(FieldProjectionMixin, viewsets.ModelViewSet):
     """
     ViewSet for AP Payment Batches.
     
@@ -142,6 +145,7 @@ class APPaymentBatchViewSet(viewsets.ModelViewSet):
     - reconcile: Mark as reconciled (POST)
     - summary: Get summary (GET)
     """
+    pagination_class = KeysetCursorPagination
     
     queryset = APPaymentBatch.objects.all().select_related(
         'bank_account', 'currency', 'journal_entry'
@@ -22,6 +22,7 @@ from django.utils import timezone
 from django.db.models import Sum, Q
 from decimal import Decimal
 import json
+from core.sequences import next_document_number
 
 
 class TaxJurisdiction(models.Model):
@@ -332,17 +333,7 @@ class APPaymentBatch(models.Model):
         """Generate batch number: PB-YYYYMM-NNNN"""
         today = timezone.now()
         prefix = f"PB-{today.year}{today.month:02d}"
-        last_batch = APPaymentBatch.objects.filter(
-            batch_number__startswith=prefix
-        ).order_by('-batch_number').first()
-        
-        if last_batch:
-            last_num = int(last_batch.batch_number.split('-')[-1])
-            new_num = last_num + 1
-        else:
-            new_num = 1
-        
-        return f"{prefix}-{new_num:04d}"
+        return next_document_number(APPaymentBatch, 'batch_number', prefix)
     
     def recalculate_totals(self):
         """Recalculate batch totals from payment lines"""
@@ -982,19 +973,7 @@ class PaymentRequest(models.Model):
             from django.utils import timezone
             now = timezone.now()
             prefix = f"PR-{now.strftime('%Y%m')}"
-            
-            # Get the last request number for this month
-            last_request = PaymentRequest.objects.filter(
-                request_number__startswith=prefix
-            ).order_by('-request_number').first()
-            
-            if last_request:
-                last_num = int(last_request.request_number.split('-')[-1])
-                new_num = last_num + 1
-            else:
-                new_num = 1
-            
-            self.request_number = f"{prefix}-{new_num:04d}"
+            self.request_number = next_document_number(PaymentRequest, 'request_number', prefix)
         
         # Calculate base currency amount
         if self.exchange_rate and self.payment_amount:
@@ -10,6 +10,9 @@ from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import filters
 from django.contrib.auth.models import User
 
+from core.mixins import FieldProjectionMixin
+from core.pagination import KeysetCursorPagination
+
 from .models import POHeader, POLine
 from .serializers import (
     POHeaderListSerializer, POHeaderDetailSerializer,
@@ -18,7 +21,7 @@ from .serializers import (
 )
 
 
-class POHeaderViewSet(viewsets.ModelViewSet):
+class POHeaderViewSet(FieldProjectionMixin, viewsets.ModelViewSet):
     """
     ViewSet for Purchase Order Headers.
     
@@ -37,6 +40,7 @@ class POHeaderViewSet(viewsets.ModelViewSet):
     - GET /api/procurement/purchase-orders/my_pos/ - Get user's POs
     - GET /api/procurement/purchase-orders/pending_approval/ - Get POs pending approval
     """
+    pagination_class = KeysetCursorPagination
     
     queryset = POHeader.objects.all()
     permission_classes = [AllowAny]  # TODO: Change to IsAuthenticated in production
@@ -9,6 +9,7 @@ from datetime import date
 from decimal import Decimal
 from core.models import Currency
 from procurement.catalog.models import UnitOfMeasure
+from core.sequences import next_document_number
 
 
 class POHeader(models.Model):
@@ -187,21 +188,7 @@ class POHeader(models.Model):
         from datetime import date
         today = date.today()
         prefix = f"PO-{today.strftime('%Y%m')}"
-        
-        last_po = POHeader.objects.filter(
-            po_number__startswith=prefix
-        ).order_by('-po_number').first()
-        
-        if last_po:
-            try:
-                last_num = int(last_po.po_number.split('-')[-1])
-                new_num = last_num + 1
-            except (ValueError, IndexError):
-                new_num = 1
-        else:
-            new_num = 1
-        
-        return f"{prefix}-{new_num:04d}"
+        return next_document_number(POHeader, 'po_number', prefix)
     
     def calculate_totals(self):
         """Calculate PO totals from lines in both transaction and base currency."""
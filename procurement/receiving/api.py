@@ -9,6 +9,9 @@ from rest_framework.permissions import IsAuthenticated, AllowAny
 from django_filters.rest_framework import DjangoFilterBackend
 from django.shortcuts import get_object_or_404
 
+from core.mixins import FieldProjectionMixin
+from core.pagination import KeysetCursorPagination
+
 from .models import (
     Warehouse, GoodsReceipt, GRNLine,
     QualityInspection, NonConformance,
@@ -30,8 +33,9 @@ class WarehouseViewSet(viewsets.ModelViewSet):
     search_fields = ['name', 'code', 'location']
 
 
-class GoodsReceiptViewSet(viewsets.ModelViewSet):
+class GoodsReceiptViewSet(FieldProjectionMixin, viewsets.ModelViewSet):
     """API for Goods Receipt management"""
+    pagination_class = KeysetCursorPagination
     queryset = GoodsReceipt.objects.select_related('po_header', 'warehouse').prefetch_related('lines')
     permission_classes = [AllowAny]  # TODO: Change back to IsAuthenticated in production
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
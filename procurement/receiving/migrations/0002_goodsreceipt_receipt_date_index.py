@@ -0,0 +1,17 @@
+# Generated by Django 5.2.7 on 2026-10-16 06:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('receiving', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='goodsreceipt',
+            index=models.Index(fields=['receipt_date', 'grn_number'], name='receiving_g_receipt_e014d2_idx'),
+        ),
+    ]
@@ -12,7 +12,10 @@ Features:
 - 3-way matching (PO-Receipt-Invoice)
 """
 
+from collections import defaultdict
+
 from django.db import models
+from django.db.models import F
 from django.contrib.auth.models import User
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.utils import timezone
@@ -20,6 +23,7 @@ from django.contrib.contenttypes.fields import GenericForeignKey
 from django.contrib.contenttypes.models import ContentType
 from decimal import Decimal
 import json
+from core.sequences import next_document_number
 
 
 class Warehouse(models.Model):
@@ -275,6 +279,7 @@ class GoodsReceipt(models.Model):
         verbose_name = 'Goods Receipt'
         verbose_name_plural = 'Goods Receipts'
         indexes = [
+            models.Index(fields=['receipt_date', 'grn_number']),
             models.Index(fields=['status', 'receipt_date']),
             models.Index(fields=['supplier', 'receipt_date']),
             models.Index(fields=['warehouse', 'receipt_date']),
@@ -295,26 +300,9 @@ class GoodsReceipt(models.Model):
     
     def _generate_grn_number(self):
         """Generate unique GRN number: GRN-YYYYMM-NNNN"""
-        from django.db.models import Max
-        import re
-        
         today = timezone.now()
         prefix = f"GRN-{today.strftime('%Y%m')}"
-        
-        last_grn = GoodsReceipt.objects.filter(
-            grn_number__startswith=prefix
-        ).aggregate(Max('grn_number'))['grn_number__max']
-        
-        if last_grn:
-            match = re.search(r'-(\d+)$', last_grn)
-            if match:
-                sequence = int(match.group(1)) + 1
-            else:
-                sequence = 1
-        else:
-            sequence = 1
-        
-        return f"{prefix}-{sequence:04d}"
+        return next_document_number(GoodsReceipt, 'grn_number', prefix)
     
     def complete(self, user):
         """Complete the goods receipt."""
@@ -426,17 +414,17 @@ class GoodsReceipt(models.Model):
         
         from procurement.purchase_orders.models import POLine
         
-        # Update each GRN line's corresponding PO line
-        for grn_line in self.lines.all():
-            if grn_line.po_line_reference:
-                try:
-                    po_line = POLine.objects.get(id=int(grn_line.po_line_reference))
-                    # Add the received quantity to the PO line's received quantity
-                    po_line.quantity_received += grn_line.received_quantity
-                    po_line.save()
-                except (POLine.DoesNotExist, ValueError):
-                    # If PO line not found, continue with other lines
-                    continue
+        # Total received per PO line, added with one UPDATE per line
+        received = defaultdict(Decimal)
+        for reference, quantity in self.lines.values_list('po_line_reference', 'received_quantity'):
+            try:
+                received[int(reference)] += quantity
+            except (TypeError, ValueError):
+                # No or malformed PO line reference
+                continue
+        for po_line_id, quantity in received.items():
+            # A missing PO line updates nothing
+            POLine.objects.filter(id=po_line_id).update(quantity_received=F('quantity_received') + quantity)
         
         # Update PO header status based on receiving progress
         self._update_po_status()
@@ -886,26 +874,9 @@ class QualityInspection(models.Model):
     
     def _generate_inspection_number(self):
         """Generate unique inspection number: QI-YYYYMM-NNNN"""
-        from django.db.models import Max
-        import re
-        
         today = timezone.now()
         prefix = f"QI-{today.strftime('%Y%m')}"
-        
-        last_qi = QualityInspection.objects.filter(
-            inspection_number__startswith=prefix
-        ).aggregate(Max('inspection_number'))['inspection_number__max']
-        
-        if last_qi:
-            match = re.search(r'-(\d+)$', last_qi)
-            if match:
-                sequence = int(match.group(1)) + 1
-            else:
-                sequence = 1
-        else:
-            sequence = 1
-        
-        return f"{prefix}-{sequence:04d}"
+        return next_document_number(QualityInspection, 'inspection_number', prefix)
     
     def complete(self, user):
         """Complete the inspection."""
@@ -1077,26 +1048,9 @@ class NonConformance(models.Model):
     
     def _generate_ncr_number(self):
         """Generate unique NCR number: NCR-YYYYMM-NNNN"""
-        from django.db.models import Max
-        import re
-        
         today = timezone.now()
         prefix = f"NCR-{today.strftime('%Y%m')}"
-        
-        last_ncr = NonConformance.objects.filter(
-            ncr_number__startswith=prefix
-        ).aggregate(Max('ncr_number'))['ncr_number__max']
-        
-        if last_ncr:
-            match = re.search(r'-(\d+)$', last_ncr)
-            if match:
-                sequence = int(match.group(1)) + 1
-            else:
-                sequence = 1
-        else:
-            sequence = 1
-        
-        return f"{prefix}-{sequence:04d}"
+        return next_document_number(NonConformance, 'ncr_number', prefix)
     
     def close(self, user, resolution_notes):
         """Close the NCR."""
@@ -1238,26 +1192,9 @@ class ReturnToVendor(models.Model):
     
     def _generate_rtv_number(self):
         """Generate unique RTV number: RTV-YYYYMM-NNNN"""
-        from django.db.models import Max
-        import re
-        
         today = timezone.now()
         prefix = f"RTV-{today.strftime('%Y%m')}"
-        
-        last_rtv = ReturnToVendor.objects.filter(
-            rtv_number__startswith=prefix
-        ).aggregate(Max('rtv_number'))['rtv_number__max']
-        
-        if last_rtv:
-            match = re.search(r'-(\d+)$', last_rtv)
-            if match:
-                sequence = int(match.group(1)) + 1
-            else:
-                sequence = 1
-        else:
-            sequence = 1
-        
-        return f"{prefix}-{sequence:04d}"
+        return next_document_number(ReturnToVendor, 'rtv_number', prefix)
     
     def recalculate_total(self):
         """Recalculate total amount from lines."""
@@ -12,6 +12,9 @@ from django.db.models import Q, Sum, Count
 from django.utils import timezone
 from datetime import timedelta
 
+from core.mixins import FieldProjectionMixin
+from core.pagination import KeysetCursorPagination
+
 from .models import CostCenter, Project, PRHeader, PRLine
 from .services import PRToPOConversionService, PRLineSelectionHelper
 from .serializers import (
@@ -148,7 +151,7 @@ class ProjectViewSet(viewsets.ModelViewSet):
         return Response(utilization)
 
 
-class PRHeaderViewSet(viewsets.ModelViewSet):
+class PRHeaderViewSet(FieldProjectionMixin, viewsets.ModelViewSet):
     """
     ViewSet for Purchase Requisition Header management.
     
@@ -170,6 +173,7 @@ class PRHeaderViewSet(viewsets.ModelViewSet):
     - GET /api/requisition/pr-headers/pending_approval/ - Get PRs pending approval
     - GET /api/requisition/pr-headers/statistics/ - Get PR statistics
     """
+    pagination_class = KeysetCursorPagination
     
     queryset = PRHeader.objects.all()
     permission_classes = [AllowAny]  # TODO: Change back to IsAuthenticated in production
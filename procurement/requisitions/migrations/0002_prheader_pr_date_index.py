@@ -0,0 +1,17 @@
+# Generated by Django 5.2.7 on 2026-10-16 06:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('requisitions', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='prheader',
+            index=models.Index(fields=['pr_date', 'pr_number'], name='requisition_pr_date_a275b1_idx'),
+        ),
+    ]
@@ -17,6 +17,7 @@ from django.core.validators import MinValueValidator
 from django.utils import timezone
 from datetime import date
 from decimal import Decimal
+from core.sequences import next_document_number
 
 
 class CostCenter(models.Model):
@@ -351,6 +352,7 @@ class PRHeader(models.Model):
         verbose_name = 'Purchase Requisition'
         verbose_name_plural = 'Purchase Requisitions'
         indexes = [
+            models.Index(fields=['pr_date', 'pr_number']),
             models.Index(fields=['status', 'pr_date']),
             models.Index(fields=['cost_center', 'status']),
             models.Index(fields=['project', 'status']),
@@ -371,28 +373,9 @@ class PRHeader(models.Model):
     
     def _generate_pr_number(self):
         """Generate unique PR number: PR-YYYYMM-NNNN"""
-        from django.db.models import Max
-        import re
-        
         today = timezone.now()
         prefix = f"PR-{today.strftime('%Y%m')}"
-        
-        # Get the last PR number for this month
-        last_pr = PRHeader.objects.filter(
-            pr_number__startswith=prefix
-        ).aggregate(Max('pr_number'))['pr_number__max']
-        
-        if last_pr:
-            # Extract the sequence number
-            match = re.search(r'-(\d+)$', last_pr)
-            if match:
-                sequence = int(match.group(1)) + 1
-            else:
-                sequence = 1
-        else:
-            sequence = 1
-        
-        return f"{prefix}-{sequence:04d}"
+        return next_document_number(PRHeader, 'pr_number', prefix)
     
     def recalculate_totals(self):
         """Recalculate financial totals from lines."""
@@ -562,51 +545,33 @@ class PRHeader(models.Model):
         """
         Generate catalog item suggestions for lines without catalog items.
         
-        Uses text matching on item descriptions to suggest catalog items.
+        All line descriptions are matched against the catalog search index
+        in one pass (ranked, prefix- and typo-tolerant).
         """
-        from procurement.catalog.models import CatalogItem
-        from django.db.models import Q
-        
-        suggestions_count = 0
-        
-        for line in self.lines.filter(catalog_item__isnull=True):
-            if not line.item_description:
-                continue
-            
-            # Simple text search in catalog
-            # TODO: Implement more sophisticated matching (ML, fuzzy search)
-            keywords = line.item_description.lower().split()[:5]  # First 5 words
-            
-            query = Q()
-            for keyword in keywords:
-                if len(keyword) > 3:  # Skip short words
-                    query |= Q(name__icontains=keyword)
-                    query |= Q(description__icontains=keyword)
-            
-            if query:
-                suggestions = CatalogItem.objects.filter(
-                    query,
-                    is_active=True
-                ).distinct()[:5]
-                
-                if suggestions.exists():
-                    # Store suggestions in line
-                    line.suggested_catalog_items = [
-                        {
-                            'id': item.id,
-                            'name': item.name,
-                            'sku': item.sku,
-                            'unit_price': str(item.list_price),
-                        }
-                        for item in suggestions
-                    ]
-                    line.save()
-                    suggestions_count += 1
+        from procurement.catalog.search import suggest_items
+        
+        lines = [line for line in self.lines.filter(catalog_item__isnull=True) if line.item_description]
+        suggested = []
+        for line, items in zip(lines, suggest_items([line.item_description for line in lines])):
+            if items:
+                # Store suggestions in line
+                line.suggested_catalog_items = [
+                    {
+                        'id': item.id,
+                        'name': item.name,
+                        'sku': item.sku,
+                        'unit_price': str(item.list_price),
+                    }
+                    for item in items
+                ]
+                suggested.append(line)
+        if suggested:
+            PRLine.objects.bulk_update(suggested, ['suggested_catalog_items'])
         
         self.catalog_suggestions_generated = True
         self.save()
         
-        return suggestions_count
+        return len(suggested)
     
     def split_by_vendor(self):
         """
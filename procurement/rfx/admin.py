@@ -6,6 +6,7 @@ from .models import (
     RFxEvent, RFxItem, SupplierInvitation, SupplierQuote, SupplierQuoteLine,
     RFxAward, RFxAwardLine, AuctionBid
 )
+from .quote_comparison import lowest_submitted_totals
 
 
 # ==================== INLINE ADMINS ====================
@@ -437,8 +438,10 @@ class SupplierQuoteAdmin(admin.ModelAdmin):
     calculate_totals.short_description = "Recalculate quote totals"
     
     def calculate_scores(self, request, queryset):
-        for quote in queryset:
-            quote.calculate_scores()
+        # One lowest-total lookup for all selected events instead of one per quote
+        lowest = lowest_submitted_totals(queryset.values('rfx_event_id'))
+        for quote in queryset.select_related('rfx_event'):
+            quote.calculate_scores(lowest_price=lowest.get(quote.rfx_event_id))
         self.message_user(request, f'{queryset.count()} quote(s) scores recalculated.')
     calculate_scores.short_description = "Recalculate evaluation scores"
     
@@ -6,12 +6,18 @@ from rest_framework.permissions import IsAuthenticated, AllowAny
 from django_filters.rest_framework import DjangoFilterBackend
 from django.db.models import Q, Count, Sum, Avg, Min, Max
 from django.utils import timezone
-from decimal import Decimal
+from decimal import Decimal, InvalidOperation
+from django.shortcuts import get_object_or_404
+
+from core.mixins import FieldProjectionMixin
+from core.pagination import KeysetCursorPagination
 
 from .models import (
     RFxEvent, RFxItem, SupplierInvitation, SupplierQuote, SupplierQuoteLine,
     RFxAward, RFxAwardLine, AuctionBid
 )
+from .auction_engine import auction_engine
+from .quote_comparison import QuoteComparison
 from .serializers import (
     RFxEventListSerializer, RFxEventDetailSerializer, RFxEventCreateUpdateSerializer,
     RFxItemSerializer, SupplierInvitationSerializer, SupplierQuoteSerializer,
@@ -20,7 +26,7 @@ from .serializers import (
 )
 
 
-class RFxEventViewSet(viewsets.ModelViewSet):
+class RFxEventViewSet(FieldProjectionMixin, viewsets.ModelViewSet):
     """
     ViewSet for RFx Events (RFQ/RFP/RFI/ITB)
     
@@ -31,6 +37,7 @@ class RFxEventViewSet(viewsets.ModelViewSet):
     - Quote comparison
     - Awarding to suppliers
     """
+    pagination_class = KeysetCursorPagination
     queryset = RFxEvent.objects.all()
     permission_classes = [AllowAny]  # TODO: Change back to IsAuthenticated in production
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
@@ -143,70 +150,50 @@ class RFxEventViewSet(viewsets.ModelViewSet):
         """Get side-by-side comparison of all quotes"""
         rfx_event = self.get_object()
         
-        # Get all items
-        items = RFxItem.objects.filter(rfx_event=rfx_event).order_by('line_number')
-        
-        # Get all submitted quotes
-        quotes = SupplierQuote.objects.filter(
-            rfx_event=rfx_event,
-            status='SUBMITTED'
-        ).select_related('supplier', 'currency')
-        
-        # Build comparison matrix
-        comparison_matrix = {}
-        
-        for item in items:
-            item_data = {
-                'item_id': item.id,
-                'line_number': item.line_number,
-                'description': item.description,
-                'quantity': str(item.quantity),
-                'quotes': {}
-            }
-            
-            for quote in quotes:
-                try:
-                    quote_line = SupplierQuoteLine.objects.get(
-                        quote=quote,
-                        rfx_item=item,
-                        is_quoted=True
-                    )
-                    item_data['quotes'][quote.supplier.name] = {
-                        'quote_id': quote.id,
-                        'unit_price': str(quote_line.unit_price),
-                        'line_total': str(quote_line.get_line_total()),
-                        'delivery_days': quote_line.delivery_lead_time_days,
-                        'meets_specs': quote_line.meets_specifications,
-                        'brand': quote_line.brand_offered,
-                    }
-                except SupplierQuoteLine.DoesNotExist:
-                    item_data['quotes'][quote.supplier.name] = {
-                        'quoted': False
-                    }
-            
-            comparison_matrix[f'line_{item.line_number}'] = item_data
-        
-        # Identify best quotes
-        best_price = quotes.order_by('total_amount').first()
-        best_technical = quotes.order_by('-technical_score').first()
-        best_overall = quotes.order_by('-overall_score').first()
+        # Items, quotes and all their lines in three queries
+        comparison = QuoteComparison(rfx_event)
         
         result = {
             'rfx_event_id': rfx_event.id,
             'rfx_number': rfx_event.rfx_number,
             'rfx_title': rfx_event.title,
-            'item_count': items.count(),
-            'quote_count': quotes.count(),
-            'items': RFxItemSerializer(items, many=True).data,
-            'quotes': SupplierQuoteSerializer(quotes, many=True).data,
-            'comparison_matrix': comparison_matrix,
-            'best_price_supplier': best_price.supplier.name if best_price else None,
-            'best_technical_supplier': best_technical.supplier.name if best_technical else None,
-            'best_overall_supplier': best_overall.supplier.name if best_overall else None,
+            'item_count': len(comparison.items),
+            'quote_count': len(comparison.quotes),
+            'items': RFxItemSerializer(
+                comparison.items, many=True,
+                context={'item_quote_stats': comparison.item_quote_stats()}
+            ).data,
+            'quotes': SupplierQuoteSerializer(comparison.quotes, many=True).data,
+            'comparison_matrix': comparison.matrix(),
+            'quote_statistics': comparison.quote_statistics(),
+            'best_price_supplier': comparison.best_supplier('total_amount'),
+            'best_technical_supplier': comparison.best_supplier('technical_score', lowest=False),
+            'best_overall_supplier': comparison.best_supplier('overall_score', lowest=False),
         }
         
         return Response(result)
     
+    @action(detail=True, methods=['post'])
+    def score_quotes(self, request, pk=None):
+        """Recalculate evaluation scores of all submitted quotes"""
+        rfx_event = self.get_object()
+        quotes = QuoteComparison(rfx_event).score_quotes()
+        
+        return Response({
+            'status': 'success',
+            'scored_count': len(quotes),
+            'scores': [
+                {
+                    'quote_id': quote.id,
+                    'supplier_name': quote.supplier.name,
+                    'price_score': quote.price_score,
+                    'technical_score': quote.technical_score,
+                    'overall_score': quote.overall_score,
+                }
+                for quote in quotes
+            ]
+        })
+    
     @action(detail=True, methods=['post'])
     def create_award(self, request, pk=None):
         """Create award decision for RFx event"""
@@ -374,8 +361,9 @@ class SupplierInvitationViewSet(viewsets.ModelViewSet):
         })
 
 
-class SupplierQuoteViewSet(viewsets.ModelViewSet):
+class SupplierQuoteViewSet(FieldProjectionMixin, viewsets.ModelViewSet):
     """ViewSet for Supplier Quotes"""
+    pagination_class = KeysetCursorPagination
     queryset = SupplierQuote.objects.all()
     serializer_class = SupplierQuoteSerializer
     permission_classes = [AllowAny]  # TODO: Change back to IsAuthenticated in production
@@ -548,7 +536,7 @@ class AuctionBidViewSet(viewsets.ModelViewSet):
     
     @action(detail=False, methods=['post'])
     def submit_bid(self, request):
-        """Submit a new auction bid"""
+        """Submit a new auction bid (accepted through the per-event auction engine)"""
         rfx_event_id = request.data.get('rfx_event_id')
         supplier_id = request.data.get('supplier_id')
         bid_amount = request.data.get('bid_amount')
@@ -559,106 +547,56 @@ class AuctionBidViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        rfx_event = RFxEvent.objects.get(id=rfx_event_id)
-        
-        # Validate auction is active
-        now = timezone.now()
-        if not rfx_event.is_auction:
-            return Response(
-                {'error': 'This is not an auction event'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        if not (rfx_event.auction_start_date <= now <= rfx_event.auction_end_date):
-            return Response(
-                {'error': 'Auction is not currently active'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
+        try:
+            bid_amount = Decimal(str(bid_amount))
+        except InvalidOperation:
+            return Response({'error': 'bid_amount must be a number'}, status=status.HTTP_400_BAD_REQUEST)
         
         from ap.models import Supplier
-        supplier = Supplier.objects.get(id=supplier_id)
-        
-        # Get next bid number
-        last_bid = AuctionBid.objects.filter(
-            rfx_event=rfx_event,
-            supplier=supplier
-        ).order_by('-bid_number').first()
+        supplier = get_object_or_404(Supplier, id=supplier_id)
         
-        bid_number = (last_bid.bid_number + 1) if last_bid else 1
-        
-        # Validate bid amount (must be lower than current best)
-        current_best = AuctionBid.objects.filter(
-            rfx_event=rfx_event,
-            is_current_best=True
-        ).first()
-        
-        bid_amount = Decimal(str(bid_amount))
-        
-        if current_best and bid_amount >= current_best.bid_amount:
-            return Response(
-                {'error': f'Bid must be lower than current best bid of {current_best.bid_amount}'},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-        
-        # Create bid
-        bid = AuctionBid.objects.create(
-            rfx_event=rfx_event,
-            supplier=supplier,
-            bid_number=bid_number,
-            bid_amount=bid_amount
-        )
-        
-        # Update best bid flags
-        if current_best:
-            current_best.is_current_best = False
-            current_best.save()
-        
-        bid.is_current_best = True
-        bid.save()
-        
-        # Check for auto-extension
-        time_remaining = (rfx_event.auction_end_date - now).total_seconds() / 60
-        if time_remaining < rfx_event.auction_extension_minutes:
-            rfx_event.auction_end_date = timezone.now() + timezone.timedelta(
-                minutes=rfx_event.auction_extension_minutes
-            )
-            rfx_event.save()
-            bid.caused_extension = True
-            bid.save()
-        
-        # Update ranks
-        self._update_bid_ranks(rfx_event)
+        try:
+            bid, caused_extension = auction_engine.submit_bid(int(rfx_event_id), supplier, bid_amount)
+        except RFxEvent.DoesNotExist:
+            return Response({'error': 'RFx event not found'}, status=status.HTTP_404_NOT_FOUND)
+        except (ValueError, InvalidOperation) as e:
+            return Response({'error': str(e)}, status=status.HTTP_400_BAD_REQUEST)
         
         return Response({
             'status': 'success',
             'message': 'Bid submitted successfully',
             'bid': AuctionBidSerializer(bid).data,
             'is_best': bid.is_current_best,
-            'caused_extension': bid.caused_extension
+            'caused_extension': caused_extension
         })
     
-    def _update_bid_ranks(self, rfx_event):
-        """Update rank for all bids in an auction"""
-        # Get latest bid from each supplier
-        from django.db.models import Max
-        
-        latest_bids = AuctionBid.objects.filter(
-            rfx_event=rfx_event
-        ).values('supplier').annotate(
-            latest_bid_time=Max('bid_time')
-        )
-        
-        bids = []
-        for item in latest_bids:
-            bid = AuctionBid.objects.get(
-                rfx_event=rfx_event,
-                supplier_id=item['supplier'],
-                bid_time=item['latest_bid_time']
+    @action(detail=False, methods=['get'])
+    def live(self, request):
+        """
+        Long-poll an auction's ranking.
+        
+        Query params: rfx_event_id (required), since (version the client last
+        saw; omit to get the current state at once), timeout (seconds, max 30)
+        and supplier_id (return only that supplier's position).
+        """
+        try:
+            rfx_event_id = int(request.query_params['rfx_event_id'])
+            since = request.query_params.get('since')
+            since = int(since) if since is not None else None
+            timeout = min(float(request.query_params.get('timeout', 25)), 30)
+            supplier_id = request.query_params.get('supplier_id')
+            supplier_id = int(supplier_id) if supplier_id else None
+        except (KeyError, ValueError):
+            return Response(
+                {'error': 'rfx_event_id is required; since, timeout and supplier_id must be numbers'},
+                status=status.HTTP_400_BAD_REQUEST
             )
-            bids.append(bid)
         
-        # Sort by amount and assign ranks
-        bids.sort(key=lambda x: x.bid_amount)
-        for rank, bid in enumerate(bids, 1):
-            bid.rank = rank
-            bid.save()
+        try:
+            if since is None:
+                data = auction_engine.snapshot(rfx_event_id, supplier_id)
+            else:
+                data = auction_engine.wait_for_change(rfx_event_id, since, timeout, supplier_id)
+        except RFxEvent.DoesNotExist:
+            return Response({'error': 'RFx event not found'}, status=status.HTTP_404_NOT_FOUND)
+        return Response(data)
@@ -5,3 +5,7 @@ class ProcurementCoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'procurement.rfx'
     verbose_name = 'RFx & Sourcing Events'
+
+    def ready(self):
+        """Import signal handlers when Django starts"""
+        import procurement.rfx.signals  # noqa: F401
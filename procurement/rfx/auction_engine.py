@@ -0,0 +1,314 @@
+"""
+Reverse-auction bid engine.
+
+Bids on one RFxEvent are accepted one at a time. Every submission starts by
+bumping RFxEvent.auction_version, which takes the event's row lock (the
+database write lock on SQLite) until the transaction commits. Everything the
+acceptance rules read is read under that lock: the best bid, the supplier's
+last bid number and the closing time. So two concurrent bids can never both
+become the current best. Within a process, bidders on the same event also
+queue on a thread lock before touching the database.
+
+Each process keeps an AuctionBook per event. The book holds every supplier's
+latest bid, kept sorted by amount, and the auction_version it reflects. A
+book that is behind the event row, because another process accepted bids, is
+brought up to date from the bids created since. A book that cannot be
+reconciled is reloaded with one query. Ranks come from the book, and only
+bids whose rank changed are written, in a single bulk_update.
+
+Clients follow an auction through wait_for_change (the auction-bids/live/
+long-poll endpoint). It returns as soon as the version moves past the one the
+client last saw.
+
+A closed auction (status CLOSED, AWARDED or CANCELLED, or past its end date)
+keeps no book or lock in the process: release() drops them when the event is
+closed (see procurement.rfx.signals), and bids or snapshots that find the
+auction over drop them too.
+"""
+import threading
+import time
+from bisect import bisect_left, insort
+from collections import defaultdict
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from .models import AuctionBid, RFxEvent
+
+# Long-poll waiters re-check the database this often for bids accepted by other processes
+POLL_INTERVAL = 1.0
+CLOSED_STATUSES = ('CLOSED', 'AWARDED', 'CANCELLED')
+
+
+class AuctionClosed(ValueError):
+    """A bid on an auction that has ended"""
+
+
+def _is_closed(event, now):
+    return event.status in CLOSED_STATUSES or (event.auction_end_date is not None and now > event.auction_end_date)
+
+
+class _Entry:
+    __slots__ = ('supplier_id', 'supplier_name', 'bid_id', 'bid_number', 'amount', 'bid_time', 'rank')
+
+    def __init__(self, supplier_id, supplier_name, bid_id, bid_number, amount, bid_time, rank):
+        self.supplier_id = supplier_id
+        self.supplier_name = supplier_name
+        self.bid_id = bid_id
+        self.bid_number = bid_number
+        self.amount = amount
+        self.bid_time = bid_time
+        self.rank = rank
+
+    @property
+    def key(self):
+        # Lower amount ranks first; an earlier bid wins a tie
+        return (self.amount, self.bid_time, self.bid_id)
+
+
+class AuctionBook:
+    """Latest bid of each supplier in one auction, ordered by amount"""
+
+    def __init__(self, version=0):
+        self.version = version
+        self.last_bid_id = 0
+        self._keys = []           # sorted entry keys
+        self._by_supplier = {}    # supplier id -> latest entry
+        self._by_bid = {}         # bid id -> entry, for the entries in _keys
+
+    def __len__(self):
+        return len(self._keys)
+
+    def place(self, entry):
+        """Make entry the supplier's latest bid; returns it"""
+        old = self._by_supplier.get(entry.supplier_id)
+        if old is not None:
+            del self._keys[bisect_left(self._keys, old.key)]
+            del self._by_bid[old.bid_id]
+        self._by_supplier[entry.supplier_id] = entry
+        self._by_bid[entry.bid_id] = entry
+        insort(self._keys, entry.key)
+        self.last_bid_id = max(self.last_bid_id, entry.bid_id)
+        return entry
+
+    def best(self):
+        """Entry holding the lowest bid, or None"""
+        return self._by_bid[self._keys[0][2]] if self._keys else None
+
+    def last_bid_number(self, supplier_id):
+        entry = self._by_supplier.get(supplier_id)
+        return entry.bid_number if entry else 0
+
+    def ranked(self):
+        """Entries in rank order"""
+        return [self._by_bid[key[2]] for key in self._keys]
+
+    def rerank(self):
+        """Assign ranks from the current order; returns the entries whose rank changed"""
+        changed = []
+        for rank, entry in enumerate(self.ranked(), 1):
+            if entry.rank != rank:
+                entry.rank = rank
+                changed.append(entry)
+        return changed
+
+
+def _entries(queryset):
+    return [
+        _Entry(supplier_id, name, bid_id, bid_number, amount, bid_time, rank)
+        for supplier_id, name, bid_id, bid_number, amount, bid_time, rank in queryset.values_list(
+            'supplier_id', 'supplier__name', 'id', 'bid_number', 'bid_amount', 'bid_time', 'rank')
+    ]
+
+
+class AuctionEngine:
+    """Accepts auction bids and keeps one AuctionBook per event in this process"""
+
+    def __init__(self):
+        self._books = {}
+        self._locks = defaultdict(threading.Lock)
+        self._locks_guard = threading.Lock()
+        self._changed = threading.Condition()
+
+    def _lock(self, event_id):
+        with self._locks_guard:
+            return self._locks[event_id]
+
+    def forget(self, event_id=None):
+        """Drop cached books (all of them when event_id is None)"""
+        if event_id is None:
+            self._books.clear()
+        else:
+            self._books.pop(event_id, None)
+
+    def release(self, event_id):
+        """Drop the book and lock of an auction that has closed"""
+        with self._locks_guard:
+            self._locks.pop(event_id, None)
+        self._books.pop(event_id, None)
+
+    def _load(self, event_id, version):
+        book = AuctionBook(version)
+        bids = AuctionBid.objects.filter(rfx_event_id=event_id, is_valid=True).order_by('supplier_id', 'bid_number')
+        for entry in _entries(bids):
+            book.place(entry)
+        return book
+
+    def _book(self, event_id, version):
+        """The cached book brought up to `version`; caller holds the event's thread lock"""
+        book = self._books.get(event_id)
+        if book is not None and book.version < version:
+            # Catch up on bids accepted by other processes since this book was current
+            new_bids = _entries(
+                AuctionBid.objects.filter(rfx_event_id=event_id, id__gt=book.last_bid_id, is_valid=True).order_by('id')
+            )
+            if len(new_bids) == version - book.version:
+                for entry in new_bids:
+                    book.place(entry)
+                # The processes that accepted them already stored these ranks
+                book.rerank()
+                book.version = version
+        if book is None or book.version != version:
+            book = self._load(event_id, version)
+        self._books[event_id] = book
+        return book
+
+    def submit_bid(self, event_id, supplier, amount, now=None):
+        """
+        Accept a bid on an auction event.
+
+        Returns (bid, caused_extension). Raises ValueError when the bid is
+        rejected and RFxEvent.DoesNotExist for an unknown event.
+        """
+        try:
+            amount = Decimal(str(amount))
+            if not amount.is_finite():
+                raise InvalidOperation
+            amount = amount.quantize(Decimal('0.01'))
+        except (InvalidOperation, ValueError, TypeError):
+            raise ValueError('Bid amount must be a number')
+        try:
+            with self._lock(event_id):
+                try:
+                    with transaction.atomic():
+                        result = self._accept(event_id, supplier, amount, now or timezone.now())
+                except ValueError:
+                    # Rejected before the book was touched
+                    raise
+                except Exception:
+                    # The book may hold changes the rollback just undid
+                    self.forget(event_id)
+                    raise
+                transaction.on_commit(self._notify)
+        except AuctionClosed:
+            self.release(event_id)
+            raise
+        return result
+
+    def _accept(self, event_id, supplier, amount, now):
+        # Takes the per-event row lock for the rest of the transaction
+        if not RFxEvent.objects.filter(pk=event_id).update(auction_version=F('auction_version') + 1):
+            raise RFxEvent.DoesNotExist(f"RFx event {event_id} does not exist")
+        event = RFxEvent.objects.get(pk=event_id)
+
+        if not event.is_auction:
+            raise ValueError('This is not an auction event')
+        if event.auction_end_date and _is_closed(event, now):
+            raise AuctionClosed('Auction is not currently active')
+        if not (event.auction_start_date and event.auction_end_date
+                and event.auction_start_date <= now <= event.auction_end_date):
+            raise ValueError('Auction is not currently active')
+        if amount <= 0:
+            raise ValueError('Bid amount must be positive')
+
+        book = self._book(event_id, event.auction_version - 1)
+        best = book.best()
+        if best is not None:
+            if amount >= best.amount:
+                raise ValueError(f'Bid must be lower than current best bid of {best.amount}')
+            decrement = event.auction_minimum_decrement
+            if decrement and amount > best.amount - decrement:
+                raise ValueError(f'Bid must be at most {best.amount - decrement} (minimum decrement {decrement})')
+
+        bid = AuctionBid.objects.create(
+            rfx_event=event,
+            supplier=supplier,
+            bid_number=book.last_bid_number(supplier.id) + 1,
+            bid_amount=amount,
+            bid_time=now,
+            is_current_best=True,
+        )
+        AuctionBid.objects.filter(rfx_event=event, is_current_best=True).exclude(pk=bid.pk).update(is_current_best=False)
+
+        entry = book.place(_Entry(supplier.id, supplier.name, bid.id, bid.bid_number, amount, now, None))
+        changed = book.rerank()
+        AuctionBid.objects.bulk_update([AuctionBid(id=e.bid_id, rank=e.rank) for e in changed], ['rank'])
+        bid.rank = entry.rank
+
+        # Last-minute bids push the close out
+        remaining = (event.auction_end_date - now).total_seconds() / 60
+        if remaining < event.auction_extension_minutes:
+            event.auction_end_date = now + timezone.timedelta(minutes=event.auction_extension_minutes)
+            event.save(update_fields=['auction_end_date', 'updated_at'])
+            bid.caused_extension = True
+            bid.save(update_fields=['caused_extension'])
+
+        book.version = event.auction_version
+        return bid, bid.caused_extension
+
+    def _notify(self):
+        with self._changed:
+            self._changed.notify_all()
+
+    def snapshot(self, event_id, supplier_id=None):
+        """
+        Current state of an auction.
+
+        Buyers get the full ranking. When supplier_id is given, only that
+        supplier's own position and the best amount are returned.
+        """
+        event = RFxEvent.objects.only('auction_version', 'auction_end_date', 'status').get(pk=event_id)
+        if _is_closed(event, timezone.now()):
+            # Final ranking: read once, nothing kept
+            self.release(event_id)
+            book = self._load(event_id, event.auction_version)
+            ranked = book.ranked()
+        else:
+            with self._lock(event_id):
+                book = self._book(event_id, event.auction_version)
+                ranked = book.ranked()
+        best = ranked[0] if ranked else None
+        data = {
+            'rfx_event_id': event_id,
+            'version': book.version,
+            'auction_end_date': event.auction_end_date,
+            'best_bid_amount': best.amount if best else None,
+            'bidder_count': len(ranked),
+        }
+        rows = [
+            {'rank': e.rank, 'supplier_id': e.supplier_id, 'supplier_name': e.supplier_name,
+             'bid_number': e.bid_number, 'bid_amount': e.amount, 'bid_time': e.bid_time}
+            for e in ranked if supplier_id is None or e.supplier_id == supplier_id
+        ]
+        if supplier_id is None:
+            data['ranking'] = rows
+        else:
+            data['position'] = rows[0] if rows else None
+        return data
+
+    def wait_for_change(self, event_id, since, timeout=25, supplier_id=None):
+        """Block until the auction version differs from `since` or timeout passes; returns a snapshot"""
+        deadline = time.monotonic() + timeout
+        while True:
+            version = RFxEvent.objects.filter(pk=event_id).values_list('auction_version', flat=True).get()
+            remaining = deadline - time.monotonic()
+            if version != since or remaining <= 0:
+                return self.snapshot(event_id, supplier_id)
+            # Woken at once by bids accepted in this process, polled for the rest
+            with self._changed:
+                self._changed.wait(min(POLL_INTERVAL, remaining))
+
+
+auction_engine = AuctionEngine()
@@ -0,0 +1 @@
+# Procurement RFx management commands
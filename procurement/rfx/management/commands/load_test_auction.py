@@ -0,0 +1,190 @@
+"""
+Load test the reverse-auction engine with concurrent bidders.
+
+Creates a live auction event with --suppliers suppliers. It then spawns
+--processes worker processes, each running --threads bidder threads. Every
+bidder repeatedly undercuts the current best bid. Afterwards the command
+checks the auction's invariants:
+- exactly one current best, and it is the lowest bid;
+- every accepted bid beat all earlier ones;
+- bid numbers run 1..n per supplier;
+- latest-bid ranks match amount order;
+- auction_version equals the bid count.
+It reports accepted bids per second and submit latency. The event and its
+suppliers are deleted at the end unless --keep is given.
+
+Usage: python manage.py load_test_auction --processes 4 --threads 4 --bids 50
+"""
+import multiprocessing
+import os
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand, CommandError
+
+# Spawned workers import this module before django.setup() runs, so model
+# and service imports stay inside the functions below.
+
+
+def init_worker(settings_module):
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", settings_module)
+    from django.conf import settings
+    if settings.DATABASES["default"]["ENGINE"].endswith("sqlite3"):
+        # Bidders queue on the database lock rather than failing after 5s
+        settings.DATABASES["default"].setdefault("OPTIONS", {}).setdefault("timeout", 30)
+    import django
+    django.setup()
+
+
+def run_bidders(event_id, supplier_ids, threads, bids, seed):
+    """Run `threads` bidders that each try `bids` undercutting bids; returns (accepted, rejected, latencies)"""
+    from django.db import close_old_connections
+
+    from ap.models import Supplier
+    from procurement.rfx.auction_engine import auction_engine
+
+    suppliers = list(Supplier.objects.filter(id__in=supplier_ids))
+    accepted, rejected, latencies = [0], [0], []
+    guard = threading.Lock()
+
+    def bidder(n):
+        rng = random.Random(seed * 1000 + n)
+        try:
+            for _ in range(bids):
+                supplier = rng.choice(suppliers)
+                best = auction_engine.snapshot(event_id)['best_bid_amount'] or Decimal('1000000.00')
+                amount = best - Decimal(rng.randrange(1, 500)) / 100
+                t0 = time.perf_counter()
+                try:
+                    auction_engine.submit_bid(event_id, supplier, amount)
+                    ok = True
+                except ValueError:
+                    ok = False  # someone else got there first
+                with guard:
+                    latencies.append(time.perf_counter() - t0)
+                    if ok:
+                        accepted[0] += 1
+                    else:
+                        rejected[0] += 1
+        finally:
+            close_old_connections()
+
+    workers = [threading.Thread(target=bidder, args=(n,)) for n in range(threads)]
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    return accepted[0], rejected[0], latencies
+
+
+def verify_auction(event_id):
+    """Check an auction's stored bids against the engine's invariants; returns a list of problems"""
+    from procurement.rfx.models import AuctionBid, RFxEvent
+
+    problems = []
+    bids = list(AuctionBid.objects.filter(rfx_event_id=event_id).order_by('id'))
+    event = RFxEvent.objects.get(pk=event_id)
+    if event.auction_version != len(bids):
+        problems.append(f'auction_version {event.auction_version} != {len(bids)} bids')
+    if not bids:
+        return problems
+
+    best = [b for b in bids if b.is_current_best]
+    lowest = min(bids, key=lambda b: b.bid_amount)
+    if len(best) != 1 or best[0].pk != lowest.pk:
+        problems.append(f'current best {[b.pk for b in best]} is not the lowest bid {lowest.pk}')
+
+    floor = None
+    latest = {}
+    for bid in bids:
+        if floor is not None and bid.bid_amount >= floor:
+            problems.append(f'bid {bid.pk} ({bid.bid_amount}) did not beat {floor}')
+        floor = bid.bid_amount if floor is None else min(floor, bid.bid_amount)
+        expected = latest[bid.supplier_id].bid_number + 1 if bid.supplier_id in latest else 1
+        if bid.bid_number != expected:
+            problems.append(f'bid {bid.pk} has bid_number {bid.bid_number}, expected {expected}')
+        latest[bid.supplier_id] = bid
+
+    ranked = sorted(latest.values(), key=lambda b: (b.bid_amount, b.bid_time, b.pk))
+    for rank, bid in enumerate(ranked, 1):
+        if bid.rank != rank:
+            problems.append(f'bid {bid.pk} has rank {bid.rank}, expected {rank}')
+    return problems
+
+
+class Command(BaseCommand):
+    help = 'Load test the auction bid engine with concurrent bidder processes'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--processes', type=int, default=min(4, os.cpu_count() or 1))
+        parser.add_argument('--threads', type=int, default=4, help='Bidder threads per process')
+        parser.add_argument('--bids', type=int, default=50, help='Bid attempts per bidder')
+        parser.add_argument('--suppliers', type=int, default=12)
+        parser.add_argument('--keep', action='store_true', help='Keep the generated event and suppliers')
+
+    def handle(self, *args, **options):
+        from datetime import timedelta
+
+        from django.utils import timezone
+
+        from ap.models import Supplier
+        from core.models import Currency
+        from procurement.rfx.models import RFxEvent
+
+        currency = Currency.objects.filter(is_base=True).first() or Currency.objects.first()
+        if currency is None:
+            raise CommandError('Load test needs at least one currency')
+
+        tag = uuid.uuid4().hex[:8]
+        now = timezone.now()
+        suppliers = [Supplier.objects.create(code=f'LT-{tag}-{n}', name=f'Load test supplier {n}')
+                     for n in range(options['suppliers'])]
+        event = RFxEvent.objects.create(
+            rfx_number=f'LT-{tag}', title='Auction load test', description='Generated by load_test_auction',
+            submission_start_date=now, submission_due_date=now + timedelta(days=1), currency=currency,
+            is_auction=True, auction_start_date=now - timedelta(minutes=1),
+            auction_end_date=now + timedelta(hours=2), auction_extension_minutes=0,
+        )
+        try:
+            self._run(event, [s.id for s in suppliers], options)
+        finally:
+            if not options['keep']:
+                event.delete()
+                Supplier.objects.filter(id__in=[s.id for s in suppliers]).delete()
+
+    def _run(self, event, supplier_ids, options):
+        processes = options['processes']
+        self.stdout.write(f'{processes} process(es) x {options["threads"]} bidder(s) x {options["bids"]} bids '
+                          f'on {event.rfx_number}')
+        pool = ProcessPoolExecutor(
+            max_workers=processes,
+            mp_context=multiprocessing.get_context('spawn'),
+            initializer=init_worker,
+            initargs=(os.environ['DJANGO_SETTINGS_MODULE'],),
+        )
+        with pool:
+            t0 = time.perf_counter()
+            results = list(pool.map(
+                run_bidders, [event.id] * processes, [supplier_ids] * processes,
+                [options['threads']] * processes, [options['bids']] * processes, range(processes),
+            ))
+            elapsed = time.perf_counter() - t0
+
+        accepted = sum(r[0] for r in results)
+        rejected = sum(r[1] for r in results)
+        latencies = sorted(l for r in results for l in r[2])
+        p50 = latencies[len(latencies) // 2] * 1000 if latencies else 0
+        p99 = latencies[int(len(latencies) * 0.99)] * 1000 if latencies else 0
+        self.stdout.write(f'  accepted {accepted:,}  rejected {rejected:,}  in {elapsed:.2f}s '
+                          f'({accepted / elapsed:,.0f} accepted/s)  submit p50 {p50:.1f}ms p99 {p99:.1f}ms')
+
+        problems = verify_auction(event.id)
+        if problems:
+            for p in problems[:20]:
+                self.stdout.write(self.style.ERROR(f'  {p}'))
+            raise CommandError(f'{len(problems)} invariant violation(s)')
+        self.stdout.write(self.style.SUCCESS('  All auction invariants hold'))
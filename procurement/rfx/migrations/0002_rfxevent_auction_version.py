@@ -0,0 +1,18 @@
+# Generated by Django 5.2.7 on 2026-10-16 10:05
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rfx', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='rfxevent',
+            name='auction_version',
+            field=models.PositiveIntegerField(default=0, editable=False, help_text='Bumped by every accepted auction bid (see auction_engine)'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.7 on 2026-10-16 06:46
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('rfx', '0002_rfxevent_auction_version'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='rfxevent',
+            index=models.Index(fields=['created_at'], name='procurement_created_cb6e4a_idx'),
+        ),
+    ]
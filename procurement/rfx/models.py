@@ -79,6 +79,7 @@ class RFxEvent(models.Model):
     auction_end_date = models.DateTimeField(null=True, blank=True)
     auction_extension_minutes = models.IntegerField(default=5, help_text="Auto-extend auction by X minutes on last-minute bids")
     auction_minimum_decrement = models.DecimalField(max_digits=10, decimal_places=2, null=True, blank=True, help_text="Minimum price decrement for bids")
+    auction_version = models.PositiveIntegerField(default=0, editable=False, help_text="Bumped by every accepted auction bid (see auction_engine)")
     
     # Award Information
     awarded_to = models.ManyToManyField(Supplier, through='RFxAward', related_name='awarded_rfx_events')
@@ -103,6 +104,9 @@ class RFxEvent(models.Model):
         ordering = ['-created_at']
         verbose_name = 'RFx Event'
         verbose_name_plural = 'RFx Events'
+        indexes = [
+            models.Index(fields=['created_at']),
+        ]
     
     def __str__(self):
         return f"{self.rfx_number} - {self.title}"
@@ -348,20 +352,26 @@ class SupplierQuote(models.Model):
         
         return self.total_amount
     
-    def calculate_scores(self):
-        """Calculate evaluation scores"""
+    def calculate_scores(self, lowest_price=None, commit=True):
+        """
+        Calculate evaluation scores.
+        
+        lowest_price is the lowest submitted total of the event and is looked
+        up when not given; QuoteComparison.score_quotes passes it in when
+        scoring every quote of an event.
+        """
         if not self.rfx_event:
             return
         
         # Price Score (inverse - lower price = higher score)
-        all_quotes = SupplierQuote.objects.filter(
-            rfx_event=self.rfx_event,
-            status='SUBMITTED',
-            total_amount__isnull=False
-        ).order_by('total_amount')
+        if lowest_price is None and self.total_amount:
+            lowest_price = SupplierQuote.objects.filter(
+                rfx_event=self.rfx_event,
+                status='SUBMITTED',
+                total_amount__isnull=False
+            ).aggregate(lowest=models.Min('total_amount'))['lowest']
         
-        if all_quotes.exists() and self.total_amount:
-            lowest_price = all_quotes.first().total_amount
+        if lowest_price is not None and self.total_amount:
             if lowest_price and lowest_price > 0:
                 # Price score: 100 for lowest, scaled down for higher prices
                 self.price_score = min(Decimal('100'), (lowest_price / self.total_amount) * 100)
@@ -376,7 +386,8 @@ class SupplierQuote(models.Model):
         elif self.technical_score:
             self.overall_score = self.technical_score
         
-        self.save()
+        if commit:
+            self.save()
 
 
 class SupplierQuoteLine(models.Model):
@@ -0,0 +1,182 @@
+"""
+Quote comparison for an RFx event.
+
+QuoteComparison loads the event's items and its submitted quotes, with their
+lines prefetched, in three queries. It holds quoted unit prices as a NumPy
+matrix, one row per item and one column per quote, with NaN where a supplier
+did not quote. Per-line statistics (min, median, max, spread, best quote) and
+normalized price scores are computed over the whole matrix at once.
+
+The price score stored on SupplierQuote is still computed in Decimal from the
+lowest submitted total, so persisted scores do not depend on float rounding.
+"""
+from decimal import Decimal
+
+import numpy as np
+from django.db.models import Min, Prefetch
+from django.utils import timezone
+
+from .models import RFxItem, SupplierQuote, SupplierQuoteLine
+
+
+def _num(value):
+    """JSON-friendly float for a NumPy scalar; None for NaN"""
+    value = float(value)
+    return None if np.isnan(value) else round(value, 2)
+
+
+class QuoteComparison:
+    """Price matrix and statistics for the submitted quotes of one RFx event"""
+
+    def __init__(self, rfx_event):
+        self.rfx_event = rfx_event
+        self.items = list(RFxItem.objects.filter(rfx_event=rfx_event).order_by('line_number'))
+        self.quotes = list(
+            SupplierQuote.objects.filter(rfx_event=rfx_event, status='SUBMITTED')
+            .select_related('supplier', 'currency', 'rfx_event')
+            .prefetch_related(Prefetch('quote_lines', queryset=SupplierQuoteLine.objects.select_related('rfx_item')))
+        )
+        item_index = {item.id: i for i, item in enumerate(self.items)}
+
+        # lines[i][j]: quoted line of item i in quote j
+        self.lines = [[None] * len(self.quotes) for _ in self.items]
+        self.prices = np.full((len(self.items), len(self.quotes)), np.nan)
+        # Every submitted line, quoted or not, as RFxItem.get_quote_count/get_best_quote see them
+        self.item_line_counts = [0] * len(self.items)
+        self.item_min_prices = [None] * len(self.items)
+
+        for j, quote in enumerate(self.quotes):
+            for line in quote.quote_lines.all():
+                i = item_index.get(line.rfx_item_id)
+                if i is None:
+                    continue
+                self.item_line_counts[i] += 1
+                if self.item_min_prices[i] is None or line.unit_price < self.item_min_prices[i]:
+                    self.item_min_prices[i] = line.unit_price
+                if line.is_quoted:
+                    self.lines[i][j] = line
+                    self.prices[i, j] = float(line.unit_price)
+
+        self._stats = None
+
+    @property
+    def lowest_total(self):
+        """Lowest total_amount among the submitted quotes, as SupplierQuote.calculate_scores uses it"""
+        totals = [q.total_amount for q in self.quotes if q.total_amount is not None]
+        return min(totals) if totals else None
+
+    def line_statistics(self):
+        """Per-item price statistics over the quoted lines, as NumPy arrays"""
+        if self._stats is None:
+            # A zero-width matrix has no identity for min/max; one NaN column gives the same result
+            prices = self.prices if self.quotes else np.full((len(self.items), 1), np.nan)
+            quoted = ~np.isnan(prices)
+            counts = quoted.sum(axis=1)
+            has_quotes = counts > 0
+            # nan* reductions warn on all-NaN rows; fill those rows so they stay quiet, then mask them out
+            filled = np.where(has_quotes[:, None], prices, 0.0)
+            low = np.where(has_quotes, np.nanmin(filled, axis=1), np.nan)
+            high = np.where(has_quotes, np.nanmax(filled, axis=1), np.nan)
+            median = np.where(has_quotes, np.nanmedian(filled, axis=1), np.nan)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                spread_pct = np.where(low > 0, (high - low) / low * 100, np.nan)
+                # 100 for the cheapest quote of a line, proportionally less for dearer ones
+                scores = np.where(quoted & (prices > 0), low[:, None] / prices * 100, np.nan)
+            best = np.where(has_quotes, np.argmin(np.where(quoted, prices, np.inf), axis=1), -1)
+            self._stats = {
+                'count': counts, 'min': low, 'max': high, 'median': median,
+                'spread_pct': spread_pct, 'best': best, 'scores': scores,
+            }
+        return self._stats
+
+    def item_quote_stats(self):
+        """{item id: {'count', 'best_price'}} for RFxItemSerializer, matching its per-item queries"""
+        return {
+            item.id: {'count': self.item_line_counts[i], 'best_price': self.item_min_prices[i]}
+            for i, item in enumerate(self.items)
+        }
+
+    def matrix(self):
+        """The comparison_matrix payload: one entry per item, keyed 'line_<n>'"""
+        stats = self.line_statistics()
+        result = {}
+        for i, item in enumerate(self.items):
+            best = int(stats['best'][i])
+            item_data = {
+                'item_id': item.id,
+                'line_number': item.line_number,
+                'description': item.description,
+                'quantity': str(item.quantity),
+                'quotes': {},
+                'price_stats': {
+                    'quote_count': int(stats['count'][i]),
+                    'min_unit_price': _num(stats['min'][i]),
+                    'median_unit_price': _num(stats['median'][i]),
+                    'max_unit_price': _num(stats['max'][i]),
+                    'spread_pct': _num(stats['spread_pct'][i]),
+                    'best_quote_id': self.quotes[best].id if best >= 0 else None,
+                    'best_supplier': self.quotes[best].supplier.name if best >= 0 else None,
+                },
+            }
+            for j, quote in enumerate(self.quotes):
+                line = self.lines[i][j]
+                if line is None:
+                    item_data['quotes'][quote.supplier.name] = {'quoted': False}
+                    continue
+                item_data['quotes'][quote.supplier.name] = {
+                    'quote_id': quote.id,
+                    'unit_price': str(line.unit_price),
+                    'line_total': str(line.get_line_total()),
+                    'delivery_days': line.delivery_lead_time_days,
+                    'meets_specs': line.meets_specifications,
+                    'brand': line.brand_offered,
+                    'price_score': _num(stats['scores'][i, j]),
+                    'is_best': j == best,
+                }
+            result[f'line_{item.line_number}'] = item_data
+        return result
+
+    def quote_statistics(self):
+        """Per-quote summary: lines quoted, lines where it is cheapest, mean line score"""
+        stats = self.line_statistics()
+        quoted = ~np.isnan(self.prices)
+        lines_quoted = quoted.sum(axis=0)
+        lines_best = np.bincount(stats['best'][stats['best'] >= 0], minlength=len(self.quotes))
+        score_sums = np.where(quoted, np.nan_to_num(stats['scores']), 0.0).sum(axis=0)
+        return [
+            {
+                'quote_id': quote.id,
+                'supplier_name': quote.supplier.name,
+                'lines_quoted': int(lines_quoted[j]),
+                'lines_best': int(lines_best[j]),
+                'average_line_score': round(float(score_sums[j] / lines_quoted[j]), 2) if lines_quoted[j] else None,
+            }
+            for j, quote in enumerate(self.quotes)
+        ]
+
+    def best_supplier(self, field, lowest=True):
+        """Supplier name of the quote with the lowest (or highest) non-null `field`"""
+        candidates = [q for q in self.quotes if getattr(q, field) is not None]
+        if not candidates:
+            return None
+        pick = min if lowest else max
+        return pick(candidates, key=lambda q: getattr(q, field)).supplier.name
+
+    def score_quotes(self):
+        """Recalculate price and overall scores of every submitted quote; returns the quotes"""
+        lowest = self.lowest_total
+        now = timezone.now()
+        for quote in self.quotes:
+            quote.calculate_scores(lowest_price=lowest, commit=False)
+            quote.updated_at = now
+        SupplierQuote.objects.bulk_update(self.quotes, ['price_score', 'overall_score', 'updated_at'])
+        return self.quotes
+
+
+def lowest_submitted_totals(rfx_event_ids):
+    """{event id: lowest submitted quote total} for several events in one grouped query"""
+    rows = (
+        SupplierQuote.objects.filter(rfx_event_id__in=rfx_event_ids, status='SUBMITTED', total_amount__isnull=False)
+        .values('rfx_event_id').annotate(lowest=Min('total_amount'))
+    )
+    return {row['rfx_event_id']: row['lowest'] for row in rows}
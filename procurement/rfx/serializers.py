@@ -24,10 +24,20 @@ class RFxItemSerializer(serializers.ModelSerializer):
         ]
         read_only_fields = ['id', 'created_at']
     
+    def _quote_stats(self, obj):
+        # Precomputed by QuoteComparison when serializing a whole event's items
+        return self.context.get('item_quote_stats', {}).get(obj.id)
+    
     def get_quote_count(self, obj):
+        stats = self._quote_stats(obj)
+        if stats is not None:
+            return stats['count']
         return obj.get_quote_count()
     
     def get_best_quote_price(self, obj):
+        stats = self._quote_stats(obj)
+        if stats is not None:
+            return stats['best_price']
         best_quote = obj.get_best_quote()
         return best_quote.unit_price if best_quote else None
 
@@ -284,6 +294,7 @@ class QuoteComparisonSerializer(serializers.Serializer):
     items = serializers.ListField()
     quotes = serializers.ListField()
     comparison_matrix = serializers.DictField()
+    quote_statistics = serializers.ListField()
     
     best_price_supplier = serializers.CharField(allow_null=True)
     best_technical_supplier = serializers.CharField(allow_null=True)
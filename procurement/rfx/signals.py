@@ -0,0 +1,20 @@
+"""
+Django signals for the rfx app.
+Free the auction engine's per-event state once an event is closed.
+"""
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .auction_engine import CLOSED_STATUSES, auction_engine
+
+
+@receiver(post_save, sender='rfx.RFxEvent')
+def release_closed_auction(sender, instance, **kwargs):
+    """Drop the cached book and lock of a closed, awarded or cancelled event"""
+    if instance.status in CLOSED_STATUSES:
+        auction_engine.release(instance.pk)
+
+
+@receiver(post_delete, sender='rfx.RFxEvent')
+def release_deleted_auction(sender, instance, **kwargs):
+    auction_engine.release(instance.pk)
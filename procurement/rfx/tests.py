@@ -0,0 +1,273 @@
+import threading
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import close_old_connections, connection
+from django.test import TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+
+from ap.models import Supplier
+from core.models import Currency
+from .auction_engine import AuctionEngine
+from .management.commands.load_test_auction import verify_auction
+from .models import AuctionBid, RFxEvent, RFxItem, SupplierQuote, SupplierQuoteLine
+from .quote_comparison import QuoteComparison
+
+
+def make_auction(suppliers=3, **kwargs):
+    now = timezone.now()
+    currency = Currency.objects.create(code="AED", name="Dirham", is_base=True)
+    fields = dict(
+        rfx_number="RFQ-AUC-1", title="Reverse auction", description="Test auction",
+        submission_start_date=now, submission_due_date=now + timedelta(days=1), currency=currency,
+        is_auction=True, auction_start_date=now - timedelta(minutes=5), auction_end_date=now + timedelta(hours=1),
+    )
+    fields.update(kwargs)
+    event = RFxEvent.objects.create(**fields)
+    return event, [Supplier.objects.create(code=f"S{n}", name=f"Supplier {n}") for n in range(suppliers)]
+
+
+class AuctionEngineTestCase(TestCase):
+
+    def setUp(self):
+        self.event, self.suppliers = make_auction(auction_minimum_decrement=Decimal("5.00"))
+        self.engine = AuctionEngine()
+
+    def bid(self, supplier, amount, engine=None):
+        return (engine or self.engine).submit_bid(self.event.id, supplier, Decimal(amount))
+
+    def test_ranks_best_flag_and_bid_numbers(self):
+        a, b, c = self.suppliers
+        self.bid(a, "1000")
+        self.bid(b, "990")
+        self.bid(a, "980")
+        self.bid(c, "900")
+
+        latest = {bid.supplier_id: bid for bid in AuctionBid.objects.order_by("id")}
+        self.assertEqual({s: latest[s.id].rank for s in self.suppliers}, {c: 1, a: 2, b: 3})
+        self.assertEqual(list(AuctionBid.objects.filter(is_current_best=True).values_list("bid_amount", flat=True)),
+                         [Decimal("900.00")])
+        self.assertEqual([bid.bid_number for bid in AuctionBid.objects.filter(supplier=a).order_by("id")], [1, 2])
+        self.assertEqual(verify_auction(self.event.id), [])
+
+    def test_rejections_leave_no_trace(self):
+        a, b, _ = self.suppliers
+        self.bid(a, "1000")
+        with self.assertRaisesMessage(ValueError, "lower than current best"):
+            self.bid(b, "1000")
+        with self.assertRaisesMessage(ValueError, "minimum decrement"):
+            self.bid(b, "996")
+        self.event.refresh_from_db()
+        self.assertEqual(self.event.auction_version, 1)
+
+        bid, _ = self.bid(b, "995")
+        self.assertEqual(bid.rank, 1)
+        self.assertEqual(verify_auction(self.event.id), [])
+
+    def test_closed_auction_and_extension(self):
+        RFxEvent.objects.filter(pk=self.event.pk).update(auction_end_date=timezone.now() - timedelta(seconds=1))
+        with self.assertRaisesMessage(ValueError, "not currently active"):
+            self.bid(self.suppliers[0], "1000")
+
+        RFxEvent.objects.filter(pk=self.event.pk).update(auction_end_date=timezone.now() + timedelta(minutes=1))
+        _, extended = self.bid(self.suppliers[0], "1000")
+        self.assertTrue(extended)
+        self.event.refresh_from_db()
+        self.assertGreater(self.event.auction_end_date, timezone.now() + timedelta(minutes=4))
+
+    def test_books_in_other_processes_catch_up(self):
+        # A second engine stands in for another worker process with its own book
+        a, b, c = self.suppliers
+        other = AuctionEngine()
+        self.bid(a, "1000")
+        self.bid(b, "990", engine=other)
+        self.bid(c, "980", engine=other)
+        with self.assertRaisesMessage(ValueError, "current best bid of 980.00"):
+            self.bid(a, "985")
+        bid, _ = self.bid(a, "970")
+        self.assertEqual(bid.bid_number, 2)
+
+        snapshot = self.engine.snapshot(self.event.id)
+        self.assertEqual(snapshot["version"], 4)
+        self.assertEqual([row["supplier_id"] for row in snapshot["ranking"]], [a.id, c.id, b.id])
+        self.assertEqual(other.snapshot(self.event.id)["ranking"], snapshot["ranking"])
+        self.assertEqual(verify_auction(self.event.id), [])
+
+    def test_live_endpoint(self):
+        a, b, _ = self.suppliers
+        self.bid(a, "1000")
+        url = "/api/procurement/rfx/auction-bids/live/"
+        resp = self.client.get(url, {"rfx_event_id": self.event.id})
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(resp.json()["version"], 1)
+
+        # Nothing new since version 1: returns the unchanged book when the timeout passes
+        resp = self.client.get(url, {"rfx_event_id": self.event.id, "since": 1, "timeout": 0.1})
+        self.assertEqual(resp.json()["version"], 1)
+
+        resp = self.client.post("/api/procurement/rfx/auction-bids/submit_bid/",
+                                {"rfx_event_id": self.event.id, "supplier_id": b.id, "bid_amount": "950"})
+        self.assertEqual(resp.status_code, 200)
+        resp = self.client.get(url, {"rfx_event_id": self.event.id, "since": 1, "supplier_id": a.id})
+        data = resp.json()
+        self.assertEqual((data["version"], data["position"]["rank"]), (2, 2))
+        self.assertNotIn("ranking", data)
+
+        for amount in ("NaN", "Infinity", "-Infinity", "1e40"):
+            resp = self.client.post("/api/procurement/rfx/auction-bids/submit_bid/",
+                                    {"rfx_event_id": self.event.id, "supplier_id": b.id, "bid_amount": amount})
+            self.assertEqual(resp.status_code, 400, amount)
+
+    def test_closed_auction_state_is_dropped(self):
+        from .auction_engine import auction_engine
+
+        self.bid(self.suppliers[0], "1000")
+        RFxEvent.objects.filter(pk=self.event.pk).update(auction_end_date=timezone.now() - timedelta(seconds=1))
+        with self.assertRaisesMessage(ValueError, "not currently active"):
+            self.bid(self.suppliers[1], "900")
+        self.assertNotIn(self.event.id, self.engine._books)
+        self.assertNotIn(self.event.id, self.engine._locks)
+        self.assertEqual(len(self.engine.snapshot(self.event.id)["ranking"]), 1)
+        self.assertNotIn(self.event.id, self.engine._books)
+
+        # Closing the event frees the shared engine's state
+        RFxEvent.objects.filter(pk=self.event.pk).update(auction_end_date=timezone.now() + timedelta(hours=1))
+        self.bid(self.suppliers[1], "900", engine=auction_engine)
+        self.assertIn(self.event.id, auction_engine._books)
+        self.event.refresh_from_db()
+        self.event.status = "PUBLISHED"
+        self.assertTrue(self.event.close())
+        self.assertNotIn(self.event.id, auction_engine._books)
+        self.assertNotIn(self.event.id, auction_engine._locks)
+
+
+class AuctionConcurrencyTestCase(TransactionTestCase):
+    """Bidders racing on one event: exactly one current best and consistent ranks"""
+
+    def test_concurrent_bidders(self):
+        event, suppliers = make_auction(suppliers=6, auction_extension_minutes=0)
+        engine = AuctionEngine()
+        outcomes = []
+
+        def bidder(n):
+            try:
+                for step in range(15):
+                    # Every bidder aims for the same price, so most attempts collide
+                    amount = Decimal(10_000 - step * 100 - n)
+                    try:
+                        engine.submit_bid(event.id, suppliers[n], amount)
+                        outcomes.append(True)
+                    except ValueError:
+                        outcomes.append(False)
+            finally:
+                close_old_connections()
+
+        threads = [threading.Thread(target=bidder, args=(n,)) for n in range(len(suppliers))]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(len(outcomes), 6 * 15)
+        self.assertEqual(AuctionBid.objects.count(), outcomes.count(True))
+        self.assertEqual(verify_auction(event.id), [])
+
+
+class QuoteComparisonTestCase(TestCase):
+
+    def setUp(self):
+        self.event, self.suppliers = make_auction(is_auction=False, rfx_number="RFQ-CMP-1")
+        self.event.refresh_from_db()  # Decimal weights, as loaded events have them
+        self.items = []
+
+    def add_items(self, count):
+        start = len(self.items)
+        self.items += [
+            RFxItem.objects.create(rfx_event=self.event, line_number=start + n + 1,
+                                   description=f"Item {start + n + 1}", quantity=Decimal("10"))
+            for n in range(count)
+        ]
+
+    def add_quote(self, supplier, prices, status="SUBMITTED", technical_score=None):
+        """prices: one unit price per item, None for a line quoted as not offered"""
+        quote = SupplierQuote.objects.create(
+            rfx_event=self.event, supplier=supplier, quote_number=f"Q-{SupplierQuote.objects.count() + 1}",
+            status=status, currency=self.event.currency, payment_terms_days=30, delivery_lead_time_days=14,
+            technical_score=technical_score,
+        )
+        for item, price in zip(self.items, prices):
+            SupplierQuoteLine.objects.create(quote=quote, rfx_item=item, quantity=item.quantity,
+                                             unit_price=Decimal(price or "0"), is_quoted=price is not None)
+        quote.calculate_totals()
+        return quote
+
+    def test_matrix_and_statistics(self):
+        a, b, c = self.suppliers
+        self.add_items(3)
+        qa = self.add_quote(a, ["10.00", "20.00", None], technical_score=Decimal("60"))
+        qb = self.add_quote(b, ["12.00", "15.00", "7.00"], technical_score=Decimal("90"))
+        self.add_quote(c, ["1.00", "1.00", "1.00"], status="DRAFT")
+
+        resp = self.client.get(f"/api/procurement/rfx/rfx-events/{self.event.id}/quote_comparison/")
+        self.assertEqual(resp.status_code, 200)
+        data = resp.json()
+        self.assertEqual((data["item_count"], data["quote_count"]), (3, 2))
+
+        line1 = data["comparison_matrix"]["line_1"]
+        self.assertEqual(line1["price_stats"], {
+            "quote_count": 2, "min_unit_price": 10.0, "median_unit_price": 11.0, "max_unit_price": 12.0,
+            "spread_pct": 20.0, "best_quote_id": qa.id, "best_supplier": a.name,
+        })
+        self.assertEqual(line1["quotes"][b.name]["price_score"], 83.33)
+        self.assertTrue(line1["quotes"][a.name]["is_best"])
+        self.assertEqual(line1["quotes"][a.name]["unit_price"], "10.00")
+        self.assertEqual(data["comparison_matrix"]["line_3"]["quotes"][a.name], {"quoted": False})
+        self.assertEqual(data["comparison_matrix"]["line_3"]["price_stats"]["spread_pct"], 0.0)
+
+        stats = {row["quote_id"]: row for row in data["quote_statistics"]}
+        self.assertEqual((stats[qa.id]["lines_quoted"], stats[qa.id]["lines_best"]), (2, 1))
+        self.assertEqual((stats[qb.id]["lines_quoted"], stats[qb.id]["lines_best"]), (3, 2))
+
+        # Item columns count every submitted line, as RFxItem.get_quote_count does
+        items = {row["line_number"]: row for row in data["items"]}
+        for item in self.items:
+            best = item.get_best_quote()
+            self.assertEqual(items[item.line_number]["quote_count"], item.get_quote_count())
+            self.assertEqual(items[item.line_number]["best_quote_price"], float(best.unit_price))
+        self.assertEqual(data["best_price_supplier"], a.name)
+        self.assertEqual(data["best_technical_supplier"], b.name)
+
+    def test_query_count_independent_of_size(self):
+        self.add_items(2)
+        self.add_quote(self.suppliers[0], ["10.00", "20.00"])
+        url = f"/api/procurement/rfx/rfx-events/{self.event.id}/quote_comparison/"
+        with CaptureQueriesContext(connection) as small:
+            self.client.get(url)
+
+        self.add_items(8)
+        for supplier in self.suppliers[1:]:
+            self.add_quote(supplier, [str(n + 5) for n in range(len(self.items))])
+        with CaptureQueriesContext(connection) as large:
+            resp = self.client.get(url)
+        self.assertEqual(resp.json()["quote_count"], 3)
+        self.assertEqual(len(large), len(small))
+
+    def test_score_quotes_matches_calculate_scores(self):
+        a, b, c = self.suppliers
+        self.add_items(2)
+        quotes = [
+            self.add_quote(a, ["10.00", "20.00"], technical_score=Decimal("70")),
+            self.add_quote(b, ["13.00", "19.00"], technical_score=Decimal("85")),
+            self.add_quote(c, ["30.00", "40.00"]),
+        ]
+        for quote in quotes:
+            quote.calculate_scores()
+        expected = [(q.pk, q.price_score, q.overall_score) for q in SupplierQuote.objects.order_by("pk")]
+        SupplierQuote.objects.update(price_score=None, overall_score=None)
+
+        resp = self.client.post(f"/api/procurement/rfx/rfx-events/{self.event.id}/score_quotes/")
+        self.assertEqual(resp.json()["scored_count"], 3)
+        actual = [(q.pk, q.price_score, q.overall_score) for q in SupplierQuote.objects.order_by("pk")]
+        self.assertEqual(actual, expected)
+        self.assertEqual(expected[0][1], Decimal("100.00"))
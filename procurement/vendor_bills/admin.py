@@ -6,10 +6,12 @@ from django.contrib import admin
 from django.utils.html import format_html
 from django.urls import reverse
 from django.utils import timezone
+from django.db import transaction
 from .models import (
     VendorBill, VendorBillLine, ThreeWayMatch, 
     MatchException, MatchTolerance
 )
+from .services import BatchThreeWayMatcher
 
 
 class VendorBillLineInline(admin.TabularInline):
@@ -250,16 +252,17 @@ class VendorBillAdmin(admin.ModelAdmin):
     
     def action_match(self, request, queryset):
         """Perform 3-way matching"""
-        count = 0
-        for bill in queryset:
-            if bill.status == 'SUBMITTED':
-                try:
-                    bill.perform_three_way_match(request.user)
-                    count += 1
-                except Exception as e:
-                    self.message_user(request, f"Error matching {bill.bill_number}: {e}", level='error')
+        bills = list(queryset.filter(status='SUBMITTED'))
+        matcher = BatchThreeWayMatcher(request.user)
+        try:
+            with transaction.atomic():
+                results = matcher.match(bills)
+                matcher.update_bills(bills, results)
+        except Exception as e:
+            self.message_user(request, f"Error matching bills: {e}", level='error')
+            return
         
-        self.message_user(request, f"Matched {count} bills")
+        self.message_user(request, f"Matched {len(bills)} bills")
     action_match.short_description = "Perform 3-way match"
     
     def action_approve(self, request, queryset):
@@ -11,6 +11,9 @@ from rest_framework.permissions import IsAuthenticated, AllowAny
 from django.db.models import Count, Sum, Q
 from django.utils import timezone
 
+from core.mixins import FieldProjectionMixin
+from core.pagination import KeysetCursorPagination
+
 from .models import (
     VendorBill, VendorBillLine, ThreeWayMatch,
     MatchException, MatchTolerance
@@ -24,7 +27,7 @@ from .serializers import (
 from .services import ThreeWayMatchService
 
 
-class VendorBillViewSet(viewsets.ModelViewSet):
+class VendorBillViewSet(FieldProjectionMixin, viewsets.ModelViewSet):
     """
     ViewSet for Vendor Bills.
     
@@ -41,6 +44,7 @@ class VendorBillViewSet(viewsets.ModelViewSet):
     - post_to_ap: Post to AP module (POST)
     - summary: Get bills summary (GET)
     """
+    pagination_class = KeysetCursorPagination
     
     queryset = VendorBill.objects.all().select_related(
         'supplier', 'currency', 'ap_invoice'
@@ -160,17 +164,7 @@ class VendorBillViewSet(viewsets.ModelViewSet):
             match_service = ThreeWayMatchService()
             result = match_service.match_vendor_bill(vendor_bill, request.user)
             
-            # Update bill status based on match results (same logic as perform_three_way_match)
-            if result['has_exceptions']:
-                vendor_bill.status = 'EXCEPTION'
-                vendor_bill.has_exceptions = True
-                vendor_bill.exception_count = result['exception_count']
-            else:
-                vendor_bill.status = 'MATCHED'
-                vendor_bill.is_matched = True
-                vendor_bill.match_date = timezone.now()
-            
-            vendor_bill.save()
+            vendor_bill.apply_match_result(result)
             vendor_bill.refresh_from_db()
             serializer = self.get_serializer(vendor_bill)
             
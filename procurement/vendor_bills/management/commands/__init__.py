@@ -0,0 +1 @@
+# Vendor bill management commands
@@ -0,0 +1,74 @@
+"""
+Management command to 3-way match submitted vendor bills in batches.
+
+Meant to run nightly. Bills are matched --batch-size at a time with
+BatchThreeWayMatcher: each batch loads its GRN lines, PO lines and tolerances
+in a few queries, writes its matches and exceptions with bulk_create and
+updates the bills' statuses, all in one transaction. A failing batch is
+reported and skipped; the other batches are kept.
+
+Usage:
+    python manage.py auto_match_vendor_bills
+    python manage.py auto_match_vendor_bills --status SUBMITTED EXCEPTION --batch-size 1000 --user matcher
+"""
+import time
+
+from django.contrib.auth.models import User
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from procurement.vendor_bills.models import VendorBill
+from procurement.vendor_bills.services import BatchThreeWayMatcher
+
+
+class Command(BaseCommand):
+    help = '3-way match submitted vendor bills in batches'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--status', nargs='+', default=['SUBMITTED'],
+                            help='Bill statuses to match (default: SUBMITTED)')
+        parser.add_argument('--batch-size', type=int, default=500, help='Bills matched per transaction')
+        parser.add_argument('--limit', type=int, help='Match at most this many bills')
+        parser.add_argument('--user', help='Username recorded as matched_by')
+
+    def handle(self, *args, **options):
+        user = None
+        if options['user']:
+            try:
+                user = User.objects.get(username=options['user'])
+            except User.DoesNotExist:
+                raise CommandError(f"User {options['user']} does not exist")
+
+        bill_ids = list(
+            VendorBill.objects.filter(status__in=options['status']).order_by('id').values_list('id', flat=True)
+        )
+        if options['limit']:
+            bill_ids = bill_ids[:options['limit']]
+        batch_size = max(1, options['batch_size'])
+        matcher = BatchThreeWayMatcher(user)
+
+        matched = exceptions = failed = 0
+        t0 = time.perf_counter()
+        for start in range(0, len(bill_ids), batch_size):
+            batch_ids = bill_ids[start:start + batch_size]
+            try:
+                with transaction.atomic():
+                    # Re-checked under the batch's transaction in case a bill moved on since the id scan
+                    bills = list(VendorBill.objects.filter(id__in=batch_ids, status__in=options['status']))
+                    results = matcher.match(bills)
+                    matcher.update_bills(bills, results)
+            except Exception as e:
+                failed += len(batch_ids)
+                self.stdout.write(self.style.ERROR(f'Batch starting at bill id {batch_ids[0]} failed: {e}'))
+                continue
+            for result in results.values():
+                if result['has_exceptions']:
+                    exceptions += 1
+                else:
+                    matched += 1
+
+        elapsed = time.perf_counter() - t0
+        self.stdout.write(self.style.SUCCESS(
+            f'Matched {matched + exceptions} bill(s) in {elapsed:.2f}s: '
+            f'{matched} matched, {exceptions} with exceptions, {failed} failed'
+        ))
@@ -20,6 +20,7 @@ from django.core.exceptions import ValidationError
 from django.utils import timezone
 from decimal import Decimal
 from datetime import datetime
+from core.sequences import next_document_number
 
 
 class VendorBill(models.Model):
@@ -141,6 +142,9 @@ class VendorBill(models.Model):
         verbose_name = 'Vendor Bill'
         verbose_name_plural = 'Vendor Bills'
     
+    # Fields set by apply_match_result
+    MATCH_RESULT_FIELDS = ['status', 'is_matched', 'has_exceptions', 'exception_count', 'match_date', 'updated_at']
+    
     def __str__(self):
         return f"{self.bill_number} - {self.supplier.name} ({self.supplier_invoice_number})"
     
@@ -187,17 +191,7 @@ class VendorBill(models.Model):
         """Generate bill number: VB-YYYYMM-NNNN"""
         today = timezone.now()
         prefix = f"VB-{today.year}{today.month:02d}"
-        last_bill = VendorBill.objects.filter(
-            bill_number__startswith=prefix
-        ).order_by('-bill_number').first()
-        
-        if last_bill:
-            last_num = int(last_bill.bill_number.split('-')[-1])
-            new_num = last_num + 1
-        else:
-            new_num = 1
-        
-        return f"{prefix}-{new_num:04d}"
+        return next_document_number(VendorBill, 'bill_number', prefix)
     
     def recalculate_totals(self):
         """Recalculate totals from lines"""
@@ -232,19 +226,30 @@ class VendorBill(models.Model):
         
         match_service = ThreeWayMatchService()
         result = match_service.match_vendor_bill(self, user)
+        self.apply_match_result(result)
+        return result
+    
+    def apply_match_result(self, result, commit=True):
+        """
+        Update bill status from a match result.
         
-        # Update bill status based on match results
+        BatchThreeWayMatcher passes commit=False and bulk-updates
+        MATCH_RESULT_FIELDS for a whole batch of bills.
+        """
         if result['has_exceptions']:
             self.status = 'EXCEPTION'
+            self.is_matched = False
             self.has_exceptions = True
             self.exception_count = result['exception_count']
         else:
             self.status = 'MATCHED'
             self.is_matched = True
+            self.has_exceptions = False
+            self.exception_count = 0
             self.match_date = timezone.now()
         
-        self.save()
-        return result
+        if commit:
+            self.save()
     
     def approve(self, user):
         """Approve matched bill"""
@@ -548,17 +553,7 @@ class ThreeWayMatch(models.Model):
         """Generate match number: 3WM-YYYYMM-NNNN"""
         today = timezone.now()
         prefix = f"3WM-{today.year}{today.month:02d}"
-        last_match = ThreeWayMatch.objects.filter(
-            match_number__startswith=prefix
-        ).order_by('-match_number').first()
-        
-        if last_match:
-            last_num = int(last_match.match_number.split('-')[-1])
-            new_num = last_num + 1
-        else:
-            new_num = 1
-        
-        return f"{prefix}-{new_num:04d}"
+        return next_document_number(ThreeWayMatch, 'match_number', prefix)
     
     def calculate_variances(self):
         """Calculate quantity and price variances"""
@@ -578,7 +573,7 @@ class ThreeWayMatch(models.Model):
         else:
             self.price_variance_pct = 0
     
-    def check_tolerances(self):
+    def check_tolerances(self, tolerance=None):
         """
         Check if variances exceed tolerances.
         
@@ -587,14 +582,23 @@ class ThreeWayMatch(models.Model):
         - Price: ±3%
         
         Can be customized per supplier/item in MatchTolerance model.
+        The batch matcher passes the tolerance it already resolved.
         """
         from .models import MatchTolerance
         
+        if self.grn_line_id is None:
+            # Nothing received to compare against
+            self.quantity_tolerance_exceeded = False
+            self.price_tolerance_exceeded = False
+            self.has_exception = True
+            return
+        
         # Get tolerance configuration
-        tolerance = MatchTolerance.get_tolerance(
-            supplier=self.vendor_bill_line.vendor_bill.supplier,
-            catalog_item=self.catalog_item
-        )
+        if tolerance is None:
+            tolerance = MatchTolerance.get_tolerance(
+                supplier=self.vendor_bill_line.vendor_bill.supplier,
+                catalog_item=self.catalog_item
+            )
         
         # Check quantity tolerance
         if abs(self.quantity_variance_pct) > tolerance.quantity_tolerance_pct:
@@ -613,7 +617,9 @@ class ThreeWayMatch(models.Model):
     
     def update_match_status(self):
         """Update match status based on variances and exceptions"""
-        if self.has_exception:
+        if self.grn_line_id is None:
+            self.match_status = 'UNMATCHED'
+        elif self.has_exception:
             self.match_status = 'EXCEPTION'
         elif self.quantity_variance == 0 and self.price_variance == 0:
             self.match_status = 'MATCHED'
@@ -731,6 +737,11 @@ class MatchException(models.Model):
         if not self.exception_number:
             self.exception_number = self.generate_exception_number()
         
+        self.fill_derived_fields()
+        super().save(*args, **kwargs)
+    
+    def fill_derived_fields(self):
+        """Description and approval flag, as save() sets them (also used before bulk_create)"""
         # Auto-generate description if not provided
         if not self.description:
             self.description = self.generate_description()
@@ -738,24 +749,12 @@ class MatchException(models.Model):
         # Determine if approval required (high financial impact)
         if self.financial_impact > 10000:  # Configurable threshold
             self.requires_approval = True
-        
-        super().save(*args, **kwargs)
     
     def generate_exception_number(self):
         """Generate exception number: EXC-YYYYMM-NNNN"""
         today = timezone.now()
         prefix = f"EXC-{today.year}{today.month:02d}"
-        last_exc = MatchException.objects.filter(
-            exception_number__startswith=prefix
-        ).order_by('-exception_number').first()
-        
-        if last_exc:
-            last_num = int(last_exc.exception_number.split('-')[-1])
-            new_num = last_num + 1
-        else:
-            new_num = 1
-        
-        return f"{prefix}-{new_num:04d}"
+        return next_document_number(MatchException, 'exception_number', prefix)
     
     def generate_description(self):
         """Auto-generate exception description"""
@@ -2,13 +2,298 @@
 3-Way Match Service
 
 Implements the matching logic between PO, GRN, and Vendor Bill.
+
+BatchThreeWayMatcher matches many bills at once: MatchCandidates loads the
+candidate GRN lines, PO lines and tolerances for all their lines in a few
+queries, variances are computed in memory and the ThreeWayMatch and
+MatchException rows are written with bulk_create. ThreeWayMatchService runs
+single bills through the same matcher.
 """
 
+from bisect import bisect_left
+from collections import defaultdict
+from datetime import timedelta
+
 from django.db import transaction
+from django.db.models import Q
 from django.core.exceptions import ValidationError
+from django.utils import timezone
 from decimal import Decimal
 from typing import Dict, List, Any
 
+from core.sequences import next_document_numbers
+
+# GRNs received up to this many days before the bill date are match candidates
+GRN_LOOKBACK_DAYS = 90
+
+
+class MatchCandidates:
+    """
+    GRN lines, PO lines and tolerances for a set of vendor bill lines.
+    
+    Everything is loaded up front in five queries at most, whatever the
+    number of bills and lines. The lookups then follow the per-line rules of
+    ThreeWayMatchService.find_matching_grn_line.
+    """
+    
+    def __init__(self, bill_lines):
+        from procurement.receiving.models import GRNLine
+        from procurement.purchase_orders.models import POLine
+        
+        bill_lines = [line for line in bill_lines if line.catalog_item_id]
+        supplier_ids = {line.vendor_bill.supplier_id for line in bill_lines}
+        item_ids = {line.catalog_item_id for line in bill_lines}
+        
+        # Strategy 1: lines of GRNs named on the bill
+        self._by_grn_number = {}
+        grn_numbers = {line.grn_number for line in bill_lines if line.grn_number}
+        if grn_numbers:
+            named = GRNLine.objects.filter(
+                goods_receipt__grn_number__in=grn_numbers,
+                goods_receipt__supplier_id__in=supplier_ids,
+                catalog_item_id__in=item_ids,
+            ).select_related('goods_receipt').order_by('goods_receipt_id', 'line_number')
+            for grn_line in named:
+                grn = grn_line.goods_receipt
+                self._by_grn_number.setdefault((grn.grn_number, grn.supplier_id, grn_line.catalog_item_id), grn_line)
+        
+        # Strategy 3: completed GRNs for the same supplier and item, newest first
+        self._recent = defaultdict(list)
+        self._recent_keys = defaultdict(list)
+        if bill_lines:
+            bill_dates = [line.vendor_bill.bill_date for line in bill_lines]
+            recent = GRNLine.objects.filter(
+                goods_receipt__supplier_id__in=supplier_ids,
+                goods_receipt__receipt_date__gte=min(bill_dates) - timedelta(days=GRN_LOOKBACK_DAYS),
+                goods_receipt__receipt_date__lte=max(bill_dates),
+                catalog_item_id__in=item_ids,
+                goods_receipt__status='COMPLETED',
+            ).select_related('goods_receipt').order_by(
+                '-goods_receipt__receipt_date', '-goods_receipt__grn_number', 'line_number'
+            )
+            for grn_line in recent:
+                key = (grn_line.goods_receipt.supplier_id, grn_line.catalog_item_id)
+                self._recent[key].append(grn_line)
+                # Ascending keys for bisect: newest receipt first
+                self._recent_keys[key].append(-grn_line.goods_receipt.receipt_date.toordinal())
+        
+        # PO lines of every GRN that may be matched
+        self._po_lines = {}
+        po_header_ids = {
+            grn_line.goods_receipt.po_header_id
+            for grn_line in list(self._by_grn_number.values()) + [l for ls in self._recent.values() for l in ls]
+            if grn_line.goods_receipt.po_header_id
+        }
+        if po_header_ids:
+            for po_line in POLine.objects.filter(po_header_id__in=po_header_ids).order_by('po_header_id', 'line_number'):
+                self._po_lines.setdefault((po_line.po_header_id, 'line', po_line.line_number), po_line)
+                if po_line.catalog_item_id:
+                    self._po_lines.setdefault((po_line.po_header_id, 'item', po_line.catalog_item_id), po_line)
+        
+        self._tolerances = MatchTolerances(supplier_ids, item_ids)
+    
+    def grn_line_for(self, bill_line):
+        """GRN line matched to a bill line, or None"""
+        if not bill_line.catalog_item_id:
+            return None
+        supplier_id = bill_line.vendor_bill.supplier_id
+        
+        if bill_line.grn_number:
+            grn_line = self._by_grn_number.get((bill_line.grn_number, supplier_id, bill_line.catalog_item_id))
+            if grn_line:
+                return grn_line
+        
+        key = (supplier_id, bill_line.catalog_item_id)
+        bill_date = bill_line.vendor_bill.bill_date
+        candidates = self._recent.get(key)
+        if not candidates:
+            return None
+        # Newest receipt on or before the bill date, within the lookback window
+        i = bisect_left(self._recent_keys[key], -bill_date.toordinal())
+        if i < len(candidates):
+            receipt_date = candidates[i].goods_receipt.receipt_date
+            if receipt_date >= bill_date - timedelta(days=GRN_LOOKBACK_DAYS):
+                return candidates[i]
+        return None
+    
+    def po_line_for(self, bill_line, grn_line):
+        """PO line behind a matched GRN line, or None"""
+        po_header_id = grn_line.goods_receipt.po_header_id
+        if not po_header_id:
+            return None
+        if bill_line.po_line_number:
+            po_line = self._po_lines.get((po_header_id, 'line', bill_line.po_line_number))
+            if po_line:
+                return po_line
+        return self._po_lines.get((po_header_id, 'item', grn_line.catalog_item_id))
+    
+    def tolerance_for(self, bill_line):
+        return self._tolerances.get(bill_line.vendor_bill.supplier_id, bill_line.catalog_item_id)
+
+
+class MatchTolerances:
+    """
+    Active tolerances for a set of suppliers and items, in one query.
+    
+    Resolves like MatchTolerance.get_tolerance: item, then supplier, then
+    global, the newest row winning within a scope.
+    """
+    
+    def __init__(self, supplier_ids, item_ids):
+        from .models import MatchTolerance
+        
+        self._item, self._supplier, self._global = {}, {}, None
+        rows = MatchTolerance.objects.filter(is_active=True).filter(
+            Q(scope='GLOBAL')
+            | Q(scope='SUPPLIER', supplier_id__in=supplier_ids)
+            | Q(scope='ITEM', catalog_item_id__in=item_ids)
+        )
+        for tolerance in rows:  # Meta ordering: newest first within a scope
+            if tolerance.scope == 'ITEM':
+                self._item.setdefault(tolerance.catalog_item_id, tolerance)
+            elif tolerance.scope == 'SUPPLIER':
+                self._supplier.setdefault(tolerance.supplier_id, tolerance)
+            elif self._global is None:
+                self._global = tolerance
+    
+    def get(self, supplier_id, item_id):
+        tolerance = self._item.get(item_id) or self._supplier.get(supplier_id)
+        if tolerance:
+            return tolerance
+        if self._global is None:
+            from .models import MatchTolerance
+            # Creates the default global row if there is none
+            self._global = MatchTolerance.get_tolerance()
+        return self._global
+
+
+class BatchThreeWayMatcher:
+    """Set-based 3-way matching for a batch of vendor bills"""
+    
+    def __init__(self, user=None):
+        self.user = user
+    
+    def match(self, vendor_bills) -> Dict[int, Dict[str, Any]]:
+        """
+        Match every line of the given bills, replacing earlier match records.
+        
+        Returns {bill id: result}, each result shaped like
+        ThreeWayMatchService.match_vendor_bill's. Bill statuses are not
+        changed; see update_bills.
+        """
+        from .models import ThreeWayMatch, MatchException, VendorBillLine
+        
+        bills = {bill.id: bill for bill in vendor_bills}
+        results = {
+            bill_id: {
+                'success': False,
+                'matched_lines': 0,
+                'exception_lines': 0,
+                'has_exceptions': False,
+                'exception_count': 0,
+                'matches': [],
+                'exceptions': []
+            }
+            for bill_id in bills
+        }
+        if not bills:
+            return results
+        
+        with transaction.atomic():
+            # Clear old match data for re-matching; exceptions cascade
+            ThreeWayMatch.objects.filter(vendor_bill_line__vendor_bill_id__in=bills).delete()
+            
+            bill_lines = list(VendorBillLine.objects.filter(vendor_bill_id__in=bills).order_by('vendor_bill_id', 'line_number'))
+            for line in bill_lines:
+                # Share the caller's bill instances instead of loading each bill again
+                line.vendor_bill = bills[line.vendor_bill_id]
+            candidates = MatchCandidates(bill_lines)
+            
+            matches = []
+            for line in bill_lines:
+                if not line.catalog_item_id:
+                    # Cannot be matched or recorded without an item
+                    results[line.vendor_bill_id]['exception_lines'] += 1
+                    continue
+                matches.append(self.build_match(line, candidates))
+            
+            numbers = self._numbers(ThreeWayMatch, 'match_number', '3WM', len(matches))
+            for match, number in zip(matches, numbers):
+                match.match_number = number
+            ThreeWayMatch.objects.bulk_create(matches)
+            
+            service = ThreeWayMatchService()
+            exceptions = [service.build_exception(match) for match in matches if match.has_exception]
+            numbers = self._numbers(MatchException, 'exception_number', 'EXC', len(exceptions))
+            for exception, number in zip(exceptions, numbers):
+                exception.exception_number = number
+                exception.fill_derived_fields()
+            MatchException.objects.bulk_create(exceptions)
+        
+        for match in matches:
+            result = results[match.vendor_bill_line.vendor_bill_id]
+            result['matches'].append(match)
+            if match.has_exception:
+                result['exception_lines'] += 1
+                result['exceptions'].append(match.exception)
+            else:
+                result['matched_lines'] += 1
+        
+        for result in results.values():
+            result['has_exceptions'] = result['exception_lines'] > 0
+            result['exception_count'] = result['exception_lines']
+            result['success'] = True
+        return results
+    
+    def build_match(self, bill_line, candidates):
+        """Unsaved ThreeWayMatch for a bill line, with variances and status computed"""
+        from .models import ThreeWayMatch
+        
+        grn_line = candidates.grn_line_for(bill_line)
+        match = ThreeWayMatch(
+            vendor_bill_line=bill_line,
+            po_number=bill_line.po_number or '',
+            po_line_number=bill_line.po_line_number,
+            grn_line=grn_line,
+            catalog_item_id=bill_line.catalog_item_id,
+            bill_quantity=bill_line.quantity,
+            bill_unit_price=bill_line.unit_price,
+            matched_by=self.user,
+        )
+        if grn_line is not None:
+            po_line = candidates.po_line_for(bill_line, grn_line)
+            match.po_number = bill_line.po_number or grn_line.goods_receipt.grn_number
+            match.po_line_number = bill_line.po_line_number or grn_line.line_number
+            match.grn_quantity = grn_line.received_quantity
+            if po_line is not None:
+                match.po_quantity = po_line.quantity
+                match.po_unit_price = po_line.unit_price
+            else:
+                match.po_quantity = grn_line.ordered_quantity
+                # GRN lines carry the PO price for invoice matching
+                match.po_unit_price = grn_line.unit_price or Decimal('0.00')
+        
+        match.calculate_variances()
+        match.check_tolerances(candidates.tolerance_for(bill_line))
+        match.update_match_status()
+        return match
+    
+    @staticmethod
+    def _numbers(model, field, code, count):
+        today = timezone.now()
+        return next_document_numbers(model, field, f"{code}-{today.year}{today.month:02d}", count)
+    
+    def update_bills(self, vendor_bills, results):
+        """Apply match results to the bills' statuses in one bulk update"""
+        from .models import VendorBill
+        
+        now = timezone.now()
+        for bill in vendor_bills:
+            bill.apply_match_result(results[bill.id], commit=False)
+            bill.updated_by = self.user or bill.updated_by
+            bill.updated_at = now
+        VendorBill.objects.bulk_update(vendor_bills, VendorBill.MATCH_RESULT_FIELDS + ['updated_by'])
+
 
 class ThreeWayMatchService:
     """Service for performing 3-way matching"""
@@ -28,47 +313,7 @@ class ThreeWayMatchService:
                 'exceptions': List[MatchException]
             }
         """
-        from .models import ThreeWayMatch, MatchException
-        
-        # Clear old match data and exceptions for re-matching
-        ThreeWayMatch.objects.filter(vendor_bill_line__vendor_bill=vendor_bill).delete()
-        MatchException.objects.filter(three_way_match__vendor_bill_line__vendor_bill=vendor_bill).delete()
-        
-        results = {
-            'success': False,
-            'matched_lines': 0,
-            'exception_lines': 0,
-            'has_exceptions': False,
-            'exception_count': 0,
-            'matches': [],
-            'exceptions': []
-        }
-        
-        with transaction.atomic():
-            for bill_line in vendor_bill.lines.all():
-                try:
-                    match = self.match_bill_line(bill_line, user)
-                    results['matches'].append(match)
-                    
-                    if match.has_exception:
-                        results['exception_lines'] += 1
-                        
-                        # Create exception record
-                        exception = self.create_exception(match, user)
-                        results['exceptions'].append(exception)
-                    else:
-                        results['matched_lines'] += 1
-                    
-                except Exception as e:
-                    # Create exception for matching failure
-                    results['exception_lines'] += 1
-                    # Log error but continue with other lines
-        
-        results['has_exceptions'] = results['exception_lines'] > 0
-        results['exception_count'] = results['exception_lines']
-        results['success'] = True
-        
-        return results
+        return BatchThreeWayMatcher(user).match([vendor_bill])[vendor_bill.id]
     
     def match_bill_line(self, bill_line, user):
         """
@@ -76,62 +321,15 @@ class ThreeWayMatchService:
         
         Steps:
         1. Find matching GRN line(s) based on:
-           - PO number + line number (if provided)
-           - Item + supplier + date range (if PO not provided)
+           - GRN number (if provided)
+           - Item + supplier + date range
         
         2. Find matching PO line from GRN
         
         3. Create ThreeWayMatch record with variance calculations
         """
-        from .models import ThreeWayMatch
-        from procurement.receiving.models import GRNLine
-        
-        vendor_bill = bill_line.vendor_bill
-        
-        # Find matching GRN line
-        grn_line = self.find_matching_grn_line(bill_line)
-        
-        if not grn_line:
-            # No GRN found - create unmatched record
-            match = ThreeWayMatch.objects.create(
-                vendor_bill_line=bill_line,
-                po_number=bill_line.po_number or '',
-                po_line_number=bill_line.po_line_number,
-                grn_line=None,
-                catalog_item=bill_line.catalog_item,
-                po_quantity=0,
-                grn_quantity=0,
-                bill_quantity=bill_line.quantity,
-                po_unit_price=0,
-                bill_unit_price=bill_line.unit_price,
-                match_status='UNMATCHED',
-                has_exception=True,
-                matched_by=user,
-            )
-            return match
-        
-        # Get PO details from GRN line
-        # Note: PO module not yet implemented, using placeholder values
-        po_quantity = grn_line.ordered_quantity if hasattr(grn_line, 'ordered_quantity') else grn_line.received_quantity
-        po_unit_price = Decimal('0.00')  # Will come from PO line when PO module implemented
-        
-        # Create match record
-        match = ThreeWayMatch.objects.create(
-            vendor_bill_line=bill_line,
-            po_number=bill_line.po_number or grn_line.goods_receipt.receipt_number,
-            po_line_number=bill_line.po_line_number or grn_line.line_number,
-            grn_line=grn_line,
-            catalog_item=bill_line.catalog_item,
-            po_quantity=po_quantity,
-            grn_quantity=grn_line.received_quantity,
-            bill_quantity=bill_line.quantity,
-            po_unit_price=po_unit_price,
-            bill_unit_price=bill_line.unit_price,
-            matched_by=user,
-        )
-        
-        # Variance calculations and tolerance checking done in model save()
-        
+        match = BatchThreeWayMatcher(user).build_match(bill_line, MatchCandidates([bill_line]))
+        match.save()
         return match
     
     def find_matching_grn_line(self, bill_line):
@@ -139,56 +337,20 @@ class ThreeWayMatchService:
         Find matching GRN line for vendor bill line.
         
         Matching criteria:
-        1. If PO number + line provided: Match by PO reference
-        2. Otherwise: Match by item + supplier + date range
+        1. If GRN number provided: that GRN's line for the item
+        2. Otherwise: most recent completed GRN line for the same item and
+           supplier received within GRN_LOOKBACK_DAYS before the bill date
         """
-        from procurement.receiving.models import GRNLine, GoodsReceipt
-        
-        vendor_bill = bill_line.vendor_bill
-        
-        # Strategy 1: Match by GRN number if provided
-        if bill_line.grn_number:
-            grn = GoodsReceipt.objects.filter(
-                receipt_number=bill_line.grn_number,
-                supplier=vendor_bill.supplier
-            ).first()
-            
-            if grn:
-                grn_line = grn.lines.filter(
-                    catalog_item=bill_line.catalog_item
-                ).first()
-                if grn_line:
-                    return grn_line
-        
-        # Strategy 2: Match by PO number if provided
-        if bill_line.po_number:
-            # Will use PO reference when PO module implemented
-            # For now, search GRN by supplier and item
-            pass
-        
-        # Strategy 3: Match by item, supplier, and date range
-        # Find GRN lines for same supplier and item within date range
-        from datetime import timedelta
-        
-        date_range_start = vendor_bill.bill_date - timedelta(days=90)  # 90 days lookback
-        date_range_end = vendor_bill.bill_date
-        
-        grn_lines = GRNLine.objects.filter(
-            goods_receipt__supplier=vendor_bill.supplier,
-            goods_receipt__receipt_date__gte=date_range_start,
-            goods_receipt__receipt_date__lte=date_range_end,
-            catalog_item=bill_line.catalog_item,
-            goods_receipt__status='COMPLETED'
-        ).order_by('-goods_receipt__receipt_date')
-        
-        # Return most recent matching GRN line
-        if grn_lines.exists():
-            return grn_lines.first()
-        
-        return None
+        return MatchCandidates([bill_line]).grn_line_for(bill_line)
     
     def create_exception(self, match, user):
         """Create exception record for failed match"""
+        exception = self.build_exception(match)
+        exception.save()
+        return exception
+    
+    def build_exception(self, match):
+        """Unsaved exception record for a failed match"""
         from .models import MatchException
         
         # Determine exception type
@@ -235,8 +397,7 @@ class ThreeWayMatchService:
         else:
             severity = 'LOW'
         
-        # Create exception
-        exception = MatchException.objects.create(
+        return MatchException(
             three_way_match=match,
             exception_type=exception_type,
             severity=severity,
@@ -244,8 +405,6 @@ class ThreeWayMatchService:
             variance_percentage=variance_pct,
             financial_impact=financial_impact,
         )
-        
-        return exception
     
     def resolve_exception(self, exception, user, action, notes):
         """Resolve a match exception"""
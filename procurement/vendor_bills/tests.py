@@ -0,0 +1,165 @@
+from datetime import date, timedelta
+from decimal import Decimal
+from io import StringIO
+
+from django.contrib.auth.models import User
+from django.core.management import call_command
+from django.db import connection
+from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
+
+from ap.models import Supplier
+from core.models import Currency
+from procurement.catalog.models import CatalogCategory, CatalogItem, UnitOfMeasure
+from procurement.purchase_orders.models import POHeader, POLine
+from procurement.receiving.models import GoodsReceipt, GRNLine, Warehouse
+from .models import MatchException, MatchTolerance, ThreeWayMatch, VendorBill, VendorBillLine
+from .services import BatchThreeWayMatcher
+
+BILL_DATE = date(2026, 3, 31)
+
+
+class BatchThreeWayMatchTestCase(TestCase):
+
+    def setUp(self):
+        self.user = User.objects.create_user("matcher")
+        self.currency = Currency.objects.create(code="AED", name="Dirham", is_base=True)
+        self.supplier = Supplier.objects.create(code="S1", name="Supplier 1")
+        self.uom = UnitOfMeasure.objects.create(code="EA", name="Each")
+        category = CatalogCategory.objects.create(code="GEN", name="General")
+        self.items = [
+            CatalogItem.objects.create(sku=f"SKU-{n}", item_code=f"IT-{n}", name=f"Item {n}",
+                                       category=category, unit_of_measure=self.uom, list_price=Decimal("5.00"), currency=self.currency)
+            for n in range(3)
+        ]
+        self.warehouse = Warehouse.objects.create(code="WH1", name="Main")
+
+    def receive(self, lines, receipt_date=BILL_DATE - timedelta(days=5), po_header=None, status="COMPLETED"):
+        """lines: (item, received quantity, GRN unit price)"""
+        grn = GoodsReceipt.objects.create(
+            supplier=self.supplier, warehouse=self.warehouse, received_by=self.user,
+            receipt_date=receipt_date, status=status, po_header=po_header,
+        )
+        for item, quantity, price in lines:
+            GRNLine.objects.create(goods_receipt=grn, catalog_item=item, item_description=item.name,
+                                   ordered_quantity=quantity, received_quantity=quantity,
+                                   unit_price=price, unit_of_measure=self.uom)
+        return grn
+
+    def bill(self, lines, status="SUBMITTED"):
+        """lines: (item, quantity, unit price) or (item, quantity, unit price, grn number)"""
+        bill = VendorBill.objects.create(
+            supplier=self.supplier, supplier_invoice_number=f"INV-{VendorBill.objects.count() + 1}",
+            supplier_invoice_date=BILL_DATE, bill_date=BILL_DATE, due_date=BILL_DATE + timedelta(days=30),
+            currency=self.currency, status=status,
+        )
+        for n, (item, quantity, price, *grn_number) in enumerate(lines, 1):
+            VendorBillLine.objects.create(vendor_bill=bill, line_number=n, catalog_item=item,
+                                          description=item.name, quantity=Decimal(quantity),
+                                          unit_of_measure=self.uom, unit_price=Decimal(price), tax_rate=Decimal("0"),
+                                          grn_number=grn_number[0] if grn_number else "")
+        return bill
+
+    def match(self, bills):
+        matcher = BatchThreeWayMatcher(self.user)
+        results = matcher.match(bills)
+        matcher.update_bills(bills, results)
+        return results
+
+    def test_matches_and_exceptions(self):
+        a, b, c = self.items
+        self.receive([(a, Decimal("10"), Decimal("5.00")), (b, Decimal("10"), Decimal("8.00"))])
+        clean = self.bill([(a, "10", "5.00")])
+        mixed = self.bill([(a, "10", "5.00"), (b, "12", "8.00"), (c, "1", "3.00")])
+
+        results = self.match([clean, mixed])
+        self.assertEqual((results[clean.id]["matched_lines"], results[clean.id]["exception_lines"]), (1, 0))
+        self.assertEqual((results[mixed.id]["matched_lines"], results[mixed.id]["exception_lines"]), (1, 2))
+
+        statuses = dict(ThreeWayMatch.objects.values_list("vendor_bill_line__line_number", "match_status")
+                        .filter(vendor_bill_line__vendor_bill=mixed))
+        self.assertEqual(statuses, {1: "MATCHED", 2: "EXCEPTION", 3: "UNMATCHED"})
+        self.assertEqual(
+            sorted(MatchException.objects.values_list("exception_type", flat=True)),
+            ["GRN_NOT_FOUND", "QUANTITY_OVER"],
+        )
+        over = MatchException.objects.get(exception_type="QUANTITY_OVER")
+        self.assertEqual(over.financial_impact, Decimal("16.00"))
+        self.assertIn("exceeds received quantity", over.description)
+
+        clean.refresh_from_db()
+        mixed.refresh_from_db()
+        self.assertEqual((clean.status, clean.is_matched), ("MATCHED", True))
+        self.assertEqual((mixed.status, mixed.exception_count), ("EXCEPTION", 2))
+
+        # Re-matching replaces the earlier records
+        self.match([mixed])
+        self.assertEqual(ThreeWayMatch.objects.filter(vendor_bill_line__vendor_bill=mixed).count(), 3)
+        self.assertEqual(MatchException.objects.count(), 2)
+
+    def test_grn_selection_and_po_price(self):
+        a, b, _ = self.items
+        po = POHeader.objects.create(title="Order", currency=self.currency, created_by=self.user)
+        POLine.objects.create(po_header=po, line_number=1, item_description="Item 0", catalog_item=a,
+                              quantity=Decimal("10"), unit_of_measure=self.uom, unit_price=Decimal("5.00"))
+        self.receive([(a, Decimal("10"), Decimal("9.99"))], receipt_date=BILL_DATE - timedelta(days=120))
+        named = self.receive([(a, Decimal("10"), None)], receipt_date=BILL_DATE - timedelta(days=30), po_header=po)
+        self.receive([(a, Decimal("4"), Decimal("5.00"))], receipt_date=BILL_DATE - timedelta(days=2))
+        self.receive([(a, Decimal("7"), Decimal("5.00"))], receipt_date=BILL_DATE + timedelta(days=1))
+        self.receive([(b, Decimal("1"), Decimal("5.00"))], receipt_date=BILL_DATE - timedelta(days=1), status="DRAFT")
+
+        bill = self.bill([(a, "4", "5.00"), (a, "10", "5.10", named.grn_number), (b, "1", "5.00")])
+        self.match([bill])
+        matches = {m.vendor_bill_line.line_number: m
+                   for m in ThreeWayMatch.objects.select_related("vendor_bill_line", "grn_line")}
+
+        # Newest completed receipt on or before the bill date
+        self.assertEqual(matches[1].grn_quantity, Decimal("4"))
+        # Named GRN wins; its PO line supplies the price
+        self.assertEqual(matches[2].grn_line.goods_receipt_id, named.id)
+        self.assertEqual(matches[2].po_unit_price, Decimal("5.00"))
+        self.assertEqual(matches[2].price_variance_pct, Decimal("2.00"))
+        self.assertEqual(matches[2].match_status, "PARTIALLY_MATCHED")
+        # Draft receipts are not candidates
+        self.assertEqual(matches[3].match_status, "UNMATCHED")
+
+    def test_tolerance_precedence(self):
+        a, b, _ = self.items
+        self.receive([(a, Decimal("10"), Decimal("5.00")), (b, Decimal("10"), Decimal("5.00"))])
+        MatchTolerance.objects.create(scope="GLOBAL", quantity_tolerance_pct=1, price_tolerance_pct=1)
+        MatchTolerance.objects.create(scope="SUPPLIER", supplier=self.supplier,
+                                      quantity_tolerance_pct=25, price_tolerance_pct=1)
+        MatchTolerance.objects.create(scope="ITEM", catalog_item=b, quantity_tolerance_pct=10, price_tolerance_pct=1)
+        bill = self.bill([(a, "12", "5.00"), (b, "12", "5.00")])
+
+        self.match([bill])
+        statuses = dict(ThreeWayMatch.objects.values_list("vendor_bill_line__line_number", "match_status"))
+        self.assertEqual(statuses, {1: "PARTIALLY_MATCHED", 2: "EXCEPTION"})
+
+    def test_query_count_independent_of_batch_size(self):
+        a, b, _ = self.items
+        self.receive([(a, Decimal("10"), Decimal("5.00")), (b, Decimal("10"), Decimal("5.00"))])
+        # Creates the number counters and the default tolerance
+        self.match([self.bill([(a, "10", "5.00"), (b, "11", "5.00")])])
+
+        def run(count):
+            bills = [self.bill([(a, "10", "5.00"), (b, "11", "5.00")]) for _ in range(count)]
+            with CaptureQueriesContext(connection) as queries:
+                self.match(bills)
+            return len(queries)
+
+        self.assertEqual(run(2), run(12))
+
+    def test_submit_and_nightly_command(self):
+        a, _, _ = self.items
+        self.receive([(a, Decimal("10"), Decimal("5.00"))])
+        draft = self.bill([(a, "10", "5.00")], status="DRAFT")
+        draft.submit(self.user)
+        self.assertEqual(draft.status, "MATCHED")
+
+        pending = [self.bill([(a, "10", "5.00")]) for _ in range(5)]
+        out = StringIO()
+        call_command("auto_match_vendor_bills", "--batch-size", "2", "--user", "matcher", stdout=out)
+        self.assertIn("5 matched, 0 with exceptions, 0 failed", out.getvalue())
+        self.assertEqual(VendorBill.objects.filter(id__in=[b.id for b in pending], status="MATCHED").count(), 5)
+        self.assertEqual(len(set(ThreeWayMatch.objects.values_list("match_number", flat=True))), 6)
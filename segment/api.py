@@ -3,10 +3,14 @@ from rest_framework.decorators import action
 from rest_framework.response import Response
 from django_filters.rest_framework import DjangoFilterBackend
 from django.core.exceptions import ValidationError
+from .hierarchy import build_tree, subtree, with_tree_links
 from .models import XX_SegmentType, XX_Segment
 from .serializers import SegmentTypeSerializer, SegmentSerializer
 from .utils import SegmentHelper
 
+SEGMENT_TREE_FIELDS = ("id", "code", "alias", "level", "is_active")
+ACCOUNT_TREE_FIELDS = ("id", "code", "alias", "node_type", "level", "is_active")
+
 
 class SegmentTypeViewSet(viewsets.ModelViewSet):
     queryset = XX_SegmentType.objects.all()
@@ -35,7 +39,7 @@ class SegmentTypeViewSet(viewsets.ModelViewSet):
     def values(self, request, pk=None):
         """Get all segment values for this segment type"""
         segment_type = self.get_object()
-        segments = XX_Segment.objects.filter(segment_type=segment_type)
+        segments = with_tree_links(XX_Segment.objects.filter(segment_type=segment_type))
         serializer = SegmentSerializer(segments, many=True)
         return Response(serializer.data)
     
@@ -76,7 +80,7 @@ class SegmentTypeViewSet(viewsets.ModelViewSet):
 
 
 class SegmentViewSet(viewsets.ModelViewSet):
-    queryset = XX_Segment.objects.all()
+    queryset = with_tree_links(XX_Segment.objects.all())
     serializer_class = SegmentSerializer
     filter_backends = [DjangoFilterBackend, filters.SearchFilter, filters.OrderingFilter]
     filterset_fields = ["segment_type", "is_active", "level", "parent_code", "code"]
@@ -150,10 +154,10 @@ class SegmentViewSet(viewsets.ModelViewSet):
     def children(self, request, pk=None):
         """Get all children of this segment"""
         segment = self.get_object()
-        children = XX_Segment.objects.filter(
+        children = with_tree_links(XX_Segment.objects.filter(
             segment_type=segment.segment_type,
             parent_code=segment.code
-        )
+        ))
         serializer = self.get_serializer(children, many=True)
         return Response(serializer.data)
     
@@ -161,11 +165,7 @@ class SegmentViewSet(viewsets.ModelViewSet):
     def descendants(self, request, pk=None):
         """Get all descendants (recursive children) of this segment"""
         segment = self.get_object()
-        descendant_codes = segment.get_all_children()
-        descendants = XX_Segment.objects.filter(
-            segment_type=segment.segment_type,
-            code__in=descendant_codes
-        )
+        descendants = with_tree_links(subtree(segment, include_root=False).order_by("level", "code"))
         serializer = self.get_serializer(descendants, many=True)
         return Response(serializer.data)
     
@@ -196,13 +196,18 @@ class SegmentViewSet(viewsets.ModelViewSet):
         if is_active:
             queryset = queryset.filter(is_active=True)
         
-        queryset = queryset.order_by('code')
+        queryset = with_tree_links(queryset.order_by('code'))
         serializer = self.get_serializer(queryset, many=True)
         return Response(serializer.data)
     
     @action(detail=False, methods=["get"])
     def hierarchy(self, request):
-        """Get hierarchical tree structure for a segment type"""
+        """
+        Get hierarchical tree structure for a segment type.
+        Query params:
+        - segment_type: Required - segment type ID
+        - root: Optional - segment ID; returns only the subtree under it
+        """
         segment_type_id = request.query_params.get('segment_type')
         if not segment_type_id:
             return Response(
@@ -210,27 +215,19 @@ class SegmentViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Get root segments (no parent)
-        roots = XX_Segment.objects.filter(
-            segment_type_id=segment_type_id,
-            parent_code__isnull=True
-        )
-        
-        def build_tree(segment):
-            children = XX_Segment.objects.filter(
-                segment_type=segment.segment_type,
-                parent_code=segment.code
-            )
-            return {
-                "id": segment.id,
-                "code": segment.code,
-                "alias": segment.alias,
-                "level": segment.level,
-                "is_active": segment.is_active,
-                "children": [build_tree(child) for child in children]
-            }
+        segments = XX_Segment.objects.filter(segment_type_id=segment_type_id)
+        root = request.query_params.get('root')
+        if root:
+            if not root.isdigit():
+                return Response(
+                    {"error": "root must be a segment id"},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+            root = int(root)
+            segments = segments.filter(ancestor_links__ancestor_id=root)
         
-        tree = [build_tree(root) for root in roots]
+        # One query for the whole (sub)tree, nested in memory
+        tree = build_tree(segments.order_by("level", "code"), SEGMENT_TREE_FIELDS, root=root or None)
         return Response(tree)
 
 
@@ -250,7 +247,7 @@ class AccountViewSet(viewsets.ModelViewSet):
     def get_queryset(self):
         """Return segments where segment_type.segment_name = 'Account'"""
         try:
-            return SegmentHelper.get_account_segments()
+            return with_tree_links(SegmentHelper.get_account_segments())
         except ValueError:
             # If 'Account' segment type doesn't exist, return empty queryset
             return XX_Segment.objects.none()
@@ -260,28 +257,8 @@ class AccountViewSet(viewsets.ModelViewSet):
         """Get hierarchical chart of accounts"""
         try:
             account_type = SegmentHelper.get_segment_type('Account')
-            roots = XX_Segment.objects.filter(
-                segment_type=account_type,
-                parent_code__isnull=True
-            )
-            
-            def build_tree(segment):
-                children = XX_Segment.objects.filter(
-                    segment_type=segment.segment_type,
-                    parent_code=segment.code
-                )
-                return {
-                    "id": segment.id,
-                    "code": segment.code,
-                    "alias": segment.alias,
-                    "node_type": segment.node_type,
-                    "level": segment.level,
-                    "is_active": segment.is_active,
-                    "children": [build_tree(child) for child in children]
-                }
-            
-            tree = [build_tree(root) for root in roots]
-            return Response(tree)
+            segments = XX_Segment.objects.filter(segment_type=account_type).order_by("level", "code")
+            return Response(build_tree(segments, ACCOUNT_TREE_FIELDS))
         except ValueError:
             return Response(
                 {"error": "Account segment type not configured"},
@@ -5,3 +5,7 @@ class SegmentConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'segment'
     verbose_name = 'Chart of Accounts & Segments'
+
+    def ready(self):
+        """Import signal handlers when Django starts"""
+        import segment.signals  # noqa: F401
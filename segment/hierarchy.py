@@ -0,0 +1,166 @@
+"""
+Segment hierarchy closure table.
+
+XX_Segment points at its parent by (segment_type, parent_code).
+XX_SegmentClosure stores every (ancestor, descendant) pair of that
+hierarchy, each segment paired with itself at depth 0, so that:
+- a subtree is one indexed join (ancestor_links__ancestor=<root>);
+- a segment's path is its ancestor rows ordered by depth;
+- balances roll up over any subtree by joining lines to the closure;
+- listing segments with their paths and children takes a fixed number of
+  queries (with_tree_links).
+
+The segment signals keep the table in step with model save() and delete().
+Writes that skip signals (bulk_create, queryset.update, raw imports) should
+be followed by `manage.py rebuild_segment_closure`, which rebuilds the table
+from parent_code.
+"""
+from django.db import transaction
+from django.db.models import Prefetch, Q
+
+from .models import XX_Segment, XX_SegmentClosure
+import logging
+
+logger = logging.getLogger(__name__)
+
+CLOSURE_BATCH_SIZE = 5000
+
+
+def _parent_id(segment_type_id, parent_code):
+    """pk of the segment parent_code names within its segment type, or None"""
+    if not parent_code:
+        return None
+    return XX_Segment.objects.filter(segment_type_id=segment_type_id, code=parent_code) \
+        .values_list("pk", flat=True).first()
+
+
+def _move_subtree(segment_id, parent_id):
+    """Cut the subtree under segment_id off its ancestors and hang it below parent_id (None: leave it a root)"""
+    subtree = XX_SegmentClosure.objects.filter(ancestor_id=segment_id).values("descendant_id")
+    XX_SegmentClosure.objects.filter(descendant_id__in=subtree).exclude(ancestor_id__in=subtree).delete()
+    if parent_id is None:
+        return
+    descendants = list(XX_SegmentClosure.objects.filter(ancestor_id=segment_id).values_list("descendant_id", "depth"))
+    if any(descendant_id == parent_id for descendant_id, _ in descendants):
+        logger.warning("Segment %s: parent %s is one of its own descendants; left as a root", segment_id, parent_id)
+        return
+    ancestors = list(XX_SegmentClosure.objects.filter(descendant_id=parent_id).values_list("ancestor_id", "depth"))
+    XX_SegmentClosure.objects.bulk_create(
+        [
+            XX_SegmentClosure(ancestor_id=ancestor_id, descendant_id=descendant_id, depth=up + down + 1)
+            for ancestor_id, up in ancestors
+            for descendant_id, down in descendants
+        ],
+        batch_size=CLOSURE_BATCH_SIZE,
+    )
+
+
+@transaction.atomic
+def sync_segment(segment):
+    """
+    Update the closure after `segment` was saved: link it below its parent,
+    re-link segments whose parent_code now does or no longer names it.
+    """
+    XX_SegmentClosure.objects.get_or_create(ancestor_id=segment.pk, descendant_id=segment.pk, defaults={"depth": 0})
+
+    linked_children = XX_SegmentClosure.objects.filter(ancestor_id=segment.pk, depth=1).values("descendant_id")
+    named_children = Q(segment_type_id=segment.segment_type_id, parent_code=segment.code)
+    affected = XX_Segment.objects.filter(
+        Q(pk=segment.pk)
+        | (Q(pk__in=linked_children) & ~named_children)
+        | (named_children & ~Q(pk__in=linked_children))
+    ).values_list("pk", "segment_type_id", "parent_code")
+    for pk, segment_type_id, parent_code in affected:
+        wanted = _parent_id(segment_type_id, parent_code)
+        linked = XX_SegmentClosure.objects.filter(descendant_id=pk, depth=1).values_list("ancestor_id", flat=True).first()
+        if wanted != linked:
+            _move_subtree(pk, wanted)
+
+
+@transaction.atomic
+def detach_children(segment):
+    """After `segment` was deleted, make the segments that named it as parent roots"""
+    orphans = XX_Segment.objects.filter(segment_type_id=segment.segment_type_id, parent_code=segment.code)
+    for pk in orphans.values_list("pk", flat=True):
+        _move_subtree(pk, None)
+
+
+@transaction.atomic
+def rebuild_closure(segment_type_id=None):
+    """
+    Rebuild closure rows from parent_code for one segment type (or all).
+    Returns the number of rows written.
+    """
+    segments = XX_Segment.objects.all()
+    if segment_type_id is not None:
+        segments = segments.filter(segment_type_id=segment_type_id)
+    rows = list(segments.values_list("pk", "segment_type_id", "code", "parent_code"))
+    by_code = {(type_id, code): pk for pk, type_id, code, _ in rows}
+    parents = {pk: by_code.get((type_id, parent_code)) for pk, type_id, _, parent_code in rows}
+
+    XX_SegmentClosure.objects.filter(descendant_id__in=segments.values("pk")).delete()
+    written, batch = 0, []
+    for pk in parents:
+        node, depth, seen = pk, 0, set()
+        while node is not None and node not in seen:
+            batch.append(XX_SegmentClosure(ancestor_id=node, descendant_id=pk, depth=depth))
+            seen.add(node)
+            node, depth = parents.get(node), depth + 1
+        if node is not None:
+            logger.warning("Segment %s: parent_code cycle; path cut at segment %s", pk, node)
+        if len(batch) >= CLOSURE_BATCH_SIZE:
+            XX_SegmentClosure.objects.bulk_create(batch)
+            written, batch = written + len(batch), []
+    XX_SegmentClosure.objects.bulk_create(batch)
+    return written + len(batch)
+
+
+def with_tree_links(queryset):
+    """
+    Segments with what SegmentSerializer reads of each row loaded up front:
+    the segment type, the path (path_links, ancestors from the root down)
+    and the direct children (child_links, by code). Three queries however
+    many rows there are.
+    """
+    return queryset.select_related("segment_type").prefetch_related(
+        Prefetch(
+            "ancestor_links",
+            queryset=XX_SegmentClosure.objects.select_related("ancestor").order_by("-depth"),
+            to_attr="path_links",
+        ),
+        Prefetch(
+            "descendant_links",
+            queryset=XX_SegmentClosure.objects.filter(depth=1).select_related("descendant")
+            .order_by("descendant__code"),
+            to_attr="child_links",
+        ),
+    )
+
+
+def subtree(root, include_root=True):
+    """Segments in the subtree under `root` (an XX_Segment or its pk), from one join"""
+    links = {"ancestor_links__ancestor": root}
+    if not include_root:
+        links["ancestor_links__depth__gt"] = 0
+    return XX_Segment.objects.filter(**links)
+
+
+def build_tree(segments, fields, root=None):
+    """
+    Nest already-loaded segments by parent_code into
+    [{<fields>..., "children": [...]}]. Roots are segments without a
+    parent_code, or `root` (a pk) when building a subtree; segments whose
+    parent is not among `segments` are left out.
+    """
+    segments = list(segments)
+    nodes = {(s.segment_type_id, s.code): {**{f: getattr(s, f) for f in fields}, "children": []} for s in segments}
+    tree = []
+    for s in segments:
+        node = nodes[(s.segment_type_id, s.code)]
+        if s.pk == root or (root is None and not s.parent_code):
+            tree.append(node)
+            continue
+        parent = nodes.get((s.segment_type_id, s.parent_code))
+        if parent is not None:
+            parent["children"].append(node)
+    return tree
@@ -0,0 +1,26 @@
+"""
+Management command to rebuild the segment hierarchy closure table from
+parent_code.
+
+Migration segment 0004 fills the table and the segment signals maintain it
+on every save and delete, so run this after segments were written without
+signals (bulk imports, queryset.update, raw SQL).
+
+Usage:
+    python manage.py rebuild_segment_closure
+    python manage.py rebuild_segment_closure --segment-type 3
+"""
+from django.core.management.base import BaseCommand
+
+from segment.hierarchy import rebuild_closure
+
+
+class Command(BaseCommand):
+    help = 'Rebuild segment hierarchy closure rows from parent_code'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--segment-type', type=int, help='Rebuild only this segment type id')
+
+    def handle(self, *args, **options):
+        rows = rebuild_closure(options['segment_type'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt segment closure: {rows} row(s)'))
@@ -0,0 +1,30 @@
+# Generated by Django 5.2.7 on 2026-10-16 06:59
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('segment', '0002_alter_xx_segmenttype_segment_id'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='XX_SegmentClosure',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('depth', models.PositiveIntegerField(help_text='Levels between ancestor and descendant (0 = same segment)')),
+                ('ancestor', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='descendant_links', to='segment.xx_segment')),
+                ('descendant', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ancestor_links', to='segment.xx_segment')),
+            ],
+            options={
+                'verbose_name': 'Segment Hierarchy Link',
+                'verbose_name_plural': 'Segment Hierarchy Links',
+                'db_table': 'XX_SEGMENT_CLOSURE_XX',
+                'indexes': [models.Index(fields=['descendant', 'depth'], name='XX_SEGMENT__descend_f6485c_idx')],
+                'unique_together': {('ancestor', 'descendant')},
+            },
+        ),
+    ]
@@ -0,0 +1,19 @@
+from django.db import migrations
+
+
+def populate_closure(apps, schema_editor):
+    """Fill the closure table for segments that existed before it did"""
+    from segment.hierarchy import rebuild_closure
+
+    rebuild_closure()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('segment', '0003_xx_segmentclosure'),
+    ]
+
+    operations = [
+        migrations.RunPython(populate_closure, migrations.RunPython.noop),
+    ]
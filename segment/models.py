@@ -206,32 +206,34 @@ class XX_Segment(models.Model):
     
     @property
     def parent(self):
-        """Get parent segment object if exists"""
-        if self.parent_code:
-            try:
-                return XX_Segment.objects.get(
-                    segment_type=self.segment_type,
-                    code=self.parent_code
-                )
-            except XX_Segment.DoesNotExist:
-                return None
-        return None
+        """Get parent segment object if exists (from the segment registry)"""
+        if not self.parent_code:
+            return None
+        from .registry import segment_registry
+        return segment_registry.segment_by_code(self.segment_type_id, self.parent_code)
     
     @property
     def full_path(self):
-        """Get full hierarchical path"""
-        path = [self.code]
-        current = self
-        while current.parent_code:
-            try:
-                current = XX_Segment.objects.get(
-                    segment_type=current.segment_type,
-                    code=current.parent_code
-                )
-                path.insert(0, current.code)
-            except XX_Segment.DoesNotExist:
-                break
-        return " > ".join(path)
+        """Get full hierarchical path (one query over the closure table, none if prefetched)"""
+        if self.pk is None:
+            return self.code
+        links = self.__dict__.get("path_links")
+        if links is not None:
+            path = [link.ancestor.code for link in links]
+        else:
+            path = list(
+                XX_SegmentClosure.objects.filter(descendant=self)
+                .order_by("-depth")
+                .values_list("ancestor__code", flat=True)
+            )
+        return " > ".join(path or [self.code])
+    
+    def child_segments(self):
+        """Direct children, by code (one query over the closure table, none if prefetched)"""
+        links = self.__dict__.get("child_links")
+        if links is not None:
+            return [link.descendant for link in links]
+        return list(XX_Segment.objects.filter(ancestor_links__ancestor=self, ancestor_links__depth=1).order_by("code"))
     
     @property
     def hierarchy_level(self):
@@ -239,25 +241,12 @@ class XX_Segment(models.Model):
         return self.level
     
     def get_all_children(self):
-        """Get all descendant codes recursively"""
-        children = list(XX_Segment.objects.filter(
-            segment_type=self.segment_type,
-            parent_code=self.code
-        ).values_list('code', flat=True))
-        
-        descendants = []
-        for child_code in children:
-            descendants.append(child_code)
-            try:
-                child = XX_Segment.objects.get(
-                    segment_type=self.segment_type,
-                    code=child_code
-                )
-                descendants.extend(child.get_all_children())
-            except XX_Segment.DoesNotExist:
-                continue
-        
-        return descendants
+        """Get all descendant codes (one query over the closure table), nearest first"""
+        return list(
+            XX_SegmentClosure.objects.filter(ancestor=self, depth__gt=0)
+            .order_by("depth", "descendant__code")
+            .values_list("descendant__code", flat=True)
+        )
     
     def is_used_in_transactions(self):
         """
@@ -365,3 +354,31 @@ class XX_Segment(models.Model):
             raise ValidationError(error_msg)
         
         super().delete(*args, **kwargs)
+
+
+class XX_SegmentClosure(models.Model):
+    """
+    Ancestor/descendant pairs of the segment hierarchy (closure table).
+    Every segment is paired with itself at depth 0 and with each ancestor
+    reached through parent_code at its distance. Maintained by
+    segment.hierarchy; see there.
+    """
+    ancestor = models.ForeignKey(
+        XX_Segment, on_delete=models.CASCADE, related_name='descendant_links'
+    )
+    descendant = models.ForeignKey(
+        XX_Segment, on_delete=models.CASCADE, related_name='ancestor_links'
+    )
+    depth = models.PositiveIntegerField(help_text="Levels between ancestor and descendant (0 = same segment)")
+
+    class Meta:
+        db_table = "XX_SEGMENT_CLOSURE_XX"
+        verbose_name = "Segment Hierarchy Link"
+        verbose_name_plural = "Segment Hierarchy Links"
+        unique_together = ("ancestor", "descendant")
+        indexes = [
+            models.Index(fields=["descendant", "depth"]),
+        ]
+
+    def __str__(self):
+        return f"{self.ancestor_id} > {self.descendant_id} ({self.depth})"
@@ -0,0 +1,161 @@
+"""
+In-process registry of the chart of accounts.
+
+Loads every XX_SegmentType and XX_Segment once and answers name/id/code
+lookups from dictionaries. Every segment or segment type save/delete bumps
+the "segment:registry" CacheVersion row (see segment.signals and
+core.cache_versions), and each process refreshes on its next lookup after
+that. A refresh re-reads only the segments updated since the last load (with
+REFRESH_OVERLAP for transactions that committed late) plus the id column to
+spot deletions. Segment type changes and REGISTRY_FULL_RELOAD_SECONDS
+(settings.SEGMENT_REGISTRY_FULL_RELOAD_SECONDS) trigger a full reload.
+
+Lookups return copies, so callers may modify what they get back without
+affecting the registry.
+"""
+import copy
+import threading
+import time
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+
+from core.cache_versions import VersionGuard
+
+from .models import XX_Segment, XX_SegmentType
+
+REFRESH_OVERLAP = timedelta(minutes=5)
+REGISTRY_FULL_RELOAD_SECONDS = 900
+
+
+def _copy_segment(segment):
+    clone = copy.copy(segment)
+    if segment.segment_type is not None:
+        clone.segment_type = copy.copy(segment.segment_type)
+    return clone
+
+
+class SegmentRegistry:
+    VERSION_KEY = "segment:registry"
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._guard = VersionGuard(self.VERSION_KEY)
+        self._loaded = False
+        self.hits = 0
+        self.loads = 0
+        self.refreshes = 0
+
+    @staticmethod
+    def _type_signature(types):
+        return {t.segment_id: t.updated_at for t in types}
+
+    def _load(self):
+        types = list(XX_SegmentType.objects.all())
+        self._types_by_id = {t.segment_id: t for t in types}
+        self._types_by_name = {t.segment_name: t for t in types}
+        self._type_versions = self._type_signature(types)
+        self._segments_by_id = {}
+        self._segments_by_type_code = {}
+        self._children_by_code = defaultdict(list)
+        self._watermark = None
+        for s in XX_Segment.objects.all():
+            self._add(s)
+        self._loaded = True
+        self._loaded_at = time.monotonic()
+        self.loads += 1
+
+    def _add(self, s):
+        s.segment_type = self._types_by_id.get(s.segment_type_id)
+        self._segments_by_id[s.id] = s
+        self._segments_by_type_code[(s.segment_type_id, s.code)] = s
+        if s.node_type == 'child':
+            self._children_by_code[s.code].append(s)
+        if s.updated_at and (self._watermark is None or s.updated_at > self._watermark):
+            self._watermark = s.updated_at
+
+    def _discard(self, segment_id):
+        s = self._segments_by_id.pop(segment_id, None)
+        if s is None:
+            return
+        key = (s.segment_type_id, s.code)
+        if self._segments_by_type_code.get(key) is s:
+            del self._segments_by_type_code[key]
+        children = self._children_by_code.get(s.code)
+        if children and s in children:
+            children[:] = [c for c in children if c is not s]
+            if not children:
+                del self._children_by_code[s.code]
+
+    def _refresh(self):
+        """Bring the registry up to date, re-reading only changed segments where possible"""
+        full_reload = getattr(settings, 'SEGMENT_REGISTRY_FULL_RELOAD_SECONDS', REGISTRY_FULL_RELOAD_SECONDS)
+        types = list(XX_SegmentType.objects.all())
+        if (self._type_signature(types) != self._type_versions or self._watermark is None
+                or time.monotonic() - self._loaded_at >= full_reload):
+            self._load()
+            return
+        changed = list(XX_Segment.objects.filter(updated_at__gte=self._watermark - REFRESH_OVERLAP))
+        existing = set(XX_Segment.objects.values_list('id', flat=True))
+        for segment_id in set(self._segments_by_id) - existing:
+            self._discard(segment_id)
+        for s in changed:
+            self._discard(s.id)
+            self._add(s)
+        self.refreshes += 1
+
+    def _ensure_loaded(self):
+        with self._lock:
+            if not self._loaded:
+                self._guard.is_current()
+                self._load()
+            elif not self._guard.is_current():
+                self._refresh()
+            else:
+                self.hits += 1
+
+    def segment_type(self, segment_name: str):
+        """XX_SegmentType by segment_name, or None"""
+        self._ensure_loaded()
+        segment_type = self._types_by_name.get(segment_name)
+        return copy.copy(segment_type) if segment_type is not None else None
+
+    def segment_type_by_id(self, segment_type_id):
+        """XX_SegmentType by primary key, or None"""
+        self._ensure_loaded()
+        segment_type = self._types_by_id.get(segment_type_id)
+        return copy.copy(segment_type) if segment_type is not None else None
+
+    def segment(self, segment_id):
+        """XX_Segment by primary key, or None"""
+        self._ensure_loaded()
+        segment = self._segments_by_id.get(segment_id)
+        return _copy_segment(segment) if segment is not None else None
+
+    def segment_by_code(self, segment_type_id, code: str):
+        """XX_Segment of a segment type by code, or None"""
+        self._ensure_loaded()
+        segment = self._segments_by_type_code.get((segment_type_id, code))
+        return _copy_segment(segment) if segment is not None else None
+
+    def child_segments_by_code(self, code: str) -> list:
+        """All child segments with this code, across segment types"""
+        self._ensure_loaded()
+        return [_copy_segment(s) for s in self._children_by_code.get(code, ())]
+
+    def invalidate(self):
+        """Refresh every process's registry (this one on its next lookup, others after commit)"""
+        self._guard.bump()
+
+    def stats(self) -> dict:
+        return {
+            "hits": self.hits,
+            "loads": self.loads,
+            "refreshes": self.refreshes,
+            "segment_types": len(self._types_by_id) if self._loaded else 0,
+            "segments": len(self._segments_by_id) if self._loaded else 0,
+        }
+
+
+segment_registry = SegmentRegistry()
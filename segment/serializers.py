@@ -59,21 +59,26 @@ class SegmentSerializer(serializers.ModelSerializer):
         
         return data
     
+    def update(self, instance, validated_data):
+        instance = super().update(instance, validated_data)
+        # The path and children loaded with the instance may have changed
+        instance.__dict__.pop("path_links", None)
+        instance.__dict__.pop("child_links", None)
+        return instance
+    
     def get_parent(self, obj):
-        if obj.parent:
+        parent = obj.parent
+        if parent:
             return {
-                "id": obj.parent.id,
-                "code": obj.parent.code,
-                "alias": obj.parent.alias
+                "id": parent.id,
+                "code": parent.code,
+                "alias": parent.alias
             }
         return None
     
     def get_children(self, obj):
-        children = XX_Segment.objects.filter(
-            segment_type=obj.segment_type,
-            parent_code=obj.code
-        )
-        return [{"id": c.id, "code": c.code, "alias": c.alias} for c in children]
+        # Prefetched by hierarchy.with_tree_links on the list endpoints
+        return [{"id": c.id, "code": c.code, "alias": c.alias} for c in obj.child_segments()]
 
 
 class AccountSerializer(serializers.ModelSerializer):
@@ -0,0 +1,32 @@
+"""
+Django signals for the segment app.
+Keeps the in-process segment registry and the hierarchy closure table in
+step with the chart of accounts.
+"""
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from .hierarchy import detach_children, sync_segment
+from .registry import segment_registry
+
+
+@receiver(post_save, sender='segment.XX_Segment')
+@receiver(post_delete, sender='segment.XX_Segment')
+@receiver(post_save, sender='segment.XX_SegmentType')
+@receiver(post_delete, sender='segment.XX_SegmentType')
+def invalidate_segment_registry(sender, instance, **kwargs):
+    """Refresh the registry in every process after any segment or segment type change"""
+    segment_registry.invalidate()
+
+
+@receiver(post_save, sender='segment.XX_Segment')
+def link_segment_hierarchy(sender, instance, raw=False, **kwargs):
+    """Link a saved segment (and segments naming it as parent) into the closure table"""
+    if not raw:
+        sync_segment(instance)
+
+
+@receiver(post_delete, sender='segment.XX_Segment')
+def unlink_segment_hierarchy(sender, instance, **kwargs):
+    """Segments whose parent was deleted become roots of the closure table"""
+    detach_children(instance)
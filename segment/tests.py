@@ -43,3 +43,158 @@ class SegmentTestCase(TestCase):
         accounts = SegmentHelper.get_account_segments()
         self.assertEqual(accounts.count(), 1)
         self.assertEqual(accounts.first().code, "1000")
+
+    def test_registry_serves_lookups_without_queries(self):
+        """After warm-up, account lookups hit the registry; saves invalidate it"""
+        SegmentHelper.get_account_by_code("1000")
+        with self.assertNumQueries(0):
+            self.assertEqual(SegmentHelper.get_account_by_code("1000").alias, "Test Account")
+            self.assertEqual(SegmentHelper.get_segment_type("Account"), self.account_type)
+
+        self.account.alias = "Renamed"
+        self.account.save()
+        self.assertEqual(SegmentHelper.get_account_by_code("1000").alias, "Renamed")
+        with self.assertRaises(XX_Segment.DoesNotExist):
+            SegmentHelper.get_account_by_code("9999")
+
+    def test_registry_copies_and_refreshes_changed_rows(self):
+        """Callers get copies; another process's change reloads only the changed rows"""
+        from django.test import override_settings
+        from django.utils import timezone
+        from core.cache_versions import bump_version
+        from .registry import segment_registry
+
+        mine = SegmentHelper.get_account_by_code("1000")
+        mine.alias = "Scribbled"
+        mine.segment_type.segment_name = "Scribbled"
+        self.assertEqual(SegmentHelper.get_account_by_code("1000").alias, "Test Account")
+        self.assertEqual(SegmentHelper.get_segment_type("Account").segment_name, "Account")
+
+        # Another process renames the account: no signal here, only its version bump
+        loads, refreshes = segment_registry.loads, segment_registry.refreshes
+        XX_Segment.objects.filter(pk=self.account.pk).update(alias="Elsewhere", updated_at=timezone.now())
+        bump_version(segment_registry.VERSION_KEY)
+        with override_settings(CACHE_VERSION_CHECK_SECONDS=0):
+            self.assertEqual(SegmentHelper.get_account_by_code("1000").alias, "Elsewhere")
+            XX_Segment.objects.filter(pk=self.account.pk).delete()
+            with self.assertRaises(XX_Segment.DoesNotExist):
+                SegmentHelper.get_account_by_code("1000")
+        self.assertEqual(segment_registry.loads, loads)
+        self.assertEqual(segment_registry.refreshes, refreshes + 2)
+
+
+class SegmentHierarchyTestCase(TestCase):
+    """Closure table maintenance and single-query tree reads"""
+
+    def setUp(self):
+        self.cost_center = XX_SegmentType.objects.create(
+            segment_name="Cost Center", segment_type="cost_center", has_hierarchy=True, length=3
+        )
+
+    def make(self, code, parent_code=None):
+        return XX_Segment.objects.create(segment_type=self.cost_center, code=code, parent_code=parent_code)
+
+    def links(self):
+        from .models import XX_SegmentClosure
+        return set(XX_SegmentClosure.objects.values_list("ancestor__code", "descendant__code", "depth"))
+
+    def test_closure_follows_saves_and_deletes(self):
+        from django.core.management import call_command
+        from io import StringIO
+
+        # Children saved before their parent are linked once it arrives
+        self.make("110", "100")
+        self.make("111", "110")
+        root = self.make("100")
+        self.make("200")
+        self.assertEqual(root.get_all_children(), ["110", "111"])
+        self.assertEqual(XX_Segment.objects.get(code="111").full_path, "100 > 110 > 111")
+
+        # Moving a subtree
+        middle = XX_Segment.objects.get(code="110")
+        middle.parent_code = "200"
+        middle.save()
+        self.assertEqual(XX_Segment.objects.get(code="111").full_path, "200 > 110 > 111")
+        self.assertEqual(root.get_all_children(), [])
+
+        # Renaming a parent detaches children still naming the old code
+        middle.code = "120"
+        middle.save()
+        self.assertEqual(XX_Segment.objects.get(code="111").full_path, "111")
+
+        # Deleting a parent leaves its children as roots
+        self.make("121", "120")
+        XX_Segment.objects.filter(code="120").delete()
+        self.assertEqual(XX_Segment.objects.get(code="121").full_path, "121")
+
+        maintained = self.links()
+        call_command("rebuild_segment_closure", stdout=StringIO())
+        self.assertEqual(self.links(), maintained)
+
+    def test_tree_endpoints_use_one_query(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        def grow(prefix, count):
+            top = self.make(f"{prefix}00")
+            for n in range(1, count + 1):
+                self.make(f"{prefix}{n}0", top.code)
+                self.make(f"{prefix}{n}1", f"{prefix}{n}0")
+            return top
+
+        small = grow("1", 2)
+        big = grow("2", 8)
+
+        def hierarchy(**params):
+            with CaptureQueriesContext(connection) as queries:
+                resp = self.client.get("/api/segment/values/hierarchy/", {"segment_type": self.cost_center.pk, **params})
+            self.assertEqual(resp.status_code, 200)
+            return len(queries), resp.json()
+
+        _, tree = hierarchy()
+        self.assertEqual([n["code"] for n in tree], ["100", "200"])
+        self.assertEqual([c["code"] for c in tree[1]["children"]], [f"2{n}0" for n in range(1, 9)])
+        self.assertEqual([c["code"] for c in tree[1]["children"][0]["children"]], ["211"])
+
+        small_queries, small_tree = hierarchy(root=small.pk)
+        big_queries, big_tree = hierarchy(root=big.pk)
+        self.assertEqual([n["code"] for n in small_tree], ["100"])
+        self.assertEqual(len(big_tree[0]["children"]), 8)
+        self.assertEqual(small_queries, big_queries)
+
+        descendants = self.client.get(f"/api/segment/values/{small.pk}/descendants/").json()
+        self.assertEqual([d["code"] for d in descendants], ["110", "111", "120", "121"])
+
+    def test_segment_list_loads_paths_parents_and_children_up_front(self):
+        from django.db import connection
+        from django.test.utils import CaptureQueriesContext
+
+        project = XX_SegmentType.objects.create(segment_name="Project", segment_type="project", length=3)
+
+        def grow(segment_type, count):
+            XX_Segment.objects.create(segment_type=segment_type, code="100")
+            for n in range(1, count + 1):
+                XX_Segment.objects.create(segment_type=segment_type, code=f"1{n}0", parent_code="100")
+                XX_Segment.objects.create(segment_type=segment_type, code=f"1{n}1", parent_code=f"1{n}0")
+
+        def listing(segment_type):
+            with CaptureQueriesContext(connection) as queries:
+                resp = self.client.get("/api/segment/values/", {"segment_type": segment_type.pk, "ordering": "code"})
+            self.assertEqual(resp.status_code, 200)
+            # Closure reads, and parent lookups by code
+            tree_queries = [q["sql"] for q in queries if "XX_SEGMENT_CLOSURE_XX" in q["sql"]
+                            or '"XX_SEGMENT_XX"."code" = ' in q["sql"]]
+            return len(tree_queries), {row["code"]: row for row in resp.json()}
+
+        grow(self.cost_center, 1)
+        grow(project, 8)
+        self.client.get("/api/segment/values/")  # loads the segment registry
+        small_queries, small = listing(self.cost_center)
+        big_queries, big = listing(project)
+        self.assertEqual((small_queries, big_queries), (2, 2))
+        self.assertEqual(len(big), 17)
+        self.assertEqual(big["181"]["full_path"], "100 > 180 > 181")
+        self.assertEqual(big["181"]["parent"]["code"], "180")
+        self.assertIsNone(big["100"]["parent"])
+        self.assertEqual([c["code"] for c in big["100"]["children"]], [f"1{n}0" for n in range(1, 9)])
+        self.assertEqual(small["110"]["children"], [{"id": small["111"]["id"], "code": "111", "alias": None}])
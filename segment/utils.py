@@ -3,6 +3,7 @@ Segment utility functions for dynamic segment management
 """
 from django.db.models import QuerySet
 from .models import XX_Segment, XX_SegmentType
+from .registry import segment_registry
 
 
 class SegmentHelper:
@@ -14,10 +15,10 @@ class SegmentHelper:
     @staticmethod
     def get_segment_type(segment_name: str) -> XX_SegmentType:
         """Get segment type by name (e.g., 'Account', 'Department', 'Project')"""
-        try:
-            return XX_SegmentType.objects.get(segment_name=segment_name)
-        except XX_SegmentType.DoesNotExist:
+        segment_type = segment_registry.segment_type(segment_name)
+        if segment_type is None:
             raise ValueError(f"Segment type '{segment_name}' does not exist")
+        return segment_type
     
     @staticmethod
     def get_segments_by_type(segment_name: str) -> QuerySet:
@@ -35,9 +36,12 @@ class SegmentHelper:
     
     @staticmethod
     def get_segment_by_code(segment_name: str, code: str) -> XX_Segment:
-        """Get a specific segment by type and code"""
+        """Get a specific segment by type and code (served from the segment registry)"""
         segment_type = SegmentHelper.get_segment_type(segment_name)
-        return XX_Segment.objects.get(segment_type=segment_type, code=code)
+        segment = segment_registry.segment_by_code(segment_type.segment_id, code)
+        if segment is None:
+            raise XX_Segment.DoesNotExist(f"No {segment_name} segment with code '{code}'")
+        return segment
     
     @staticmethod
     def get_account_by_code(code: str) -> XX_Segment: